@@ -6,8 +6,12 @@ from datetime import datetime, time, timedelta
 from aiogram.client.default import DefaultBotProperties
 from aiogram.filters import Command
 import logging
+import os
 
-API_TOKEN = "7221891232:AAEG9L2JjVtpaqDfqiO2lHNwenNlQmxSNzY"
+# Токен не хранится в коде: берется из переменной окружения, как в bot_2.py
+API_TOKEN = os.getenv("API_TOKEN")
+if not API_TOKEN:
+    raise RuntimeError("API_TOKEN не найден в переменных окружения")
 
 logging.basicConfig(level=logging.INFO)
 
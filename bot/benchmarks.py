@@ -0,0 +1,2348 @@
+"""
+Бенчмарки бота. Работают полностью офлайн: токен подставляется фиктивный, а все файлы
+состояния создаются во временном каталоге.
+
+Запуск (из каталога bot):
+    python benchmarks.py storage      # полная перезапись JSON против журнала изменений
+    python benchmarks.py sessions     # PracticeSession против словаря с местами
+    python benchmarks.py keyboard     # построение клавиатуры мест с кэшем и без
+    python benchmarks.py callbacks    # разбор callback_data: цепочка фильтров против кодека с префиксами
+    python benchmarks.py scheduler    # неделя расписания на виртуальных часах
+    python benchmarks.py groups       # неделя расписаний многих групп: рассылка только подписчикам группы
+    python benchmarks.py outbox       # очередь доставки: повторы, удаление недоступных, доставка после перезапуска
+    python benchmarks.py history      # архив посещаемости: индексы против загрузки всей истории
+    python benchmarks.py recovery     # запуск после простоя: загрузка большого состояния и пропущенные события
+    python benchmarks.py ledger       # семестр расписания: размер учета отправленных уведомлений
+    python benchmarks.py timetable    # расписание из файла: форматы, исключения, индекс по дням и перезагрузка
+    python benchmarks.py load         # N пользователей одновременно записываются на открывшуюся практику
+    python benchmarks.py booking      # стресс-тест записи: тысячи одновременных нажатий, повторы и закрытие
+    python benchmarks.py anyseat      # запись кнопкой "Любое свободное место" против "Да" и выбора места
+    python benchmarks.py webhook      # задержка обработки нажатий: вебхук против long polling
+    python benchmarks.py clicks       # частые нажатия на места: объединение серий и ограничение частоты нажатий
+    python benchmarks.py e2e          # весь бот по HTTP против локального заменителя Bot API (fake_telegram.py)
+    python benchmarks.py shutdown     # SIGTERM посреди рассылки: срок остановки, сохранение мест, дорассылка
+    python benchmarks.py workers      # несколько процессов бота с общим хранилищем мест и арендой лидера
+
+Параметр --json ФАЙЛ (перед именем сценария) дополнительно сохраняет результаты в JSON,
+чтобы сравнивать их между версиями: python benchmarks.py --json load.json load --users 300
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time as time_module
+import tracemalloc
+from datetime import datetime, timedelta
+
+import aiohttp
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.base import BaseSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import GetMe, GetUpdates, SendMessage
+from aiogram.types import Update, User
+
+# bot_2 при импорте требует API_TOKEN и читает файлы состояния из текущего каталога,
+# поэтому до импорта подставляем фиктивный токен и переходим во временный каталог.
+os.environ.setdefault("API_TOKEN", "123456:BENCHMARK")
+START_DIR = os.getcwd()  # Относительные пути из аргументов (--json) считаются от каталога запуска
+BENCH_DIR = tempfile.mkdtemp(prefix="bot_bench_")
+os.chdir(BENCH_DIR)
+
+import bot_2  # noqa: E402
+from ledger import NotificationLedger, schedule_entry_id  # noqa: E402
+from journal import Journal, make_record  # noqa: E402
+from sessions import PracticeSession  # noqa: E402
+from keyboards import SlotKeyboardCache, build_slot_keyboard, slot_callback_data  # noqa: E402
+from broadcast import Broadcaster  # noqa: E402
+from outbox import Outbox  # noqa: E402
+from callbacks import ACTION_ANY_SEAT, ACTION_CONFIRM_YES, CallbackCodec, default_codec  # noqa: E402
+from scheduler import (EventScheduler, SimulatedClock, EVENT_LECTURE, EVENT_PRACTICE_CLOSE,  # noqa: E402
+                       EVENT_PRACTICE_OPEN)
+from groups import StudyGroup  # noqa: E402
+from history import HistoryArchive  # noqa: E402
+from timetable import ScheduleException, ScheduleSource, Timetable, load_timetable, RUSSIAN_WEEKDAYS  # noqa: E402
+from storage import create_storage  # noqa: E402
+from persistence import PersistenceWriter  # noqa: E402
+from webhook import SECRET_TOKEN_HEADER, WebhookServer  # noqa: E402
+from fake_telegram import FakeTelegramServer, RateLimiter as TelegramRateLimiter  # noqa: E402
+from lifecycle import Lifecycle  # noqa: E402
+from metrics import MetricsServer  # noqa: E402
+from throttling import fold_seat_taps  # noqa: E402
+from booking import BookingDesk, SEAT_CLAIMED, SEAT_MOVED, SEAT_RELEASED  # noqa: E402
+from state_store import InProcessStore, LeaderLease  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)  # Не засоряем вывод информационными сообщениями бота
+
+
+class StubBot:
+    """Заглушка Bot: записывает вызовы API вместо обращения к Telegram."""
+
+    def __init__(self):
+        self.calls = {}  # Метод API -> количество вызовов
+
+    def _record(self, method: str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self._record("sendMessage")
+
+    async def edit_message_reply_markup(self, **kwargs):
+        self._record("editMessageReplyMarkup")
+
+
+class StubUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class StubChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+
+class StubMessage:
+    """Заглушка types.Message: ответы и правки сообщения учитываются в StubBot."""
+
+    def __init__(self, stub: StubBot, user_id: int, message_id: int = 1):
+        self.stub = stub
+        self.from_user = StubUser(user_id)
+        self.chat = StubChat(user_id)
+        self.message_id = message_id
+
+    async def answer(self, text, **kwargs):
+        self.stub._record("sendMessage")
+
+    async def edit_text(self, text, **kwargs):
+        self.stub._record("editMessageText")
+
+    async def edit_reply_markup(self, **kwargs):
+        self.stub._record("editMessageReplyMarkup")
+
+
+class StubCallback:
+    """Заглушка CallbackQuery для вызова обработчиков bot_2 напрямую."""
+    _ids = itertools.count(1)
+
+    def __init__(self, stub: StubBot, user_id: int, data: str, message: StubMessage, callback_id: str = None):
+        self.stub = stub
+        self.id = callback_id or str(next(self._ids))
+        self.from_user = StubUser(user_id)
+        self.data = data
+        self.message = message
+
+    async def answer(self, text=None, **kwargs):
+        self.stub._record("answerCallbackQuery")
+
+
+def use_stub_bot() -> StubBot:
+    """Подменяет в bot_2 бота и рассыльщика на заглушки без ограничений частоты."""
+    stub = StubBot()
+    bot_2.broadcaster = Broadcaster(stub, concurrency=100, global_rate=1e9, per_chat_interval=0)
+    bot_2.seat_map_viewers.bot = stub
+    bot_2.seat_map_viewers.broadcaster = bot_2.broadcaster
+    bot_2.outbox.broadcaster = bot_2.broadcaster
+    return stub
+
+
+def build_state(users: int, sessions: int, seats_per_session: int, notifications: int):
+    """Создает синтетическое состояние заданного размера."""
+    user_ids = set(range(100000, 100000 + users))
+    users_list = sorted(user_ids)
+    practice_slots = {}
+    for s in range(sessions):
+        key = f"День{s}_12:{s % 60:02d}"
+        session = PracticeSession(key, f"Предмет {s}", datetime.now(), bot_2.MAX_SLOTS)
+        for slot in range(1, seats_per_session + 1):
+            session.book(slot, users_list[(s * bot_2.MAX_SLOTS + slot) % users])
+        practice_slots[key] = session
+    sent_notifications = NotificationLedger()
+    for i in range(notifications):
+        sent_notifications.add(datetime(2025, 1, 1).date(), schedule_entry_id("Понедельник", "09:00", "лекция", f"Предмет {i}"))
+    return user_ids, practice_slots, sent_notifications
+
+
+def generate_mutations(practice_slots: dict, count: int):
+    """Генерирует последовательность занятий/освобождений мест (как при записи на практику)."""
+    rng = random.Random(42)
+    keys = list(practice_slots)
+    mutations = []
+    for i in range(count):
+        key = rng.choice(keys)
+        slot = bot_2.MAX_SLOTS  # Последнее место: свободно в синтетическом состоянии
+        op = "seat_taken" if i % 2 == 0 else "seat_released"
+        mutations.append((key, make_record(op, session=key, slot=slot, user=1)))
+    return mutations
+
+
+def bench_storage(args):
+    """Сравнивает стоимость сохранения одного изменения: полная перезапись JSON против журнала."""
+    user_ids, practice_slots, sent_notifications = build_state(
+        args.users, args.sessions, args.seats, args.notifications)
+    mutations = generate_mutations(practice_slots, args.mutations)
+    results = {}
+
+    # Текущий путь: save_persistent_data перезаписывает все три файла на каждое изменение
+    started = time_module.perf_counter()
+    for key, record in mutations:
+        if record["op"] == "seat_taken":
+            practice_slots[key].book(record["slot"], record["user"])
+        else:
+            practice_slots[key].release(record["user"])
+        bot_2.save_persistent_data(user_ids, practice_slots, sent_notifications)
+    elapsed = time_module.perf_counter() - started
+    results["full_rewrite"] = elapsed / len(mutations)
+
+    # Журнал: одна строка на изменение плюс периодическая компакция
+    journal = Journal(os.path.join(BENCH_DIR, "bench_snapshot.json"), os.path.join(BENCH_DIR, "bench_journal.jsonl"),
+                      compact_every=args.compact_every)
+    journal.compact(user_ids, practice_slots, sent_notifications)
+    started = time_module.perf_counter()
+    for key, record in mutations:
+        journal.append([record])
+        if journal.needs_compaction():
+            journal.compact(user_ids, practice_slots, sent_notifications)
+    elapsed = time_module.perf_counter() - started
+    results["journal"] = elapsed / len(mutations)
+    journal.close()
+
+    # Время восстановления состояния при запуске (снимок + журнал)
+    started = time_module.perf_counter()
+    Journal(journal.snapshot_path, journal.journal_path).load()
+    results["journal_replay_total"] = time_module.perf_counter() - started
+
+    print(f"Состояние: {args.users} пользователей, {args.sessions} сессий, {args.mutations} изменений")
+    print(f"  полная перезапись JSON: {results['full_rewrite'] * 1e6:10.1f} мкс на изменение")
+    print(f"  журнал изменений:       {results['journal'] * 1e6:10.1f} мкс на изменение "
+          f"(компакция каждые {args.compact_every} записей)")
+    print(f"  восстановление журнала: {results['journal_replay_total'] * 1e3:10.1f} мс")
+    return results
+
+
+# Прежнее представление сессии: словарь {"open_time": ..., "subject_name": ..., номер_места: user_id}.
+# Функции ниже повторяют то, как с ним работали обработчики до появления PracticeSession.
+LEGACY_META_KEYS = ("open_time", "subject_name")
+
+
+def legacy_find_seat(session_data: dict, user_id: int):
+    """Поиск места пользователя перебором всех ключей сессии."""
+    for key in list(session_data.keys()):
+        if key in LEGACY_META_KEYS:
+            continue
+        if session_data.get(key) == user_id:
+            return int(key)
+    return None
+
+
+def legacy_book(session_data: dict, slot: int, user_id: int):
+    """Запись на место с переносом прежней брони (как в старом handle_slot_selection)."""
+    old_slot = legacy_find_seat(session_data, user_id)
+    if old_slot is not None:
+        del session_data[old_slot]
+    session_data[slot] = user_id
+
+
+def legacy_booked_users(session_data: dict):
+    return {uid for slot, uid in session_data.items() if slot not in LEGACY_META_KEYS and isinstance(uid, int)}
+
+
+def bench_sessions(args):
+    """Сравнивает операции с местами: словарь с перебором ключей против PracticeSession."""
+    rng = random.Random(7)
+    capacity = bot_2.MAX_SLOTS
+    users = list(range(1, args.users + 1))
+    operations = [(rng.randint(1, capacity), rng.choice(users)) for _ in range(args.operations)]
+    results = {}
+
+    # Словарь: перед каждой записью ищем прежнее место пользователя перебором
+    session_data = {"open_time": datetime.now(), "subject_name": "Предмет"}
+    started = time_module.perf_counter()
+    for slot, user_id in operations:
+        owner = session_data.get(slot)
+        if owner is None or owner == user_id:
+            legacy_book(session_data, slot, user_id)
+        legacy_find_seat(session_data, user_id)
+        legacy_booked_users(session_data)
+    results["dict"] = (time_module.perf_counter() - started) / len(operations)
+
+    # PracticeSession: массив владельцев и обратный словарь
+    session = PracticeSession("Понедельник_12:40", "Предмет", datetime.now(), capacity)
+    started = time_module.perf_counter()
+    for slot, user_id in operations:
+        owner = session.owner(slot)
+        if owner is None or owner == user_id:
+            session.book(slot, user_id)
+        session.seat_of(user_id)
+        session.booked_user_ids()
+    results["practice_session"] = (time_module.perf_counter() - started) / len(operations)
+
+    # Сериализация: to_dict/from_dict должны давать то же состояние
+    restored = PracticeSession.from_dict(session.key, session.to_dict())
+    assert sorted(restored.bookings()) == sorted(session.bookings())
+
+    print(f"{args.operations} операций (запись/перенос, поиск места, список записавшихся), {capacity} мест")
+    print(f"  словарь с перебором: {results['dict'] * 1e6:8.2f} мкс на операцию")
+    print(f"  PracticeSession:     {results['practice_session'] * 1e6:8.2f} мкс на операцию")
+    return results
+
+
+def bench_keyboard(args):
+    """
+    Стоимость отрисовки клавиатуры мест на одно нажатие: пользователь занимает место,
+    после чего клавиатура перерисовывается для него и еще для args.viewers пользователей.
+    """
+    rng = random.Random(3)
+    capacity = bot_2.MAX_SLOTS
+    users = list(range(1, args.users + 1))
+    results = {}
+
+    def run(render):
+        session = PracticeSession("Понедельник_12:40", "Предмет", datetime.now(), capacity)
+        renders = 0
+        started = time_module.perf_counter()
+        for _ in range(args.clicks):
+            user_id = rng.choice(users)
+            seat = rng.randint(1, capacity)
+            if session.owner(seat) is None:
+                session.book(seat, user_id)
+            render(session, user_id)
+            for viewer in rng.sample(users, args.viewers):
+                render(session, viewer)
+            renders += 1 + args.viewers
+        return (time_module.perf_counter() - started) / renders
+
+    results["uncached"] = run(build_slot_keyboard)
+    cache = SlotKeyboardCache()
+    results["cached"] = run(cache.get)
+
+    # Клавиатура из кэша должна совпадать с построенной заново
+    session = PracticeSession("Вторник_09:00", "Предмет", datetime.now(), capacity)
+    for seat in range(1, capacity + 1, 3):
+        session.book(seat, seat)
+    for user_id in (1, 4, 2, 999):
+        assert cache.get(session, user_id).model_dump() == build_slot_keyboard(session, user_id).model_dump()
+
+    print(f"{args.clicks} нажатий, по {args.viewers} перерисовок у других пользователей на каждое")
+    print(f"  без кэша: {results['uncached'] * 1e6:8.2f} мкс на клавиатуру")
+    print(f"  с кэшем:  {results['cached'] * 1e6:8.2f} мкс на клавиатуру "
+          f"(перестроений {cache.rebuilds}, попаданий {cache.hits})")
+    return results
+
+
+def legacy_route(data: str, filters):
+    """Старая маршрутизация: фильтры проверяются по очереди, ключ сессии разбирается split("_")."""
+    for name, matches in filters:
+        if matches(data):
+            if name == "slot":
+                parts = data.split("_")
+                return name, f"{parts[1]}_{parts[-2]}", int(parts[-1])
+            if name.startswith("confirm"):
+                return name, data.replace(name + "_", ""), None
+            return name, None, None
+    return None
+
+
+def bench_callbacks(args):
+    """
+    Разбор args.clicks нажатий на места: цепочка фильтров startswith с разбором строки (как раньше)
+    против CallbackCodec. Дополнительные фильтры (args.handlers) имитируют рост числа обработчиков.
+    """
+    rng = random.Random(5)
+    session_keys = [f"{day}_{hour:02d}:40" for day in RUSSIAN_WEEKDAYS for hour in (9, 10, 12, 14, 16)]
+    filters = [(f"extra{i}_", (lambda prefix: lambda d: d.startswith(prefix))(f"extra{i}_"))
+               for i in range(args.handlers)]
+    filters += [("busy", lambda d: d == "busy"), ("closed", lambda d: d == "closed"),
+                ("confirm_yes", lambda d: d.startswith("confirm_yes_")),
+                ("confirm_no", lambda d: d.startswith("confirm_no_")), ("slot", lambda d: d.startswith("slot_"))]
+    clicks = [(rng.choice(session_keys), rng.randint(1, 33)) for _ in range(args.clicks)]
+    legacy_data = [f"slot_{key}_{seat}" for key, seat in clicks]
+    codec = CallbackCodec()
+    codec_data = [codec.encode("slot", key, seat) for key, seat in clicks]
+
+    results = {}
+    started = time_module.perf_counter()
+    for data in legacy_data:
+        legacy_route(data, filters)
+    results["legacy_us"] = (time_module.perf_counter() - started) / len(legacy_data) * 1e6
+    started = time_module.perf_counter()
+    for data in codec_data:
+        codec.decode(data)
+    results["codec_us"] = (time_module.perf_counter() - started) / len(codec_data) * 1e6
+    # Разбор без запомненных строк: кнопки отправлены до перезапуска или другим процессом бота
+    cold = CallbackCodec()
+    for key in session_keys:
+        cold.session_ids.intern(key)
+    started = time_module.perf_counter()
+    for data in codec_data:
+        cold.decode(data)
+    results["codec_cold_us"] = (time_module.perf_counter() - started) / len(codec_data) * 1e6
+    for (key, seat), data in zip(clicks, codec_data):
+        action = cold.decode(data)
+        assert (cold.session_ids.key_of(action.session_id), action.seat) == (key, seat)
+    results["legacy_max_bytes"] = max(len(data.encode('utf-8')) for data in legacy_data)
+    results["codec_max_bytes"] = max(len(data.encode('utf-8')) for data in codec_data)
+
+    print(f"{args.clicks} нажатий, {len(filters)} фильтров в старой цепочке")
+    print(f"  фильтры + split:      {results['legacy_us']:6.3f} мкс на нажатие, до {results['legacy_max_bytes']} байт")
+    print(f"  кодек (запомненные):  {results['codec_us']:6.3f} мкс на нажатие, до {results['codec_max_bytes']} байт")
+    print(f"  кодек (разбор):       {results['codec_cold_us']:6.3f} мкс на нажатие")
+    return results
+
+
+def bench_scheduler(args):
+    """Прогоняет args.days дней расписания на виртуальных часах через настоящие обработчики bot_2."""
+    stub = use_stub_bot()
+    bot_2.user_ids.update(range(1, args.users + 1))
+    start = datetime(2025, 1, 6)  # Понедельник
+    clock = SimulatedClock(start)
+    bot_2.scheduler_clock = clock
+    bot_2.event_scheduler = EventScheduler(bot_2.full_schedule, bot_2.handle_schedule_event, clock=clock, start=start)
+
+    async def run():
+        await bot_2.event_scheduler.run_until(start + timedelta(days=args.days))
+        await bot_2.event_scheduler.drain()
+
+    started = time_module.perf_counter()
+    asyncio.run(run())
+    elapsed = time_module.perf_counter() - started
+    scheduler = bot_2.event_scheduler
+    print(f"{args.days} дней расписания, {args.users} пользователей: {elapsed * 1000:.1f} мс")
+    print(f"  событий выполнено: {scheduler.fired}, пропущено: {scheduler.skipped}")
+    print(f"  отправлено сообщений: {stub.calls.get('sendMessage', 0)}, открытых сессий в конце: {len(bot_2.practice_slots)}")
+    return {"elapsed": elapsed, "fired": scheduler.fired, "skipped": scheduler.skipped, "calls": stub.calls}
+
+
+def bench_groups(args):
+    """
+    args.groups групп с собственными расписаниями и args.users пользователей, подписанных на одну группу
+    (args.multi из них — на две). Неделя расписаний всех групп прогоняется через настоящие обработчики bot_2:
+    каждое событие должно уйти только подписчикам своей группы. Для сравнения — сколько сообщений отправила бы
+    рассылка всем пользователям и сколько стоит поиск аудитории перебором пользователей вместо индекса.
+    """
+    stub = use_stub_bot()
+    rng = random.Random(42)
+    group_ids = [f"g{number:02d}" for number in range(args.groups)]
+    bot_2.study_groups = {group_id: StudyGroup(group_id, f"Группа {group_id}", "", 20 + number % 10)
+                          for number, group_id in enumerate(group_ids)}
+    bot_2.GROUPS_ENABLED = True
+    subscriptions = bot_2.state_store.subscriptions
+    users = range(1, args.users + 1)
+    bot_2.user_ids.update(users)
+    for user_id in users:
+        subscriptions.subscribe(user_id, group_ids[user_id % args.groups])
+        if user_id <= args.multi:
+            subscriptions.subscribe(user_id, rng.choice(group_ids))
+    # Расписания групп различаются: у каждой группы часть занятий сдвинута и часть пропущена
+    schedules = {}
+    for number, group_id in enumerate(group_ids):
+        schedules[group_id] = [(day, start_time.replace(minute=(start_time.minute + number) % 60), event_type, subject)
+                               for index, (day, start_time, event_type, subject) in enumerate(bot_2.full_schedule)
+                               if (index + number) % 4 != 0]
+    start = datetime(2025, 1, 6)  # Понедельник
+    clock = SimulatedClock(start)
+    bot_2.scheduler_clock = clock
+    expected = 0  # Сообщений о лекциях и открытиях записи: сумма аудиторий групп событий
+    class_events = 0
+    closes = 0
+
+    async def handler(event):
+        nonlocal expected, class_events, closes
+        if event.kind in (EVENT_LECTURE, EVENT_PRACTICE_OPEN):
+            class_events += 1
+            expected += len(subscriptions.audience(event.group))
+        elif event.kind == EVENT_PRACTICE_CLOSE:
+            closes += 1
+        await bot_2.handle_schedule_event(event)
+
+    bot_2.event_scheduler = EventScheduler(schedules, handler, clock=clock, start=start)
+
+    async def run():
+        await bot_2.event_scheduler.run_until(start + timedelta(days=args.days))
+        await bot_2.event_scheduler.drain()
+
+    started = time_module.perf_counter()
+    asyncio.run(run())
+    elapsed = time_module.perf_counter() - started
+    sent = stub.calls.get("sendMessage", 0)
+    assert sent == expected, f"отправлено {sent} сообщений, аудитории событий — {expected}"
+    assert all("/" in key for key in bot_2.practice_slots), "ключ сессии без группы"
+    broadcast_all = class_events * args.users
+
+    # Поиск аудитории: индекс группа -> подписчики против перебора всех пользователей
+    groups_of = {user_id: subscriptions.groups_of(user_id) for user_id in users}
+    lookups = 200
+    started = time_module.perf_counter()
+    for index in range(lookups):
+        len(subscriptions.audience(group_ids[index % args.groups]))
+    indexed = (time_module.perf_counter() - started) / lookups
+    started = time_module.perf_counter()
+    for index in range(lookups):
+        group_id = group_ids[index % args.groups]
+        len([user_id for user_id in users if group_id in groups_of[user_id]])
+    scanned = (time_module.perf_counter() - started) / lookups
+
+    print(f"{args.groups} групп, {args.users} пользователей ({args.multi} в двух группах), {args.days} дней: "
+          f"{elapsed * 1000:.1f} мс")
+    print(f"  событий занятий: {class_events}, закрытий записи: {closes} "
+          f"(открытых сессий в конце: {len(bot_2.practice_slots)})")
+    print(f"  отправлено сообщений: {sent} (рассылка всем отправила бы {broadcast_all}, "
+          f"в {broadcast_all / max(sent, 1):.1f} раза больше)")
+    print(f"  аудитория группы: индекс {indexed * 1e6:.2f} мкс, перебор пользователей {scanned * 1e6:.1f} мкс")
+    return {"elapsed": elapsed, "class_events": class_events, "closes": closes, "messages": sent, "broadcast_all": broadcast_all,
+            "audience_indexed_s": indexed, "audience_scan_s": scanned, "calls": stub.calls}
+
+
+class FlakyBot(StubBot):
+    """
+    Заглушка бота с ошибками отправки: часть пользователей заблокировала бота, часть чатов не найдена,
+    у части чатов первые flaky_failures отправок завершаются ошибкой сети, а первая отправка вообще —
+    RetryAfter. down=True — сеть недоступна для всех.
+    """
+
+    def __init__(self, blocked=(), missing=(), flaky=(), flaky_failures: int = 2, retry_after: int = 0):
+        super().__init__()
+        self.blocked = set(blocked)
+        self.missing = set(missing)
+        self.flaky = set(flaky)
+        self.flaky_failures = flaky_failures
+        self.retry_after = retry_after
+        self.down = False
+        self.failures = {}  # Чат -> сколько раз отправка в него завершилась ошибкой сети
+        self.received = {}  # Чат -> сколько сообщений доставлено
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self._record("sendMessage")
+        method = SendMessage(chat_id=chat_id, text=text)
+        if self.down:
+            raise TelegramNetworkError(method, "Сеть недоступна")
+        if self.retry_after:
+            retry_after, self.retry_after = self.retry_after, 0
+            raise TelegramRetryAfter(method, "Flood control exceeded", retry_after)
+        if chat_id in self.blocked:
+            raise TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+        if chat_id in self.missing:
+            raise TelegramBadRequest(method, "Bad Request: chat not found")
+        if chat_id in self.flaky and self.failures.get(chat_id, 0) < self.flaky_failures:
+            self.failures[chat_id] = self.failures.get(chat_id, 0) + 1
+            raise TelegramNetworkError(method, "Request timeout")
+        self.received[chat_id] = self.received.get(chat_id, 0) + 1
+
+
+def bench_outbox(args):
+    """
+    Очередь доставки bot_2.Outbox. Сначала рассылка args.users пользователям, среди которых заблокировавшие бота,
+    несуществующие чаты и чаты с временными ошибками сети: каждый доступный пользователь должен получить ровно
+    одно сообщение, недоступные — удалиться из user_ids, а следующая рассылка не должна тратить на них запросы.
+    Затем сеть "падает" во время рассылки, бот перезапускается, и новая очередь, загруженная с диска, доставляет
+    все недоставленное (кроме сообщений, срок актуальности которых вышел за время простоя).
+    """
+    rng = random.Random(42)
+    users = list(range(1, args.users + 1))
+    shuffled = users[:]
+    rng.shuffle(shuffled)
+    blocked_count = int(args.users * args.blocked)
+    missing_count = int(args.users * args.missing)
+    blocked = shuffled[:blocked_count]
+    missing = shuffled[blocked_count:blocked_count + missing_count]
+    flaky = shuffled[blocked_count + missing_count:blocked_count + missing_count + int(args.users * args.flaky)]
+    dead = set(blocked) | set(missing)
+    live = [user_id for user_id in users if user_id not in dead]
+    bot_2.user_ids.update(users)
+    path = os.path.join(BENCH_DIR, "bench_outbox.jsonl")
+    current = [datetime(2025, 1, 10, 12, 0)]  # Часы для срока актуальности сообщений
+
+    def make_outbox(bot):
+        broadcaster = Broadcaster(bot, concurrency=100, global_rate=1e9, per_chat_interval=0)
+        return Outbox(broadcaster, path, on_dead=bot_2.remove_user, now=lambda: current[0],
+                      base_delay=args.retry_delay, max_delay=args.retry_delay * 8, flush_interval=0.05)
+
+    async def deliver():
+        bot = FlakyBot(blocked, missing, flaky, flaky_failures=2, retry_after=1)
+        outbox = make_outbox(bot)
+        bot_2.outbox = outbox
+        outbox.load()
+        outbox.start()
+        started = time_module.perf_counter()
+        first = await outbox.broadcast(users, "Открыта запись", name="первая", kind="practice_open")
+        await outbox.drain()
+        elapsed = time_module.perf_counter() - started
+        requests_before = bot.calls.get("sendMessage", 0)
+        await outbox.broadcast(bot_2.user_ids, "Лекция", name="вторая", kind="lecture")
+        await outbox.drain()
+        second_requests = bot.calls.get("sendMessage", 0) - requests_before
+        await outbox.stop()
+        return bot, outbox, first, elapsed, second_requests
+
+    bot, outbox, first, elapsed, second_requests = asyncio.run(deliver())
+    assert all(bot.received.get(user_id) == 2 for user_id in live), "доступный пользователь получил не 2 сообщения"
+    assert not dead & bot_2.user_ids, "недоступный пользователь остался в user_ids"
+    assert second_requests == len(live), f"вторая рассылка: {second_requests} запросов на {len(live)} пользователей"
+    assert os.path.getsize(path) == 0, "в очереди остались доставленные сообщения"
+    delivery = outbox.metrics()
+
+    async def crash():
+        bot = FlakyBot()
+        bot.down = True
+        outbox = make_outbox(bot)  # Без фоновой доставки: сбой происходит сразу после первой попытки
+        started = time_module.perf_counter()
+        await outbox.broadcast(live, "Подтверждение места", name="до сбоя", kind="practice_close",
+                               expires_at=current[0] + timedelta(hours=12))
+        enqueue = time_module.perf_counter() - started
+        await outbox.broadcast(live, "Лекция началась", name="устареет", kind="lecture",
+                               expires_at=current[0] + timedelta(minutes=10))
+        await outbox.stop()  # Сбой: сеть недоступна, сообщения остались в очереди на диске
+        return enqueue
+
+    async def restart():
+        current[0] += timedelta(minutes=30)  # Простой: лекция уже неактуальна
+        bot = FlakyBot()
+        outbox = make_outbox(bot)
+        restored = outbox.load()
+        outbox.start()
+        await outbox.drain()
+        await outbox.stop()
+        return bot, outbox, restored
+
+    enqueue = asyncio.run(crash())
+    queue_bytes = os.path.getsize(path)
+    bot, outbox, restored = asyncio.run(restart())
+    assert restored == 2 * len(live), f"после перезапуска загружено {restored} сообщений"
+    assert all(bot.received.get(user_id) == 1 for user_id in live), "после перезапуска доставлено не все"
+    assert outbox.expired == len(live), "устаревшие сообщения доставлены после перезапуска"
+
+    print(f"{args.users} пользователей: заблокировали бота {len(blocked)}, чат не найден {len(missing)}, "
+          f"временные ошибки сети {len(flaky)}")
+    print(f"  первая рассылка: сразу отправлено {first.sent}, повторов {first.retries}; "
+          f"все доступные получили сообщение за {elapsed * 1000:.0f} мс")
+    print(f"  недоступных удалено: {delivery['dead_recipients']}, запросов во второй рассылке: {second_requests} "
+          f"(без удаления было бы {args.users})")
+    print(f"  запись рассылки в очередь: {enqueue * 1000:.1f} мс, {queue_bytes / max(2 * len(live), 1):.1f} байт "
+          f"на сообщение в файле")
+    print(f"  после перезапуска: загружено {restored}, доставлено {outbox.delivered}, устарело {outbox.expired}")
+    return {"delivery_s": elapsed, "first": {"sent": first.sent, "retries": first.retries},
+            "dead_recipients": delivery["dead_recipients"], "second_requests": second_requests,
+            "enqueue_s": enqueue, "queue_bytes": queue_bytes, "restored": restored,
+            "redelivered": outbox.delivered, "expired": outbox.expired}
+
+
+def bench_history(args):
+    """
+    Архив посещаемости за args.days дней: args.subjects предметов в args.groups группах, args.users студентов.
+    Сравнивает запросы по индексам HistoryArchive (заполняемость за неделю, посещаемость предмета, CSV выгрузка)
+    с загрузкой всей истории в память, и проверяет, что ответы совпадают.
+    """
+    rng = random.Random(11)
+    path = os.path.join(BENCH_DIR, "history_bench.jsonl")
+    start = datetime(2025, 2, 3, 12, 40)
+    subjects = [f"Предмет {number}" for number in range(args.subjects)]
+    students = {f"g{group}": list(range(group * args.users // args.groups + 1, (group + 1) * args.users // args.groups + 1))
+                for group in range(args.groups)}
+    archive = HistoryArchive(path)
+
+    async def fill():
+        for day in range(args.days):
+            for number, subject in enumerate(subjects):
+                group_id = f"g{number % args.groups}"
+                session = PracticeSession(f"{group_id}/{subject}", subject, start + timedelta(days=day), args.seats)
+                audience = students[group_id]
+                for seat, user_id in enumerate(rng.sample(audience, min(len(audience), rng.randint(0, args.seats))), 1):
+                    session.book(seat, user_id)
+                    session.mark_booked_at(user_id, session.open_time + timedelta(seconds=rng.randint(1, 3600)))
+                await archive.record(session, group_id)
+
+    started = time_module.perf_counter()
+    asyncio.run(fill())
+    archive.close()
+    fill_elapsed = time_module.perf_counter() - started
+    file_size = os.path.getsize(path)
+
+    def load_archive():
+        loaded = HistoryArchive(path)
+        loaded.load()
+        return loaded
+
+    def load_full():
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def measure(func, repeat=5):
+        """(лучшее время из repeat запусков, результат последнего запуска)."""
+        best = float("inf")
+        for _ in range(repeat):
+            started = time_module.perf_counter()
+            result = func()
+            best = min(best, time_module.perf_counter() - started)
+        return best, result
+
+    def memory_of(func):
+        tracemalloc.start()
+        result = func()
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return used, result
+
+    load_elapsed, archive = measure(load_archive, repeat=3)
+    index_memory, _ = memory_of(load_archive)
+    full_load_elapsed, full = measure(load_full, repeat=3)
+    full_memory, _ = memory_of(load_full)
+
+    week_start, subject = (start + timedelta(days=args.days // 2)).date(), subjects[0]
+    week_end = week_start + timedelta(days=6)
+    results = {"sessions": len(archive), "file_size": file_size, "fill_s": fill_elapsed, "load_s": load_elapsed,
+               "index_memory": index_memory, "full_load_s": full_load_elapsed, "full_memory": full_memory}
+
+    def week_full_scan():
+        rows = [row for row in full if week_start.isoformat() <= row["date"] <= week_end.isoformat()]
+        return len(rows), sum(len(row["users"]) for row in rows)
+
+    elapsed, week = measure(lambda: archive.occupancy(since=week_start, until=week_end))
+    results["week_occupancy_ms"] = elapsed * 1000
+    elapsed, week_full = measure(week_full_scan)
+    results["week_occupancy_full_ms"] = elapsed * 1000
+    assert (week.sessions, week.booked) == week_full, (week, week_full)
+
+    elapsed, report = measure(lambda: asyncio.run(archive.attendance(subject)))
+    results["attendance_ms"] = elapsed * 1000
+    attended = {}
+    for row in full:
+        if row["subject"] == subject:
+            for user_id in row["users"]:
+                attended[user_id] = attended.get(user_id, 0) + 1
+    assert {item.user_id: item.attended for item in report} == attended
+
+    student = students["g0"][0]
+    elapsed, student_total = measure(lambda: sum(item.attended for item in archive.student(student)))
+    results["student_ms"] = elapsed * 1000
+    assert student_total == sum(1 for row in full if student in row["users"])
+
+    export_path = os.path.join(BENCH_DIR, "history_bench.csv")
+    started = time_module.perf_counter()
+    exported = asyncio.run(archive.export_csv(export_path, subject))
+    results["export_ms"] = (time_module.perf_counter() - started) * 1000
+    with open(export_path, encoding="utf-8") as f:
+        exported_lines = sum(1 for _ in f) - 1
+    assert exported_lines == sum(attended.values())
+
+    print(f"Архив: {len(archive)} сессий за {args.days} дней, {file_size / 1024:.0f} КБ, "
+          f"запись {fill_elapsed / len(archive) * 1e6:.1f} мкс на сессию")
+    print(f"  загрузка индексов: {load_elapsed * 1000:.1f} мс, {index_memory / 1024:.0f} КБ в памяти")
+    print(f"  загрузка всей истории: {full_load_elapsed * 1000:.1f} мс, {full_memory / 1024:.0f} КБ в памяти")
+    print(f"  заполняемость за неделю: {results['week_occupancy_ms']:.2f} мс по индексу, "
+          f"{results['week_occupancy_full_ms']:.2f} мс перебором ({week.occupancy:.0%})")
+    print(f"  посещаемость предмета ({len(report)} студентов): {results['attendance_ms']:.1f} мс, "
+          f"студента: {results['student_ms']:.3f} мс")
+    print(f"  CSV выгрузка предмета ({exported} сессий, {exported_lines} строк): {results['export_ms']:.1f} мс")
+    return results
+
+
+def bench_recovery(args):
+    """
+    Время до готовности после простоя. Сначала загружается большое состояние (args.users пользователей,
+    args.sessions открытых сессий) из хранилища args.storage. Затем бот "запускается" в пятницу 13:00 после
+    простоя с 08:00: schedule_checker должен по порядку выполнить пропущенные события в окне args.catch_up часов
+    (открыть практику 12:40, не открывать практики, чье время записи уже вышло, закрыть запись, открытую до
+    простоя), после чего повторный перезапуск не должен отправить ни одного сообщения.
+    """
+    user_ids, practice_slots, sent_notifications = build_state(args.users, args.sessions, bot_2.MAX_SLOTS, 200)
+    paths = dict(
+        user_ids_file=os.path.join(BENCH_DIR, "recovery_user_ids.json"),
+        practice_slots_file=os.path.join(BENCH_DIR, "recovery_practice_slots.json"),
+        sent_notifications_file=os.path.join(BENCH_DIR, "recovery_sent_notifications.json"),
+        snapshot_file=os.path.join(BENCH_DIR, "recovery_snapshot.json"),
+        journal_file=os.path.join(BENCH_DIR, "recovery_journal.jsonl"),
+        db_file=os.path.join(BENCH_DIR, "recovery.sqlite3"),
+    )
+    storage = create_storage(args.storage, **paths)
+    storage.save(user_ids, practice_slots, sent_notifications)
+    storage.close()
+    # Загрузка новым экземпляром хранилища, как при запуске бота
+    started = time_module.perf_counter()
+    storage = create_storage(args.storage, **paths)
+    loaded = storage.load()
+    load_time = time_module.perf_counter() - started
+    storage.close()
+    assert len(loaded[0]) == args.users and len(loaded[1]) == args.sessions
+
+    stub = use_stub_bot()
+    bot_2.user_ids.update(range(1, args.notify_users + 1))
+    down_at = datetime(2025, 1, 10, 8, 0)  # Пятница
+    boot_at = datetime(2025, 1, 10, 13, 0)
+    # Запись, открытая до простоя: ее время вышло в 08:50, пока бот был выключен
+    stale_key = "Пятница_07:50"
+    stale = PracticeSession(stale_key, "Практика до простоя", down_at - timedelta(minutes=10), bot_2.MAX_SLOTS)
+    for seat in range(1, 6):
+        stale.book(seat, seat)
+    bot_2.practice_slots[stale_key] = stale
+    handled = []
+
+    async def boot(now: datetime):
+        clock = SimulatedClock(now)
+        bot_2.scheduler_clock = clock
+
+        async def handler(event):
+            handled.append(event)
+            await bot_2.handle_schedule_event(event)
+
+        bot_2.event_scheduler = EventScheduler(bot_2.full_schedule, handler, clock=clock,
+                                               catch_up=timedelta(hours=args.catch_up))
+        started = time_module.perf_counter()
+        checker = asyncio.create_task(bot_2.schedule_checker())
+        await bot_2.event_scheduler.recovered.wait()
+        ready = time_module.perf_counter() - started
+        checker.cancel()
+        await bot_2.event_scheduler.drain()
+        return ready, bot_2.event_scheduler.caught_up
+
+    async def run():
+        first = await boot(boot_at)
+        caught_up_events = list(handled)
+        sent_after_first = stub.calls.get("sendMessage", 0)
+        second = await boot(boot_at + timedelta(minutes=5))
+        return first, second, caught_up_events, sent_after_first
+
+    (catch_up_time, caught_up), (_, recaught), events, sent = asyncio.run(run())
+    resent = stub.calls.get("sendMessage", 0) - sent
+    whens = [event.when for event in events]
+    assert whens == sorted(whens), "пропущенные события выполнены не по порядку"
+    assert stale_key not in bot_2.practice_slots, "запись, открытая до простоя, не закрыта"
+    assert "Пятница_12:40" in bot_2.practice_slots, "практика 12:40 не открыта после простоя"
+    assert "Пятница_09:00" not in bot_2.practice_slots, "открыта практика, время записи которой уже вышло"
+    assert resent == 0, f"после повторного перезапуска отправлено {resent} сообщений"
+    results = {"load_s": load_time, "catch_up_s": catch_up_time, "ready_s": load_time + catch_up_time,
+               "caught_up": caught_up, "recaught": recaught, "messages": sent, "resent": resent}
+    print(f"Состояние: {args.users} пользователей, {args.sessions} сессий ({args.storage})")
+    print(f"  загрузка состояния:         {load_time * 1000:8.1f} мс")
+    print(f"  пропущенные события:        {catch_up_time * 1000:8.1f} мс ({caught_up} событий, "
+          f"{sent} сообщений {args.notify_users} пользователям)")
+    print(f"  время до готовности:        {(load_time + catch_up_time) * 1000:8.1f} мс")
+    print(f"  повторный перезапуск:       {recaught} событий, {resent} повторных сообщений")
+    return results
+
+
+def bench_ledger(args):
+    """
+    Прогоняет args.days дней расписания (по умолчанию семестр) и следит за размером учета уведомлений:
+    он должен оставаться ограниченным, а не расти с каждым днем работы бота.
+    """
+    use_stub_bot()
+    bot_2.user_ids.update(range(1, args.users + 1))
+    start = datetime(2025, 2, 3)  # Понедельник
+    clock = SimulatedClock(start)
+    bot_2.scheduler_clock = clock
+    stats = {"sent": 0, "max_entries": 0, "max_partitions": 0}
+
+    async def handler(event):
+        await bot_2.handle_schedule_event(event)
+        ledger = bot_2.sent_notifications
+        stats["max_entries"] = max(stats["max_entries"], len(ledger))
+        stats["max_partitions"] = max(stats["max_partitions"], ledger.partition_count)
+
+    bot_2.event_scheduler = EventScheduler(bot_2.full_schedule, handler, clock=clock, start=start)
+
+    async def run():
+        await bot_2.event_scheduler.run_until(start + timedelta(days=args.days))
+        await bot_2.event_scheduler.drain()
+
+    started = time_module.perf_counter()
+    asyncio.run(run())
+    elapsed = time_module.perf_counter() - started
+    bot_2.save_persistent_data(bot_2.user_ids, bot_2.practice_slots, bot_2.sent_notifications)
+    file_size = os.path.getsize(bot_2.SENT_NOTIFICATIONS_FILE)
+    lecture_and_practice = sum(1 for event in bot_2.full_schedule if event[2] in ("лекция", "практика"))
+    print(f"{args.days} дней расписания: {elapsed * 1000:.1f} мс, событий выполнено {bot_2.event_scheduler.fired}")
+    print(f"  записей в расписании на неделю: {lecture_and_practice}")
+    print(f"  учет уведомлений: максимум {stats['max_entries']} записей в {stats['max_partitions']} днях, "
+          f"в конце {len(bot_2.sent_notifications)} записей")
+    print(f"  размер {bot_2.SENT_NOTIFICATIONS_FILE}: {file_size} байт")
+    return {"elapsed": elapsed, "file_size": file_size, **stats}
+
+
+SEMESTER_START = datetime(2025, 2, 3).date()  # Понедельник первой (нечетной) недели
+
+
+def timetable_fixture():
+    """
+    Расписание bot_2.full_schedule с четными/нечетными неделями и исключениями: отмена занятия,
+    праздник (отменен весь день), перенос на другой день и разовое занятие.
+    Возвращает (занятия, исключения) в полях JSON файла.
+    """
+    classes = [{"day": day_name, "time": start_time.strftime("%H:%M"), "type": event_type, "subject": subject_name}
+               for day_name, start_time, event_type, subject_name in bot_2.full_schedule]
+    classes[0]["weeks"] = "odd"   # Понедельник 09:00 — только по нечетным неделям
+    classes[1]["weeks"] = "even"  # Понедельник 10:40 — только по четным
+    exceptions = [
+        {"date": "2025-02-11", "time": "09:00", "subject": classes[3]["subject"], "action": "cancel"},
+        {"date": "2025-02-14", "time": "10:40", "subject": "Проектирование баз данных", "action": "move",
+         "to": "2025-02-15 09:00"},
+        {"date": "2025-02-12", "time": "11:00", "type": "лекция", "subject": "Консультация", "action": "add"},
+    ]
+    return classes, exceptions
+
+
+def write_json_timetable(path: str, classes, exceptions, holidays=()):
+    data = {"semester_start": SEMESTER_START.isoformat(), "classes": classes,
+            "exceptions": exceptions + [{"date": day, "action": "cancel"} for day in holidays]}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def write_csv_timetable(path: str, classes, exceptions):
+    import csv
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, ["day", "date", "time", "type", "subject", "weeks", "action", "to"])
+        writer.writeheader()
+        writer.writerow({"date": SEMESTER_START.isoformat(), "action": "semester_start"})
+        for item in classes:
+            writer.writerow(item)
+        for item in exceptions:
+            writer.writerow(item)
+
+
+def write_ical_timetable(path: str, classes, exceptions):
+    """Те же занятия в iCalendar: RRULE для недель, EXDATE для отмен, RECURRENCE-ID для переносов."""
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0"]
+    uids = {}
+    for index, item in enumerate(classes):
+        first = SEMESTER_START + timedelta(days=RUSSIAN_WEEKDAYS.index(item["day"]))
+        if item.get("weeks") == "even":
+            first += timedelta(days=7)
+        start = datetime.combine(first, datetime.strptime(item["time"], "%H:%M").time())
+        uid = f"class-{index}@bot"
+        uids[(item["time"], item["subject"], item["day"])] = uid
+        lines += ["BEGIN:VEVENT", f"UID:{uid}", f"DTSTART:{start:%Y%m%dT%H%M%S}", f"SUMMARY:{item['subject']}",
+                  f"CATEGORIES:{item['type']}",
+                  f"RRULE:FREQ=WEEKLY;INTERVAL={2 if item.get('weeks') in ('odd', 'even') else 1}"]
+        for exception in exceptions:
+            day = datetime.fromisoformat(exception["date"])
+            if (exception["action"] == "cancel" and RUSSIAN_WEEKDAYS[day.weekday()] == item["day"]
+                    and exception["time"] == item["time"] and exception["subject"] == item["subject"]):
+                lines.append(f"EXDATE:{day:%Y%m%d}T{item['time'].replace(':', '')}00")
+        lines.append("END:VEVENT")
+    for index, exception in enumerate(exceptions):
+        day = datetime.fromisoformat(exception["date"])
+        if exception["action"] == "move":
+            original = datetime.combine(day, datetime.strptime(exception["time"], "%H:%M").time())
+            uid = uids[(exception["time"], exception["subject"], RUSSIAN_WEEKDAYS[day.weekday()])]
+            target = datetime.fromisoformat(exception["to"])
+            lines += ["BEGIN:VEVENT", f"UID:{uid}", f"RECURRENCE-ID:{original:%Y%m%dT%H%M%S}",
+                      f"DTSTART:{target:%Y%m%dT%H%M%S}", f"SUMMARY:{exception['subject']}", "END:VEVENT"]
+        elif exception["action"] == "add":
+            start = datetime.combine(day, datetime.strptime(exception["time"], "%H:%M").time())
+            lines += ["BEGIN:VEVENT", f"UID:extra-{index}@bot", f"DTSTART:{start:%Y%m%dT%H%M%S}",
+                      f"SUMMARY:{exception['subject']}", f"CATEGORIES:{exception['type']}", "END:VEVENT"]
+    lines.append("END:VCALENDAR")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\r\n".join(lines) + "\r\n")
+
+
+def naive_entries_for(classes, exceptions, day):
+    """Без индекса: каждый раз перебирает все занятия и все исключения (как при пересканировании на каждом тике)."""
+    entries = []
+    for weekly_class in classes:
+        if weekly_class.weekday != day.weekday() or not weekly_class.occurs_on(day):
+            continue
+        if any(exception.day == day and exception.action in ("cancel", "move")
+               and exception.matches(weekly_class.start_time, weekly_class.subject_name) for exception in exceptions):
+            continue
+        entries.append((weekly_class.start_time, weekly_class.event_type, weekly_class.subject_name))
+    for exception in exceptions:
+        if exception.day == day and exception.action == "add":
+            entries.append((exception.start_time, exception.event_type, exception.subject_name))
+    return sorted(entries, key=lambda entry: entry[0])
+
+
+def bench_timetable(args):
+    """
+    Расписание из файла: одинаковый результат для JSON, CSV и iCal; четные/нечетные недели и исключения;
+    скорость выборки занятий дня по индексу против перебора; перезагрузка файла на ходу
+    без повторных и потерянных уведомлений.
+    """
+    classes, exceptions = timetable_fixture()
+    write_json_timetable("timetable.json", classes, exceptions)
+    write_csv_timetable("timetable.csv", classes, exceptions)
+    write_ical_timetable("timetable.ics", classes, exceptions)
+    days = [SEMESTER_START + timedelta(days=i) for i in range(args.days)]
+    by_format = {path: load_timetable(path) for path in ("timetable.json", "timetable.csv", "timetable.ics")}
+    reference = [by_format["timetable.json"].entries_for(day) for day in days]
+    for path, timetable in by_format.items():
+        assert [timetable.entries_for(day) for day in days] == reference, f"{path} отличается от JSON"
+    compiled = by_format["timetable.json"]
+    monday_subjects = lambda day: [subject for _, _, subject in compiled.entries_for(day)]  # noqa: E731
+    assert classes[0]["subject"] in monday_subjects(SEMESTER_START)
+    assert classes[1]["subject"] not in monday_subjects(SEMESTER_START)
+    assert classes[1]["subject"] in monday_subjects(SEMESTER_START + timedelta(days=7))
+    assert classes[3]["subject"] not in [s for _, _, s in compiled.entries_for(datetime(2025, 2, 11).date())]
+    assert "Консультация" in [s for _, _, s in compiled.entries_for(datetime(2025, 2, 12).date())]
+    moved = compiled.entries_for(datetime(2025, 2, 15).date())[0]
+    assert moved[0].strftime("%H:%M") == "09:00" and moved[2] == "Проектирование баз данных", moved
+    write_json_timetable("holiday.json", classes, exceptions, holidays=["2025-02-13"])
+    assert load_timetable("holiday.json").entries_for(datetime(2025, 2, 13).date()) == []
+
+    # Скорость выборки занятий дня: большое расписание (args.classes занятий, args.exceptions исключений)
+    rng = random.Random(42)
+    big_classes = [{"day": RUSSIAN_WEEKDAYS[i % 6], "time": f"{8 + i % 12:02d}:{rng.choice([0, 20, 40]):02d}",
+                    "type": rng.choice(["лекция", "практика"]), "subject": f"Предмет {i}",
+                    "weeks": rng.choice(["all", "odd", "even"])} for i in range(args.classes)]
+    big_exceptions = []
+    for i in range(args.exceptions):
+        day = SEMESTER_START + timedelta(days=rng.randrange(args.days))
+        big_exceptions.append({"date": day.isoformat(), "time": "21:00", "type": "лекция",
+                               "subject": f"Разовое {i}", "action": "add"} if i % 2 else
+                              {"date": day.isoformat(), "time": big_classes[i % args.classes]["time"],
+                               "subject": big_classes[i % args.classes]["subject"], "action": "cancel"})
+    write_json_timetable("big.json", big_classes, big_exceptions)
+    started = time_module.perf_counter()
+    big = load_timetable("big.json")
+    compile_time = time_module.perf_counter() - started
+    flat_classes = [entry for weekday in range(7) for entry in big._by_weekday[weekday]]
+    flat_exceptions = [exception for removals in big._removals.values() for exception in removals]
+    flat_exceptions += [ScheduleException(day, "add", start_time, subject_name, event_type)
+                        for day, additions in big._additions.items()
+                        for start_time, event_type, subject_name in additions]
+    for day in days:
+        assert naive_entries_for(flat_classes, flat_exceptions, day) == big.entries_for(day), day
+    started = time_module.perf_counter()
+    for _ in range(args.repeats):
+        for day in days:
+            big.entries_for(day)
+    indexed = time_module.perf_counter() - started
+    started = time_module.perf_counter()
+    for _ in range(args.repeats):
+        for day in days:
+            naive_entries_for(flat_classes, flat_exceptions, day)
+    naive = time_module.perf_counter() - started
+    lookups = args.repeats * len(days)
+
+    # Горячая перезагрузка: на середине прогона файл меняется (занятие отменено, добавлено разовое)
+    stub = use_stub_bot()
+    bot_2.user_ids.update(range(1, args.users + 1))
+    start = datetime.combine(SEMESTER_START, datetime.min.time())
+    middle = start + timedelta(days=2, hours=12)  # Среда, 12:00
+    clock = SimulatedClock(start)
+    bot_2.scheduler_clock = clock
+    source = ScheduleSource("timetable.json", fallback=Timetable.from_entries(bot_2.full_schedule))
+    fired = []
+
+    async def handler(event):
+        fired.append((event.when, event.kind, event.subject_name))
+        await bot_2.handle_schedule_event(event)
+
+    bot_2.event_scheduler = EventScheduler(source.timetable, handler, clock=clock, start=start)
+    reload_checks = 10000
+    stat_started = time_module.perf_counter()
+    for _ in range(reload_checks):
+        assert source.reload_if_changed() is None  # Файл не менялся: только os.stat
+    stat_cost = (time_module.perf_counter() - stat_started) / reload_checks
+
+    async def run():
+        await bot_2.event_scheduler.run_until(middle)
+        changed = exceptions + [
+            {"date": "2025-02-05", "time": "15:10", "subject": "Практика Среды (Английский)", "action": "cancel"},
+            {"date": "2025-02-05", "time": "17:00", "type": "лекция", "subject": "Добавлена на ходу", "action": "add"},
+            {"date": "2025-02-05", "time": "09:30", "type": "лекция", "subject": "Уже прошла", "action": "add"},
+        ]
+        write_json_timetable("timetable.json", classes, changed)
+        os.utime("timetable.json", ns=(time_module.time_ns(), time_module.time_ns() + 10 ** 9))
+        timetable = source.reload_if_changed()
+        assert timetable is not None
+        bot_2.event_scheduler.reload(timetable)
+        bot_2.event_scheduler.reload(timetable)  # Повторная перезагрузка не дублирует события
+        with open("timetable.json", "w", encoding="utf-8") as f:
+            f.write("{ испорченный файл")
+        os.utime("timetable.json", ns=(time_module.time_ns(), time_module.time_ns() + 2 * 10 ** 9))
+        assert source.reload_if_changed() is None and source.timetable is timetable  # Ошибка: расписание прежнее
+        await bot_2.event_scheduler.run_until(start + timedelta(days=7))
+        await bot_2.event_scheduler.drain()
+
+    started = time_module.perf_counter()
+    asyncio.run(run())
+    elapsed = time_module.perf_counter() - started
+    class_events = [item for item in fired if item[1] in (EVENT_LECTURE, EVENT_PRACTICE_OPEN)]
+    assert len(class_events) == len(set(class_events)), "событие выполнено дважды"
+    subjects = {subject for _, _, subject in class_events}
+    assert "Добавлена на ходу" in subjects and "Уже прошла" not in subjects
+    wednesday_practice = datetime(2025, 2, 5, 15, 10)
+    assert all(when != wednesday_practice for when, _, _ in class_events), "отмененное занятие выполнено"
+
+    print(f"JSON, CSV и iCal дают одинаковое расписание на {args.days} дней; четные недели и исключения учтены")
+    print(f"{args.classes} занятий и {args.exceptions} исключений: компиляция {compile_time * 1000:.2f} мс")
+    print(f"  занятия дня по индексу: {indexed / lookups * 1e6:.2f} мкс, "
+          f"перебором: {naive / lookups * 1e6:.2f} мкс ({naive / indexed:.0f}x)")
+    print(f"  проверка изменения файла: {stat_cost * 1e6:.2f} мкс (только os.stat)")
+    print(f"Перезагрузка на ходу: неделя за {elapsed * 1000:.1f} мс, событий занятий {len(class_events)}, "
+          f"отправлено сообщений {stub.calls.get('sendMessage', 0)}")
+    print("  проверки пройдены: без повторов, отмененное не выполнено, добавленное выполнено, "
+          "испорченный файл не применен")
+    return {"compile_ms": compile_time * 1000, "indexed_us": indexed / lookups * 1e6,
+            "naive_us": naive / lookups * 1e6, "stat_us": stat_cost * 1e6, "reload_run_ms": elapsed * 1000,
+            "class_events": len(class_events), "reloads": source.reloads}
+
+
+class HoldingClock(SimulatedClock):
+    """
+    Виртуальные часы, которые идут только до hold_until, а дальше останавливаются:
+    планировщик выполняет открытие практики и засыпает, не доходя до закрытия записи.
+    """
+
+    def __init__(self, start: datetime, hold_until: datetime):
+        super().__init__(start)
+        self.hold_until = hold_until
+
+    async def sleep(self, seconds: float):
+        if self.current >= self.hold_until:
+            await asyncio.Event().wait()  # Ждем отмены задачи
+        await super().sleep(min(seconds, (self.hold_until - self.current).total_seconds()))
+
+
+class LoopStallMonitor:
+    """Измеряет, насколько цикл событий опаздывает разбудить задачу, которая спит interval секунд."""
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.stalls = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time_module.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.stalls.append(max(time_module.perf_counter() - started - self.interval, 0.0))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def latency_summary(values) -> dict:
+    """p50/p99/максимум в миллисекундах."""
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(max(values, default=0.0) * 1000, 3),
+    }
+
+
+def bench_load(args):
+    """
+    Нагрузочный сценарий на настоящих обработчиках bot_2: args.users пользователей регистрируются (/start),
+    schedule_checker открывает запись на практику и рассылает приглашение, после чего все пользователи
+    одновременно нажимают "Да" и выбирают места (args.clicks нажатий на пользователя, места случайные,
+    поэтому часть нажатий приходится на занятые места). Бот — заглушка, Telegram не вызывается.
+    """
+    rng = random.Random(11)
+    stub = use_stub_bot()
+    bot_2.seat_map_viewers.debounce = args.debounce
+    # Отдельное хранилище нужного типа во временном каталоге
+    bot_2.storage = create_storage(
+        args.storage,
+        user_ids_file=os.path.join(BENCH_DIR, "load_user_ids.json"),
+        practice_slots_file=os.path.join(BENCH_DIR, "load_practice_slots.json"),
+        sent_notifications_file=os.path.join(BENCH_DIR, "load_sent_notifications.json"),
+        snapshot_file=os.path.join(BENCH_DIR, "load_snapshot.json"),
+        journal_file=os.path.join(BENCH_DIR, "load_journal.jsonl"),
+        db_file=os.path.join(BENCH_DIR, f"load_{rng.random():.6f}.sqlite3"),
+    )
+    bot_2.persistence_writer = PersistenceWriter(
+        bot_2.storage, lambda: (bot_2.user_ids, bot_2.practice_slots, bot_2.sent_notifications),
+        interval=args.persist_interval)
+    # Практика "Понедельник 12:40": часы останавливаются через минуту после открытия записи
+    open_at = datetime(2025, 1, 6, 12, 40)
+    clock = HoldingClock(open_at - timedelta(minutes=1), open_at + timedelta(minutes=1))
+    bot_2.scheduler_clock = clock
+    bot_2.event_scheduler = EventScheduler(bot_2.full_schedule, bot_2.handle_schedule_event, clock=clock,
+                                           start=clock.now())
+    practice_session_key = bot_2.event_scheduler.timeline._session_key_for("Понедельник", open_at.time())
+
+    latencies = {"register_user": [], "handle_confirm_yes_to_practice": [], "handle_slot_selection": []}
+    persist_latencies = []
+    original_persist_changes = bot_2.persist_changes
+
+    async def timed_persist_changes(records):
+        started = time_module.perf_counter()
+        try:
+            return await original_persist_changes(records)
+        finally:
+            persist_latencies.append(time_module.perf_counter() - started)
+
+    bot_2.persist_changes = timed_persist_changes
+
+    async def timed(name, handler, update):
+        started = time_module.perf_counter()
+        await handler(update)
+        latencies[name].append(time_module.perf_counter() - started)
+
+    async def user_flow(user_id):
+        message = StubMessage(stub, user_id, message_id=user_id)
+        await timed("handle_confirm_yes_to_practice", bot_2.handle_confirm_yes_to_practice,
+                    StubCallback(stub, user_id, default_codec.encode(ACTION_CONFIRM_YES, practice_session_key),
+                                 message))
+        for _ in range(args.clicks):
+            seat = rng.randint(1, bot_2.MAX_SLOTS)
+            callback_data = slot_callback_data(practice_session_key, seat)
+            await timed("handle_slot_selection", bot_2.handle_slot_selection,
+                        StubCallback(stub, user_id, callback_data, message))
+
+    async def run():
+        monitor = LoopStallMonitor()
+        monitor.start()
+        bot_2.persistence_writer.start()
+        phases = {}
+        users = list(range(1, args.users + 1))
+
+        started = time_module.perf_counter()
+        await asyncio.gather(*(timed("register_user", bot_2.register_user, StubMessage(stub, user_id))
+                               for user_id in users))
+        phases["register"] = time_module.perf_counter() - started
+
+        started = time_module.perf_counter()
+        checker = asyncio.create_task(bot_2.schedule_checker())
+        while bot_2.event_scheduler.fired == 0 or bot_2.event_scheduler._tasks:
+            await asyncio.sleep(0)
+        phases["open_and_broadcast"] = time_module.perf_counter() - started
+
+        started = time_module.perf_counter()
+        await asyncio.gather(*(user_flow(user_id) for user_id in users))
+        phases["clicks"] = time_module.perf_counter() - started
+
+        # Ждем живые обновления карты мест и сохранение оставшихся изменений
+        await asyncio.sleep(args.debounce * 2)
+        started = time_module.perf_counter()
+        await bot_2.persistence_writer.stop()
+        phases["final_flush"] = time_module.perf_counter() - started
+        checker.cancel()
+        await monitor.stop()
+        return phases, monitor.stalls
+
+    try:
+        phases, stalls = asyncio.run(run())
+    finally:
+        bot_2.persist_changes = original_persist_changes
+        bot_2.storage.close()
+
+    session = bot_2.practice_slots.get(practice_session_key)
+    results = {
+        "users": args.users,
+        "storage": args.storage,
+        "handlers": {name: latency_summary(values) for name, values in latencies.items()},
+        "persist_changes": latency_summary(persist_latencies),
+        "persistence_writer": bot_2.persistence_writer.metrics(),
+        "loop_stall": {**latency_summary(stalls), "total_ms": round(sum(stalls) * 1000, 3)},
+        "phases_ms": {name: round(value * 1000, 3) for name, value in phases.items()},
+        "api_calls": dict(sorted(stub.calls.items())),
+        "booked_seats": session.booked_count if session is not None else 0,
+        "live_updates": {"sent": bot_2.seat_map_viewers.edits_sent, "skipped": bot_2.seat_map_viewers.edits_skipped},
+    }
+
+    print(f"{args.users} пользователей, по {args.clicks} нажатий на места, хранилище {args.storage}")
+    for name, summary in results["handlers"].items():
+        print(f"  {name:32} p50 {summary['p50_ms']:8.3f} мс  p99 {summary['p99_ms']:8.3f} мс  "
+              f"max {summary['max_ms']:8.3f} мс  ({summary['count']} вызовов)")
+    summary = results["persist_changes"]
+    print(f"  {'persist_changes':32} p50 {summary['p50_ms']:8.3f} мс  p99 {summary['p99_ms']:8.3f} мс")
+    writer = results["persistence_writer"]
+    print(f"  фоновое сохранение: {writer['flushes']} записей на диск, в среднем {writer['avg_flush_latency_ms']} мс")
+    stall = results["loop_stall"]
+    print(f"  задержки цикла событий: p99 {stall['p99_ms']} мс, максимум {stall['max_ms']} мс, всего {stall['total_ms']} мс")
+    print(f"  фазы (мс): {results['phases_ms']}")
+    print(f"  вызовы API: {results['api_calls']}")
+    print(f"  занято мест: {results['booked_seats']} из {bot_2.MAX_SLOTS}")
+    return results
+
+
+def replay_bookings(session_key: str, capacity: int, records):
+    """
+    Проигрывает сохраненные записи о местах одной сессии по порядку и проверяет, что они непротиворечивы:
+    место не занимается поверх чужого, освобождает место его владелец, после закрытия записей нет.
+    Возвращает восстановленную сессию.
+    """
+    replayed = PracticeSession(session_key, "", datetime.now(), capacity)
+    closed = False
+    for record in records:
+        if record.get("session") != session_key:
+            continue
+        assert not closed, f"Запись после закрытия сессии: {record}"
+        if record["op"] == "seat_taken":
+            owner = replayed.owner(record["slot"])
+            assert owner is None or owner == record["user"], f"Место занято дважды: {record}"
+            assert replayed.seat_of(record["user"]) in (None, record["slot"]), f"Два места у пользователя: {record}"
+            replayed.book(record["slot"], record["user"])
+        elif record["op"] == "seat_released":
+            assert replayed.owner(record["slot"]) == record["user"], f"Освобождено чужое место: {record}"
+            replayed.release(record["user"])
+        elif record["op"] == "session_closed":
+            closed = True
+    return replayed
+
+
+def bench_anyseat(args):
+    """
+    Запись на практику в момент открытия: args.users пользователей одновременно записываются на сессию
+    из MAX_SLOTS мест двумя способами, каждое обращение к Telegram длится args.latency_ms.
+      manual  — "✅ Да", затем через время реакции (около args.think_ms) нажатие на первое место, свободное в карте
+                мест на момент ее показа; если место успели занять, карта обновляется и все повторяется
+                (все выбирают одни и те же первые места);
+      any     — одно нажатие "🎯 Любое свободное место".
+    Печатает нажатия на пользователя, вызовы API, время от первого нажатия до места и конфликты; проверяет,
+    что места не заняты дважды. Отдельно — поиск первого свободного места: битовая маска против перебора мест.
+    """
+    rng = random.Random(25)
+    latency = args.latency_ms / 1000
+    session_key = "Понедельник_12:40"
+    users = list(range(1, args.users + 1))
+    update_ids = itertools.count(1)
+
+    def tap(bench_bot, user_id, callback_data):
+        """Настоящий CallbackQuery, привязанный к боту: ответы и правки идут через сессию aiogram."""
+        update = Update.model_validate(slot_click_update(next(update_ids), user_id, callback_data),
+                                       context={"bot": bench_bot})
+        return update.callback_query
+
+    async def manual(bench_bot, user_id):
+        await bot_2.handle_confirm_yes_to_practice(
+            tap(bench_bot, user_id, default_codec.encode(ACTION_CONFIRM_YES, session_key)))
+        taps = 1
+        while True:
+            seat = bot_2.practice_slots[session_key].first_free_seat()  # Первое свободное место в показанной карте
+            if seat is None:
+                return taps
+            await asyncio.sleep(args.think_ms / 1000 * rng.uniform(0.5, 1.5))
+            await bot_2.handle_slot_selection(tap(bench_bot, user_id, slot_callback_data(session_key, seat)))
+            taps += 1
+            if bot_2.practice_slots[session_key].seat_of(user_id) is not None:
+                return taps
+
+    async def any_seat(bench_bot, user_id):
+        await bot_2.handle_any_seat(tap(bench_bot, user_id, default_codec.encode(ACTION_ANY_SEAT, session_key)))
+        return 1
+
+    async def run(flow):
+        stub_session = StubSession(latency=latency)
+        bench_bot = Bot(token=bot_2.API_TOKEN, session=stub_session)
+        bot_2.broadcaster = Broadcaster(bench_bot, concurrency=100, global_rate=1e9, per_chat_interval=0)
+        bot_2.seat_map_viewers.bot = bench_bot
+        bot_2.seat_map_viewers.broadcaster = bot_2.broadcaster
+        bot_2.practice_slots.clear()
+        await bot_2.booking_desk.open(PracticeSession(session_key, "Бенчмарк", datetime.now(), bot_2.MAX_SLOTS))
+        desk = bot_2.booking_desk
+        desk.claims = desk.moves = desk.releases = desk.conflicts = desk.assigned = 0
+        waits, taps = [], []
+
+        async def user(user_id):
+            started = time_module.perf_counter()
+            taps.append(await flow(bench_bot, user_id))
+            if bot_2.practice_slots[session_key].seat_of(user_id) is not None:
+                waits.append(time_module.perf_counter() - started)
+
+        started = time_module.perf_counter()
+        await asyncio.gather(*(user(user_id) for user_id in users))
+        elapsed = time_module.perf_counter() - started
+        await bot_2.seat_map_viewers.drain()
+        session = bot_2.practice_slots[session_key]
+        seats = [seat for seat, _ in session.bookings()]
+        assert len(seats) == len(set(seats)) == min(args.users, bot_2.MAX_SLOTS), "Места заняты неверно"
+        live_edits = bot_2.seat_map_viewers.edits_sent
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "booked": len(seats),
+            "taps_per_user": round(sum(taps) / len(taps), 2),
+            "api_calls_per_user": round((sum(stub_session.calls.values()) - live_edits) / len(users), 2),
+            "time_to_seat": latency_summary(waits),
+            "conflicts": desk.conflicts,
+        }
+
+    bot_2.seat_map_viewers.edits_sent = 0
+    results = {"users": args.users, "seats": bot_2.MAX_SLOTS, "latency_ms": args.latency_ms, "think_ms": args.think_ms,
+               "manual": asyncio.run(run(manual))}
+    bot_2.seat_map_viewers.edits_sent = 0
+    results["any"] = asyncio.run(run(any_seat))
+
+    # Поиск первого свободного места в наполовину занятой сессии: битовая маска против перебора
+    session = PracticeSession("bench", "Бенчмарк", datetime.now(), args.capacity)
+    for seat in rng.sample(range(1, args.capacity + 1), args.capacity // 2):
+        session.book(seat, seat)
+
+    def scan_first_free():
+        for seat in range(1, session.capacity + 1):
+            if session.owner(seat) is None:
+                return seat
+        return None
+
+    lookups = {}
+    for name, find in (("bitset", session.first_free_seat), ("scan", scan_first_free)):
+        started = time_module.perf_counter()
+        for _ in range(args.lookups):
+            find()
+        lookups[name] = round((time_module.perf_counter() - started) / args.lookups * 1e6, 3)
+    assert session.first_free_seat() == scan_first_free()
+    results["first_free_seat_us"] = {"capacity": args.capacity, **lookups}
+
+    print(f"{args.users} пользователей одновременно записываются на {bot_2.MAX_SLOTS} мест, "
+          f"обращение к Telegram {args.latency_ms} мс, время реакции около {args.think_ms} мс")
+    for flow in ("manual", "any"):
+        flow_results = results[flow]
+        wait = flow_results["time_to_seat"]
+        print(f"  {flow:6} нажатий на пользователя {flow_results['taps_per_user']:5}, "
+              f"вызовов API {flow_results['api_calls_per_user']:5}, до места p50 {wait['p50_ms']:8.1f} мс "
+              f"p99 {wait['p99_ms']:8.1f} мс, конфликтов {flow_results['conflicts']}")
+    print(f"  первое свободное место ({args.capacity} мест, половина занята): битовая маска {lookups['bitset']} мкс, "
+          f"перебор {lookups['scan']} мкс")
+    return results
+
+
+def bench_booking(args):
+    """
+    Стресс-тест записи на места через handle_slot_selection: args.claims одновременных нажатий
+    args.users пользователей на случайные места, часть нажатий доставляется повторно (тот же callback ID),
+    хранилище отвечает с задержкой и иногда отвергает бронь, а посередине запись закрывается.
+    Проверяет, что ни одно место не занято дважды, ни у кого нет двух мест, сохраненные записи
+    непротиворечивы и совпадают с закрытой сессией, а повторные нажатия ничего не меняют.
+    """
+    rng = random.Random(5)
+    stub = use_stub_bot()
+    bot_2.seat_map_viewers.debounce = 0
+    start = datetime(2025, 1, 6, 12, 40)
+    clock = SimulatedClock(start)
+    bot_2.scheduler_clock = clock
+    session_key = "Понедельник_12:40"
+    session = PracticeSession(session_key, "Стресс-тест", start, bot_2.MAX_SLOTS)
+    bot_2.practice_slots[session_key] = session
+    persisted = []
+    original_persist_changes = bot_2.persist_changes
+
+    async def slow_persist(records):
+        # Сохранение занимает несколько переключений цикла событий, как запись в базу в другом потоке
+        for _ in range(rng.randint(0, 3)):
+            await asyncio.sleep(0)
+        if any(record["op"] == "seat_taken" for record in records) and rng.random() < args.reject:
+            return False
+        persisted.extend(records)
+        return True
+
+    bot_2.persist_changes = slow_persist
+    statuses = {}
+    duplicate_mismatches = 0
+
+    async def click(user_id, seat, callback_id, delay):
+        for _ in range(delay):
+            await asyncio.sleep(0)
+        message = StubMessage(stub, user_id, message_id=user_id)
+        callback = StubCallback(stub, user_id, slot_callback_data(session_key, seat), message, callback_id)
+        await bot_2.handle_slot_selection(callback)
+
+    async def close_midway():
+        for _ in range(args.close_after):
+            await asyncio.sleep(0)
+        clock.current = start + bot_2.RECORDING_DURATION
+        await bot_2.close_practice(session_key)
+
+    async def run():
+        nonlocal duplicate_mismatches
+        original_toggle = bot_2.booking_desk.toggle
+        results_by_id = {}
+
+        async def recording_toggle(key, seat, user_id, update_id=None):
+            result = await original_toggle(key, seat, user_id, update_id=update_id)
+            statuses[result.status] = statuses.get(result.status, 0) + 1
+            results_by_id.setdefault(update_id, []).append(result)
+            return result
+
+        bot_2.booking_desk.toggle = recording_toggle
+        # Все нажатия стартуют одновременно, поэтому desk должен помнить все их callback ID
+        bot_2.booking_desk.remember = max(bot_2.booking_desk.remember, args.claims)
+        tasks = []
+        for i in range(args.claims):
+            user_id = rng.randint(1, args.users)
+            seat = rng.randint(1, bot_2.MAX_SLOTS)
+            callback_id = f"stress-{i}"
+            tasks.append(click(user_id, seat, callback_id, rng.randint(0, 20)))
+            if rng.random() < args.duplicates:
+                tasks.append(click(user_id, seat, callback_id, rng.randint(0, 20)))  # Повторная доставка
+        tasks.append(close_midway())
+        started = time_module.perf_counter()
+        await asyncio.gather(*tasks)
+        elapsed = time_module.perf_counter() - started
+        del bot_2.booking_desk.toggle
+        duplicate_mismatches = sum(1 for results in results_by_id.values() if len(set(results)) > 1)
+        return elapsed, len(tasks) - 1
+
+    try:
+        elapsed, clicks = asyncio.run(run())
+    finally:
+        bot_2.persist_changes = original_persist_changes
+
+    replayed = replay_bookings(session_key, bot_2.MAX_SLOTS, persisted)
+    assert session_key not in bot_2.practice_slots, "Запись не закрыта"
+    assert sorted(replayed.bookings()) == sorted(session.bookings()), "Сохраненные записи не совпадают с сессией"
+    owners = [user_id for _, user_id in session.bookings()]
+    assert len(owners) == len(set(owners)), "У пользователя два места"
+    assert duplicate_mismatches == 0, "Повторное нажатие получило другой результат"
+
+    results = {
+        "clicks": clicks,
+        "elapsed_ms": round(elapsed * 1000, 3),
+        "statuses": dict(sorted(statuses.items())),
+        "desk": bot_2.booking_desk.metrics(),
+        "persisted_records": len(persisted),
+        "booked_at_close": session.booked_count,
+        "api_calls": dict(sorted(stub.calls.items())),
+    }
+    print(f"{clicks} нажатий ({args.users} пользователей, {bot_2.MAX_SLOTS} мест), закрытие посередине: "
+          f"{elapsed * 1000:.1f} мс")
+    print(f"  результаты нажатий: {results['statuses']}")
+    print(f"  метрики записи: {results['desk']}")
+    print(f"  сохранено записей: {len(persisted)}, занято мест при закрытии: {session.booked_count}")
+    print("  проверки пройдены: места не заняты дважды, у каждого не больше одного места, "
+          "журнал совпадает с закрытой сессией, повторы не меняют места")
+    return results
+
+
+class StubSession(BaseSession):
+    """
+    Сессия aiogram без сети: вызовы API учитываются и успешно завершаются через latency секунд.
+    getUpdates отдает обновления из очереди updates, как long polling: запрос идет до "Telegram" rtt/2 секунд,
+    ждет появления обновлений и возвращается еще через rtt/2 секунд.
+    """
+
+    def __init__(self, rtt: float = 0.0, latency: float = 0.0):
+        super().__init__()
+        self.rtt = rtt
+        self.latency = latency
+        self.calls = {}
+        self.updates = asyncio.Queue()
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if isinstance(method, GetMe):
+            return User(id=1, is_bot=True, first_name="Benchmark", username="benchmark_bot")
+        if isinstance(method, GetUpdates):
+            await asyncio.sleep(self.rtt / 2)
+            batch = [await self.updates.get()]
+            while not self.updates.empty() and len(batch) < (method.limit or 100):
+                batch.append(self.updates.get_nowait())
+            await asyncio.sleep(self.rtt / 2)
+            return batch
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def slot_click_update(update_id: int, user_id: int, callback_data: str) -> dict:
+    """Синтетическое обновление Telegram: пользователь нажал кнопку места в сообщении бота."""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": f"bench-{update_id}",
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "chat_instance": str(user_id),
+            "data": callback_data,
+            "message": {"message_id": user_id, "date": 0, "text": "Выберите место",
+                        "chat": {"id": user_id, "type": "private"}},
+        },
+    }
+
+
+def bench_webhook(args):
+    """
+    Сравнивает задержку от нажатия кнопки до конца работы обработчика при приеме обновлений
+    через встроенный вебхук (настоящий HTTP запрос к серверу aiohttp) и через long polling aiogram.
+    Нажатия args.users пользователей приходят равномерно за args.spread секунд, как при открытии записи;
+    сеть до Telegram моделируется задержкой args.rtt (в обе стороны).
+    """
+    rng = random.Random(13)
+    session_key = "Понедельник_12:40"
+    rtt = args.rtt / 1000
+    finished = {}
+
+    async def record_finish(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            finished[event.update_id] = time_module.perf_counter()
+
+    bot_2.dp.update.outer_middleware(record_finish)
+
+    def prepare(stub_session):
+        bench_bot = Bot(token=bot_2.API_TOKEN, session=stub_session)
+        bot_2.broadcaster = Broadcaster(bench_bot, concurrency=100, global_rate=1e9, per_chat_interval=0)
+        bot_2.seat_map_viewers.bot = bench_bot
+        bot_2.seat_map_viewers.broadcaster = bot_2.broadcaster
+        bot_2.outbox.broadcaster = bot_2.broadcaster
+        bot_2.practice_slots.clear()
+        bot_2.practice_slots[session_key] = PracticeSession(session_key, "Бенчмарк", datetime.now(), bot_2.MAX_SLOTS)
+        finished.clear()
+        return bench_bot
+
+    clicks = [(i + 1, rng.randint(1, 10 ** 6), rng.randint(1, bot_2.MAX_SLOTS)) for i in range(args.users)]
+
+    async def click_times(deliver):
+        """Запускает нажатия по расписанию и возвращает моменты нажатий по update_id."""
+        clicked = {}
+
+        async def one(update_id, user_id, seat, delay):
+            await asyncio.sleep(delay)
+            clicked[update_id] = time_module.perf_counter()
+            await deliver(slot_click_update(update_id, user_id, slot_callback_data(session_key, seat)))
+
+        await asyncio.gather(*(one(update_id, user_id, seat, args.spread * i / len(clicks))
+                               for i, (update_id, user_id, seat) in enumerate(clicks)))
+        while len(finished) < len(clicks):
+            await asyncio.sleep(0.001)
+        return clicked
+
+    def summary(clicked):
+        return latency_summary([finished[update_id] - clicked[update_id] for update_id in clicked])
+
+    async def run_webhook():
+        stub_session = StubSession()
+        bench_bot = prepare(stub_session)
+        server = WebhookServer(bot_2.dp, bench_bot, secret_token="bench-secret", concurrency=args.concurrency)
+        await server.start("127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.port}{server.path}"
+        response_latencies = []
+        async with aiohttp.ClientSession() as http:
+            # Запрос без секретного токена должен быть отклонен
+            async with http.post(url, json=slot_click_update(0, 1, "busy")) as response:
+                assert response.status == 401, f"Запрос без секретного токена принят: {response.status}"
+
+            async def deliver(update):
+                await asyncio.sleep(rtt / 2)  # Telegram -> сервер бота
+                started = time_module.perf_counter()
+                async with http.post(url, json=update, headers={SECRET_TOKEN_HEADER: "bench-secret"}) as response:
+                    assert response.status == 200
+                response_latencies.append(time_module.perf_counter() - started)
+
+            clicked = await click_times(deliver)
+        await server.stop()
+        return {"end_to_end": summary(clicked), "http_response": latency_summary(response_latencies),
+                "server": server.metrics(), "api_calls": dict(sorted(stub_session.calls.items()))}
+
+    async def run_polling():
+        stub_session = StubSession(rtt)
+        bench_bot = prepare(stub_session)
+        polling = asyncio.create_task(bot_2.dp.start_polling(bench_bot, handle_signals=False, close_bot_session=False))
+
+        async def deliver(update):
+            stub_session.updates.put_nowait(Update.model_validate(update, context={"bot": bench_bot}))
+
+        clicked = await click_times(deliver)
+        await bot_2.dp.stop_polling()
+        await polling
+        return {"end_to_end": summary(clicked), "api_calls": dict(sorted(stub_session.calls.items()))}
+
+    results = {"users": args.users, "rtt_ms": args.rtt, "spread_s": args.spread,
+               "webhook": asyncio.run(run_webhook()), "polling": asyncio.run(run_polling())}
+
+    print(f"{args.users} нажатий за {args.spread} с, задержка сети до Telegram {args.rtt} мс (туда и обратно)")
+    for mode in ("webhook", "polling"):
+        e2e = results[mode]["end_to_end"]
+        print(f"  {mode:8} от нажатия до конца обработки: p50 {e2e['p50_ms']:8.3f} мс  p99 {e2e['p99_ms']:8.3f} мс  "
+              f"max {e2e['max_ms']:8.3f} мс")
+    http = results["webhook"]["http_response"]
+    print(f"  ответ вебхука Telegram: p50 {http['p50_ms']:.3f} мс, p99 {http['p99_ms']:.3f} мс "
+          f"(обработка идет в фоне, максимум в очереди {results['webhook']['server']['max_backlog']})")
+    print(f"  getUpdates при поллинге: {results['polling']['api_calls'].get('GetUpdates', 0)} запросов")
+    return results
+
+
+def bench_clicks(args):
+    """
+    Частые нажатия через диспетчер bot_2 (с middleware click_throttle), без ограничения и с ним.
+    Каждый из args.users пользователей нажимает args.taps раз на места своего блока мест в одной из сессий
+    (без конкуренции, чтобы итог был известен заранее) с интервалом args.interval_ms, а потом args.confirm_taps раз подряд — на "✅ Да".
+    Сравнивает число изменений мест (каждое — сохранение), правок клавиатуры и ответов на нажатия,
+    и проверяет, что итоговое место каждого пользователя совпадает с последовательной обработкой всех нажатий,
+    а серия нажатий на место, занятое другим, не освобождает свое.
+    """
+    rng = random.Random(24)
+    throttle = bot_2.click_throttle
+    window, rate = throttle.window, throttle.rate
+    users = list(range(1, args.users + 1))
+    # Каждому пользователю — свой блок из трех мест в одной из сессий по MAX_SLOTS мест
+    seats_per_user = 3
+    users_per_session = bot_2.MAX_SLOTS // seats_per_user
+    session_keys = [f"Понедельник_{8 + n:02d}:00" for n in range((args.users - 1) // users_per_session + 1)]
+
+    def seat_block(user_id):
+        index = (user_id - 1) % users_per_session
+        return session_keys[(user_id - 1) // users_per_session], range(index * seats_per_user + 1,
+                                                                       (index + 1) * seats_per_user + 1)
+
+    taps = {user_id: [rng.choice(seat_block(user_id)[1]) for _ in range(args.taps)] for user_id in users}
+    expected = {user_id: fold_seat_taps(None, user_taps) for user_id, user_taps in taps.items()}
+    update_ids = itertools.count(1)
+
+    async def run(throttled: bool):
+        throttle.window, throttle.rate = (window, rate) if throttled else (0, 0)
+        throttle.coalesced = throttle.unchanged = throttle.batches = throttle.throttled = 0
+        stub_session = StubSession()
+        bench_bot = Bot(token=bot_2.API_TOKEN, session=stub_session)
+        bot_2.broadcaster = Broadcaster(bench_bot, concurrency=100, global_rate=1e9, per_chat_interval=0)
+        bot_2.seat_map_viewers.bot = bench_bot
+        bot_2.seat_map_viewers.broadcaster = bot_2.broadcaster
+        bot_2.seat_map_viewers.edits_sent = 0
+        bot_2.practice_slots.clear()
+        for session_key in session_keys:
+            bot_2.practice_slots[session_key] = PracticeSession(session_key, "Бенчмарк", datetime.now(),
+                                                                bot_2.MAX_SLOTS)
+        desk = bot_2.booking_desk
+        desk.claims = desk.moves = desk.releases = 0
+
+        async def feed(user_id, callback_data):
+            update = Update.model_validate(slot_click_update(next(update_ids), user_id, callback_data),
+                                           context={"bot": bench_bot})
+            await bot_2.dp.feed_update(bench_bot, update)
+
+        async def user_taps(user_id):
+            session_key = seat_block(user_id)[0]
+            await asyncio.sleep(rng.random() * args.interval_ms / 1000)
+            tasks = []
+            for seat in taps[user_id]:
+                tasks.append(asyncio.create_task(feed(user_id, slot_callback_data(session_key, seat))))
+                await asyncio.sleep(args.interval_ms / 1000)
+            for _ in range(args.confirm_taps):
+                tasks.append(asyncio.create_task(feed(user_id, default_codec.encode(ACTION_CONFIRM_YES, session_key))))
+                await asyncio.sleep(0.01)
+            await asyncio.gather(*tasks)
+
+        started = time_module.perf_counter()
+        await asyncio.gather(*(user_taps(user_id) for user_id in users))
+        elapsed = time_module.perf_counter() - started
+        await bot_2.seat_map_viewers.drain()
+        wrong = sum(1 for user_id in users
+                    if bot_2.practice_slots[seat_block(user_id)[0]].seat_of(user_id) != expected[user_id])
+        assert not wrong, f"Итоговое место не совпало с последовательной обработкой у {wrong} пользователей"
+        live_edits = bot_2.seat_map_viewers.edits_sent
+        if throttled:
+            # Серия нажатий на место, занятое другим, не должна освобождать свое место
+            contested_key = "Вторник_08:00"
+            contested = bot_2.practice_slots[contested_key] = PracticeSession(contested_key, "Бенчмарк",
+                                                                              datetime.now(), bot_2.MAX_SLOTS)
+            holder, other = args.users + 1, args.users + 2
+            contested.book(3, holder)
+            contested.book(5, other)
+            contested_taps = []
+            for _ in range(3):
+                contested_taps.append(asyncio.create_task(feed(holder, slot_callback_data(contested_key, 5))))
+                await asyncio.sleep(0.05)
+            await asyncio.gather(*contested_taps)
+            assert contested.seat_of(holder) == 3 and contested.owner(5) == other, \
+                "Нажатия на чужое место изменили место пользователя"
+            del bot_2.practice_slots[contested_key]
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "seat_changes": desk.claims + desk.moves + desk.releases,
+            "keyboard_edits": stub_session.calls.get("EditMessageReplyMarkup", 0) - live_edits,
+            "live_edits": live_edits,
+            "confirm_edits": stub_session.calls.get("EditMessageText", 0),
+            "answers": stub_session.calls.get("AnswerCallbackQuery", 0),
+            "throttle": throttle.metrics(),
+        }
+
+    try:
+        results = {"users": args.users, "taps": args.taps, "interval_ms": args.interval_ms,
+                   "confirm_taps": args.confirm_taps, "window_s": window, "rate": rate,
+                   "unthrottled": asyncio.run(run(False)), "throttled": asyncio.run(run(True))}
+    finally:
+        throttle.window, throttle.rate = window, rate
+
+    print(f"{args.users} пользователей: по {args.taps} нажатий на места через {args.interval_ms} мс "
+          f"и по {args.confirm_taps} нажатий на \"✅ Да\" подряд (окно объединения {window} с, {rate} нажатий/с)")
+    for mode in ("unthrottled", "throttled"):
+        run_results = results[mode]
+        print(f"  {mode:11} изменений мест (сохранений) {run_results['seat_changes']:5}, "
+              f"правок клавиатуры {run_results['keyboard_edits']:5}, правок \"Да\" {run_results['confirm_edits']:5}, "
+              f"ответов на нажатия {run_results['answers']:5}, живых обновлений {run_results['live_edits']:4}")
+    print(f"  объединение: {results['throttled']['throttle']}")
+    print("  итоговые места совпадают с последовательной обработкой всех нажатий, "
+          "нажатия на чужое место не освобождают свое")
+    return results
+
+
+def bench_e2e(args):
+    """
+    Сквозной сценарий: bot_2 с настоящей сессией aiohttp и long polling работает против локального заменителя
+    Bot API (fake_telegram.FakeTelegramServer) с задержкой ответов args.latency_ms. args.users пользователей
+    присылают /start, планировщик открывает запись на практику и рассылает приглашение, затем все нажимают "✅ Да"
+    и случайную кнопку карты мест. Для каждой фазы — обновлений в секунду от подачи до ответа бота и задержка ответа
+    p50/p99. Лимиты Telegram на массовую отправку (args.rate, args.chat_rate) действуют в фазе рассылки: по ним
+    видно время рассылки и то, укладывается ли в них Broadcaster (ответы 429).
+    """
+    server = FakeTelegramServer(latency=args.latency_ms / 1000, seed=5)
+    users = list(range(1, args.users + 1))
+    open_at = datetime(2025, 1, 6, 12, 40)
+    clock = HoldingClock(open_at - timedelta(minutes=1), open_at + timedelta(minutes=1))
+    bot_2.scheduler_clock = clock
+    bot_2.event_scheduler = EventScheduler(bot_2.full_schedule, bot_2.handle_schedule_event, clock=clock,
+                                           start=clock.now())
+    bot_2.practice_slots.clear()
+    in_flight = set()  # Обновления, которые бот еще обрабатывает (ответ на нажатие — не конец обработчика)
+
+    async def track_in_flight(handler, event, data):
+        in_flight.add(event.update_id)
+        try:
+            return await handler(event, data)
+        finally:
+            in_flight.discard(event.update_id)
+
+    bot_2.dp.update.outer_middleware(track_in_flight)
+
+    def phase_result(elapsed):
+        metrics = server.metrics()
+        return {"elapsed_s": round(elapsed, 3), "updates_per_second": metrics["updates_per_second"],
+                "reply_p50_ms": metrics["reply_p50_ms"], "reply_p99_ms": metrics["reply_p99_ms"],
+                "sent": metrics["sent"], "rate_limited": metrics["rate_limited"], "errors": metrics["errors"]}
+
+    async def updates_phase(lines):
+        server.reset_stats()
+        started = time_module.perf_counter()
+        for line in lines:
+            server.push(line)
+        answered = await server.wait_answered(len(lines), timeout=args.timeout)
+        assert answered, f"Бот ответил на {server.answered} из {len(lines)} обновлений за {args.timeout} с"
+        return phase_result(time_module.perf_counter() - started)
+
+    async def run():
+        await server.start()
+        api_session = AiohttpSession(api=TelegramAPIServer.from_base(server.url))
+        bench_bot = Bot(token=bot_2.API_TOKEN, session=api_session)
+        bot_2.broadcaster = Broadcaster(bench_bot, concurrency=bot_2.broadcaster.concurrency,
+                                        global_rate=args.broadcast_rate)
+        bot_2.seat_map_viewers.bot = bench_bot
+        bot_2.seat_map_viewers.broadcaster = bot_2.broadcaster
+        bot_2.outbox.broadcaster = bot_2.broadcaster
+        bot_2.outbox.start()  # Повторы после 429 доставляет фоновая задача очереди
+        polling = asyncio.create_task(bot_2.dp.start_polling(bench_bot, handle_signals=False,
+                                                             close_bot_session=False))
+        phases = {}
+        try:
+            phases["start"] = await updates_phase([{"message": {"user": user_id, "text": "/start"}}
+                                                   for user_id in users])
+            server.reset_stats()
+            server.limiter = TelegramRateLimiter(args.rate, args.chat_rate)
+            started = time_module.perf_counter()
+            checker = asyncio.create_task(bot_2.schedule_checker())
+            delivered = await server.wait_sent(len(users), timeout=args.timeout)
+            phases["broadcast"] = phase_result(time_module.perf_counter() - started)
+            assert delivered, f"Приглашение получили {server.sent} из {len(users)} пользователей за {args.timeout} с"
+            server.limiter = TelegramRateLimiter()
+
+            phases["confirm"] = await updates_phase([{"callback": {"user": user_id, "button_text": "✅ Да"}}
+                                                     for user_id in users])
+            phases["seat"] = await updates_phase([{"callback": {"user": user_id, "button": "random"}}
+                                                  for user_id in users])
+            checker.cancel()
+            # Перед остановкой сервера обработчики дорисовывают карты мест, а остальным зрителям уходят живые
+            # обновления (в пределах лимита рассылок): ждем, пока правки не перестанут появляться
+            while in_flight:
+                await asyncio.sleep(0.01)
+            viewers = bot_2.seat_map_viewers
+            quiet = viewers.debounce * 2
+            started = time_module.perf_counter()
+            done = -1
+            while done != viewers.edits_sent + viewers.edits_skipped + viewers.edits_failed or viewers._pending:
+                done = viewers.edits_sent + viewers.edits_skipped + viewers.edits_failed
+                await asyncio.sleep(quiet)
+            phases["live_updates"] = {"elapsed_s": round(time_module.perf_counter() - started - quiet, 3),
+                                      "edits": viewers.edits_sent, "skipped": viewers.edits_skipped}
+        finally:
+            await bot_2.dp.stop_polling()
+            await polling
+            await bot_2.outbox.stop()
+            await api_session.close()
+            await server.stop()
+        return phases
+
+    phases = asyncio.run(run())
+    session = next(iter(bot_2.practice_slots.values()), None)
+    results = {"users": args.users, "latency_ms": args.latency_ms, "rate": args.rate,
+               "broadcast_rate": args.broadcast_rate, "phases": phases,
+               "booked_seats": session.booked_count if session is not None else 0}
+
+    print(f"{args.users} пользователей, Bot API: задержка {args.latency_ms} мс, лимит {args.rate} сообщений/с "
+          f"(рассылка — {args.broadcast_rate}/с), long polling по HTTP")
+    for name, title in (("start", "/start"), ("confirm", "«Да»"), ("seat", "место")):
+        phase = phases[name]
+        print(f"  {title:7} {phase['updates_per_second']:8.1f} обновлений/с  ответ p50 {phase['reply_p50_ms']:8.3f} мс  "
+              f"p99 {phase['reply_p99_ms']:8.3f} мс")
+    broadcast = phases["broadcast"]
+    print(f"  рассылка приглашения: {broadcast['sent']} сообщений за {broadcast['elapsed_s']:.2f} с, "
+          f"ответов 429: {broadcast['rate_limited']}")
+    live = phases["live_updates"]
+    print(f"  живые обновления карты мест: {live['edits']} правок за {live['elapsed_s']:.2f} с "
+          f"(без изменений пропущено {live['skipped']})")
+    print(f"  занято мест: {results['booked_seats']}")
+    return results
+
+
+def bench_shutdown(args):
+    """
+    Плавная остановка посреди рассылки. Планировщик открывает запись на практику для args.users пользователей,
+    приглашение рассылается через заменитель Bot API с лимитом args.rate сообщений в секунду, а получившие его
+    сразу записываются на места. Через args.stop_after секунд приходит сигнал остановки (lifecycle.request_stop)
+    со сроком args.deadline секунд. Проверяет: остановка уложилась в срок, все занятые места есть в хранилище
+    после перезапуска, а очередь после перезапуска досылает приглашение только тем, кто его не получил.
+    """
+    rng = random.Random(23)
+    server = FakeTelegramServer(latency=args.latency_ms / 1000, rate=args.rate, seed=9)
+    users = list(range(1, args.users + 1))
+    paths = {"snapshot_file": os.path.join(BENCH_DIR, "shutdown_snapshot.json"),
+             "journal_file": os.path.join(BENCH_DIR, "shutdown_journal.jsonl")}
+    outbox_path = os.path.join(BENCH_DIR, "shutdown_outbox.jsonl")
+    open_at = datetime(2025, 1, 6, 12, 40)
+    clock = HoldingClock(open_at - timedelta(minutes=1), open_at + timedelta(minutes=1))
+    bot_2.scheduler_clock = clock
+    bot_2.event_scheduler = EventScheduler(bot_2.full_schedule, bot_2.handle_schedule_event, clock=clock,
+                                           start=clock.now())
+    bot_2.practice_slots.clear()
+    bot_2.user_ids.update(users)
+
+    def invited():
+        """Сколько приглашений получил каждый пользователь (других новых сообщений в сценарии нет)."""
+        return {user_id: len(server.messages.get(user_id, {})) for user_id in users}
+
+    async def clicker(clicked: set):
+        """Пользователи, получившие приглашение, нажимают "✅ Да" и случайное место."""
+        async def click(user_id):
+            server.push({"callback": {"user": user_id, "button_text": "✅ Да"}})
+            await asyncio.sleep(0.2)
+            if not bot_2.lifecycle.stopping.is_set():
+                server.push({"callback": {"user": user_id, "button": "random"}})
+
+        while not bot_2.lifecycle.stopping.is_set():
+            for user_id in list(server.messages):
+                if user_id not in clicked and rng.random() < args.click_share:
+                    clicked.add(user_id)
+                    asyncio.create_task(click(user_id))
+                elif user_id not in clicked:
+                    clicked.add(user_id)  # Этот пользователь не записывается
+            await asyncio.sleep(0.05)
+
+    async def run():
+        await server.start()
+        api_session = AiohttpSession(api=TelegramAPIServer.from_base(server.url))
+        bench_bot = Bot(token=bot_2.API_TOKEN, session=api_session)
+        bot_2.bot = bench_bot
+        bot_2.broadcaster = Broadcaster(bench_bot, concurrency=bot_2.broadcaster.concurrency,
+                                        global_rate=args.broadcast_rate)
+        bot_2.seat_map_viewers.bot = bench_bot
+        bot_2.seat_map_viewers.broadcaster = bot_2.broadcaster
+        bot_2.outbox = Outbox(bot_2.broadcaster, outbox_path, now=lambda: bot_2.scheduler_clock.now())
+        bot_2.storage = create_storage("journal", **paths)
+        bot_2.persistence_writer = PersistenceWriter(
+            bot_2.storage, lambda: (bot_2.user_ids, bot_2.practice_slots, bot_2.sent_notifications))
+        bot_2.lifecycle = Lifecycle(drain_timeout=args.deadline)
+        bot_2.register_shutdown_steps(MetricsServer(bot_2.bot_metrics.registry))
+        bot_2.persistence_writer.start()
+        bot_2.outbox.start()
+        bot_2.lifecycle.spawn("schedule_checker", bot_2.schedule_checker())
+        receiving = asyncio.create_task(bot_2.run_polling())
+        clicked = set()
+        clicks = asyncio.create_task(clicker(clicked))
+
+        await asyncio.sleep(args.stop_after)
+        at_stop = sum(invited().values())
+        stop_requested = time_module.perf_counter()
+        bot_2.lifecycle.request_stop("SIGTERM")
+        await receiving
+        await clicks
+        report = await bot_2.lifecycle.shutdown()
+        shutdown_s = time_module.perf_counter() - stop_requested
+        session = next(iter(bot_2.practice_slots.values()))
+        before_restart = invited()
+
+        # "Перезапуск": состояние читается из хранилища, очередь — из файла и досылается без лимитов
+        restarted = create_storage("journal", **paths)
+        _, restored_slots, _ = restarted.load()
+        restarted.close()
+        server.limiter = TelegramRateLimiter()
+        restart_session = AiohttpSession(api=TelegramAPIServer.from_base(server.url))
+        outbox = Outbox(Broadcaster(Bot(token=bot_2.API_TOKEN, session=restart_session), concurrency=100,
+                                    global_rate=1e9, per_chat_interval=0), outbox_path,
+                        now=lambda: bot_2.scheduler_clock.now())
+        restored = outbox.load()
+        outbox.start()
+        await outbox.drain()
+        await outbox.stop()
+        await restart_session.close()
+        await server.stop()
+        return {"at_stop": at_stop, "shutdown_s": shutdown_s, "report": report, "session": session,
+                "restored_slots": restored_slots, "before_restart": before_restart, "restored": restored,
+                "clicked": len(clicked)}
+
+    run_results = asyncio.run(run())
+    session = run_results["session"]
+    restored_session = run_results["restored_slots"].get(session.key)
+    assert restored_session is not None, "Открытая сессия не сохранена при остановке"
+    assert restored_session.to_dict() == session.to_dict(), "Места после перезапуска не совпадают с местами при остановке"
+    before = run_results["before_restart"]
+    final = invited()
+    delivered_before = sum(1 for count in before.values() if count)
+    missing = [user_id for user_id, count in final.items() if not count]
+    duplicates = sum(count - 1 for count in final.values() if count > 1)
+    assert not missing, f"После перезапуска приглашение не получили {len(missing)} пользователей"
+    assert run_results["restored"] == args.users - delivered_before + duplicates, (
+        f"После перезапуска в очереди {run_results['restored']}, а недоставленных {args.users - delivered_before}")
+    assert run_results["shutdown_s"] < args.deadline + 1.0, f"Остановка заняла {run_results['shutdown_s']:.2f} с"
+
+    results = {
+        "users": args.users, "deadline_s": args.deadline, "stop_after_s": args.stop_after,
+        "shutdown_s": round(run_results["shutdown_s"], 3), "steps": run_results["report"],
+        "invited_at_stop": run_results["at_stop"], "invited_before_restart": delivered_before,
+        "resumed_after_restart": run_results["restored"], "duplicates": duplicates,
+        "booked_seats": session.booked_count,
+    }
+    print(f"{args.users} пользователей, рассылка {args.broadcast_rate}/с, сигнал остановки через {args.stop_after} с, "
+          f"срок остановки {args.deadline} с")
+    print(f"  остановка: {results['shutdown_s']:.2f} с, шаги (мс): {results['steps']}")
+    print(f"  приглашений: к сигналу {results['invited_at_stop']}, до остановки {delivered_before}, "
+          f"после перезапуска дослано {results['resumed_after_restart']} (повторно получили {duplicates})")
+    print(f"  занято мест: {session.booked_count}, после перезапуска в хранилище те же места")
+    return results
+
+
+class NetworkStoreStandIn(InProcessStore):
+    """
+    Заменитель Redis: состояние хранится отдельно от "процессов" (они получают только копии сессий),
+    а каждая операция выполняется атомарно, но после случайной "сетевой" задержки в несколько
+    переключений цикла событий — так операции разных процессов перемешиваются, как с настоящим Redis.
+    """
+    shared = True
+
+    def __init__(self, rng, max_hops: int = 3):
+        super().__init__()
+        self.rng = rng
+        self.max_hops = max_hops
+        self.operations = 0
+
+    async def _call(self, operation, *args):
+        for _ in range(self.rng.randint(0, self.max_hops)):
+            await asyncio.sleep(0)
+        self.operations += 1
+        result = await operation(*args)
+        for _ in range(self.rng.randint(0, self.max_hops)):
+            await asyncio.sleep(0)
+        return result
+
+    async def add_user(self, user_id):
+        return await self._call(super().add_user, user_id)
+
+    async def user_ids(self):
+        return set(await self._call(super().user_ids))
+
+    async def open_session(self, session):
+        return await self._call(super().open_session, session.copy())
+
+    async def load_session(self, practice_session_key):
+        session = await self._call(super().load_session, practice_session_key)
+        return session.copy() if session is not None else None
+
+    async def open_session_keys(self):
+        return await self._call(super().open_session_keys)
+
+    async def toggle_seat(self, practice_session_key, seat, user_id):
+        return await self._call(super().toggle_seat, practice_session_key, seat, user_id)
+
+    async def claim_any_seat(self, practice_session_key, user_id, zone=None):
+        return await self._call(super().claim_any_seat, practice_session_key, user_id, zone)
+
+    async def claim_seat(self, practice_session_key, seat, user_id):
+        return await self._call(super().claim_seat, practice_session_key, seat, user_id)
+
+    async def release_seat(self, practice_session_key, seat, user_id):
+        return await self._call(super().release_seat, practice_session_key, seat, user_id)
+
+    async def close_session(self, practice_session_key):
+        return await self._call(super().close_session, practice_session_key)
+
+    async def acquire_lease(self, name, owner, ttl):
+        return await self._call(super().acquire_lease, name, owner, ttl)
+
+    async def release_lease(self, name, owner):
+        return await self._call(super().release_lease, name, owner)
+
+
+def bench_workers(args):
+    """
+    args.workers "процессов" бота (каждый со своим BookingDesk и своими копиями сессий) обслуживают
+    нажатия на места через одно общее хранилище. Каждый пользователь делает args.clicks нажатий подряд,
+    и каждое нажатие попадает к случайному процессу. Проверяет, что места не заняты дважды, итоговое
+    место каждого пользователя совпадает с результатом его последнего успешного нажатия, а аренду лидера
+    одновременно держит не больше одного процесса.
+    """
+    rng = random.Random(17)
+    store = NetworkStoreStandIn(rng)
+    session_key = "Понедельник_12:40"
+    persisted = {worker: 0 for worker in range(args.workers)}
+
+    def persist_for(worker):
+        async def persist(records):
+            await asyncio.sleep(0)
+            if any(record["op"] == "seat_taken" for record in records) and rng.random() < args.reject:
+                return False
+            persisted[worker] += len(records)
+            return True
+        return persist
+
+    desks = [BookingDesk({}, persist_for(worker), store=store) for worker in range(args.workers)]
+    expected_seat = {}
+    statuses = {}
+
+    async def user_flow(user_id):
+        for click in range(args.clicks):
+            for _ in range(rng.randint(0, 5)):
+                await asyncio.sleep(0)
+            desk = rng.choice(desks)
+            seat = rng.randint(1, bot_2.MAX_SLOTS)
+            result = await desk.toggle(session_key, seat, user_id, update_id=f"{user_id}-{click}")
+            statuses[result.status] = statuses.get(result.status, 0) + 1
+            if result.status in (SEAT_CLAIMED, SEAT_MOVED):
+                expected_seat[user_id] = seat
+            elif result.status == SEAT_RELEASED:
+                expected_seat.pop(user_id, None)
+
+    async def check_lease():
+        """Два процесса борются за аренду; лидер останавливается, второй должен его сменить."""
+        leases = [LeaderLease(store, "scheduler", f"worker-{i}", ttl=args.lease_ttl) for i in range(2)]
+        for lease in leases:
+            lease.start()
+        overlaps = 0
+        leader_seen = False
+        for _ in range(40):
+            await asyncio.sleep(args.lease_ttl / 10)
+            leaders = [lease for lease in leases if lease.is_leader]
+            overlaps += len(leaders) > 1
+            leader_seen = leader_seen or bool(leaders)
+        first_leader = next(lease for lease in leases if lease.is_leader)
+        await first_leader.stop()
+        started = time_module.perf_counter()
+        other = leases[1 - leases.index(first_leader)]
+        while not other.is_leader:
+            await asyncio.sleep(args.lease_ttl / 20)
+        failover = time_module.perf_counter() - started
+        await other.stop()
+        return {"overlaps": overlaps, "leader_seen": leader_seen, "failover_ms": round(failover * 1000, 3)}
+
+    async def run():
+        opened = await desks[0].open(PracticeSession(session_key, "Несколько процессов", datetime.now(), bot_2.MAX_SLOTS))
+        assert opened and not await desks[1 % args.workers].open(
+            PracticeSession(session_key, "Повтор", datetime.now(), bot_2.MAX_SLOTS)), "Сессия открыта дважды"
+        started = time_module.perf_counter()
+        await asyncio.gather(*(user_flow(user_id) for user_id in range(1, args.users + 1)))
+        elapsed = time_module.perf_counter() - started
+        closed = await desks[-1].close(session_key)
+        lease = await check_lease()
+        return elapsed, closed, lease
+
+    elapsed, closed, lease = asyncio.run(run())
+
+    owners = [user_id for _, user_id in closed.bookings()]
+    assert len(owners) == len(set(owners)), "У пользователя два места"
+    assert dict((user_id, seat) for seat, user_id in closed.bookings()) == expected_seat, \
+        "Итоговые места не совпадают с результатами нажатий"
+    assert lease["overlaps"] == 0 and lease["leader_seen"], "Аренду лидера держали два процесса одновременно"
+
+    results = {
+        "workers": args.workers,
+        "clicks": args.users * args.clicks,
+        "elapsed_ms": round(elapsed * 1000, 3),
+        "statuses": dict(sorted(statuses.items())),
+        "store_operations": store.operations,
+        "booked_at_close": closed.booked_count,
+        "persisted_records": persisted,
+        "lease": lease,
+    }
+    print(f"{args.workers} процессов, {args.users} пользователей по {args.clicks} нажатий: {elapsed * 1000:.1f} мс, "
+          f"{store.operations} операций с хранилищем")
+    print(f"  результаты нажатий: {results['statuses']}")
+    print(f"  занято мест при закрытии: {closed.booked_count}, сохранено записей по процессам: {persisted}")
+    print(f"  аренда лидера: пересечений {lease['overlaps']}, смена лидера за {lease['failover_ms']} мс")
+    print("  проверки пройдены: места не заняты дважды, итоговые места совпадают с последними успешными нажатиями")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки бота записи на практики")
+    parser.add_argument("--json", metavar="ФАЙЛ", help="сохранить результаты в JSON файл ('-' — вывести в stdout)")
+    subparsers = parser.add_subparsers(dest="scenario", required=True)
+
+    storage_parser = subparsers.add_parser("storage", help="полная перезапись JSON против журнала изменений")
+    storage_parser.add_argument("--users", type=int, default=3000)
+    storage_parser.add_argument("--sessions", type=int, default=10)
+    storage_parser.add_argument("--seats", type=int, default=25)
+    storage_parser.add_argument("--notifications", type=int, default=50)
+    storage_parser.add_argument("--mutations", type=int, default=500)
+    storage_parser.add_argument("--compact-every", type=int, default=1000)
+    storage_parser.set_defaults(func=bench_storage)
+
+    sessions_parser = subparsers.add_parser("sessions", help="PracticeSession против словаря с местами")
+    sessions_parser.add_argument("--users", type=int, default=100)
+    sessions_parser.add_argument("--operations", type=int, default=100000)
+    sessions_parser.set_defaults(func=bench_sessions)
+
+    keyboard_parser = subparsers.add_parser("keyboard", help="построение клавиатуры мест с кэшем и без")
+    keyboard_parser.add_argument("--users", type=int, default=300)
+    keyboard_parser.add_argument("--clicks", type=int, default=2000)
+    keyboard_parser.add_argument("--viewers", type=int, default=5)
+    keyboard_parser.set_defaults(func=bench_keyboard)
+
+    callbacks_parser = subparsers.add_parser("callbacks", help="разбор callback_data: фильтры против кодека")
+    callbacks_parser.add_argument("--clicks", type=int, default=200000)
+    callbacks_parser.add_argument("--handlers", type=int, default=10, help="дополнительных обработчиков в цепочке")
+    callbacks_parser.set_defaults(func=bench_callbacks)
+
+    scheduler_parser = subparsers.add_parser("scheduler", help="неделя расписания на виртуальных часах")
+    scheduler_parser.add_argument("--days", type=int, default=7)
+    scheduler_parser.add_argument("--users", type=int, default=50)
+    scheduler_parser.set_defaults(func=bench_scheduler)
+
+    groups_parser = subparsers.add_parser("groups", help="расписания многих групп: рассылка подписчикам группы")
+    groups_parser.add_argument("--groups", type=int, default=20)
+    groups_parser.add_argument("--users", type=int, default=20000)
+    groups_parser.add_argument("--multi", type=int, default=1000, help="пользователей, подписанных на две группы")
+    groups_parser.add_argument("--days", type=int, default=7)
+    groups_parser.set_defaults(func=bench_groups)
+
+    outbox_parser = subparsers.add_parser("outbox", help="очередь доставки: повторы, удаление недоступных, перезапуск")
+    outbox_parser.add_argument("--users", type=int, default=2000)
+    outbox_parser.add_argument("--blocked", type=float, default=0.05, help="доля пользователей, заблокировавших бота")
+    outbox_parser.add_argument("--missing", type=float, default=0.02, help="доля несуществующих чатов")
+    outbox_parser.add_argument("--flaky", type=float, default=0.1, help="доля чатов с временными ошибками сети")
+    outbox_parser.add_argument("--retry-delay", type=float, default=0.01, help="пауза перед первым повтором, сек.")
+    outbox_parser.set_defaults(func=bench_outbox)
+
+    history_parser = subparsers.add_parser("history", help="архив посещаемости: индексы против загрузки всей истории")
+    history_parser.add_argument("--days", type=int, default=365)
+    history_parser.add_argument("--subjects", type=int, default=40)
+    history_parser.add_argument("--groups", type=int, default=10)
+    history_parser.add_argument("--users", type=int, default=3000)
+    history_parser.add_argument("--seats", type=int, default=30)
+    history_parser.set_defaults(func=bench_history)
+
+    recovery_parser = subparsers.add_parser("recovery", help="запуск после простоя: загрузка состояния и пропущенные события")
+    recovery_parser.add_argument("--users", type=int, default=100000)
+    recovery_parser.add_argument("--sessions", type=int, default=50)
+    recovery_parser.add_argument("--storage", choices=["json", "journal", "sqlite"], default="json")
+    recovery_parser.add_argument("--catch-up", type=float, default=5.0, help="окно пропущенных событий, часов")
+    recovery_parser.add_argument("--notify-users", type=int, default=200, help="пользователей, получающих рассылки")
+    recovery_parser.set_defaults(func=bench_recovery)
+
+    ledger_parser = subparsers.add_parser("ledger", help="семестр расписания: размер учета отправленных уведомлений")
+    ledger_parser.add_argument("--days", type=int, default=120)
+    ledger_parser.add_argument("--users", type=int, default=10)
+    ledger_parser.set_defaults(func=bench_ledger)
+
+    timetable_parser = subparsers.add_parser("timetable", help="расписание из файла: форматы, исключения, перезагрузка")
+    timetable_parser.add_argument("--days", type=int, default=120)
+    timetable_parser.add_argument("--classes", type=int, default=300)
+    timetable_parser.add_argument("--exceptions", type=int, default=200)
+    timetable_parser.add_argument("--repeats", type=int, default=20)
+    timetable_parser.add_argument("--users", type=int, default=10)
+    timetable_parser.set_defaults(func=bench_timetable)
+
+    load_parser = subparsers.add_parser("load", help="N пользователей одновременно записываются на практику")
+    load_parser.add_argument("--users", type=int, default=300)
+    load_parser.add_argument("--clicks", type=int, default=3, help="нажатий на места на пользователя")
+    load_parser.add_argument("--storage", choices=["json", "journal", "sqlite"], default="journal")
+    load_parser.add_argument("--persist-interval", type=float, default=0.2)
+    load_parser.add_argument("--debounce", type=float, default=0.05)
+    load_parser.set_defaults(func=bench_load)
+
+    booking_parser = subparsers.add_parser("booking", help="стресс-тест записи на места")
+    booking_parser.add_argument("--users", type=int, default=500)
+    booking_parser.add_argument("--claims", type=int, default=5000)
+    booking_parser.add_argument("--duplicates", type=float, default=0.05, help="доля повторно доставленных нажатий")
+    booking_parser.add_argument("--reject", type=float, default=0.02, help="доля броней, отвергнутых хранилищем")
+    booking_parser.add_argument("--close-after", type=int, default=10, help="переключений цикла событий до закрытия")
+    booking_parser.set_defaults(func=bench_booking)
+
+    anyseat_parser = subparsers.add_parser("anyseat", help="\"Любое свободное место\" против выбора места")
+    anyseat_parser.add_argument("--users", type=int, default=30)
+    anyseat_parser.add_argument("--latency-ms", type=float, default=50.0, help="длительность обращения к Telegram")
+    anyseat_parser.add_argument("--think-ms", type=float, default=500.0, help="время реакции пользователя на карту мест")
+    anyseat_parser.add_argument("--capacity", type=int, default=100, help="мест в сессии для поиска свободного места")
+    anyseat_parser.add_argument("--lookups", type=int, default=200000)
+    anyseat_parser.set_defaults(func=bench_anyseat)
+
+    webhook_parser = subparsers.add_parser("webhook", help="задержка обработки нажатий: вебхук против поллинга")
+    webhook_parser.add_argument("--users", type=int, default=300)
+    webhook_parser.add_argument("--spread", type=float, default=0.5, help="за сколько секунд приходят все нажатия")
+    webhook_parser.add_argument("--rtt", type=float, default=60.0, help="задержка сети до Telegram туда и обратно, мс")
+    webhook_parser.add_argument("--concurrency", type=int, default=100)
+    webhook_parser.set_defaults(func=bench_webhook)
+
+    clicks_parser = subparsers.add_parser("clicks", help="частые нажатия: объединение серий и ограничение частоты")
+    clicks_parser.add_argument("--users", type=int, default=100)
+    clicks_parser.add_argument("--taps", type=int, default=8, help="нажатий на места у каждого пользователя")
+    clicks_parser.add_argument("--interval-ms", type=float, default=80.0, help="интервал между нажатиями на места")
+    clicks_parser.add_argument("--confirm-taps", type=int, default=15, help="нажатий на \"✅ Да\" подряд")
+    clicks_parser.set_defaults(func=bench_clicks)
+
+    e2e_parser = subparsers.add_parser("e2e", help="весь бот против локального заменителя Bot API")
+    e2e_parser.add_argument("--users", type=int, default=200)
+    e2e_parser.add_argument("--latency-ms", type=float, default=20.0, help="задержка ответа Bot API")
+    e2e_parser.add_argument("--rate", type=float, default=30.0, help="лимит Bot API, новых сообщений в секунду")
+    e2e_parser.add_argument("--chat-rate", type=float, default=1.0, help="лимит Bot API в один чат, сообщений в секунду")
+    e2e_parser.add_argument("--broadcast-rate", type=float, default=25.0, help="скорость рассылки бота, сообщений в секунду")
+    e2e_parser.add_argument("--timeout", type=float, default=120.0, help="сколько ждать каждую фазу, сек.")
+    e2e_parser.set_defaults(func=bench_e2e)
+
+    shutdown_parser = subparsers.add_parser("shutdown", help="остановка посреди рассылки и дорассылка после запуска")
+    shutdown_parser.add_argument("--users", type=int, default=300)
+    shutdown_parser.add_argument("--latency-ms", type=float, default=20.0, help="задержка ответа Bot API")
+    shutdown_parser.add_argument("--rate", type=float, default=30.0, help="лимит Bot API, новых сообщений в секунду")
+    shutdown_parser.add_argument("--broadcast-rate", type=float, default=25.0, help="скорость рассылки бота, сообщений в секунду")
+    shutdown_parser.add_argument("--click-share", type=float, default=0.3, help="доля получивших приглашение, кто записывается")
+    shutdown_parser.add_argument("--stop-after", type=float, default=3.0, help="через сколько секунд приходит сигнал остановки")
+    shutdown_parser.add_argument("--deadline", type=float, default=2.0, help="срок остановки (SHUTDOWN_TIMEOUT), сек.")
+    shutdown_parser.set_defaults(func=bench_shutdown)
+
+    workers_parser = subparsers.add_parser("workers", help="несколько процессов бота с общим хранилищем")
+    workers_parser.add_argument("--workers", type=int, default=4)
+    workers_parser.add_argument("--users", type=int, default=300)
+    workers_parser.add_argument("--clicks", type=int, default=5)
+    workers_parser.add_argument("--reject", type=float, default=0.02, help="доля броней, отвергнутых хранилищем")
+    workers_parser.add_argument("--lease-ttl", type=float, default=0.2, help="срок аренды лидера, сек.")
+    workers_parser.set_defaults(func=bench_workers)
+
+    args = parser.parse_args()
+    results = args.func(args)
+    if args.json:
+        report = {"scenario": args.scenario, "python": sys.version.split()[0], "results": results}
+        output = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+        if args.json == "-":
+            print(output)
+        else:
+            with open(os.path.join(START_DIR, args.json), "w", encoding="utf-8") as f:
+                f.write(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
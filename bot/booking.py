@@ -0,0 +1,284 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime
+
+from journal import make_record
+from state_store import (InProcessStore, SEAT_CLAIMED, SEAT_MOVED, SEAT_RELEASED, SEAT_TAKEN, SEAT_REJECTED,
+                         SESSION_CLOSED, SEAT_INVALID)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REMEMBER_UPDATES = 10000  # Сколько последних callback ID помнить для защиты от повторной обработки
+
+
+@dataclass(frozen=True)
+class BookingResult:
+    status: str
+    seat: int = None
+    previous_seat: int = None  # Прежнее место пользователя при переходе на другое
+
+    @property
+    def changed(self) -> bool:
+        """Места в сессии изменились (нужно обновить карту мест у остальных)."""
+        return self.status in (SEAT_CLAIMED, SEAT_MOVED, SEAT_RELEASED)
+
+
+class BookingDesk:
+    """
+    Запись на места практик без гонок.
+    Все изменения мест одной сессии (занять, освободить, перейти на другое место) и ее закрытие
+    выполняются под замком этой сессии: проверка, изменение в памяти и сохранение идут как одна операция,
+    поэтому между проверкой места и его записью никто не вклинится, а записи в журнале идут в том же
+    порядке, что и изменения в памяти. Если хранилище отвергло изменение, оно полностью откатывается
+    (включая возврат прежнего места). Нажатия с одним и тем же callback ID (повторная доставка обновления)
+    обрабатываются один раз: повтор получает результат первой обработки.
+    Сессии разных практик друг друга не блокируют.
+    Сами места меняются в общем хранилище store (см. state_store): с хранилищем в памяти это те же
+    practice_slots, а с общим хранилищем (Redis) sessions — локальные копии сессий, которые обновляются
+    из хранилища после каждого изменения; место атомарно занимается в хранилище, поэтому несколько
+    процессов бота не займут одно место дважды.
+    Время записи берется из now() и сохраняется вместе с местом (для архива посещаемости).
+    """
+
+    def __init__(self, sessions: dict, persist, store=None, remember: int = DEFAULT_REMEMBER_UPDATES, now=None):
+        self.sessions = sessions  # Ключ сессии -> PracticeSession (practice_slots бота)
+        self.persist = persist    # async persist(records) -> bool
+        self.store = store if store is not None else InProcessStore(sessions)
+        self.remember = remember
+        self.now = now or datetime.now
+        self._locks = {}          # Ключ сессии -> [asyncio.Lock, сколько задач держат или ждут замок]
+        self._recent = OrderedDict()  # callback ID -> Future с результатом обработки
+        # Метрики
+        self.claims = 0
+        self.moves = 0
+        self.releases = 0
+        self.conflicts = 0    # Место уже занято
+        self.rejected = 0     # Хранилище отвергло изменение
+        self.duplicates = 0   # Повторные нажатия с тем же callback ID
+        self.assigned = 0     # Места, выданные кнопкой "Любое свободное место" (входят в claims)
+
+    @asynccontextmanager
+    async def lock(self, practice_session_key: str):
+        """
+        Замок сессии (async with). Замок забывается, только когда его никто не держит и не ждет: если удалить его
+        раньше (например, при закрытии записи), опоздавшее нажатие и новая сессия с тем же ключом окажутся
+        под разными замками.
+        """
+        entry = self._locks.get(practice_session_key)
+        if entry is None:
+            entry = self._locks[practice_session_key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[practice_session_key]
+
+    async def toggle(self, practice_session_key: str, seat: int, user_id: int, update_id=None) -> BookingResult:
+        """
+        Нажатие пользователя на место seat: свободное место занимается (прежнее место освобождается),
+        нажатие на свое место отменяет запись. update_id — ID callback для защиты от повторной обработки.
+        """
+        return await self._once(update_id, lambda: self._toggle(practice_session_key, seat, user_id))
+
+    async def claim_any(self, practice_session_key: str, user_id: int, zone=None, update_id=None) -> BookingResult:
+        """
+        "Любое свободное место": пользователь без места атомарно получает свободное место с наименьшим номером
+        (сначала в зоне zone, см. PracticeSession.first_free_seat). Пользователь с местом его сохраняет (SEAT_KEPT),
+        если мест нет — SESSION_FULL. update_id — как в toggle.
+        """
+        return await self._once(update_id, lambda: self._claim_any(practice_session_key, user_id, zone))
+
+    async def _once(self, update_id, operation) -> BookingResult:
+        """Выполняет operation() один раз на update_id: повтор того же нажатия получает результат первой обработки."""
+        if update_id is None:
+            return await operation()
+        previous = self._recent.get(update_id)
+        if previous is not None:
+            self.duplicates += 1
+            return await asyncio.shield(previous)
+        future = asyncio.get_running_loop().create_future()
+        self._recent[update_id] = future
+        if len(self._recent) > self.remember:
+            self._recent.popitem(last=False)
+        try:
+            result = await operation()
+        except BaseException as e:
+            # Повтор того же нажатия должен обрабатываться заново, а не получить эту ошибку
+            self._recent.pop(update_id, None)
+            future.set_exception(e)
+            future.exception()  # Ошибка уже передана вызывающему; не пишем "exception was never retrieved"
+            raise
+        future.set_result(result)
+        return result
+
+    async def session(self, practice_session_key: str):
+        """Открытая сессия (локальная копия) или None. С общим хранилищем недостающая копия загружается из него."""
+        session = self.sessions.get(practice_session_key)
+        if session is None and self.store.shared:
+            session = await self._refresh(practice_session_key)
+        return session
+
+    async def _refresh(self, practice_session_key: str):
+        """Обновляет локальную копию сессии из общего хранилища."""
+        loaded = await self.store.load_session(practice_session_key)
+        local = self.sessions.get(practice_session_key)
+        if loaded is None:
+            self.sessions.pop(practice_session_key, None)
+            return None
+        if local is not None and local.open_time == loaded.open_time:
+            # Тот же объект сессии сохраняется, чтобы кэш клавиатур перестраивался только по version
+            local.set_bookings(loaded.bookings())
+            return local
+        self.sessions[practice_session_key] = loaded
+        return loaded
+
+    async def open(self, session) -> bool:
+        """Открывает запись на практику. False, если сессия с этим ключом уже открыта (возможно, другим процессом)."""
+        async with self.lock(session.key):
+            if not await self.store.open_session(session):
+                return False
+            self.sessions[session.key] = session
+            return True
+
+    async def _toggle(self, practice_session_key: str, seat: int, user_id: int) -> BookingResult:
+        async with self.lock(practice_session_key):
+            if await self.session(practice_session_key) is None:
+                return BookingResult(SESSION_CLOSED, seat)
+            status, previous_seat = await self.store.toggle_seat(practice_session_key, seat, user_id)
+            if self.store.shared:
+                # Копия получает и это изменение, и изменения других процессов
+                await self._refresh(practice_session_key)
+            if status in (SESSION_CLOSED, SEAT_INVALID):
+                return BookingResult(status, seat)
+            if status == SEAT_TAKEN:
+                self.conflicts += 1
+                return BookingResult(SEAT_TAKEN, seat)
+
+            if status == SEAT_RELEASED:
+                records = [make_record("seat_released", session=practice_session_key, slot=seat, user=user_id)]
+            else:
+                # При переходе на другое место время записи остается прежним
+                booked_at = self._stamp(practice_session_key, user_id)
+                records = []
+                if previous_seat is not None:
+                    records.append(make_record("seat_released", session=practice_session_key,
+                                               slot=previous_seat, user=user_id))
+                records.append(make_record("seat_taken", session=practice_session_key, slot=seat, user=user_id,
+                                           at=booked_at.isoformat()))
+            result = BookingResult(status, seat, previous_seat)
+
+            if not await self.persist(records):
+                await self._rollback(practice_session_key, user_id, result)
+                self.rejected += 1
+                return BookingResult(SEAT_REJECTED, seat)
+
+            if status == SEAT_CLAIMED:
+                self.claims += 1
+            elif status == SEAT_MOVED:
+                self.moves += 1
+            else:
+                self.releases += 1
+            return result
+
+    async def _claim_any(self, practice_session_key: str, user_id: int, zone) -> BookingResult:
+        async with self.lock(practice_session_key):
+            if await self.session(practice_session_key) is None:
+                return BookingResult(SESSION_CLOSED)
+            status, seat = await self.store.claim_any_seat(practice_session_key, user_id, zone)
+            if self.store.shared:
+                await self._refresh(practice_session_key)
+            if status != SEAT_CLAIMED:  # SESSION_CLOSED, SEAT_KEPT или SESSION_FULL
+                return BookingResult(status, seat)
+            booked_at = self._stamp(practice_session_key, user_id)
+            result = BookingResult(SEAT_CLAIMED, seat)
+            if not await self.persist([make_record("seat_taken", session=practice_session_key, slot=seat,
+                                                   user=user_id, at=booked_at.isoformat())]):
+                await self._rollback(practice_session_key, user_id, result)
+                self.rejected += 1
+                return BookingResult(SEAT_REJECTED, seat)
+            self.claims += 1
+            self.assigned += 1
+            return result
+
+    def _stamp(self, practice_session_key: str, user_id: int) -> datetime:
+        """Время записи пользователя в локальной копии сессии; для новой записи — текущее время."""
+        session = self.sessions.get(practice_session_key)
+        booked_at = session.booked_at(user_id) if session is not None else None
+        if booked_at is None:
+            booked_at = self.now()
+            if session is not None:
+                session.mark_booked_at(user_id, booked_at)
+        return booked_at
+
+    async def _rollback(self, practice_session_key: str, user_id: int, result: BookingResult):
+        """Возвращает места в состояние до отвергнутого изменения (под замком сессии)."""
+        if result.status == SEAT_RELEASED:
+            restored = await self.store.claim_seat(practice_session_key, result.seat, user_id)
+        else:
+            restored = await self.store.release_seat(practice_session_key, result.seat, user_id)
+            if restored and result.previous_seat is not None:
+                restored = await self.store.claim_seat(practice_session_key, result.previous_seat, user_id)
+        if not restored:
+            # Возможно только с общим хранилищем: место успел занять другой процесс
+            logger.warning(f"Не удалось полностью откатить изменение места #{result.seat} "
+                           f"пользователя {user_id} в сессии {practice_session_key}")
+        if self.store.shared:
+            await self._refresh(practice_session_key)
+
+    async def close(self, practice_session_key: str, is_due=None):
+        """
+        Закрывает запись: удаляет сессию и сохраняет закрытие, дождавшись уже начатых изменений мест.
+        is_due(session) — дополнительная проверка, что закрывать пора (сессию могли открыть заново).
+        Возвращает закрытую сессию (больше не изменяется) или None, если закрывать нечего.
+        """
+        async with self.lock(practice_session_key):
+            session = await self.session(practice_session_key)
+            if session is None or (is_due is not None and not is_due(session)):
+                return None
+            closed = await self.store.close_session(practice_session_key)
+            local = self.sessions.pop(practice_session_key, None)
+            if closed is None:
+                return None  # Запись уже закрыл другой процесс
+            if local is not None and local is not closed:
+                # Сессия из общего хранилища приходит без времени записи: оно известно локальной копии
+                for _, user_id in closed.bookings():
+                    booked_at = local.booked_at(user_id)
+                    if booked_at is not None:
+                        closed.mark_booked_at(user_id, booked_at)
+            # Закрытие сохраняется под замком: в журнале после него не будет записей об этой сессии
+            await self.persist([make_record("session_closed", session=practice_session_key)])
+        return closed
+
+    async def forget(self, practice_session_key: str, is_due=None) -> bool:
+        """
+        Удаляет локальную копию сессии, запись на которую закрывает другой процесс (лидер) в общем хранилище.
+        Копия удаляется, если сессии в хранилище уже нет или (как в close) ее время вышло — is_due(session);
+        если лидер еще не закрыл запись, следующее обращение к сессии загрузит ее заново.
+        С хранилищем в памяти процесса ничего не делает: там копия и есть сама сессия (ее закрывает close).
+        Возвращает True, если копии больше нет.
+        """
+        if not self.store.shared:
+            return False
+        async with self.lock(practice_session_key):
+            session = await self._refresh(practice_session_key)
+            if session is not None and is_due is not None and not is_due(session):
+                return False  # Под тем же ключом открыта более новая сессия
+            self.sessions.pop(practice_session_key, None)
+            return True
+
+    def metrics(self) -> dict:
+        return {
+            "claims": self.claims,
+            "moves": self.moves,
+            "releases": self.releases,
+            "conflicts": self.conflicts,
+            "rejected": self.rejected,
+            "duplicates": self.duplicates,
+            "assigned": self.assigned,
+        }
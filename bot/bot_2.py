@@ -1,15 +1,45 @@
 import asyncio
+import html
 import logging
-import json  # Импорт для работы с JSON файлами
 import os    # Импорт для работы с операционной системой (проверка существования файла)
+import socket
+import tempfile
+from contextlib import nullcontext
+import time as time_module  # Часы для измерения длительности (метрики, время запуска)
 from aiogram import Bot, Dispatcher, types
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, FSInputFile
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from datetime import datetime, time, timedelta # Импорты для работы с датой и временем
 import locale # Импорт для работы с локализацией ( для названий дней недели)
 from dotenv import load_dotenv # Импорт для загрузки переменных окружения из .env файла
+from broadcast import Broadcaster # Рассылка сообщений с ограничением параллельности и частоты
+from outbox import Outbox # Очередь уведомлений на диске с повторами и удалением недоступных получателей
+from journal import make_record # Записи об изменениях состояния
+from history import HistoryArchive # Архив закрытых сессий с индексами по предмету, дате и студенту
+from ledger import DEFAULT_RETENTION_DAYS, schedule_entry_id # Учет отправленных уведомлений по дням
+from storage import create_storage # Хранилища состояния: json, journal, sqlite
+from persistence import PersistenceWriter # Фоновое сохранение состояния вне цикла событий
+from sessions import PracticeSession # Сессия записи на практику с быстрым поиском мест и пользователей
+from booking import (BookingDesk, SEAT_CLAIMED, SEAT_MOVED, SEAT_RELEASED, SEAT_TAKEN, SEAT_REJECTED,
+                     SESSION_CLOSED) # Запись на места без гонок
+from keyboards import SlotKeyboardCache, build_group_keyboard # Кэш клавиатур выбора места, клавиатура выбора групп
+from callbacks import (CallbackRouter, ACTION_ANY_SEAT, ACTION_BUSY, ACTION_CLOSED, ACTION_CONFIRM_NO, ACTION_CONFIRM_YES,
+                       ACTION_GROUP, ACTION_SLOT, CLOSED_DATA, CallbackAction, default_codec) # Компактные callback_data и маршрутизация нажатий
+from groups import DEFAULT_GROUP, SubscriptionFile, load_groups, split_session_key # Группы (потоки) и подписки на них
+from live_updates import SeatMapViewers # Живое обновление карты мест у всех, кто ее видит
+from webhook import WebhookServer # Прием обновлений через вебхук (aiohttp)
+from state_store import create_state_store, LeaderLease, SESSION_FULL # Общее состояние нескольких процессов бота
+from scheduler import (Clock, EventScheduler, ScheduledEvent, EVENT_LECTURE, EVENT_PRACTICE_OPEN,
+                       EVENT_PRACTICE_CLOSE, EVENT_DAILY_CLEANUP) # Планировщик событий расписания
+from timetable import ScheduleSource, Timetable # Расписание из файла (JSON, CSV, iCal) с горячей перезагрузкой
+from metrics import BotMetrics, HandlerMetricsMiddleware, MetricsServer # Метрики в формате Prometheus
+from profiling import Profiler # Трассировка обновлений, зависания цикла событий, профили по запросу
+from lifecycle import DEFAULT_DRAIN_TIMEOUT, InFlightUpdates, Lifecycle # Плавная остановка по SIGTERM
+from throttling import ClickThrottle # Объединение частых нажатий на места и ограничение частоты нажатий
 
 # Загружает переменные окружения (API_TOKEN) из файла .env
 load_dotenv()
@@ -27,140 +57,191 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Создание именованного логгера для этого модуля
 logger = logging.getLogger(__name__)
 
+# Адрес Bot API; для нагрузочных тестов без сети — локальный заменитель (fake_telegram.py), например
+# TELEGRAM_API_URL=http://127.0.0.1:8081. Пусто — настоящий api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+api_session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+
 # Инициализация объекта бота с указанием токена и настроек по умолчанию (HTML как режим парсинга сообщений)
-bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+bot = Bot(token=API_TOKEN, session=api_session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 # Инициализация диспетчера для обработки входящих обновлений
 dp = Dispatcher()
 
+# Метрики (задержка обработчиков, рассылки, сохранение, размер состояния) отдаются по HTTP на METRICS_PORT
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")    # По умолчанию сервер метрик доступен только локально
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9102"))    # 0 — не запускать сервер метрик
+bot_metrics = BotMetrics()
+# Время каждого обработчика учитывается в гистограмме с именем обработчика
+# (обработчики нажатий измеряет callback_router, который выбирает их после диспетчера)
+dp.message.middleware(HandlerMetricsMiddleware(bot_metrics))
+
+# Профилирование (PROFILING=1): разбивка времени каждого обновления на обработчик, сохранение и Telegram API,
+# стеки кода, блокирующего цикл событий, а также профиль и снимок памяти по запросу на сервере метрик (/debug/...)
+PROFILING = os.getenv("PROFILING", "0") == "1"
+profiler = None
+if PROFILING:
+    profiler = Profiler(
+        bot_metrics,
+        slow_update=float(os.getenv("SLOW_UPDATE_MS", "1000")) / 1000,        # Медленные обновления пишутся в лог
+        stall_threshold=float(os.getenv("STALL_THRESHOLD_MS", "100")) / 1000,  # Порог зависания цикла событий
+    )
+    profiler.install(dp, bot)
+
+
+# Плавная остановка (SIGTERM при остановке контейнера, Ctrl+C): прием обновлений прекращается, начатые обработчики
+# и рассылки завершаются не дольше SHUTDOWN_TIMEOUT секунд, недоставленное остается в очереди до следующего запуска,
+# а состояние сохраняется на диск
+lifecycle = Lifecycle(drain_timeout=float(os.getenv("SHUTDOWN_TIMEOUT", str(DEFAULT_DRAIN_TIMEOUT))))
+in_flight_updates = InFlightUpdates() # Обновления в обработке: при остановке их дожидаются
+dp.update.outer_middleware(in_flight_updates)
+
+
+def trace_span(part: str):
+    """Учитывает время блока в трассе текущего обновления (если профилирование включено)."""
+    return profiler.tracer.span(part) if profiler is not None else nullcontext()
+
+# Режим получения обновлений: если задан WEBHOOK_URL, бот принимает обновления через вебхук, иначе — long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")                      # Публичный адрес, например https://example.com/webhook
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")            # Путь, на котором сервер принимает обновления
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")             # Адрес и порт встроенного сервера
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")                # Секретный токен, который Telegram передает в заголовке
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "100"))  # Одновременно обрабатываемых обновлений
+# Удалять ли обновления, накопившиеся, пока бот был выключен (по умолчанию — нет: нажатия во время
+# перезапуска обрабатываются; нажатия на уже закрытые сессии получат ответ "Запись закрыта")
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "0") == "1"
+
+# Рассыльщик уведомлений: отправляет параллельно, но в пределах лимитов Telegram
+broadcaster = Broadcaster(
+    bot,
+    concurrency=int(os.getenv("BROADCAST_CONCURRENCY", "20")),      # Одновременных отправок
+    global_rate=float(os.getenv("BROADCAST_RATE", "25")),           # Сообщений в секунду на весь бот
+    metrics=bot_metrics,                                            # Длительность, скорость и ошибки рассылок
+)
+
 # --- Начало секции персистентности ---
 # Определение имен файлов для хранения данных
 USER_IDS_FILE = 'user_ids.json'             # Файл для хранения ID пользователей
 PRACTICE_SLOTS_FILE = 'practice_slots.json' # Файл для хранения информации о записи на практики
 SENT_NOTIFICATIONS_FILE = 'sent_notifications.json' # Файл для хранения отправленных уведомлений (для избежания дублей)
+SNAPSHOT_FILE = 'state_snapshot.json' # Снимок состояния (режим journal)
+JOURNAL_FILE = 'state_journal.jsonl'  # Журнал изменений после снимка (режим journal)
+DB_FILE = 'bot_state.sqlite3'         # База данных (режим sqlite)
+SUBSCRIPTIONS_FILE = 'subscriptions.json' # Подписки пользователей на группы
+OUTBOX_FILE = 'outbox.jsonl'          # Очередь недоставленных уведомлений
+HISTORY_FILE = 'attendance_history.jsonl' # Архив закрытых сессий (кто и на какое место записался)
+
+# Режим хранения: "json" — три JSON файла, перезаписываемые целиком при каждом изменении;
+# "journal" — снимок состояния плюс журнал изменений, в который дописывается одна строка на изменение;
+# "sqlite" — база SQLite с таблицами пользователей, сессий, бронирований и уведомлений.
+STORAGE_MODE = os.getenv("STORAGE_MODE", "json")
+storage = create_storage(
+    STORAGE_MODE,
+    user_ids_file=USER_IDS_FILE,
+    practice_slots_file=PRACTICE_SLOTS_FILE,
+    sent_notifications_file=SENT_NOTIFICATIONS_FILE,
+    snapshot_file=SNAPSHOT_FILE,
+    journal_file=JOURNAL_FILE,
+    compact_every=int(os.getenv("JOURNAL_COMPACT_EVERY", "1000")), # Через сколько записей писать новый снимок
+    fsync=os.getenv("JOURNAL_FSYNC", "0") == "1",                 # fsync после каждой записи в журнал
+    db_file=os.getenv("DB_FILE", DB_FILE),
+)
+
 
 def load_persistent_data():
     """
-    Загружает данные (user_ids, practice_slots, sent_notifications) из JSON файлов при запуске бота.
-    Если файлы не существуют или содержат некорректный JSON, инициализирует соответствующую
-    структуру данных пустым значением (set() или dict()).
+    Загружает данные (user_ids, practice_slots, sent_notifications) из хранилища при запуске бота.
+    Если данных нет или они повреждены, соответствующая структура инициализируется пустым значением.
     """
-    loaded_user_ids = set()
-    loaded_practice_slots = {}
-    loaded_sent_notifications = set()
-
-    # Загрузка user_ids (множество ID пользователей)
-    try:
-        if os.path.exists(USER_IDS_FILE): # Проверка существования файла
-            with open(USER_IDS_FILE, 'r', encoding='utf-8') as f:
-                # Загрузка из JSON и преобразование в множество
-                loaded_user_ids = set(json.load(f))
-            logger.info(f"Загружено {len(loaded_user_ids)} user_ids из {USER_IDS_FILE}")
-    except (json.JSONDecodeError, FileNotFoundError) as e:
-        # Обработка ошибок: если файл не найден или ошибка парсинга JSON
-        logger.warning(f"Не удалось загрузить user_ids из {USER_IDS_FILE} ({e}). Используется пустое множество.")
-        loaded_user_ids = set() # Инициализация пустым множеством
-
-    # Загрузка practice_slots (словарь с информацией о практиках)
-    try:
-        if os.path.exists(PRACTICE_SLOTS_FILE):
-            with open(PRACTICE_SLOTS_FILE, 'r', encoding='utf-8') as f:
-                temp_practice_slots = json.load(f) # Временный словарь для обработки
-                for key, value in temp_practice_slots.items():
-                    # Преобразование строки времени открытия практики обратно в datetime объект
-                    if isinstance(value, dict) and "open_time" in value and isinstance(value["open_time"], str):
-                        try:
-                            value["open_time"] = datetime.fromisoformat(value["open_time"])
-                        except ValueError:
-                            logger.error(
-                                f"Ошибка парсинга datetime для open_time в practice_slots для ключа {key}. Значение: {value['open_time']}")
-                    # Преобразование ключей слотов (номеров мест) обратно в int,
-                    # так как JSON сохраняет все ключи словарей как строки.
-                    value_copy = value.copy()  # Копируем словарь для безопасной итерации при изменении ключей
-                    for slot_key, user_id_val in value.items():
-                        # Пропускаем служебные поля "open_time" и "subject_name"
-                        if slot_key not in ["open_time", "subject_name"]:
-                            try:
-                                int_slot_key = int(slot_key) # Попытка преобразовать ключ в int
-                                if str(int_slot_key) == slot_key and int_slot_key != slot_key : # Если ключ был "1", а стал 1
-                                     del value_copy[slot_key] # Удаляем старый строковый ключ
-                                     value_copy[int_slot_key] = user_id_val # Добавляем новый int ключ
-                                elif isinstance(slot_key, str) : # если ключ строка, но должен быть int
-                                    del value_copy[slot_key]
-                                    value_copy[int_slot_key] = user_id_val
-
-                            except ValueError:
-                                # Если ключ слота не может быть преобразован в int, логируем предупреждение
-                                logger.warning(f"Ключ слота {slot_key} не является числом в {key} в practice_slots.")
-                    loaded_practice_slots[key] = value_copy # Сохраняем обработанное значение
-            logger.info(f"Загружено {len(loaded_practice_slots)} записей practice_slots из {PRACTICE_SLOTS_FILE}")
-    except (json.JSONDecodeError, FileNotFoundError) as e:
-        logger.warning(
-            f"Не удалось загрузить practice_slots из {PRACTICE_SLOTS_FILE} ({e}). Используется пустой словарь.")
-        loaded_practice_slots = {} # Инициализация пустым словарем
-
-    # Загрузка sent_notifications (множество отправленных уведомлений)
-    try:
-        if os.path.exists(SENT_NOTIFICATIONS_FILE):
-            with open(SENT_NOTIFICATIONS_FILE, 'r', encoding='utf-8') as f:
-                loaded_sent_notifications = set(json.load(f))
-            logger.info(f"Загружено {len(loaded_sent_notifications)} sent_notifications из {SENT_NOTIFICATIONS_FILE}")
-    except (json.JSONDecodeError, FileNotFoundError) as e:
-        logger.warning(
-            f"Не удалось загрузить sent_notifications из {SENT_NOTIFICATIONS_FILE} ({e}). Используется пустое множество.")
-        loaded_sent_notifications = set() # Инициализация пустым множеством
-
-    return loaded_user_ids, loaded_practice_slots, loaded_sent_notifications
+    return storage.load()
 
 
 def save_persistent_data(user_ids_data, practice_slots_data, sent_notifications_data):
-    """
-    Сохраняет текущее состояние user_ids, practice_slots и sent_notifications в JSON файлы.
-    Множества преобразуются в списки, datetime объекты - в строки ISO формата.
-    """
-    # Сохранение user_ids
-    try:
-        with open(USER_IDS_FILE, 'w', encoding='utf-8') as f:
-            # Преобразование множества в список для JSON-сериализации
-            json.dump(list(user_ids_data), f, ensure_ascii=False, indent=4)
-        # logger.debug(f"user_ids сохранены в {USER_IDS_FILE}") # Отладочное сообщение (закомментировано)
-    except IOError as e: # Обработка ошибок ввода-вывода
-        logger.error(f"Ошибка сохранения user_ids в {USER_IDS_FILE}: {e}")
-
-    # Подготовка и сохранение practice_slots
-    practice_slots_to_save = {} # Временный словарь для данных, готовых к сохранению
-    for key, value in practice_slots_data.items():
-        # Если значение является словарем и содержит 'open_time' типа datetime,
-        # преобразуем 'open_time' в строку ISO формата.
-        if isinstance(value, dict) and "open_time" in value and isinstance(value["open_time"], datetime):
-            value_copy = value.copy()  # Копируем, чтобы не изменять оригинальный объект в памяти
-            value_copy["open_time"] = value_copy["open_time"].isoformat() # Преобразование datetime в строку
-            practice_slots_to_save[key] = value_copy
-        else:
-            # Если нет 'open_time' или он не datetime, сохраняем значение как есть
-            # (или value.copy() если есть другие вложенные изменяемые структуры, требующие копирования)
-            practice_slots_to_save[key] = value
-    try:
-        with open(PRACTICE_SLOTS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(practice_slots_to_save, f, ensure_ascii=False, indent=4)
-        # logger.debug(f"practice_slots сохранены в {PRACTICE_SLOTS_FILE}")
-    except IOError as e:
-        logger.error(f"Ошибка сохранения practice_slots в {PRACTICE_SLOTS_FILE}: {e}")
-
-    # Сохранение sent_notifications
-    try:
-        with open(SENT_NOTIFICATIONS_FILE, 'w', encoding='utf-8') as f:
-            # Преобразование множества в список для JSON-сериализации
-            json.dump(list(sent_notifications_data), f, ensure_ascii=False, indent=4)
-        # logger.debug(f"sent_notifications сохранены в {SENT_NOTIFICATIONS_FILE}")
-    except IOError as e:
-        logger.error(f"Ошибка сохранения sent_notifications в {SENT_NOTIFICATIONS_FILE}: {e}")
-    # Логирование успешного сохранения всех данных
-    logger.info("Данные сохранены (user_ids, practice_slots, sent_notifications).")
+    """Сохраняет полное текущее состояние user_ids, practice_slots и sent_notifications в хранилище."""
+    bytes_before = storage.bytes_written
+    started = time_module.perf_counter()
+    storage.save(user_ids_data, practice_slots_data, sent_notifications_data)
+    bot_metrics.observe_persist(storage.name, time_module.perf_counter() - started, storage.bytes_written - bytes_before)
 
 
-# Инициализация глобальных переменных данными из файлов (или пустыми значениями по умолчанию, если файлы отсутствуют/повреждены)
+# Инициализация глобальных переменных данными из хранилища (или пустыми значениями по умолчанию)
 # Эта строка выполняется один раз при запуске скрипта.
+BOOT_STARTED = time_module.perf_counter() # Начало загрузки состояния (для времени до готовности бота)
 user_ids, practice_slots, sent_notifications = load_persistent_data()
+logger.info(f"Состояние загружено за {time_module.perf_counter() - BOOT_STARTED:.2f} сек.")
+# Сколько последних дней хранится учет отправленных уведомлений (более старые дни удаляются в полночь)
+sent_notifications.retention_days = int(os.getenv("NOTIFICATION_RETENTION_DAYS", str(DEFAULT_RETENTION_DAYS)))
+# Размер состояния (пользователи, открытые сессии, занятые места, учет уведомлений) считается при запросе метрик
+bot_metrics.watch_state(user_ids, practice_slots, sent_notifications)
+# Подписки на группы меняются редко и хранятся отдельно от остального состояния (см. groups.SubscriptionFile)
+subscription_file = SubscriptionFile(SUBSCRIPTIONS_FILE)
+subscriptions = subscription_file.load()
+bot_metrics.watch_subscriptions(subscriptions)
+
+# Фоновый писатель: объединяет изменения за PERSIST_INTERVAL секунд и сохраняет их в отдельном потоке
+persistence_writer = PersistenceWriter(
+    storage,
+    lambda: (user_ids, practice_slots, sent_notifications),
+    interval=float(os.getenv("PERSIST_INTERVAL", "1.0")),
+    metrics=bot_metrics,
+)
+
+
+async def persist_changes(records) -> bool:
+    """
+    Сохраняет изменения состояния.
+    records: список записей журнала (см. journal.make_record), описывающих изменения.
+    Для журнала и JSON файлов изменения передаются фоновому писателю и сохраняются пачкой,
+    не блокируя обработчик. База SQLite записывает каждое изменение сразу (в своем потоке),
+    потому что может отвергнуть бронь.
+    Возвращает False, если хранилище отвергло изменение (например, место уже занято в базе).
+    """
+    if not records:
+        return True
+    if storage.transactional:
+        started = time_module.perf_counter()
+        try:
+            with trace_span("persist"):
+                return await storage.apply_async(records, user_ids, practice_slots, sent_notifications)
+        finally:
+            bot_metrics.observe_persist(storage.name, time_module.perf_counter() - started)
+    persistence_writer.submit(records)
+    return True
+
+
+# Общее хранилище мест и пользователей: "memory" — в памяти этого процесса (работают прямо practice_slots,
+# user_ids и subscriptions), "redis" — в Redis, чтобы несколько процессов бота обслуживали нажатия одновременно
+# без двойных броней
+STATE_STORE = os.getenv("STATE_STORE", "memory")
+state_store = create_state_store(STATE_STORE, sessions=practice_slots, user_ids=user_ids,
+                                 redis_url=os.getenv("REDIS_URL"), subscriptions=subscriptions)
+# Рассылки и события расписания выполняет только процесс-лидер (держатель аренды в общем хранилище)
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}:{os.getpid()}")
+scheduler_lease = LeaderLease(state_store, "scheduler", WORKER_ID,
+                              ttl=float(os.getenv("LEADER_LEASE_TTL", "15")))
+
+# Все изменения мест и закрытие записи идут через booking_desk: под замком сессии и без повторной обработки нажатий
+booking_desk = BookingDesk(practice_slots, lambda records: persist_changes(records), store=state_store,
+                           now=lambda: scheduler_clock.now()) # Время записи — по часам планировщика
+
+# Уведомления о занятиях идут через очередь на диске: рассылка записывается до первой отправки, временные ошибки
+# повторяются с нарастающей паузой, пользователи, заблокировавшие бота, удаляются (remove_user), а недоставленное
+# до перезапуска доставляется после него (если еще актуально)
+outbox = Outbox(
+    broadcaster,
+    OUTBOX_FILE,
+    on_dead=lambda user_id: remove_user(user_id),
+    now=lambda: scheduler_clock.now(),                               # Срок актуальности — по часам планировщика
+    max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8")),         # Попыток при временных ошибках
+    base_delay=float(os.getenv("OUTBOX_RETRY_DELAY", "2")),          # Пауза перед первым повтором (сек.)
+)
+outbox.load()
+bot_metrics.watch_outbox(outbox)
+
+# Закрытые сессии не пропадают, а дописываются в архив посещаемости; в памяти остаются только его индексы
+history = HistoryArchive(os.getenv("HISTORY_FILE", HISTORY_FILE))
+history.load()
+bot_metrics.watch_history(history)
 # --- Конец секции персистентности ---
 
 
@@ -189,19 +270,77 @@ full_schedule = [
     ("Суббота", time(18, 0), "практика", "Программирование на языке Питон"),
 ]
 
+# Расписание читается из файла SCHEDULE_FILE (.json, .csv или .ics) и перечитывается при его изменении
+# без перезапуска бота; full_schedule используется, только если файла нет
+SCHEDULE_FILE = os.getenv("SCHEDULE_FILE", "schedule.json")
+SCHEDULE_RELOAD_INTERVAL = float(os.getenv("SCHEDULE_RELOAD_INTERVAL", "30")) # Как часто проверять mtime файла (сек.)
+
 # practice_slots = {} # Эта переменная теперь инициализируется функцией load_persistent_data()
 MAX_SLOTS = 33 # Максимальное количество мест на практику
 RECORDING_DURATION = timedelta(hours=1) # Продолжительность открытия записи на практику (1 час)
+LECTURE_NOTICE_TTL = timedelta(minutes=90) # Уведомление о лекции не доставляется после ее окончания
+CLOSE_NOTICE_TTL = timedelta(hours=12)     # Сколько доставляется подтверждение места после закрытия записи
+
+
+def parse_seat_zone(value: str):
+    """Зона мест из строки: "1-12" -> (1, 12), "5" -> (5, 5), пустая строка -> None."""
+    if not value.strip():
+        return None
+    first, _, last = value.partition("-")
+    return int(first), int(last or first)
+
+
+# Места, которые кнопка "Любое свободное место" выдает в первую очередь, например "1-12" (первые ряды).
+# Пусто — свободное место с наименьшим номером во всей аудитории
+ANY_SEAT_ZONE = parse_seat_zone(os.getenv("ANY_SEAT_ZONE", ""))
+
+# Группы (потоки) из GROUPS_FILE: у каждой свое расписание, вместимость практик и подписчики, и события группы
+# рассылаются только ее подписчикам. Если файла нет, группа одна (SCHEDULE_FILE и MAX_SLOTS) и уведомления
+# получают все зарегистрированные пользователи, как раньше
+GROUPS_FILE = os.getenv("GROUPS_FILE", "groups.json")
+study_groups = load_groups(GROUPS_FILE, SCHEDULE_FILE, MAX_SLOTS)
+GROUPS_ENABLED = DEFAULT_GROUP not in study_groups
+schedule_sources = {
+    group_id: ScheduleSource(group.schedule_file,
+                             fallback=Timetable.from_entries(full_schedule) if group.is_default else None)
+    for group_id, group in study_groups.items()
+}
+# ID групп в кнопках выбора групп: кнопки, отправленные до перезапуска, тоже разбираются
+for group_id in study_groups:
+    default_codec.session_ids.intern(group_id)
+
+# Часы планировщика (в бенчмарках подменяются виртуальными) и сам планировщик событий расписания
+scheduler_clock = Clock()
+event_scheduler = EventScheduler(
+    {group_id: source.timetable for group_id, source in schedule_sources.items()},
+    lambda event: handle_schedule_event(event),
+    clock=scheduler_clock,
+    grace=timedelta(minutes=float(os.getenv("SCHEDULE_GRACE_MINUTES", "10"))), # Допустимое опоздание события
+    # События, пропущенные за столько минут простоя до запуска, выполняются при запуске по порядку
+    catch_up=timedelta(minutes=float(os.getenv("CATCHUP_MINUTES", "60"))),
+)
+
+slot_keyboard_cache = SlotKeyboardCache() # Кэш клавиатур выбора места (по версии мест каждой сессии)
+# Клавиатура для закрытой записи одинакова для всех, поэтому создается один раз
+CLOSED_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Запись закрыта", callback_data=CLOSED_DATA)]
+])
+# Все нажатия приходят в один обработчик диспетчера, а он выбирает нужный по префиксу callback_data
+callback_router = CallbackRouter(default_codec, on_handled=bot_metrics.observe_handler)
 
 
 def get_confirm_keyboard(practice_session_key: str) -> InlineKeyboardMarkup:
     """
-    Создает инлайн-клавиатуру с кнопками "Да" и "Нет" для подтверждения записи на практику.
+    Создает инлайн-клавиатуру с кнопками "Да" и "Нет" для подтверждения записи на практику
+    и кнопкой "Любое свободное место" для записи одним нажатием.
     practice_session_key: Уникальный ключ сессии практики (например, "Понедельник_12:40").
     """
     return InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text="✅ Да", callback_data=f"confirm_yes_{practice_session_key}"),
-        InlineKeyboardButton(text="❌ Нет", callback_data=f"confirm_no_{practice_session_key}")
+        InlineKeyboardButton(text="✅ Да", callback_data=default_codec.encode(ACTION_CONFIRM_YES, practice_session_key)),
+        InlineKeyboardButton(text="❌ Нет", callback_data=default_codec.encode(ACTION_CONFIRM_NO, practice_session_key))
+    ], [
+        InlineKeyboardButton(text="🎯 Любое свободное место",
+                             callback_data=default_codec.encode(ACTION_ANY_SEAT, practice_session_key))
     ]])
 
 
@@ -214,351 +353,648 @@ def get_slot_keyboard(practice_session_key: str, user_id: int) -> InlineKeyboard
     global practice_slots  # Используем глобальную переменную practice_slots
     # Если сессия практики не найдена (например, запись уже закрыта), возвращаем клавиатуру с сообщением.
     if practice_session_key not in practice_slots:
-        return InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Запись закрыта", callback_data="closed")]
-        ])
-
-    booked_data = practice_slots.get(practice_session_key, {}) # Получаем данные о забронированных местах
-    keyboard_rows = [] # Список рядов кнопок
-    current_row = []   # Текущий формируемый ряд кнопок
-
-    # Итерация по всем возможным местам (от 1 до MAX_SLOTS)
-    for i in range(1, MAX_SLOTS + 1):
-        slot_owner_id = booked_data.get(i)  # Получаем ID пользователя, занявшего слот i (ключи слотов должны быть int)
-        text = "" # Текст на кнопке
-        callback_data_slot = "" # Данные, отправляемые при нажатии кнопки
-
-        if isinstance(slot_owner_id, int): # Если слот занят
-            if slot_owner_id == user_id: # Если слот занят текущим пользователем
-                text = f"✅{i}" # Отмечаем его место галочкой
-                callback_data_slot = f"slot_{practice_session_key}_{i}" # Позволяем отменить запись
-            else: # Если слот занят другим пользователем
-                text = f"🔒{i}" # Отмечаем место как заблокированное
-                callback_data_slot = "busy" # Сообщаем, что место занято
-        else: # Если слот свободен
-            text = str(i) # Просто номер места
-            callback_data_slot = f"slot_{practice_session_key}_{i}" # Позволяем занять место
-
-        current_row.append(InlineKeyboardButton(text=text, callback_data=callback_data_slot))
-        # Формируем ряды по 6 кнопок
-        if len(current_row) == 6:
-            keyboard_rows.append(current_row)
-            current_row = []
-    # Добавляем последний неполный ряд, если он есть
-    if current_row:
-        keyboard_rows.append(current_row)
-    return InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
+        return CLOSED_KEYBOARD
+
+    # Клавиатура берется из кэша: общая раскладка мест перестраивается только после изменения мест,
+    # а для пользователя в ней подменяется лишь кнопка его собственного места
+    return slot_keyboard_cache.get(practice_slots[practice_session_key], user_id)
+
+
+# Сообщения с клавиатурой выбора места: при изменении мест им рассылаются обновления
+seat_map_viewers = SeatMapViewers(
+    bot,
+    get_slot_keyboard,
+    broadcaster, # Правки сообщений идут через те же лимиты частоты, что и рассылки
+    debounce=float(os.getenv("SEAT_MAP_DEBOUNCE", "0.7")), # Секунд на объединение изменений в одно обновление
+)
 
 
 @dp.message(Command(commands=["start"]))
 async def register_user(message: types.Message):
     """
     Обработчик команды /start. Регистрирует пользователя (добавляет его ID в user_ids)
-    и сохраняет обновленный список user_ids.
+    и сохраняет обновленный список user_ids. Если настроены группы, а пользователь еще ни на одну
+    не подписан, предлагает выбрать группу.
     """
     # Объявляем использование глобальных переменных, чтобы их можно было изменять
     global user_ids, practice_slots, sent_notifications
-    user_ids.add(message.from_user.id) # Добавляем ID нового пользователя
-    # Сохраняем все персистентные данные (включая обновленный user_ids)
-    save_persistent_data(user_ids, practice_slots, sent_notifications)
+    user_id = message.from_user.id
+    # Регистрация идет через общее хранилище, чтобы рассылки лидера дошли и до пользователей других процессов
+    if await state_store.add_user(user_id):
+        user_ids.add(user_id) # Добавляем ID нового пользователя
+        # Сохраняем изменение (повторный /start ничего не меняет и не пишется на диск)
+        await persist_changes([make_record("user_registered", user=user_id)])
+    outbox.revive(user_id) # Пользователь, удаленный после блокировки бота, снова получает уведомления
+    if GROUPS_ENABLED and not await state_store.user_groups(user_id):
+        await message.answer("Бот запущен. Выберите свою группу, чтобы получать уведомления о ее занятиях:",
+                             reply_markup=build_group_keyboard(study_groups.values(), ()))
+        return
     await message.answer("Бот запущен. Ждите уведомлений о занятиях.")
 
 
-@dp.callback_query(lambda c: c.data == "busy")
-async def handle_busy_slot(callback: CallbackQuery):
+async def remove_user(user_id: int):
+    """
+    Удаляет пользователя, которому сообщения больше не доставляются (заблокировал бота, удалил аккаунт):
+    последующие рассылки не тратят на него запросы. После /start он будет зарегистрирован заново.
+    """
+    if await state_store.remove_user(user_id):
+        user_ids.discard(user_id)
+        await persist_changes([make_record("user_removed", user=user_id)])
+        await subscription_file.save(subscriptions)
+
+
+@dp.message(Command(commands=["groups"]))
+async def choose_groups(message: types.Message):
+    """Обработчик команды /groups: клавиатура групп, нажатие подписывает на группу или отписывает от нее."""
+    if not GROUPS_ENABLED:
+        await message.answer("Группы не настроены: уведомления о всех занятиях получают все пользователи.")
+        return
+    subscribed = await state_store.user_groups(message.from_user.id)
+    await message.answer("Ваши группы (нажмите, чтобы подписаться или отписаться):",
+                         reply_markup=build_group_keyboard(study_groups.values(), subscribed))
+
+
+# Администраторы (ID через запятую в ADMIN_IDS) видят статистику посещаемости: /stats, /attendance, /export
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if user_id}
+REPORT_LINES = 40 # Сколько строк отчета показывать в сообщении (полный список — в /export)
+
+
+def is_admin(message: types.Message) -> bool:
+    return message.from_user.id in ADMIN_IDS
+
+
+def command_argument(message: types.Message) -> str:
+    """Текст после команды: "/attendance Философия" -> "Философия"."""
+    return (message.text or "").partition(" ")[2].strip()
+
+
+@dp.message(Command(commands=["stats"]))
+async def show_stats(message: types.Message):
+    """
+    Обработчик команды /stats [дней]: заполняемость практик по предметам за последние дни (по умолчанию 30).
+    Считается по индексам архива, без чтения файла истории.
+    """
+    if not is_admin(message):
+        return
+    argument = command_argument(message)
+    days = int(argument) if argument.isdigit() else 30
+    until = scheduler_clock.now().date()
+    since = until - timedelta(days=days - 1)
+    total = history.occupancy(since=since, until=until)
+    if not total.sessions:
+        await message.answer(f"За последние {days} дн. закрытых практик нет.")
+        return
+    lines = [f"📊 Практики за {days} дн. ({since:%d.%m}–{until:%d.%m}): {total.sessions}, "
+             f"занято {total.booked} из {total.seats} мест ({total.occupancy:.0%})"]
+    for stats in history.subject_stats(since, until)[:REPORT_LINES]:
+        lines.append(f"{html.escape(stats.subject)}: {stats.sessions} практ., {stats.booked}/{stats.seats} "
+                     f"({stats.occupancy:.0%})")
+    await message.answer("\n".join(lines))
+
+
+@dp.message(Command(commands=["attendance"]))
+async def show_attendance(message: types.Message):
+    """
+    Обработчик команды /attendance <предмет или ID студента>.
+    Для предмета — посещения и пропуски каждого студента (сначала больше всего пропусков),
+    для студента — посещенные практики по предметам.
+    """
+    if not is_admin(message):
+        return
+    argument = command_argument(message)
+    if not argument:
+        await message.answer("Укажите предмет (можно часть названия) или ID студента: /attendance Философия")
+        return
+    if argument.isdigit():
+        user_id = int(argument)
+        subjects = history.student(user_id)
+        if not subjects:
+            await message.answer(f"Студент {user_id} не записывался на практики.")
+            return
+        lines = [f"👤 Студент {user_id}: посещено практик {sum(item.attended for item in subjects)}"]
+        lines += [f"{html.escape(item.subject)}: {item.attended} (последняя {item.last_date:%d.%m})"
+                  for item in subjects[:REPORT_LINES]]
+        await message.answer("\n".join(lines))
+        return
+    subject = history.find_subject(argument)
+    if subject is None:
+        await message.answer(f"Предмет «{html.escape(argument)}» не найден в архиве (или подходит несколько).")
+        return
+    report = await history.attendance(subject)
+    total = history.occupancy(subject)
+    lines = [f"📋 <b>{html.escape(subject)}</b>: практик {total.sessions}, заполняемость {total.occupancy:.0%}, "
+             f"студентов {len(report)}",
+             "ID студента: посещено / пропущено"]
+    lines += [f"{item.user_id}: {item.attended} / {item.missed}" for item in report[:REPORT_LINES]]
+    if len(report) > REPORT_LINES:
+        lines.append(f"… и еще {len(report) - REPORT_LINES}, полный список — /export")
+    await message.answer("\n".join(lines))
+
+
+@dp.message(Command(commands=["export"]))
+async def export_history(message: types.Message):
+    """Обработчик команды /export [предмет]: архив посещаемости CSV файлом (пишется на диск построчно)."""
+    if not is_admin(message):
+        return
+    argument = command_argument(message)
+    subject = history.find_subject(argument) if argument else None
+    if argument and subject is None:
+        await message.answer(f"Предмет «{html.escape(argument)}» не найден в архиве (или подходит несколько).")
+        return
+    fd, path = tempfile.mkstemp(prefix="attendance_", suffix=".csv")
+    os.close(fd)
+    try:
+        sessions = await history.export_csv(path, subject)
+        await message.answer_document(FSInputFile(path, filename="attendance.csv"),
+                                      caption=f"Сессий в выгрузке: {sessions}")
+    finally:
+        os.remove(path)
+
+
+@dp.callback_query()
+async def handle_callback(callback: CallbackQuery, callback_action: CallbackAction = None):
+    """
+    Единственный обработчик нажатий в диспетчере: вызывает обработчик по виду нажатия.
+    callback_action — нажатие, уже разобранное click_throttle (для серии нажатий на места — итоговое).
+    """
+    await callback_router.dispatch(callback, callback_action)
+
+
+async def callback_session_key(action: CallbackAction):
+    """
+    Ключ сессии по ID из callback_data. ID, который этот процесс еще не встречал (кнопка отправлена до
+    перезапуска или другим процессом бота), ищется среди открытых сессий общего хранилища.
+    None — сессии с таким ID нет (запись уже закрыта).
+    """
+    session_ids = default_codec.session_ids
+    practice_session_key = session_ids.key_of(action.session_id)
+    if practice_session_key is None:
+        for open_key in await state_store.open_session_keys():
+            session_ids.intern(open_key)
+        practice_session_key = session_ids.key_of(action.session_id)
+    return practice_session_key
+
+
+async def current_session(action: CallbackAction):
+    """Сессия нажатия или None (для объединения серии нажатий на места)."""
+    practice_session_key = await callback_session_key(action)
+    return await booking_desk.session(practice_session_key) if practice_session_key is not None else None
+
+
+# Частые нажатия одного пользователя: серия нажатий на места выполняется одним изменением мест, одним сохранением
+# и одной правкой клавиатуры, а остальные нажатия сверх CLICK_RATE в секунду получают короткий ответ
+click_throttle = ClickThrottle(
+    default_codec,
+    current_session,
+    window=float(os.getenv("CLICK_COALESCE_WINDOW", "0.4")),     # Сек. между нажатиями на места, чтобы их объединить
+    max_delay=float(os.getenv("CLICK_COALESCE_MAX_DELAY", "1.5")), # Дольше этого серия нажатий не откладывается
+    rate=float(os.getenv("CLICK_RATE", "5")),                     # Остальных нажатий в секунду на пользователя
+    burst=int(os.getenv("CLICK_BURST", "10")),                    # ... и подряд
+)
+dp.callback_query.middleware(click_throttle)
+bot_metrics.watch_click_throttle(click_throttle)
+
+
+@callback_router.route(ACTION_BUSY)
+async def handle_busy_slot(callback: CallbackQuery, action: CallbackAction = None):
     """Обработчик нажатия на кнопку занятого места."""
     await callback.answer("Это место уже занято другим пользователем.", show_alert=True)
 
 
-@dp.callback_query(lambda c: c.data == "closed")
-async def handle_closed_practice(callback: CallbackQuery):
+@callback_router.route(ACTION_CLOSED)
+async def handle_closed_practice(callback: CallbackQuery, action: CallbackAction = None):
     """Обработчик нажатия на кнопку "Запись закрыта"."""
     await callback.answer("Запись на эту практику уже закрыта.", show_alert=True)
 
 
-@dp.callback_query(lambda c: c.data.startswith("confirm_yes_"))
-async def handle_confirm_yes_to_practice(callback: CallbackQuery):
+@callback_router.route(ACTION_GROUP)
+async def handle_group_toggle(callback: CallbackQuery, action: CallbackAction = None):
+    """Обработчик нажатия на группу: подписывает пользователя на группу или отписывает от нее."""
+    if action is None:
+        action = default_codec.decode(callback.data)
+    group = study_groups.get(default_codec.session_ids.key_of(action.session_id)) if action is not None else None
+    if group is None or group.is_default:
+        await callback.answer("Такой группы больше нет.", show_alert=True)
+        return
+    user_id = callback.from_user.id
+    if await state_store.subscribe(user_id, group.group_id):
+        answer = f"Вы подписаны на уведомления группы {group.title}."
+    else:
+        await state_store.unsubscribe(user_id, group.group_id)
+        answer = f"Вы отписались от уведомлений группы {group.title}."
+    subscribed = await state_store.user_groups(user_id)
+    await callback.message.edit_reply_markup(reply_markup=build_group_keyboard(study_groups.values(), subscribed))
+    await callback.answer(answer)
+    await subscription_file.save(subscriptions)
+
+
+@callback_router.route(ACTION_CONFIRM_YES)
+async def handle_confirm_yes_to_practice(callback: CallbackQuery, action: CallbackAction = None):
     """
     Обработчик нажатия кнопки "Да" для подтверждения участия в практике.
     Показывает клавиатуру для выбора места.
     """
     global practice_slots # Используем глобальную переменную
-    # Извлекаем ключ сессии практики из callback_data
-    practice_session_key = callback.data.replace("confirm_yes_", "")
-    if practice_session_key in practice_slots: # Если сессия еще активна
-        session_data = practice_slots.get(practice_session_key)
+    if action is None:
+        action = default_codec.decode(callback.data)
+    # Ключ сессии практики по ее ID из callback_data
+    practice_session_key = await callback_session_key(action) if action is not None else None
+    # Сессия могла быть открыта другим процессом бота — тогда ее копия загружается из общего хранилища
+    session = await booking_desk.session(practice_session_key) if practice_session_key is not None else None
+    if session is not None: # Если сессия еще активна
         # Формируем отображаемое имя предмета
-        subject_name_display = practice_session_key.replace('_', ' ') # По умолчанию, если имя не найдено
-        if session_data and "subject_name" in session_data:
-            subject_name_display = session_data["subject_name"]
+        subject_name_display = session.subject_name
 
         # Редактируем сообщение, предлагая выбрать место
+        slot_keyboard = get_slot_keyboard(practice_session_key, callback.from_user.id)
         await callback.message.edit_text(
-            f"Выберите место на практику: <b>{subject_name_display}</b>\n({practice_session_key.replace('_', ' ')}):",
-            reply_markup=get_slot_keyboard(practice_session_key, callback.from_user.id)
+            f"Выберите место на практику: <b>{subject_name_display}</b>\n({session_label(practice_session_key)}):",
+            reply_markup=slot_keyboard
         )
+        # Запоминаем сообщение, чтобы обновлять в нем карту мест, когда их занимают другие
+        seat_map_viewers.track(practice_session_key, callback.message.chat.id, callback.message.message_id,
+                               callback.from_user.id, slot_keyboard)
         await callback.answer() # Отвечаем на callback, чтобы убрать "часики"
     else: # Если сессия уже закрыта
         await callback.message.edit_text("Запись на эту практику уже закрыта.")
         await callback.answer("Запись на эту практику уже закрыта.", show_alert=True)
 
 
-@dp.callback_query(lambda c: c.data.startswith("confirm_no_"))
-async def handle_confirm_no_to_practice(callback: CallbackQuery):
+@callback_router.route(ACTION_CONFIRM_NO)
+async def handle_confirm_no_to_practice(callback: CallbackQuery, action: CallbackAction = None):
     """Обработчик нажатия кнопки "Нет" (отказ от записи)."""
     await callback.message.edit_text("❌ Вы отказались от записи.")
     await callback.answer()
 
 
-@dp.callback_query(lambda c: c.data.startswith("slot_"))
-async def handle_slot_selection(callback: CallbackQuery):
+async def telegram_call(method):
+    """
+    Выполняет вызов Telegram API. Вызовы aiogram (callback.answer(), message.edit_text()) можно ждать, но это
+    не корутины, и asyncio.gather их не принимает; обернутые в корутину, они отправляются одновременно.
+    """
+    return await method
+
+
+@callback_router.route(ACTION_ANY_SEAT)
+async def handle_any_seat(callback: CallbackQuery, action: CallbackAction = None):
+    """
+    Обработчик кнопки "Любое свободное место" в приглашении: сразу записывает пользователя на свободное место
+    с наименьшим номером (сначала в зоне ANY_SEAT_ZONE) и показывает карту мест, где место можно поменять.
+    Ответ на нажатие и правка сообщения отправляются одновременно — запись занимает одно обращение к Telegram.
+    """
+    if action is None:
+        action = default_codec.decode(callback.data)
+    practice_session_key = await callback_session_key(action) if action is not None else None
+    user_id = callback.from_user.id
+    result = await booking_desk.claim_any(practice_session_key, user_id, zone=ANY_SEAT_ZONE, update_id=callback.id) \
+        if practice_session_key is not None else None
+    if result is None or result.status == SESSION_CLOSED:
+        await asyncio.gather(telegram_call(callback.answer("Запись на эту практику уже закрыта.", show_alert=True)),
+                             telegram_call(callback.message.edit_text("Запись на эту практику уже закрыта.")))
+        return
+    if result.status == SESSION_FULL:
+        await callback.answer("Свободных мест не осталось.", show_alert=True)
+        return
+    if result.status == SEAT_REJECTED:
+        await callback.answer("Не удалось записаться. Попробуйте еще раз.", show_alert=True)
+        return
+    session = await booking_desk.session(practice_session_key)
+    answer = f"Вы записаны на место #{result.seat}." if result.status == SEAT_CLAIMED \
+        else f"У вас уже есть место #{result.seat}."
+    slot_keyboard = get_slot_keyboard(practice_session_key, user_id)
+    await asyncio.gather(
+        telegram_call(callback.answer(answer)),
+        telegram_call(callback.message.edit_text(
+            f"✅ Место #{result.seat} на практику: <b>{session.subject_name if session is not None else ''}</b>\n"
+            f"({session_label(practice_session_key)}).\nЧтобы выбрать другое место, нажмите на него:",
+            reply_markup=slot_keyboard)),
+    )
+    seat_map_viewers.track(practice_session_key, callback.message.chat.id, callback.message.message_id,
+                           user_id, slot_keyboard)
+    if result.status == SEAT_CLAIMED:
+        seat_map_viewers.notify_changed(practice_session_key)
+
+
+async def update_seat_map_message(callback: CallbackQuery, practice_session_key: str, user_id: int):
+    """Перерисовывает клавиатуру мест в сообщении, где нажата кнопка, и запоминает его для живых обновлений."""
+    slot_keyboard = get_slot_keyboard(practice_session_key, user_id)
+    await callback.message.edit_reply_markup(reply_markup=slot_keyboard)
+    seat_map_viewers.track(practice_session_key, callback.message.chat.id, callback.message.message_id,
+                           user_id, slot_keyboard)
+
+
+@callback_router.route(ACTION_SLOT)
+async def handle_slot_selection(callback: CallbackQuery, action: CallbackAction = None):
     """
     Обработчик выбора конкретного места на практику.
     Позволяет занять свободное место или отменить свою бронь.
     """
     global practice_slots, user_ids, sent_notifications # Используем глобальные переменные
-    # Парсинг callback_data для получения информации о слоте и сессии
-    parts = callback.data.split("_") # Например, "slot_Понедельник_12:40_5"
-    slot_num_str = parts[-1]          # Номер слота (строка)
-    time_str = parts[-2]              # Время сессии
-    practice_day_key_part = parts[1]  # День недели
-    practice_session_key = f"{practice_day_key_part}_{time_str}" # Полный ключ сессии
-
-    try:
-        slot_num = int(slot_num_str) # Преобразуем номер слота в число
-    except ValueError:
-        logger.error(f"Ошибка парсинга номера слота из callback_data: {callback.data}")
+    # callback_data уже разобран маршрутизатором: ID сессии и номер места (например, "s1x2k9c.5")
+    if action is None:
+        action = default_codec.decode(callback.data)
+    if action is None or action.kind != ACTION_SLOT:
+        logger.error(f"Ошибка разбора callback_data места: {callback.data}")
         await callback.answer("Произошла ошибка. Попробуйте еще раз.", show_alert=True)
         return
+    slot_num = action.seat
+    practice_session_key = await callback_session_key(action)
+    if practice_session_key is None:
+        await callback.message.edit_text("Запись на эту практику уже закрыта.")
+        await callback.answer("Запись на эту практику уже закрыта.", show_alert=True)
+        return
 
     user_id = callback.from_user.id # ID пользователя, выбравшего слот
 
-    # Проверка, активна ли еще сессия практики
-    if practice_session_key not in practice_slots:
+    # Проверка места, изменение и сохранение выполняются атомарно под замком сессии;
+    # повторная доставка того же нажатия (тот же callback.id) не меняет места второй раз
+    result = await booking_desk.toggle(practice_session_key, slot_num, user_id, update_id=callback.id)
+
+    if result.status == SESSION_CLOSED:
         await callback.message.edit_text("Запись на эту практику уже закрыта.")
         await callback.answer("Запись на эту практику уже закрыта.", show_alert=True)
         return
-
-    current_practice_session_data = practice_slots[practice_session_key]
-
-    # Проверка, не занял ли кто-то это место только что
-    # Слот `slot_num` (int) должен быть ключом в `current_practice_session_data`
-    if current_practice_session_data.get(slot_num) is not None and \
-            isinstance(current_practice_session_data.get(slot_num), int) and \
-            current_practice_session_data.get(slot_num) != user_id:
+    if result.status in (SEAT_TAKEN, SEAT_REJECTED):
+        # Место занято другим пользователем (или хранилище отвергло бронь) — показываем актуальную карту мест
         await callback.answer("Это место только что заняли. Выберите другое.", show_alert=True)
-        # Обновляем клавиатуру, чтобы показать актуальное состояние
-        await callback.message.edit_reply_markup(reply_markup=get_slot_keyboard(practice_session_key, user_id))
+        await update_seat_map_message(callback, practice_session_key, user_id)
         return
-
-    # Проверяем, был ли этот слот уже занят текущим пользователем
-    user_already_has_this_slot = (current_practice_session_data.get(slot_num) == user_id)
-
-    # Ищем, был ли у пользователя уже другой слот в этой сессии, и если да, удаляем его
-    old_slot_of_user = None
-    # Создаем копию ключей для безопасной итерации, так как можем изменять словарь
-    keys_to_check = list(current_practice_session_data.keys())
-    for s_key in keys_to_check:
-        # Пропускаем служебные поля
-        if s_key in ["open_time", "subject_name"]: continue
-
-        s_num_candidate = -1
-        try:
-            # Преобразуем ключ слота в int (так как они могут быть строками после загрузки из JSON,
-            # хотя load_persistent_data должен это исправлять)
-            s_num_candidate = int(s_key)
-        except ValueError:
-            continue # Пропускаем нечисловые ключи (если такие есть по ошибке)
-
-        booked_uid = current_practice_session_data.get(s_key) # Получаем ID пользователя на этом слоте
-        # Если на слоте `s_num_candidate` записан текущий пользователь
-        if isinstance(booked_uid, int) and booked_uid == user_id:
-            old_slot_of_user = s_num_candidate
-            # Удаляем старую бронь пользователя. Важно удалять по правильному типу ключа.
-            # Если s_key был строкой, а s_num_candidate - int, убедимся, что удаляем правильно.
-            if s_num_candidate in current_practice_session_data:
-                 del current_practice_session_data[s_num_candidate]
-            elif str(s_num_candidate) in current_practice_session_data: # На случай, если ключ все еще строка
-                 del current_practice_session_data[str(s_num_candidate)]
-            break # Пользователь может занимать только одно место, выходим из цикла
-
-    if user_already_has_this_slot:
-        # Если пользователь нажал на свой уже занятый слот, это означает отмену записи на этот слот.
-        # К этому моменту `old_slot_of_user` должен был найти этот слот и удалить его из `current_practice_session_data`.
+    if result.status == SEAT_RELEASED:
         await callback.answer(f"Ваша запись на место #{slot_num} отменена.")
-    else:
-        # Если пользователь выбрал новый слот (не тот, что был у него ранее, или у него не было слотов):
-        # 1. Если у него был другой слот, он уже удален (см. цикл выше).
-        # 2. Теперь занимаем новый слот.
-        current_practice_session_data[slot_num] = user_id  # Записываем пользователя на новый слот (ключ slot_num - int)
+    elif result.status in (SEAT_CLAIMED, SEAT_MOVED):
         await callback.answer(f"Вы выбрали место #{slot_num}.")
-
-    # Сохраняем изменения в practice_slots
-    save_persistent_data(user_ids, practice_slots, sent_notifications)
+    else:
+        logger.error(f"Номер места вне диапазона в callback_data: {callback.data}")
+        await callback.answer("Произошла ошибка. Попробуйте еще раз.", show_alert=True)
+        return
     # Обновляем клавиатуру с новым состоянием слотов
-    await callback.message.edit_reply_markup(reply_markup=get_slot_keyboard(practice_session_key, user_id))
+    await update_seat_map_message(callback, practice_session_key, user_id)
+    # Остальные пользователи, смотрящие на эту сессию, получат обновленную карту мест (с задержкой на объединение)
+    seat_map_viewers.notify_changed(practice_session_key)
+
+
+def session_label(practice_session_key: str) -> str:
+    """Подпись сессии для пользователя: "Понедельник 12:40" и, если настроены группы, название группы."""
+    group_id, day_name, time_str = split_session_key(practice_session_key)
+    group = study_groups.get(group_id)
+    if group is None or group.is_default:
+        return f"{day_name} {time_str}"
+    return f"{day_name} {time_str}, {group.title}"
+
+
+def notification_entry_id(event: ScheduledEvent) -> str:
+    """ID записи расписания события; вместе с датой события однозначно определяет уведомление."""
+    return schedule_entry_id(event.day_name, event.time_str, event.event_type, event.subject_name, event.group)
+
+
+async def group_audience(group_id: str):
+    """Получатели событий группы: ее подписчики, а для группы по умолчанию — все зарегистрированные пользователи."""
+    if group_id == DEFAULT_GROUP:
+        return await state_store.user_ids()
+    return await state_store.group_members(group_id)
+
+
+def group_prefix(group_id: str) -> str:
+    """Название группы в начале уведомления (пусто, если группы не настроены)."""
+    group = study_groups.get(group_id)
+    return f"[{group.title}] " if group is not None and not group.is_default else ""
+
+
+async def notify_lecture(event: ScheduledEvent):
+    """Отправляет подписчикам группы события уведомление о начале лекции."""
+    message_text = f"📘 {group_prefix(event.group)}Сейчас начинается лекция: <b>{event.subject_name}</b>\n{event.day_name} в {event.time_str}"
+    if scheduler_clock.now() - event.when > event_scheduler.grace:
+        # Уведомление о лекции, пропущенной за время простоя бота
+        message_text = f"📘 {group_prefix(event.group)}Идет лекция: <b>{event.subject_name}</b>\n{event.day_name}, началась в {event.time_str}"
+    # Отправляем уведомление только аудитории группы (без группы — всем зарегистрированным пользователям)
+    await outbox.broadcast(await group_audience(event.group), message_text, name=f"лекция {event.subject_name}",
+                           kind="lecture", expires_at=event.when + LECTURE_NOTICE_TTL)
+
+
+async def open_practice(event: ScheduledEvent):
+    """Открывает запись на практику, уведомляет подписчиков группы и планирует закрытие записи."""
+    practice_session_key = event.session_key
+    group = study_groups.get(event.group)
+    capacity = group.capacity if group is not None else MAX_SLOTS # Вместимость практик группы
+    # Запись отсчитывается от времени по расписанию: если открытие выполняется после простоя бота,
+    # закрыться она должна в то же время, что и без простоя
+    open_time = event.when
+    close_at = open_time + RECORDING_DURATION
+    now = scheduler_clock.now()
+    if close_at <= now:
+        logger.warning(f"Запись на практику {event.subject_name} ({practice_session_key}) не открыта: "
+                       f"ее время ({close_at:%H:%M}) закончилось, пока бот был выключен")
+        return
+    # Открываем запись: добавляем сессию в practice_slots (и в общее хранилище).
+    # Если сессия уже была открыта (например, до перезапуска бота), повторно не уведомляем
+    if not await booking_desk.open(PracticeSession(practice_session_key, event.subject_name, open_time, capacity)):
+        logger.info(
+            f"Сессия записи на практику {event.subject_name} ({practice_session_key}) уже была открыта ранее. Уведомление не отправляется повторно.")
+        return
+    # Сохраняем открытие сразу, до рассылки: во время рассылки пользователи уже
+    # начнут занимать места, и эти записи в журнале должны идти после открытия сессии
+    await persist_changes([make_record("session_opened", session=practice_session_key, open_time=open_time.isoformat(),
+                                       subject=event.subject_name, capacity=capacity)])
+    # Закрытие записи планируется сразу при открытии
+    event_scheduler.schedule_close(practice_session_key, close_at)
+    message_text = f"📢 {group_prefix(event.group)}Открыта запись на практику: <b>{event.subject_name}</b>\n{event.day_name} в {event.time_str}.\nЗапись будет открыта в течение {int(RECORDING_DURATION.total_seconds() / 3600)} часа."
+    if now - open_time > event_scheduler.grace:
+        message_text = f"📢 {group_prefix(event.group)}Открыта запись на практику: <b>{event.subject_name}</b>\n{event.day_name} в {event.time_str}.\nЗапись открыта до {close_at:%H:%M}."
+    # Уведомляем аудиторию группы об открытии записи.
+    # Рассылка идет параллельно, чтобы запись открылась для всех почти одновременно.
+    await outbox.broadcast(
+        await group_audience(event.group),
+        message_text,
+        name=f"открытие {practice_session_key}",
+        kind="practice_open",
+        expires_at=close_at, # После закрытия записи приглашение уже бесполезно
+        reply_markup=get_confirm_keyboard(practice_session_key) # Клавиатура "Да/Нет"
+    )
+    logger.info(f"Открыта запись на практику: {event.subject_name} ({practice_session_key})")
+
+
+async def close_practice(practice_session_key: str):
+    """Закрывает запись на практику и подтверждает места всем записавшимся."""
+    # Сессия удаляется под ее замком, после уже начатых изменений мест; список записавшихся
+    # берется из закрытой сессии, которую больше никто не меняет.
+    # Закрывается только сессия, чье время вышло: под тем же ключом могли открыть более новую.
+    session = await booking_desk.close(
+        practice_session_key,
+        is_due=lambda opened: scheduler_clock.now() - opened.open_time >= RECORDING_DURATION)
+    if session is None:
+        return
+    slot_keyboard_cache.invalidate(practice_session_key)
+    seat_map_viewers.close_session(practice_session_key)
+    group_id, day_from_key, time_str_from_key = split_session_key(practice_session_key)
+    # Итоговые места сохраняются в архив посещаемости (для /stats, /attendance и выгрузки)
+    await history.record(session, group_id)
+    logger.info(f"Сессия записи на практику {practice_session_key} закрыта и перенесена в архив.")
+
+    # Уведомляем каждого записавшегося пользователя о закрытии записи
+    # (временные ошибки отправки повторяются очередью, заблокировавшие бота пользователи удаляются)
+    await outbox.broadcast(
+        session.booked_user_ids(),
+        f"📢 {group_prefix(group_id)}Запись на практику <b>{session.subject_name}</b> ({day_from_key} в {time_str_from_key}) закрыта. Ваше место подтверждено.",
+        name=f"закрытие {practice_session_key}",
+        kind="practice_close",
+        expires_at=scheduler_clock.now() + CLOSE_NOTICE_TTL,
+    )
+
+
+async def forget_practice(practice_session_key: str):
+    """
+    Закрытие записи в процессе, который не лидер: запись в общем хранилище закрывает лидер, а этот процесс
+    удаляет свою копию сессии, ее клавиатуры и живые обновления, чтобы они не оставались в памяти и метриках.
+    """
+    if await booking_desk.forget(
+            practice_session_key,
+            is_due=lambda opened: scheduler_clock.now() - opened.open_time >= RECORDING_DURATION):
+        slot_keyboard_cache.invalidate(practice_session_key)
+        seat_map_viewers.close_session(practice_session_key)
+
+
+async def cleanup_sent_notifications(today):
+    """Удаляет учет уведомлений за дни старше срока хранения, чтобы sent_notifications не рос бесконечно."""
+    cutoff = sent_notifications.expire(today)
+    if cutoff is not None:
+        logger.info(f"Удален учет уведомлений до {cutoff}, осталось {len(sent_notifications)} записей")
+        await persist_changes([make_record("notifications_expired", before=cutoff)])
+
+
+async def handle_schedule_event(event: ScheduledEvent):
+    """Выполняет событие расписания: лекцию, открытие или закрытие записи, ежедневную очистку."""
+    if not scheduler_lease.is_leader:
+        # События выполняет другой процесс. Закрытие записи все равно планируется:
+        # если этот процесс станет лидером, он закроет запись, открытую прежним лидером
+        if event.kind == EVENT_PRACTICE_OPEN:
+            event_scheduler.schedule_close(event.session_key, event.when + RECORDING_DURATION)
+        elif event.kind == EVENT_PRACTICE_CLOSE:
+            await forget_practice(event.session_key)
+        return
+    if event.kind == EVENT_PRACTICE_CLOSE:
+        await close_practice(event.session_key)
+        return
+    if event.kind == EVENT_DAILY_CLEANUP:
+        await cleanup_sent_notifications(event.when.date())
+        return
+
+    event_date = event.when.date()
+    entry_id = notification_entry_id(event)
+    # Если уведомление уже было отправлено (например, до перезапуска бота), пропускаем событие
+    if not sent_notifications.add(event_date, entry_id):
+        return
+    await persist_changes([make_record("notification_sent", date=event_date.isoformat(), entry=entry_id)])
+    logger.info(f"Отправка уведомления для: {event.day_name} {event.time_str} {event.subject_name} ({event_date})")
+
+    if event.kind == EVENT_LECTURE:
+        await notify_lecture(event)
+    elif event.kind == EVENT_PRACTICE_OPEN:
+        await open_practice(event)
 
 
 async def schedule_checker():
     """
-    Асинхронная задача, которая периодически проверяет расписание и:
-    1. Отправляет уведомления о начинающихся лекциях.
-    2. Открывает запись на практики и уведомляет пользователей.
-    3. Закрывает запись на практики по истечении времени (RECORDING_DURATION) и уведомляет записавшихся.
-    4. Очищает старые записи из sent_notifications.
-    """
-    global sent_notifications, practice_slots, user_ids # Используем глобальные переменные
-
-    # Словари для преобразования дней недели (если locale не сработает)
-    weekdays_map_english_to_russian = {
-        "Monday": "Понедельник", "Tuesday": "Вторник", "Wednesday": "Среда",
-        "Thursday": "Четверг", "Friday": "Пятница", "Saturday": "Суббота", "Sunday": "Воскресенье"
-    }
-    # Список русских дней недели для использования с datetime.weekday() (Понедельник=0)
-    russian_weekdays_by_index = [
-        "Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"
-    ]
-
-    while True: # Бесконечный цикл проверки
-        now = datetime.now() # Текущее время
-        today_russian_weekday = "Unknown" # Переменная для хранения текущего дня недели на русском
-
-        # Пытаемся определить день недели через strftime (зависит от установленной локали)
-        try:
-            day_from_strftime = now.strftime("%A").capitalize() # Например, "Monday" -> "Понедельник"
-            if day_from_strftime in weekdays_map_english_to_russian.values(): # Если уже на русском
-                today_russian_weekday = day_from_strftime
-            elif day_from_strftime in weekdays_map_english_to_russian: # Если на английском, переводим
-                today_russian_weekday = weekdays_map_english_to_russian[day_from_strftime]
-        except Exception as e:
-            logger.warning(f"Ошибка при получении дня недели через strftime('%A'): {e}.")
-
-        # Если strftime не сработал или вернул не то, используем datetime.weekday() (не зависит от локали)
-        if today_russian_weekday == "Unknown":
-            try:
-                day_index = now.weekday()  # Понедельник=0, Вторник=1, ...
-                today_russian_weekday = russian_weekdays_by_index[day_index]
-                logger.info(
-                    f"День недели определен через now.weekday() как: {today_russian_weekday} (индекс {day_index})")
-            except IndexError: # На всякий случай, если day_index будет некорректным
-                logger.error(f"Ошибка: индекс дня недели {day_index} вне диапазона.")
-                today_russian_weekday = "Unknown"
-            except Exception as e:
-                logger.error(f"Непредвиденная ошибка при определении дня через now.weekday(): {e}")
-                today_russian_weekday = "Unknown"
-
-        # Если день недели так и не определен, пропускаем текущую итерацию проверки
-        if today_russian_weekday == "Unknown":
-            logger.error("Не удалось определить текущий день недели. Пропускаем проверку расписания.")
-            await asyncio.sleep(60) # Ждем минуту перед следующей попыткой
-            continue
-
-        logger.debug(f"Финальный определенный русский день недели: {today_russian_weekday}")
-        now_minutes = now.hour * 60 + now.minute # Текущее время в минутах от начала дня
-        data_changed = False  # Флаг, указывающий, были ли изменения в данных, требующие сохранения
-
-        # --- Закрытие старых сессий записи на практики ---
-        keys_to_remove_from_practice_slots = [] # Список ключей сессий для удаления
-        # Итерируемся по копии элементов словаря, так как можем изменять его в процессе
-        for practice_session_key, session_data in list(practice_slots.items()):
-            # Проверяем, что 'open_time' существует и является объектом datetime
-            if "open_time" in session_data and isinstance(session_data["open_time"], datetime):
-                # Если с момента открытия записи прошло больше времени, чем RECORDING_DURATION
-                if (now - session_data["open_time"]) > RECORDING_DURATION:
-                    keys_to_remove_from_practice_slots.append(practice_session_key)
-                    day_from_key, time_str_from_key = practice_session_key.split("_")
-                    subject_name_closed = session_data.get("subject_name", f"{day_from_key} {time_str_from_key}")
-
-                    # Собираем ID всех пользователей, записавшихся на эту практику
-                    booked_user_ids = {uid for slot, uid in session_data.items() if
-                                       slot not in ["open_time", "subject_name"] and isinstance(uid, int)}
-                    # Уведомляем каждого записавшегося пользователя о закрытии записи
-                    for user_id_booked in booked_user_ids:
-                        try:
-                            await bot.send_message(user_id_booked,
-                                                   f"📢 Запись на практику <b>{subject_name_closed}</b> ({day_from_key} в {time_str_from_key}) закрыта. Ваше место подтверждено.")
-                        except Exception as e: # Обработка возможных ошибок при отправке (например, пользователь заблокировал бота)
-                            logger.warning(
-                                f"Не удалось отправить сообщение о закрытии записи пользователю {user_id_booked}: {e}")
-            elif "open_time" in session_data: # Если 'open_time' есть, но не datetime (ошибка в данных)
-                logger.error(
-                    f"Некорректный тип open_time для {practice_session_key}: {type(session_data['open_time'])}")
-
-        # Удаляем закрытые сессии из practice_slots
-        if keys_to_remove_from_practice_slots:
-            for key_to_del in keys_to_remove_from_practice_slots:
-                if key_to_del in practice_slots:
-                    del practice_slots[key_to_del]
-                    logger.info(f"Сессия записи на практику {key_to_del} закрыта и удалена.")
-                    data_changed = True # Отмечаем, что данные изменились
-
-        # --- Проверка текущих событий по расписанию (лекции, практики) ---
-        for day_schedule, t_schedule, type_schedule, subject_name in full_schedule:
-            # Пропускаем события, не относящиеся к сегодняшнему дню
-            if day_schedule != today_russian_weekday:
-                continue
-
-            t_schedule_minutes = t_schedule.hour * 60 + t_schedule.minute # Время начала события в минутах
-            # Уникальный ключ для события (включая дату), чтобы не отправлять уведомление повторно в тот же день
-            notification_event_key = f"{day_schedule}_{t_schedule.strftime('%H:%M')}_{type_schedule}_{subject_name}_{now.date().isoformat()}"
-            # Проверяем, наступило ли время события
-            should_notify = (now_minutes == t_schedule_minutes)
-
-            # Если время наступило и уведомление еще не было отправлено
-            if should_notify and notification_event_key not in sent_notifications:
-                sent_notifications.add(notification_event_key) # Добавляем ключ в отправленные
-                data_changed = True # Отмечаем, что данные изменились
-                logger.info(f"Отправка уведомления для: {notification_event_key}")
-
-                if type_schedule == "лекция":
-                    message_text = f"📘 Сейчас начинается лекция: <b>{subject_name}</b>\n{day_schedule} в {t_schedule.strftime('%H:%M')}"
-                    # Отправляем уведомление всем зарегистрированным пользователям
-                    for uid in user_ids:
-                        try:
-                            await bot.send_message(uid, message_text)
-                        except Exception as e:
-                            logger.warning(f"Не удалось отправить уведомление о лекции пользователю {uid}: {e}")
-
-                elif type_schedule == "практика":
-                    current_practice_session_key = f"{day_schedule}_{t_schedule.strftime('%H:%M')}"
-                    # Если запись на эту практику еще не открыта
-                    if current_practice_session_key not in practice_slots:
-                        # Открываем запись: добавляем сессию в practice_slots
-                        practice_slots[current_practice_session_key] = {"open_time": now, "subject_name": subject_name}
-                        data_changed = True # Отмечаем, что данные изменились
-                        message_text = f"📢 Открыта запись на практику: <b>{subject_name}</b>\n{day_schedule} в {t_schedule.strftime('%H:%M')}.\nЗапись будет открыта в течение {int(RECORDING_DURATION.total_seconds() / 3600)} часа."
-                        # Уведомляем всех пользователей об открытии записи
-                        for uid in user_ids:
-                            try:
-                                await bot.send_message(
-                                    uid,
-                                    message_text,
-                                    reply_markup=get_confirm_keyboard(current_practice_session_key) # Клавиатура "Да/Нет"
-                                )
-                            except Exception as e:
-                                logger.warning(f"Не удалось отправить уведомление о практике пользователю {uid}: {e}")
-                        logger.info(f"Открыта запись на практику: {subject_name} ({current_practice_session_key})")
-                    else: # Если сессия уже была открыта (например, после перезапуска бота)
-                        logger.info(
-                            f"Сессия записи на практику {subject_name} ({current_practice_session_key}) уже была открыта ранее. Уведомление не отправляется повторно.")
-
-        # --- Очистка старых ключей из sent_notifications ---
-        # Удаляем ключи уведомлений, относящиеся к вчерашнему дню, чтобы sent_notifications не рос бесконечно
-        yesterday_date_str = (now - timedelta(days=1)).date().isoformat()
-        keys_to_clear_from_sent = {
-            key for key in sent_notifications if yesterday_date_str in key
-        }
-        if keys_to_clear_from_sent:
-            for old_key in keys_to_clear_from_sent:
-                sent_notifications.discard(old_key) # Используем discard, чтобы не было ошибки, если ключ уже удален
-                logger.info(f"Удален старый ключ из sent_notifications: {old_key}")
-            data_changed = True # Отмечаем, что данные изменились
-
-        # Если в течение этой итерации были изменения в данных, сохраняем их
-        if data_changed:
-            save_persistent_data(user_ids, practice_slots, sent_notifications)
-
-        await asyncio.sleep(30) # Пауза перед следующей проверкой (30 секунд)
+    Фоновая задача расписания. Расписания групп из GROUPS_FILE (или одно расписание из SCHEDULE_FILE,
+    или full_schedule) разворачиваются в общую очередь конкретных событий (лекции, открытия записи на практики,
+    их закрытия через RECORDING_DURATION, ежедневная очистка sent_notifications), и планировщик спит ровно
+    до ближайшего события.
+    Опоздавшие события (в пределах SCHEDULE_GRACE_MINUTES) выполняются, а не теряются.
+    При запуске сначала по порядку выполняются события, пропущенные за время простоя (до CATCHUP_MINUTES),
+    и закрываются записи, время которых вышло; уже отправленные уведомления не повторяются.
+    """
+    # Записи, открытые до перезапуска бота (или другим процессом), закроются в положенное время
+    # (а если время уже вышло — сразу, в порядке пропущенных событий)
+    for practice_session_key in await state_store.open_session_keys():
+        session = await booking_desk.session(practice_session_key)
+        if session is not None:
+            event_scheduler.schedule_close(practice_session_key, session.open_time + RECORDING_DURATION)
+    # Пропущенные события выполняет лидер: аренду нужно взять до них, а не при первом продлении
+    await scheduler_lease.renew()
+    await event_scheduler.run_until()
+
+
+async def log_ready(started: float):
+    """Пишет в лог время от запуска до готовности: состояние загружено, пропущенные события выполнены."""
+    await event_scheduler.recovered.wait()
+    logger.info(f"Бот готов через {time_module.perf_counter() - started:.2f} сек. после запуска: "
+                f"выполнено пропущенных событий {event_scheduler.caught_up}, "
+                f"открытых сессий {len(practice_slots)}, пользователей {len(user_ids)}")
+
+
+async def schedule_reloader():
+    """
+    Раз в SCHEDULE_RELOAD_INTERVAL секунд проверяет, не изменились ли файлы расписаний групп, и подменяет
+    расписание изменившейся группы в планировщике. Уже отправленные уведомления не повторяются: их помнит
+    sent_notifications.
+    """
+    while True:
+        await asyncio.sleep(SCHEDULE_RELOAD_INTERVAL)
+        for group_id, source in schedule_sources.items():
+            timetable = source.reload_if_changed()
+            if timetable is not None:
+                event_scheduler.reload(timetable, group_id)
+
+
+async def run_webhook(server: WebhookServer):
+    """
+    Запускает встроенный сервер вебхука и регистрирует его адрес в Telegram.
+    Обновления, накопившиеся за время перезапуска, не удаляются: Telegram доставит их на вебхук.
+    Работает до сигнала остановки; уже принятые обновления дообрабатываются при остановке (lifecycle).
+    """
+    await server.start(WEBHOOK_HOST, WEBHOOK_PORT)
+    try:
+        await bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=min(WEBHOOK_CONCURRENCY, 100), # Telegram допускает не больше 100 соединений
+            drop_pending_updates=False,
+        )
+        logger.info(f"Вебхук зарегистрирован: {WEBHOOK_URL}")
+        await lifecycle.wait()
+    finally:
+        # Новые запросы Telegram не принимаются (он повторит их после запуска); вебхук остается зарегистрированным
+        await server.close()
+
+
+async def run_polling():
+    """Long polling до сигнала остановки. Сессию бота закрывает остановка (lifecycle), а не aiogram."""
+    # Удаление вебхука перед запуском поллинга (ожидающие обновления удаляются, если DROP_PENDING_UPDATES=1)
+    await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+    # Сигналы обрабатывает lifecycle: aiogram не должен закрывать сессию, пока дорассылаются уведомления
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    await lifecycle.wait(polling)
+    if not polling.done():
+        await dp.stop_polling() # Новые обновления больше не запрашиваются
+    await polling # Ошибка поллинга (если он завершился сам) передается дальше
+
+
+def register_shutdown_steps(metrics_server: MetricsServer, webhook_server: WebhookServer = None):
+    """
+    Порядок остановки бота (lifecycle.shutdown). Сначала, не дольше SHUTDOWN_TIMEOUT, завершается начатая работа:
+    принятые обновления, события расписания (с первой попыткой своих рассылок), отложенные обновления карты мест
+    и повторы очереди уведомлений. Затем, без ограничения по времени, все сохраняется и закрывается.
+    """
+    if webhook_server is not None:
+        lifecycle.on_drain("обновления вебхука", webhook_server.drain) # В том числе ждущие своей очереди
+    lifecycle.on_drain("обработчики обновлений", in_flight_updates.drain)
+    lifecycle.on_drain("события расписания", event_scheduler.drain)
+    lifecycle.on_drain("карта мест", seat_map_viewers.drain)
+    lifecycle.on_drain("очередь уведомлений", outbox.drain)
+    # Отдаем аренду лидера, чтобы события расписания сразу подхватил другой процесс
+    lifecycle.on_checkpoint("аренда лидера", scheduler_lease.stop)
+    # Итоги доставки — на диск; недоставленное останется в очереди и будет дослано после запуска, а не заново всем
+    lifecycle.on_checkpoint("очередь уведомлений", outbox.stop)
+    # Сохраняем изменения, которые еще не успели записаться на диск, и итоговый снимок состояния
+    lifecycle.on_checkpoint("сохранение", persistence_writer.stop)
+    lifecycle.on_checkpoint("снимок состояния", persistence_writer.checkpoint)
+    lifecycle.on_checkpoint("хранилище", storage.close)
+    lifecycle.on_checkpoint("архив посещаемости", history.close)
+    lifecycle.on_checkpoint("общее хранилище", state_store.close)
+    lifecycle.on_checkpoint("сессия Telegram", bot.session.close)
+    lifecycle.on_checkpoint("сервер метрик", metrics_server.stop)
+    if profiler is not None:
+        lifecycle.on_checkpoint("профилирование", profiler.stop)
 
 
 async def main():
@@ -610,12 +1046,45 @@ async def main():
         logger.info(f"Финально установленная локаль для LC_TIME: {locale.getlocale(locale.LC_TIME)}")
 
     logger.info("Запуск бота...")
-    # Запуск фоновой задачи schedule_checker
-    asyncio.create_task(schedule_checker())
-    # Удаление вебхука и очистка ожидающих обновлений перед запуском поллинга
-    await bot.delete_webhook(drop_pending_updates=True)
-    # Запуск поллинга для получения обновлений от Telegram
-    await dp.start_polling(bot)
+    # Запуск фонового сохранения состояния
+    persistence_writer.start()
+    # Доставка повторов и уведомлений, не доставленных до перезапуска
+    outbox.start()
+    # Сервер метрик (GET /metrics в формате Prometheus)
+    metrics_server = MetricsServer(bot_metrics.registry)
+    if profiler is not None:
+        profiler.add_routes(metrics_server.app)
+        profiler.start()
+    # GET /history.csv — потоковая выгрузка архива посещаемости, только с токеном HISTORY_EXPORT_TOKEN
+    history.add_routes(metrics_server.app, os.getenv("HISTORY_EXPORT_TOKEN"))
+    if METRICS_PORT:
+        await metrics_server.start(METRICS_HOST, METRICS_PORT)
+    # Пользователи и подписки с диска переносятся в общее хранилище (в режиме redis оно могло быть пустым):
+    # иначе прежние пользователи не получали бы уведомлений, пока снова не отправят /start
+    imported = await state_store.import_users(user_ids, subscriptions)
+    if imported:
+        logger.info(f"В общее хранилище ({state_store.name}) перенесено пользователей: {imported}")
+    # Аренда лидера (нужна, только если процессов бота несколько)
+    scheduler_lease.start()
+    # Фоновые задачи работают до остановки; при остановке планировщик отменяется первым,
+    # и новые события расписания не начинаются
+    lifecycle.install_signal_handlers()
+    lifecycle.spawn("schedule_checker", schedule_checker())
+    lifecycle.spawn("log_ready", log_ready(BOOT_STARTED))
+    lifecycle.spawn("schedule_reloader", schedule_reloader())
+
+    webhook_server = None
+    if WEBHOOK_URL:
+        webhook_server = WebhookServer(dp, bot, secret_token=WEBHOOK_SECRET or None, path=WEBHOOK_PATH,
+                                       concurrency=WEBHOOK_CONCURRENCY)
+    register_shutdown_steps(metrics_server, webhook_server)
+    try:
+        if webhook_server is not None:
+            await run_webhook(webhook_server)
+        else:
+            await run_polling()
+    finally:
+        await lifecycle.shutdown()
 
 
 if __name__ == "__main__":
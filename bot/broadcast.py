@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time as time_module  # monotonic-часы для измерения интервалов (не зависят от перевода системного времени)
+from dataclasses import dataclass, field
+
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Telegram Bot API: не более ~30 сообщений в секунду суммарно
+# и не более ~1 сообщения в секунду в один чат. Берем значения с запасом.
+DEFAULT_CONCURRENCY = 20        # Сколько отправок может выполняться одновременно
+DEFAULT_GLOBAL_RATE = 25.0      # Сообщений в секунду на весь бот
+DEFAULT_PER_CHAT_INTERVAL = 1.0 # Минимальный интервал (сек.) между сообщениями в один чат
+DEFAULT_MAX_RETRIES = 3         # Сколько раз повторять отправку после TelegramRetryAfter
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты по алгоритму "token bucket".
+    rate: сколько токенов (сообщений) добавляется в секунду.
+    capacity: максимальный запас токенов (размер допустимого всплеска).
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time_module.monotonic()
+        self._paused_until = 0.0  # Момент, до которого отправка запрещена (после RetryAfter)
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """
+        Приостанавливает выдачу токенов на seconds секунд (Telegram попросил подождать).
+        Запас обнуляется и начинает пополняться только после паузы, чтобы сразу после нее не ушел всплеск.
+        """
+        self._paused_until = max(self._paused_until, time_module.monotonic() + seconds)
+        self._tokens = 0.0
+        self._updated_at = self._paused_until
+
+    async def acquire(self):
+        """Ждет, пока не появится свободный токен, и забирает его."""
+        async with self._lock:  # Токены выдаются строго по очереди
+            while True:
+                now = time_module.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                # Пополняем запас токенов пропорционально прошедшему времени
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """
+    Следит, чтобы в один чат уходило не больше одного сообщения за interval секунд.
+    Нужен, когда несколько рассылок (например, лекция и практика в одну минуту) идут одновременно.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_allowed = {}  # chat_id -> момент (monotonic), начиная с которого можно писать в чат
+
+    async def acquire(self, chat_id: int):
+        now = time_module.monotonic()
+        next_allowed = self._next_allowed.get(chat_id, 0.0)
+        # Сразу резервируем следующий слот, чтобы параллельные отправки в тот же чат выстроились в очередь
+        self._next_allowed[chat_id] = max(now, next_allowed) + self.interval
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+        # Периодически чистим устаревшие записи, чтобы словарь не рос бесконечно
+        if len(self._next_allowed) > 10000:
+            self._next_allowed = {cid: t for cid, t in self._next_allowed.items() if t > now}
+
+
+@dataclass
+class BroadcastReport:
+    """Итог одной рассылки: сколько отправлено, сколько ошибок и за какое время."""
+    name: str
+    total: int
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    errors: dict = field(default_factory=dict)  # Тип ошибки -> количество
+    duration: float = 0.0                       # Время от начала до последней отправки (сек.)
+
+    @property
+    def rate(self) -> float:
+        """Фактическая скорость рассылки (сообщений в секунду)."""
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+
+class Broadcaster:
+    """
+    Рассылка сообщений многим пользователям с ограниченной параллельностью.
+    Соблюдает общий лимит Telegram на бота и лимит на один чат,
+    а при TelegramRetryAfter приостанавливает всю рассылку на указанное время и повторяет отправку.
+    """
+
+    def __init__(self, bot, concurrency: int = DEFAULT_CONCURRENCY, global_rate: float = DEFAULT_GLOBAL_RATE,
+                 per_chat_interval: float = DEFAULT_PER_CHAT_INTERVAL, max_retries: int = DEFAULT_MAX_RETRIES,
+                 metrics=None):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.global_limiter = RateLimiter(global_rate)
+        self.chat_limiter = PerChatLimiter(per_chat_interval)
+        self.metrics = metrics  # metrics.BotMetrics или None
+
+    async def send(self, chat_id: int, text: str, report: BroadcastReport = None, **kwargs) -> bool:
+        """
+        Отправляет одно сообщение с учетом лимитов. Возвращает True при успехе.
+        Ошибки (кроме RetryAfter) не пробрасываются, а учитываются в report.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.chat_limiter.acquire(chat_id)
+            await self.global_limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                if report is not None:
+                    report.sent += 1
+                return True
+            except TelegramRetryAfter as e:
+                # Telegram просит подождать: останавливаем всю рассылку, а не только этот чат
+                logger.warning(f"Превышен лимит Telegram, пауза {e.retry_after} сек. (чат {chat_id}, попытка {attempt + 1})")
+                self.global_limiter.pause(e.retry_after)
+                if report is not None:
+                    report.retries += 1
+            except Exception as e:  # Пользователь заблокировал бота, чат не найден и т.п.
+                logger.warning(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+                self.count_failure(type(e).__name__, report)
+                return False
+        # Все попытки исчерпаны из-за RetryAfter
+        self.count_failure("TelegramRetryAfter", report)
+        return False
+
+    def count_failure(self, error_type: str, report: BroadcastReport = None):
+        """Учитывает неудачную отправку в отчете рассылки и в метриках."""
+        if report is not None:
+            report.failed += 1
+            report.errors[error_type] = report.errors.get(error_type, 0) + 1
+        if self.metrics is not None:
+            self.metrics.observe_send_failure(error_type)
+
+    async def broadcast(self, user_ids, text: str, name: str = "", kind: str = "other", **kwargs) -> BroadcastReport:
+        """
+        Рассылает text всем пользователям из user_ids (дополнительные kwargs передаются в send_message).
+        kind — вид рассылки для метрик (например, "lecture"); name — подробное имя для лога.
+        Возвращает BroadcastReport с количеством отправленных сообщений, ошибок и временем рассылки.
+        """
+        recipients = list(user_ids)  # Снимок списка: user_ids может меняться во время рассылки
+        report = BroadcastReport(name=name, total=len(recipients))
+        started_at = time_module.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send_limited(chat_id):
+            async with semaphore:
+                await self.send(chat_id, text, report=report, **kwargs)
+
+        await asyncio.gather(*(send_limited(uid) for uid in recipients))
+        report.duration = time_module.monotonic() - started_at
+        logger.info(
+            f"Рассылка '{name}' завершена: отправлено {report.sent}/{report.total}, ошибок {report.failed}, "
+            f"повторов {report.retries}, время {report.duration:.2f} сек., скорость {report.rate:.1f} сообщ./сек.")
+        if self.metrics is not None:
+            self.metrics.observe_broadcast(kind, report)
+        return report
@@ -0,0 +1,255 @@
+import hashlib
+import logging
+import time as time_module
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+MAX_CALLBACK_DATA = 64  # Ограничение Telegram на размер callback_data в байтах
+
+# Виды нажатий
+ACTION_CONFIRM_YES = "confirm_yes"
+ACTION_CONFIRM_NO = "confirm_no"
+ACTION_SLOT = "slot"
+ACTION_BUSY = "busy"
+ACTION_CLOSED = "closed"
+ACTION_GROUP = "group"  # Подписка на группу или отписка (ID группы кодируется так же, как ID сессии)
+ACTION_ANY_SEAT = "any_seat"  # "Любое свободное место": запись одним нажатием из приглашения
+
+# Первый символ callback_data определяет вид нажатия (одна проверка по словарю вместо цепочки фильтров)
+PREFIXES = {
+    ACTION_CONFIRM_YES: "y",
+    ACTION_CONFIRM_NO: "n",
+    ACTION_SLOT: "s",
+    ACTION_BUSY: "b",
+    ACTION_CLOSED: "c",
+    ACTION_GROUP: "g",
+    ACTION_ANY_SEAT: "a",
+}
+KIND_BY_PREFIX = {prefix: kind for kind, prefix in PREFIXES.items()}
+SEAT_SEPARATOR = "."
+# Нажатия без параметров: callback_data — это только префикс
+BUSY_DATA = PREFIXES[ACTION_BUSY]
+CLOSED_DATA = PREFIXES[ACTION_CLOSED]
+# Старый формат ("slot_Понедельник_12:40_5", "confirm_yes_...", "busy"): кнопки в уже отправленных сообщениях
+LEGACY_PREFIXES = (("confirm_yes_", ACTION_CONFIRM_YES), ("confirm_no_", ACTION_CONFIRM_NO), ("slot_", ACTION_SLOT))
+LEGACY_PLAIN = {"busy": ACTION_BUSY, "closed": ACTION_CLOSED}
+MAX_MEMOIZED = 100000  # Сколько разобранных callback_data помнить (защита от роста памяти)
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def to_base36(number: int) -> str:
+    if number == 0:
+        return "0"
+    digits = []
+    while number:
+        number, remainder = divmod(number, 36)
+        digits.append(_DIGITS[remainder])
+    return "".join(reversed(digits))
+
+
+class CallbackAction(NamedTuple):
+    """Разобранное нажатие: вид, ID сессии (SessionIds) и номер места, если они есть."""
+    kind: str
+    session_id: int = None
+    seat: int = None
+
+
+class SessionIds:
+    """
+    Короткие числовые ID сессий записи вместо ключей вида "Понедельник_12:40" в callback_data.
+    ID — 32-битный хэш ключа, поэтому он одинаков после перезапуска и во всех процессах бота:
+    кнопки, отправленные раньше или другим процессом, указывают на ту же сессию. Обратное отображение
+    ID -> ключ заполняется при кодировании кнопок (intern) и из списка открытых сессий (см. bot_2).
+    """
+    __slots__ = ("_id_of", "_key_of")
+
+    def __init__(self):
+        self._id_of = {}   # Ключ сессии -> ID
+        self._key_of = {}  # ID -> ключ сессии
+
+    @staticmethod
+    def compute(session_key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(session_key.encode('utf-8'), digest_size=4).digest(), "big")
+
+    def intern(self, session_key: str) -> int:
+        """ID ключа сессии; ключ запоминается для обратного поиска."""
+        session_id = self._id_of.get(session_key)
+        if session_id is not None:
+            return session_id
+        session_id = self.compute(session_key)
+        known = self._key_of.get(session_id)
+        if known is not None and known != session_key:
+            raise ValueError(f"Ключи сессий {known} и {session_key} получили одинаковый ID {session_id}")
+        self._id_of[session_key] = session_id
+        self._key_of[session_id] = session_key
+        return session_id
+
+    def key_of(self, session_id: int):
+        """Ключ сессии по ID или None, если ключ с таким ID еще не встречался."""
+        return self._key_of.get(session_id)
+
+    def __len__(self):
+        return len(self._id_of)
+
+
+class CallbackCodec:
+    """
+    Кодирование callback_data: префикс вида нажатия, ID сессии в base36 и номер места,
+    например "s1x2k9c.5" вместо "slot_Понедельник_12:40_5" (31 байт в UTF-8).
+    Закодированные строки запоминаются, а строки, которые бот сам отправлял, запоминаются и в обратную
+    сторону: разбор нажатия на свою кнопку — один поиск в словаре, без разбиения строк и новых объектов.
+    """
+
+    def __init__(self, session_ids: SessionIds = None):
+        self.session_ids = session_ids if session_ids is not None else SessionIds()
+        self._encoded = {}  # (вид, ключ сессии, место) -> callback_data
+        self._decoded = {}  # callback_data -> CallbackAction
+        # Метрики
+        self.fast_decodes = 0
+        self.slow_decodes = 0
+        self.legacy_decodes = 0
+
+    def encode(self, kind: str, session_key: str = None, seat: int = None) -> str:
+        cache_key = (kind, session_key, seat)
+        data = self._encoded.get(cache_key)
+        if data is not None:
+            return data
+        session_id = self.session_ids.intern(session_key) if session_key is not None else None
+        data = PREFIXES[kind]
+        if session_id is not None:
+            data += to_base36(session_id)
+        if seat is not None:
+            data += SEAT_SEPARATOR + str(seat)
+        if len(data.encode('utf-8')) > MAX_CALLBACK_DATA:
+            raise ValueError(f"callback_data {data!r} длиннее {MAX_CALLBACK_DATA} байт")
+        self._encoded[cache_key] = data
+        self._remember(data, CallbackAction(kind, session_id, seat))
+        return data
+
+    def _remember(self, data: str, action: CallbackAction):
+        if len(self._decoded) < MAX_MEMOIZED:
+            self._decoded[data] = action
+
+    def decode(self, data: str):
+        """CallbackAction для callback_data или None, если строку не удалось разобрать."""
+        action = self._decoded.get(data)
+        if action is not None:
+            self.fast_decodes += 1
+            return action
+        if not data:
+            return None
+        kind = KIND_BY_PREFIX.get(data[0])
+        if kind is None:
+            return self._decode_legacy(data)
+        try:
+            action = self._parse(kind, data[1:])
+        except ValueError:
+            return self._decode_legacy(data)
+        self.slow_decodes += 1
+        # Запоминаются только строки с известной сессией: произвольные строки не раздувают словарь
+        if action.session_id is None or self.session_ids.key_of(action.session_id) is not None:
+            self._remember(data, action)
+        return action
+
+    @staticmethod
+    def _parse(kind: str, payload: str) -> CallbackAction:
+        if kind in (ACTION_BUSY, ACTION_CLOSED):
+            if payload:
+                raise ValueError(payload)
+            return CallbackAction(kind)
+        session_part, separator, seat_part = payload.partition(SEAT_SEPARATOR)
+        session_id = int(session_part, 36)
+        if kind == ACTION_SLOT:
+            if not separator:
+                raise ValueError(payload)
+            return CallbackAction(kind, session_id, int(seat_part))
+        if separator:
+            raise ValueError(payload)
+        return CallbackAction(kind, session_id)
+
+    def _decode_legacy(self, data: str):
+        """Разбор старого формата с ключом сессии в тексте (сообщения, отправленные до обновления бота)."""
+        kind = LEGACY_PLAIN.get(data)
+        if kind is not None:
+            self.legacy_decodes += 1
+            return CallbackAction(kind)
+        for prefix, kind in LEGACY_PREFIXES:
+            if not data.startswith(prefix):
+                continue
+            payload = data[len(prefix):]
+            seat = None
+            if kind == ACTION_SLOT:
+                payload, _, seat_part = payload.rpartition("_")
+                try:
+                    seat = int(seat_part)
+                except ValueError:
+                    return None
+            if not payload:
+                return None
+            try:
+                session_id = self.session_ids.intern(payload)
+            except ValueError as e:
+                logger.error(f"Не удалось разобрать callback_data {data!r}: {e}")
+                return None
+            self.legacy_decodes += 1
+            return CallbackAction(kind, session_id, seat)
+        return None
+
+    def metrics(self) -> dict:
+        return {
+            "sessions": len(self.session_ids),
+            "memoized": len(self._decoded),
+            "fast_decodes": self.fast_decodes,
+            "slow_decodes": self.slow_decodes,
+            "legacy_decodes": self.legacy_decodes,
+        }
+
+
+class CallbackRouter:
+    """
+    Маршрутизация нажатий: callback_data разбирается один раз, обработчик выбирается по виду нажатия
+    из словаря, поэтому время не зависит от числа обработчиков. Обработчик вызывается как
+    handler(callback, action). on_handled(имя обработчика, секунды, ошибка) — для метрик.
+    """
+
+    def __init__(self, codec: CallbackCodec, on_handled=None):
+        self.codec = codec
+        self.on_handled = on_handled
+        self._handlers = {}  # Вид нажатия -> обработчик
+        self.unknown = 0     # Нажатия, которые не удалось разобрать
+
+    def route(self, kind: str):
+        """Декоратор: регистрирует обработчик нажатий вида kind."""
+        def register(handler):
+            if kind in self._handlers:
+                raise ValueError(f"Обработчик нажатий {kind} уже зарегистрирован")
+            self._handlers[kind] = handler
+            return handler
+        return register
+
+    async def dispatch(self, callback, action: CallbackAction = None):
+        """Вызывает обработчик нажатия. action — уже разобранное нажатие (например, middleware), иначе разбирается здесь."""
+        if action is None:
+            action = self.codec.decode(callback.data or "")
+        handler = self._handlers.get(action.kind) if action is not None else None
+        if handler is None:
+            self.unknown += 1
+            logger.warning(f"Нажатие с неизвестными данными: {callback.data!r}")
+            await callback.answer()
+            return
+        started = time_module.perf_counter()
+        failed = False
+        try:
+            await handler(callback, action)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if self.on_handled is not None:
+                self.on_handled(handler.__name__, time_module.perf_counter() - started, failed)
+
+
+# Кодек, общий для клавиатур и обработчиков бота
+default_codec = CallbackCodec()
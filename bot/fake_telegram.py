@@ -0,0 +1,492 @@
+"""
+Локальный заменитель Telegram Bot API для нагрузочных тестов без настоящего токена и без сети.
+
+Сервер (aiohttp) понимает методы, которыми пользуется бот: getMe, getUpdates (long polling), deleteWebhook, setWebhook,
+sendMessage, editMessageText, editMessageReplyMarkup, answerCallbackQuery, sendDocument. Задержка ответа,
+доля ошибок сервера, заблокированные и несуществующие чаты и лимиты частоты новых сообщений (ответ 429
+с retry_after, как у Telegram) настраиваются. Обновления (сообщения и нажатия кнопок) подаются из сценария JSONL, через HTTP или
+из кода; поданные обновления можно записать в файл и затем воспроизвести.
+
+Запуск отдельным процессом и бот, направленный на него:
+    python fake_telegram.py --port 8081 --rate 30 --latency-ms 40 --script updates.jsonl
+    API_TOKEN=123:FAKE TELEGRAM_API_URL=http://127.0.0.1:8081 python bot_2.py
+
+Строка сценария — JSON объект, after — секунды от начала воспроизведения:
+    {"after": 0.0, "message": {"user": 5, "text": "/start"}}
+    {"after": 1.5, "callback": {"user": 5, "button_text": "✅ Да"}}     # кнопка в последнем сообщении бота
+    {"after": 2.0, "callback": {"user": 5, "button": "random"}}        # случайная кнопка того же сообщения
+    {"after": 2.5, "callback": {"user": 5, "data": "s1x2k9c.5", "message_id": 12}}
+    {"after": 3.0, "update": {...}}                                    # обновление Bot API как есть
+Служебные адреса: POST /_fake/updates (строки сценария JSON списком), GET /_fake/stats, POST /_fake/reset.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import random
+import time as time_module
+from collections import deque
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+DEFAULT_UPDATES_LIMIT = 100
+# Методы, которые отправляют или меняют сообщения: на них действуют ошибки чатов и доля ошибок сервера
+OUTGOING_METHODS = {"sendMessage", "editMessageText", "editMessageReplyMarkup", "sendDocument"}
+# Новые сообщения ограничены по частоте (правки сообщений в лимиты рассылок Telegram не входят)
+RATE_LIMITED_METHODS = {"sendMessage", "sendDocument"}
+
+
+class TelegramError(Exception):
+    """Ошибка в ответе Bot API: {"ok": false, "error_code": ..., "description": ...}."""
+
+    def __init__(self, code: int, description: str, retry_after: int = None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.retry_after = retry_after
+
+    def payload(self) -> dict:
+        payload = {"ok": False, "error_code": self.code, "description": self.description}
+        if self.retry_after is not None:
+            payload["parameters"] = {"retry_after": self.retry_after}
+        return payload
+
+
+class RateLimiter:
+    """
+    Лимиты Telegram на исходящие сообщения: общий (rate в секунду, корзина токенов на секунду запаса)
+    и на чат (не чаще chat_rate в секунду). Превышение — TelegramError 429 с retry_after в целых секундах.
+    0 — без лимита.
+    """
+
+    def __init__(self, rate: float = 0.0, chat_rate: float = 0.0):
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self._tokens = rate
+        self._updated = time_module.monotonic()
+        self._last_in_chat = {}  # chat_id -> время последнего сообщения
+        self.limited = 0
+
+    def check(self, chat_id):
+        now = time_module.monotonic()
+        if self.chat_rate:
+            last = self._last_in_chat.get(chat_id)
+            interval = 1 / self.chat_rate
+            if last is not None and now - last < interval:
+                self._limit(interval - (now - last))
+        if self.rate:
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                self._limit((1 - self._tokens) / self.rate)
+            self._tokens -= 1
+        if self.chat_rate:
+            self._last_in_chat[chat_id] = now
+
+    def _limit(self, wait: float):
+        retry_after = max(1, math.ceil(wait))  # Telegram сообщает retry_after в целых секундах
+        self.limited += 1
+        raise TelegramError(429, f"Too Many Requests: retry after {retry_after}", retry_after=retry_after)
+
+
+class FakeTelegramServer:
+    """
+    Заменитель Bot API. Хранит отправленные ботом сообщения по чатам (для нажатий на их кнопки в сценариях),
+    очередь обновлений для getUpdates и статистику: вызовы методов, задержку от подачи обновления до ответа
+    бота (answerCallbackQuery на нажатие, первое сообщение в чат на текстовое сообщение) и время рассылок.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, rate: float = 0.0,
+                 chat_rate: float = 0.0, blocked=(), missing=(), record_path: str = None, seed: int = None):
+        self.latency = latency          # Задержка каждого ответа (сек.)
+        self.jitter = jitter            # Случайная добавка к задержке, от 0 до jitter (сек.)
+        self.error_rate = error_rate    # Доля исходящих запросов, на которые отвечается 500
+        self.limiter = RateLimiter(rate, chat_rate)
+        self.blocked = set(blocked)     # Чаты, заблокировавшие бота (403)
+        self.missing = set(missing)     # Несуществующие чаты (400 chat not found)
+        self.record_path = record_path  # Файл, куда записываются поданные обновления (в формате сценария)
+        self.rng = random.Random(seed)
+        self.app = web.Application()
+        self.app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        self.app.router.add_post("/_fake/updates", self._handle_push)
+        self.app.router.add_get("/_fake/stats", self._handle_stats)
+        self.app.router.add_post("/_fake/reset", self._handle_reset)
+        self._runner = None
+        self._updates = deque()          # Обновления, еще не подтвержденные ботом (offset)
+        self._update_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._record_file = None
+        self._record_started = None
+        self.reset()
+
+    def reset(self):
+        """Сбрасывает сообщения и статистику (очередь обновлений сохраняется)."""
+        self.messages = {}               # chat_id -> {message_id: сообщение}
+        self._message_ids = {}           # chat_id -> последний message_id
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Сбрасывает только статистику: сообщения остаются, по их кнопкам можно нажимать дальше."""
+        self.calls = {}                  # Метод -> число вызовов
+        self.errors = {}                 # Код ошибки -> число ответов
+        self.sent = 0                    # Успешно отправлено сообщений
+        self.first_sent_at = None
+        self.last_sent_at = None
+        self._pushed_at = {}             # ID нажатия -> время подачи обновления
+        self._awaiting_reply = {}        # chat_id -> время подачи текстового сообщения, ждущего ответа
+        self.latencies = []              # От подачи обновления до ответа бота (сек.)
+        self.pushed = 0
+        self.answered = 0
+        self.first_pushed_at = None
+        self.last_answered_at = None
+        self.limiter.limited = 0
+
+    # --- HTTP ---
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        logger.info(f"Заменитель Bot API слушает http://{host}:{self.port}")
+
+    @property
+    def port(self):
+        """Порт, на котором фактически слушает сервер (полезно, если запускали на порту 0)."""
+        if self._runner is None or not self._runner.addresses:
+            return None
+        return self._runner.addresses[0][1]
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._record_file is not None:
+            self._record_file.close()
+            self._record_file = None
+
+    @staticmethod
+    async def _read_params(request: web.Request) -> dict:
+        """Параметры запроса: JSON тело, форма (так отправляет aiogram) или строка запроса."""
+        if request.content_type == "application/json":
+            return await request.json()
+        params = dict(request.query)
+        if request.method == "POST":
+            form = await request.post()
+            for name, value in form.items():
+                params[name] = value.file.read() if hasattr(value, "file") else value
+        return params
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._read_params(request)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        handler = getattr(self, f"api_{method}", None)
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            if handler is None:
+                raise TelegramError(404, "Not Found: method not found")
+            if method in OUTGOING_METHODS:
+                self._check_outgoing(int(params["chat_id"]), method in RATE_LIMITED_METHODS)
+            result = await handler(params)
+        except TelegramError as e:
+            self.errors[e.code] = self.errors.get(e.code, 0) + 1
+            return web.json_response(e.payload(), status=e.code)
+        return web.json_response({"ok": True, "result": result})
+
+    def _check_outgoing(self, chat_id: int, rate_limited: bool):
+        if chat_id in self.blocked:
+            raise TelegramError(403, "Forbidden: bot was blocked by the user")
+        if chat_id in self.missing:
+            raise TelegramError(400, "Bad Request: chat not found")
+        if self.error_rate and self.rng.random() < self.error_rate:
+            raise TelegramError(500, "Internal Server Error")
+        if rate_limited:
+            self.limiter.check(chat_id)
+
+    async def _handle_push(self, request: web.Request) -> web.Response:
+        lines = await request.json()
+        for line in lines if isinstance(lines, list) else [lines]:
+            self.push(line)
+        return web.json_response({"ok": True, "queued": len(self._updates)})
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.metrics())
+
+    async def _handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"ok": True})
+
+    # --- Методы Bot API ---
+
+    @staticmethod
+    def _json_param(params: dict, name: str):
+        value = params.get(name)
+        return json.loads(value) if isinstance(value, str) else value
+
+    def _store_message(self, chat_id: int, text: str, reply_markup=None, **extra) -> dict:
+        message_id = self._message_ids.get(chat_id, 0) + 1
+        self._message_ids[chat_id] = message_id
+        message = {"message_id": message_id, "date": int(time_module.time()), "from": BOT_USER,
+                   "chat": {"id": chat_id, "type": "private", "first_name": f"User{chat_id}"}, "text": text, **extra}
+        if reply_markup:
+            message["reply_markup"] = reply_markup
+        self.messages.setdefault(chat_id, {})[message_id] = message
+        return message
+
+    def _mark_sent(self, chat_id: int):
+        now = time_module.perf_counter()
+        self.sent += 1
+        if self.first_sent_at is None:
+            self.first_sent_at = now
+        self.last_sent_at = now
+        pushed_at = self._awaiting_reply.pop(chat_id, None)
+        if pushed_at is not None:
+            self._answer(pushed_at, now)
+
+    def _answer(self, pushed_at: float, now: float):
+        self.latencies.append(now - pushed_at)
+        self.answered += 1
+        self.last_answered_at = now
+
+    def _edit(self, params: dict, **changes) -> dict:
+        chat_id = int(params["chat_id"])
+        message = self.messages.get(chat_id, {}).get(int(params["message_id"]))
+        if message is None:
+            raise TelegramError(400, "Bad Request: message to edit not found")
+        reply_markup = self._json_param(params, "reply_markup")
+        if changes.get("text", message["text"]) == message["text"] and reply_markup == message.get("reply_markup"):
+            raise TelegramError(400, "Bad Request: message is not modified")
+        message.update(changes)
+        if reply_markup:
+            message["reply_markup"] = reply_markup
+        else:
+            message.pop("reply_markup", None)
+        message["edit_date"] = int(time_module.time())
+        self._mark_sent(chat_id)
+        return message
+
+    async def api_getMe(self, params: dict):
+        return BOT_USER
+
+    async def api_deleteWebhook(self, params: dict):
+        return True
+
+    async def api_setWebhook(self, params: dict):
+        return True  # Обновления вебхуку заменитель не отправляет: бот в режиме вебхука получает их от теста
+
+    async def api_sendMessage(self, params: dict):
+        chat_id = int(params["chat_id"])
+        message = self._store_message(chat_id, params.get("text", ""), self._json_param(params, "reply_markup"))
+        self._mark_sent(chat_id)
+        return message
+
+    async def api_sendDocument(self, params: dict):
+        chat_id = int(params["chat_id"])
+        message = self._store_message(chat_id, "", caption=params.get("caption", ""),
+                                      document={"file_id": f"fake-{chat_id}", "file_unique_id": f"fake-{chat_id}"})
+        self._mark_sent(chat_id)
+        return message
+
+    async def api_editMessageText(self, params: dict):
+        return self._edit(params, text=params.get("text", ""))
+
+    async def api_editMessageReplyMarkup(self, params: dict):
+        return self._edit(params)
+
+    async def api_answerCallbackQuery(self, params: dict):
+        pushed_at = self._pushed_at.pop(params.get("callback_query_id"), None)
+        if pushed_at is not None:
+            self._answer(pushed_at, time_module.perf_counter())
+        return True
+
+    async def api_getUpdates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or DEFAULT_UPDATES_LIMIT)
+        timeout = float(params.get("timeout") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()  # Подтверждены ботом
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self._updates, limit))
+
+    # --- Обновления ---
+
+    def push(self, line: dict) -> dict:
+        """Подает обновление (строку сценария) в очередь getUpdates. Возвращает обновление Bot API."""
+        now = time_module.perf_counter()
+        update_id = next(self._update_ids)
+        if "update" in line:
+            update = dict(line["update"], update_id=update_id)
+        elif "message" in line:
+            user_id = line["message"]["user"]
+            update = {"update_id": update_id, "message": {
+                "message_id": update_id, "date": int(time_module.time()), "text": line["message"]["text"],
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+                "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"}}}
+            self._awaiting_reply[user_id] = now
+        elif "callback" in line:
+            update = {"update_id": update_id, "callback_query": self._callback_query(line["callback"], update_id)}
+            self._pushed_at[update["callback_query"]["id"]] = now
+        else:
+            raise ValueError(f"Неизвестная строка сценария: {line}")
+        self.pushed += 1
+        if self.first_pushed_at is None:
+            self.first_pushed_at = now
+        self._updates.append(update)
+        self._new_updates.set()
+        self._record(line, now)
+        return update
+
+    def _callback_query(self, callback: dict, update_id: int) -> dict:
+        """Нажатие на кнопку сообщения бота: по callback_data или по кнопке последнего (заданного) сообщения."""
+        user_id = callback["user"]
+        chat_messages = self.messages.get(user_id, {})
+        message_id = callback.get("message_id") or max(
+            (mid for mid, message in chat_messages.items() if message.get("reply_markup")), default=None)
+        message = chat_messages.get(message_id)
+        data = callback.get("data")
+        if data is None:
+            if message is None:
+                raise ValueError(f"У пользователя {user_id} нет сообщения с кнопками")
+            buttons = [button for row in message["reply_markup"]["inline_keyboard"] for button in row
+                       if "callback_data" in button]
+            if callback.get("button") == "random":
+                data = self.rng.choice(buttons)["callback_data"]
+            else:
+                data = next(button["callback_data"] for button in buttons if button["text"] == callback["button_text"])
+        if message is None:
+            message = {"message_id": message_id or 0, "date": 0, "text": "",
+                       "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"}}
+        return {"id": f"fake-{update_id}", "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+                "chat_instance": str(user_id), "data": data, "message": message}
+
+    def _record(self, line: dict, now: float):
+        if self.record_path is None:
+            return
+        if self._record_file is None:
+            self._record_file = open(self.record_path, "a", encoding="utf-8")
+            self._record_started = now
+        record = dict(line, after=round(now - self._record_started, 4))
+        self._record_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._record_file.flush()
+
+    async def replay(self, lines, speed: float = 1.0):
+        """Подает строки сценария в их время (after / speed секунд от начала)."""
+        started = time_module.perf_counter()
+        for line in sorted(lines, key=lambda item: item.get("after", 0)):
+            delay = line.get("after", 0) / speed - (time_module.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                self.push(line)
+            except (ValueError, StopIteration) as e:
+                logger.warning(f"Строка сценария пропущена ({e}): {line}")
+
+    async def wait_answered(self, count: int, timeout: float = 60.0) -> bool:
+        """Ждет, пока бот ответит на count поданных обновлений. False, если не дождались за timeout."""
+        deadline = time_module.perf_counter() + timeout
+        while self.answered < count:
+            if time_module.perf_counter() > deadline:
+                return False
+            await asyncio.sleep(0.005)
+        return True
+
+    async def wait_sent(self, count: int, timeout: float = 120.0) -> bool:
+        """Ждет count успешно отправленных (и измененных) сообщений. False, если не дождались за timeout."""
+        deadline = time_module.perf_counter() + timeout
+        while self.sent < count:
+            if time_module.perf_counter() > deadline:
+                return False
+            await asyncio.sleep(0.005)
+        return True
+
+    def metrics(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 3)
+
+        answer_window = (self.last_answered_at - self.first_pushed_at
+                         if self.last_answered_at is not None and self.first_pushed_at is not None else 0.0)
+        send_window = (self.last_sent_at - self.first_sent_at) if self.first_sent_at is not None else 0.0
+        return {
+            "calls": dict(sorted(self.calls.items())),
+            "errors": {str(code): count for code, count in sorted(self.errors.items())},
+            "rate_limited": self.limiter.limited,
+            "pushed": self.pushed,
+            "answered": self.answered,
+            "updates_per_second": round(self.answered / answer_window, 1) if answer_window else 0.0,
+            "reply_p50_ms": percentile(0.5),
+            "reply_p99_ms": percentile(0.99),
+            "sent": self.sent,
+            "send_window_s": round(send_window, 3),
+            "pending_updates": len(self._updates),
+        }
+
+
+def load_script(path: str):
+    """Строки сценария из JSONL файла (пустые строки и строки с # пропускаются)."""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+async def serve(args):
+    server = FakeTelegramServer(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                                error_rate=args.error_rate, rate=args.rate, chat_rate=args.chat_rate,
+                                blocked=args.blocked, missing=args.missing, record_path=args.record, seed=args.seed)
+    await server.start(args.host, args.port)
+    if args.script:
+        asyncio.create_task(server.replay(load_script(args.script), args.speed))
+    try:
+        while True:
+            await asyncio.sleep(args.stats_interval or 3600)
+            if args.stats_interval:
+                logger.info(json.dumps(server.metrics(), ensure_ascii=False))
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный заменитель Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="задержка каждого ответа")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="случайная добавка к задержке")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля исходящих запросов с ответом 500")
+    parser.add_argument("--rate", type=float, default=30.0, help="сообщений в секунду на бота (0 — без лимита)")
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="сообщений в секунду в один чат (0 — без лимита)")
+    parser.add_argument("--blocked", type=int, nargs="*", default=[], help="ID чатов, заблокировавших бота")
+    parser.add_argument("--missing", type=int, nargs="*", default=[], help="ID несуществующих чатов")
+    parser.add_argument("--script", help="сценарий обновлений (JSONL), воспроизводится после запуска")
+    parser.add_argument("--speed", type=float, default=1.0, help="ускорение сценария")
+    parser.add_argument("--record", help="записывать поданные обновления в этот файл (формат сценария)")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="как часто писать статистику в лог, сек.")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+
+from storage import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+# Группа по умолчанию: если файла групп нет, бот работает как раньше — одно расписание для всех пользователей
+DEFAULT_GROUP = ""
+GROUP_KEY_SEPARATOR = "/"  # Ключ сессии группы: "ivt-21/Понедельник_12:40"; у группы по умолчанию префикса нет
+
+
+@dataclass(frozen=True)
+class StudyGroup:
+    """Учебная группа (поток): свое расписание, вместимость практик и свои подписчики."""
+    group_id: str        # Короткий ID, входит в ключи сессий, например "ivt-21"
+    title: str           # Название для пользователей, например "ИВТ-21"
+    schedule_file: str   # Файл расписания группы (.json, .csv или .ics)
+    capacity: int        # Мест на практике
+
+    @property
+    def is_default(self) -> bool:
+        return self.group_id == DEFAULT_GROUP
+
+
+def group_session_key(group_id: str, session_key: str) -> str:
+    """Ключ сессии практики группы; у группы по умолчанию ключ прежний ("Понедельник_12:40")."""
+    return f"{group_id}{GROUP_KEY_SEPARATOR}{session_key}" if group_id else session_key
+
+
+def split_session_key(practice_session_key: str):
+    """(ID группы, день недели, время) из ключа сессии, например ("ivt-21", "Понедельник", "12:40")."""
+    group_id, _, session_key = practice_session_key.rpartition(GROUP_KEY_SEPARATOR)
+    day_name, _, time_str = session_key.partition("_")
+    return group_id, day_name, time_str
+
+
+def load_groups(path: str, default_schedule: str, default_capacity: int) -> dict:
+    """
+    Читает группы из JSON файла вида
+        {"groups": [{"id": "ivt-21", "title": "ИВТ-21", "schedule": "schedule_ivt21.json", "capacity": 25}, ...]}
+    Пути расписаний считаются от каталога файла групп. Возвращает словарь ID -> StudyGroup в порядке файла.
+    Если файла нет — одна группа по умолчанию с default_schedule и default_capacity.
+    Ошибка в файле — ValueError: бот не запускается с неверной настройкой групп.
+    """
+    if not os.path.exists(path):
+        return {DEFAULT_GROUP: StudyGroup(DEFAULT_GROUP, "", default_schedule, default_capacity)}
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    base_dir = os.path.dirname(path)
+    groups = {}
+    for item in data.get("groups", []):
+        group_id = str(item.get("id", "")).strip()
+        if not group_id or GROUP_KEY_SEPARATOR in group_id:
+            raise ValueError(f"Неверный ID группы в {path}: {item.get('id')!r}")
+        if group_id in groups:
+            raise ValueError(f"Группа {group_id} указана в {path} дважды")
+        schedule_file = item.get("schedule")
+        if not schedule_file:
+            raise ValueError(f"Для группы {group_id} в {path} не указан файл расписания")
+        groups[group_id] = StudyGroup(group_id, item.get("title") or group_id,
+                                      os.path.join(base_dir, schedule_file),
+                                      int(item.get("capacity", default_capacity)))
+    if not groups:
+        raise ValueError(f"В {path} нет ни одной группы")
+    logger.info(f"Загружено групп из {path}: {len(groups)}")
+    return groups
+
+
+class SubscriptionIndex:
+    """
+    Подписки пользователей на группы: индекс группа -> множество подписчиков для рассылок
+    (аудитория события — одно множество, без перебора всех пользователей) и обратный индекс
+    пользователь -> группы для клавиатуры выбора групп.
+    """
+    __slots__ = ("_members", "_groups_of")
+
+    def __init__(self):
+        self._members = {}    # ID группы -> set user_id
+        self._groups_of = {}  # user_id -> set ID групп
+
+    def subscribe(self, user_id: int, group_id: str) -> bool:
+        """Подписывает пользователя на группу. False, если он уже подписан."""
+        members = self._members.setdefault(group_id, set())
+        if user_id in members:
+            return False
+        members.add(user_id)
+        self._groups_of.setdefault(user_id, set()).add(group_id)
+        return True
+
+    def unsubscribe(self, user_id: int, group_id: str) -> bool:
+        """Отписывает пользователя от группы. False, если он не был подписан."""
+        members = self._members.get(group_id)
+        if members is None or user_id not in members:
+            return False
+        members.discard(user_id)
+        groups = self._groups_of[user_id]
+        groups.discard(group_id)
+        if not groups:
+            del self._groups_of[user_id]
+        return True
+
+    def remove_user(self, user_id: int):
+        """Отписывает пользователя от всех групп."""
+        for group_id in self._groups_of.pop(user_id, ()):
+            self._members[group_id].discard(user_id)
+
+    def audience(self, group_id: str):
+        """Подписчики группы (само множество индекса, без копирования)."""
+        return self._members.get(group_id, frozenset())
+
+    def groups_of(self, user_id: int):
+        return self._groups_of.get(user_id, frozenset())
+
+    def counts(self) -> dict:
+        """Число подписчиков по группам."""
+        return {group_id: len(members) for group_id, members in self._members.items()}
+
+    def __len__(self):
+        """Число подписок (пара пользователь-группа)."""
+        return sum(len(members) for members in self._members.values())
+
+    def to_dict(self) -> dict:
+        return {group_id: sorted(members) for group_id, members in self._members.items() if members}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SubscriptionIndex":
+        index = cls()
+        for group_id, user_ids in data.items():
+            for user_id in user_ids:
+                index.subscribe(int(user_id), group_id)
+        return index
+
+
+class SubscriptionFile:
+    """
+    Подписки на диске (JSON, атомарная запись). Подписки меняются редко, поэтому файл перезаписывается целиком,
+    в отдельном потоке; изменения, сделанные во время записи, объединяются в одну следующую запись.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.bytes_written = 0
+        self._dirty = False
+        self._saving = False
+
+    def load(self) -> SubscriptionIndex:
+        if not os.path.exists(self.path):
+            return SubscriptionIndex()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                index = SubscriptionIndex.from_dict(json.load(f))
+        except (json.JSONDecodeError, ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Файл подписок {self.path} поврежден ({e}). Подписки начинаются с пустого списка.")
+            return SubscriptionIndex()
+        logger.info(f"Подписки загружены из {self.path}: {len(index)}")
+        return index
+
+    async def save(self, index: SubscriptionIndex):
+        """Сохраняет подписки; если запись уже идет, изменение войдет в следующую запись той же задачи."""
+        self._dirty = True
+        if self._saving:
+            return
+        self._saving = True
+        try:
+            while self._dirty:
+                self._dirty = False
+                data = index.to_dict()  # Снимок в цикле событий: в потоке индекс может меняться
+                self.bytes_written += await asyncio.to_thread(atomic_write_json, self.path, data)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить подписки в {self.path}: {e}")
+        finally:
+            self._saving = False
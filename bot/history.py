@@ -0,0 +1,331 @@
+import array
+import asyncio
+import bisect
+import csv
+import functools
+import hmac
+import io
+import json
+import logging
+import os
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Столбцы CSV выгрузки: одна строка на занятое место закрытой сессии
+CSV_COLUMNS = ("date", "group", "session", "subject", "seat", "user_id", "booked_at", "open_time")
+STREAM_BATCH = 500  # Сколько сессий читать с диска за один переход в поток при потоковой выгрузке
+
+StudentAttendance = namedtuple("StudentAttendance", "user_id attended missed first_date last_date")
+StudentSubject = namedtuple("StudentSubject", "subject attended last_date")
+
+
+class SubjectStats(namedtuple("SubjectStats", "subject sessions seats booked")):
+    """Заполняемость: проведено практик, мест всего и занято мест."""
+    __slots__ = ()
+
+    @property
+    def occupancy(self) -> float:
+        """Доля занятых мест."""
+        return self.booked / self.seats if self.seats else 0.0
+
+
+class HistoryArchive:
+    """
+    Архив закрытых сессий записи на практику: файл только на добавление, одна строка JSON на сессию,
+    места, пользователи и время записи лежат в ней столбцами (параллельными массивами):
+        {"key": ..., "group": ..., "date": "2025-02-03", "subject": ..., "open": ..., "capacity": 25,
+         "seats": [3, 7], "users": [101, 102], "booked_after": [12, 40]}
+    booked_after — секунды от открытия записи до записи пользователя (null, если время неизвестно).
+    В памяти держатся только индексы: смещение строки в файле, дата, предмет, число занятых мест и
+    вместимость каждой сессии (массивы array), а также номера сессий по предмету, дате и пользователю.
+    Заполняемость и статистика по предметам считаются по индексам без чтения файла; посещаемость студентов
+    и CSV выгрузка читают с диска только нужные строки по смещениям, в отдельном потоке.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.bytes_written = 0
+        self._offsets = array.array('q')   # Номер сессии -> смещение строки в файле
+        self._dates = array.array('i')     # Номер сессии -> дата (date.toordinal)
+        self._subject_of = array.array('i')  # Номер сессии -> номер предмета
+        self._booked = array.array('i')    # Номер сессии -> занято мест
+        self._capacity = array.array('i')  # Номер сессии -> мест всего
+        self._subjects = []                # Номер предмета -> название
+        self._subject_ids = {}             # Название предмета -> номер
+        self._by_subject = {}              # Номер предмета -> array номеров сессий
+        self._by_date = {}                 # Дата (ordinal) -> array номеров сессий
+        self._date_list = []               # Отсортированные даты, для выборки по диапазону
+        self._by_user = {}                 # user_id -> array номеров сессий
+        self._file = None
+        self._lock = asyncio.Lock()        # Строки дописываются по одной
+
+    def __len__(self):
+        """Число сессий в архиве."""
+        return len(self._offsets)
+
+    @property
+    def users_count(self) -> int:
+        return len(self._by_user)
+
+    def load(self):
+        """
+        Строит индексы, читая файл один раз построчно (в памяти остаются только индексы).
+        Оборванная последняя строка (сбой во время записи) обрезается.
+        """
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    self._index(offset, json.loads(line))
+                except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"Пропущена поврежденная строка архива {self.path} (смещение {offset}): {e}")
+                offset += len(line)
+        if offset < os.path.getsize(self.path):
+            with open(self.path, 'rb+') as f:
+                f.truncate(offset)
+            logger.warning(f"Недописанный хвост архива {self.path} обрезан.")
+        logger.info(f"Архив посещаемости загружен из {self.path}: {len(self)} сессий, "
+                    f"{len(self._subjects)} предметов, {len(self._by_user)} студентов")
+
+    def _index(self, offset: int, row: dict):
+        # Сначала разбираются все поля: поврежденная строка не должна попасть в индексы частично
+        day = date.fromisoformat(row["date"]).toordinal()
+        subject = row["subject"]
+        if not isinstance(subject, str):
+            raise ValueError(f"неверный предмет {subject!r}")
+        users = [int(user_id) for user_id in row["users"]]
+        capacity = int(row["capacity"])
+        number = len(self._offsets)
+        subject_id = self._subject_ids.get(subject)
+        if subject_id is None:
+            subject_id = self._subject_ids[subject] = len(self._subjects)
+            self._subjects.append(subject)
+        self._offsets.append(offset)
+        self._dates.append(day)
+        self._subject_of.append(subject_id)
+        self._booked.append(len(users))
+        self._capacity.append(capacity)
+        self._by_subject.setdefault(subject_id, array.array('i')).append(number)
+        rows_of_day = self._by_date.get(day)
+        if rows_of_day is None:
+            rows_of_day = self._by_date[day] = array.array('i')
+            bisect.insort(self._date_list, day)
+        rows_of_day.append(number)
+        for user_id in users:
+            self._by_user.setdefault(user_id, array.array('i')).append(number)
+
+    @staticmethod
+    def make_row(session, group_id: str) -> dict:
+        """Строка архива для закрытой сессии (sessions.PracticeSession)."""
+        bookings = sorted(session.bookings())
+        booked_after = []
+        for _, user_id in bookings:
+            booked_at = session.booked_at(user_id)
+            booked_after.append(None if booked_at is None else int((booked_at - session.open_time).total_seconds()))
+        return {
+            "key": session.key,
+            "group": group_id,
+            "date": session.open_time.date().isoformat(),
+            "subject": session.subject_name,
+            "open": session.open_time.isoformat(),
+            "capacity": session.capacity,
+            "seats": [seat for seat, _ in bookings],
+            "users": [user_id for _, user_id in bookings],
+            "booked_after": booked_after,
+        }
+
+    async def record(self, session, group_id: str = ""):
+        """Добавляет закрытую сессию в архив (запись на диск — в отдельном потоке)."""
+        row = self.make_row(session, group_id)
+        line = (json.dumps(row, ensure_ascii=False, separators=(',', ':')) + "\n").encode('utf-8')
+        async with self._lock:
+            try:
+                offset = await asyncio.to_thread(self._append, line)
+            except OSError as e:
+                logger.error(f"Не удалось записать сессию {session.key} в архив {self.path}: {e}")
+                return
+        # Индекс обновляется в цикле событий, уже после записи: запросы видят только целые строки
+        self._index(offset, row)
+
+    def _append(self, line: bytes) -> int:
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        offset = self._file.tell()
+        self._file.write(line)
+        self._file.flush()
+        self.bytes_written += len(line)
+        return offset
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # --- Выборка по индексам ---
+
+    def _select(self, subject: str = None, since: date = None, until: date = None):
+        """Номера сессий по предмету и диапазону дат [since, until] в порядке дат."""
+        first = since.toordinal() if since is not None else None
+        last = until.toordinal() if until is not None else None
+        if subject is not None:
+            subject_id = self._subject_ids.get(subject)
+            if subject_id is None:
+                return []
+            dates = self._dates
+            rows = [row for row in self._by_subject[subject_id]
+                    if (first is None or dates[row] >= first) and (last is None or dates[row] <= last)]
+            rows.sort(key=lambda row: (dates[row], row))
+            return rows
+        start = bisect.bisect_left(self._date_list, first) if first is not None else 0
+        stop = bisect.bisect_right(self._date_list, last) if last is not None else len(self._date_list)
+        rows = []
+        for day in self._date_list[start:stop]:
+            rows.extend(self._by_date[day])
+        return rows
+
+    def find_subject(self, text: str):
+        """Название предмета по точному названию или по его части (без учета регистра); None, если не найдено."""
+        if text in self._subject_ids:
+            return text
+        needle = text.casefold()
+        matches = [subject for subject in self._subjects if needle in subject.casefold()]
+        return matches[0] if len(matches) == 1 else None
+
+    def occupancy(self, subject: str = None, since: date = None, until: date = None) -> SubjectStats:
+        """Заполняемость практик (все предметы или один) за период — только по индексам, без чтения файла."""
+        rows = self._select(subject, since, until)
+        return SubjectStats(subject, len(rows), sum(self._capacity[row] for row in rows),
+                            sum(self._booked[row] for row in rows))
+
+    def subject_stats(self, since: date = None, until: date = None):
+        """Заполняемость по предметам за период (по индексам), от самых заполненных к наименее."""
+        sessions, seats, booked = {}, {}, {}
+        for row in self._select(None, since, until):
+            subject_id = self._subject_of[row]
+            sessions[subject_id] = sessions.get(subject_id, 0) + 1
+            seats[subject_id] = seats.get(subject_id, 0) + self._capacity[row]
+            booked[subject_id] = booked.get(subject_id, 0) + self._booked[row]
+        stats = [SubjectStats(self._subjects[subject_id], sessions[subject_id], seats[subject_id], booked[subject_id])
+                 for subject_id in sessions]
+        stats.sort(key=lambda item: item.occupancy, reverse=True)
+        return stats
+
+    def _read_rows(self, rows):
+        """Читает строки архива по номерам сессий (вызывается в отдельном потоке)."""
+        offsets = [self._offsets[row] for row in rows]
+        with open(self.path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                yield json.loads(f.readline())
+
+    # --- Запросы, читающие файл ---
+
+    async def attendance(self, subject: str, since: date = None, until: date = None):
+        """
+        Посещаемость предмета по студентам: сколько практик студент посетил (был записан) и сколько пропустил —
+        практик его группы по этому предмету, прошедших после его первой записи, на которые он не записался.
+        Читает с диска только сессии предмета. Список отсортирован по числу пропусков.
+        """
+        rows = self._select(subject, since, until)
+        return await asyncio.to_thread(self._attendance, rows)
+
+    def _attendance(self, rows):
+        held = {}       # Группа -> сколько практик предмета проведено к текущей строке
+        first_seen = {}  # (user_id, группа) -> номер практики группы, на которую студент записался впервые
+        attended = {}   # (user_id, группа) -> посещено
+        first_date, last_date = {}, {}  # user_id -> первая и последняя посещенная дата
+        for row in self._read_rows(rows):
+            group_id = row["group"]
+            held[group_id] = held.get(group_id, 0) + 1
+            for user_id in row["users"]:
+                key = (user_id, group_id)
+                first_seen.setdefault(key, held[group_id])
+                attended[key] = attended.get(key, 0) + 1
+                first_date.setdefault(user_id, row["date"])
+                last_date[user_id] = row["date"]
+        totals = {}
+        for (user_id, group_id), count in attended.items():
+            possible = held[group_id] - first_seen[(user_id, group_id)] + 1
+            visited, missed = totals.get(user_id, (0, 0))
+            totals[user_id] = (visited + count, missed + possible - count)
+        report = [StudentAttendance(user_id, visited, missed, date.fromisoformat(first_date[user_id]),
+                                    date.fromisoformat(last_date[user_id]))
+                  for user_id, (visited, missed) in totals.items()]
+        report.sort(key=lambda item: (-item.missed, item.attended, item.user_id))
+        return report
+
+    def student(self, user_id: int):
+        """Посещенные студентом практики по предметам — по индексу пользователя, без чтения файла."""
+        subjects = {}
+        for row in self._by_user.get(user_id, ()):
+            subject = self._subjects[self._subject_of[row]]
+            count, last = subjects.get(subject, (0, 0))
+            subjects[subject] = (count + 1, max(last, self._dates[row]))
+        return [StudentSubject(subject, count, date.fromordinal(last))
+                for subject, (count, last) in sorted(subjects.items(), key=lambda item: -item[1][0])]
+
+    def _csv_lines(self, rows) -> str:
+        """CSV строки (без заголовка) для сессий rows: по строке на занятое место."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in self._read_rows(rows):
+            open_time = datetime.fromisoformat(row["open"])
+            for seat, user_id, booked_after in zip(row["seats"], row["users"], row["booked_after"]):
+                booked_at = (open_time + timedelta(seconds=booked_after)).isoformat() if booked_after is not None else ""
+                writer.writerow((row["date"], row["group"], row["key"], row["subject"], seat, user_id, booked_at,
+                                 row["open"]))
+        return buffer.getvalue()
+
+    async def stream_csv(self, write, subject: str = None, since: date = None, until: date = None,
+                         batch: int = STREAM_BATCH) -> int:
+        """
+        Потоковая CSV выгрузка: await write(bytes) вызывается для заголовка и каждой пачки из batch сессий,
+        так что в памяти никогда не лежит вся история. Возвращает число выгруженных сессий.
+        """
+        rows = self._select(subject, since, until)
+        header = io.StringIO()
+        csv.writer(header).writerow(CSV_COLUMNS)
+        await write(header.getvalue().encode('utf-8'))
+        for start in range(0, len(rows), batch):
+            chunk = await asyncio.to_thread(self._csv_lines, rows[start:start + batch])
+            if chunk:
+                await write(chunk.encode('utf-8'))
+        return len(rows)
+
+    def add_routes(self, app: web.Application, token: str, path: str = "/history.csv"):
+        """
+        GET path?subject=...&since=ГГГГ-ММ-ДД&until=ГГГГ-ММ-ДД — потоковая CSV выгрузка (на сервере метрик).
+        В выгрузке ID всех студентов, поэтому она отдается только с заголовком "Authorization: Bearer <token>";
+        без токена адрес не регистрируется (выгрузка доступна только командой /export).
+        """
+        if not token:
+            return
+        app.router.add_get(path, functools.partial(self._handle_csv, token))
+
+    async def _handle_csv(self, token: str, request: web.Request) -> web.StreamResponse:
+        received = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(received.encode(), f"Bearer {token}".encode()):
+            return web.Response(status=401, text="Нужен заголовок Authorization: Bearer <HISTORY_EXPORT_TOKEN>.\n")
+        try:
+            since = date.fromisoformat(request.query["since"]) if "since" in request.query else None
+            until = date.fromisoformat(request.query["until"]) if "until" in request.query else None
+        except ValueError:
+            return web.Response(status=400, text="since и until — даты в формате ГГГГ-ММ-ДД.\n")
+        response = web.StreamResponse(headers={"Content-Type": "text/csv; charset=utf-8"})
+        await response.prepare(request)
+        await self.stream_csv(response.write, request.query.get("subject"), since, until)
+        await response.write_eof()
+        return response
+
+    async def export_csv(self, path: str, subject: str = None, since: date = None, until: date = None) -> int:
+        """Выгружает историю в CSV файл path (построчно, см. stream_csv). Возвращает число сессий."""
+        with open(path, 'wb') as f:
+            return await self.stream_csv(lambda data: asyncio.to_thread(f.write, data), subject, since, until)
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+from datetime import date, datetime
+
+from ledger import NotificationLedger
+from sessions import DEFAULT_CAPACITY, PracticeSession
+
+logger = logging.getLogger(__name__)
+
+
+def make_record(op: str, **fields) -> dict:
+    """
+    Создает запись журнала об одном изменении состояния.
+    op — тип изменения:
+      user_registered (user), user_removed (user), session_opened (session, open_time, subject, capacity),
+      session_closed (session), seat_taken (session, slot, user, at — время записи, ISO),
+      seat_released (session, slot, user),
+      notification_sent (date, entry), notifications_expired (before).
+    """
+    record = {"op": op}
+    record.update(fields)
+    return record
+
+
+def apply_record(record: dict, user_ids: set, practice_slots: dict, sent_notifications: NotificationLedger):
+    """Применяет одну запись журнала к состоянию в памяти (используется при восстановлении)."""
+    op = record.get("op")
+    if op == "user_registered":
+        user_ids.add(record["user"])
+    elif op == "user_removed":
+        user_ids.discard(record["user"])
+    elif op == "session_opened":
+        practice_slots[record["session"]] = PracticeSession(
+            record["session"], record["subject"], datetime.fromisoformat(record["open_time"]),
+            record.get("capacity", DEFAULT_CAPACITY))
+    elif op == "session_closed":
+        practice_slots.pop(record["session"], None)
+    elif op == "seat_taken":
+        session = practice_slots.get(record["session"])
+        if session is not None:
+            try:
+                session.book(record["slot"], record["user"])
+                if "at" in record:
+                    session.mark_booked_at(record["user"], datetime.fromisoformat(record["at"]))
+            except ValueError as e:
+                logger.warning(f"Запись журнала {record} не применена: {e}")
+    elif op == "seat_released":
+        session = practice_slots.get(record["session"])
+        # Освобождаем место, только если оно все еще принадлежит этому пользователю
+        if session is not None and session.owner(record["slot"]) == record["user"]:
+            session.release(record["user"])
+    elif op == "notification_sent":
+        sent_notifications.add(date.fromisoformat(record["date"]), record["entry"])
+    elif op == "notifications_expired":
+        sent_notifications.expire_before(record["before"])
+    else:
+        logger.warning(f"Неизвестный тип записи журнала: {op}")
+
+
+class Journal:
+    """
+    Хранилище состояния в виде снимка (snapshot) и журнала изменений только на добавление.
+    Каждое изменение записывается одной компактной строкой JSON в конец журнала, поэтому
+    стоимость записи зависит от размера изменения, а не от размера всего состояния.
+    При запуске состояние восстанавливается так: загружается снимок и к нему применяются записи журнала.
+    Когда журнал вырастает до compact_every записей, пишется новый снимок, а журнал очищается.
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: str, compact_every: int = 1000, fsync: bool = False):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self.fsync = fsync                # fsync после каждой записи: надежнее, но медленнее
+        self.records_since_snapshot = 0   # Сколько записей накопилось в журнале после последнего снимка
+        self.bytes_written = 0            # Байт записано в журнал и снимки с момента запуска
+        self._file = None                 # Открытый на добавление файл журнала
+
+    def load(self):
+        """
+        Восстанавливает (user_ids, practice_slots, sent_notifications) из снимка и журнала.
+        Оборванная последняя строка журнала (сбой во время записи) пропускается.
+        """
+        user_ids, practice_slots, sent_notifications = set(), {}, NotificationLedger()
+
+        # Загрузка снимка
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+                user_ids = set(snapshot.get("user_ids", []))
+                sent_notifications = NotificationLedger.from_dict(snapshot.get("sent_notifications", {}))
+                for key, value in snapshot.get("practice_slots", {}).items():
+                    try:
+                        practice_slots[key] = PracticeSession.from_dict(key, value)
+                    except (KeyError, ValueError, TypeError) as e:
+                        logger.error(f"Ошибка восстановления сессии {key} из снимка: {e}. Сессия пропущена.")
+            except (json.JSONDecodeError, KeyError, ValueError) as e:
+                logger.error(f"Снимок {self.snapshot_path} поврежден ({e}). Восстановление только из журнала.")
+
+        # Применение журнала поверх снимка
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line_number, line in enumerate(f, start=1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Пропущена поврежденная строка {line_number} журнала {self.journal_path}.")
+                        continue
+                    apply_record(record, user_ids, practice_slots, sent_notifications)
+                    replayed += 1
+            self._truncate_torn_tail()
+        self.records_since_snapshot = replayed
+        logger.info(
+            f"Состояние восстановлено из {self.snapshot_path} и {replayed} записей журнала {self.journal_path}: "
+            f"{len(user_ids)} user_ids, {len(practice_slots)} practice_slots, {len(sent_notifications)} sent_notifications")
+        return user_ids, practice_slots, sent_notifications
+
+    def _truncate_torn_tail(self):
+        """Обрезает недописанную последнюю строку журнала, чтобы новые записи не склеились с ней."""
+        with open(self.journal_path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+                logger.warning(f"Недописанный хвост журнала {self.journal_path} обрезан.")
+
+    def append(self, records):
+        """Дописывает записи в конец журнала (по одной строке JSON на запись)."""
+        if not records:
+            return
+        if self._file is None:
+            self._file = open(self.journal_path, 'a', encoding='utf-8')
+        data = "".join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + "\n" for r in records)
+        self._file.write(data)
+        self._file.flush()
+        self.bytes_written += len(data.encode('utf-8'))
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.records_since_snapshot += len(records)
+
+    def needs_compaction(self) -> bool:
+        """Пора ли записать новый снимок и очистить журнал."""
+        return self.records_since_snapshot >= self.compact_every
+
+    def compact(self, user_ids, practice_slots, sent_notifications):
+        """
+        Записывает полный снимок состояния и очищает журнал.
+        Снимок сначала пишется во временный файл и затем атомарно подменяет старый,
+        поэтому сбой во время компакции не повреждает ни снимок, ни журнал.
+        """
+        snapshot = {
+            "user_ids": list(user_ids),
+            "practice_slots": {key: session.to_dict() for key, session in practice_slots.items()},
+            "sent_notifications": sent_notifications.to_dict(),
+        }
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+            self.bytes_written += f.tell()
+        os.replace(temp_path, self.snapshot_path)
+        # Снимок на диске — журнал больше не нужен
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        with open(self.journal_path, 'w', encoding='utf-8'):
+            pass
+        self.records_since_snapshot = 0
+        logger.info(f"Компакция журнала: снимок записан в {self.snapshot_path}, журнал {self.journal_path} очищен.")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,131 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from callbacks import ACTION_GROUP, ACTION_SLOT, BUSY_DATA, default_codec
+
+ROW_WIDTH = 6  # Кнопок мест в одном ряду клавиатуры
+
+
+def build_group_keyboard(groups, subscribed) -> InlineKeyboardMarkup:
+    """
+    Клавиатура выбора групп: по кнопке на группу, группы пользователя отмечены галочкой.
+    groups: StudyGroup в порядке файла групп; subscribed: ID групп, на которые подписан пользователь.
+    """
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"✅ {group.title}" if group.group_id in subscribed else group.title,
+                              callback_data=default_codec.encode(ACTION_GROUP, group.group_id))]
+        for group in groups
+    ])
+
+
+def slot_callback_data(practice_session_key: str, seat: int) -> str:
+    """callback_data кнопки места: ID сессии и номер места, например "s1x2k9c.5" (см. callbacks.CallbackCodec)."""
+    return default_codec.encode(ACTION_SLOT, practice_session_key, seat)
+
+
+def build_slot_keyboard(session, user_id: int) -> InlineKeyboardMarkup:
+    """
+    Создает инлайн-клавиатуру для выбора места на практику без кэширования.
+    session: PracticeSession, для которой строится клавиатура.
+    user_id: ID пользователя, для которого генерируется клавиатура (чтобы отметить его место).
+    """
+    keyboard_rows = [] # Список рядов кнопок
+    current_row = []   # Текущий формируемый ряд кнопок
+
+    # Итерация по всем местам сессии (от 1 до session.capacity)
+    for i in range(1, session.capacity + 1):
+        slot_owner_id = session.owner(i)  # Получаем ID пользователя, занявшего слот i (или None)
+
+        if slot_owner_id is not None: # Если слот занят
+            if slot_owner_id == user_id: # Если слот занят текущим пользователем
+                text = f"✅{i}" # Отмечаем его место галочкой
+                callback_data_slot = slot_callback_data(session.key, i) # Позволяем отменить запись
+            else: # Если слот занят другим пользователем
+                text = f"🔒{i}" # Отмечаем место как заблокированное
+                callback_data_slot = BUSY_DATA # Сообщаем, что место занято
+        else: # Если слот свободен
+            text = str(i) # Просто номер места
+            callback_data_slot = slot_callback_data(session.key, i) # Позволяем занять место
+
+        current_row.append(InlineKeyboardButton(text=text, callback_data=callback_data_slot))
+        # Формируем ряды по ROW_WIDTH кнопок
+        if len(current_row) == ROW_WIDTH:
+            keyboard_rows.append(current_row)
+            current_row = []
+    # Добавляем последний неполный ряд, если он есть
+    if current_row:
+        keyboard_rows.append(current_row)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
+
+
+class _CachedLayout:
+    """Общая для всех пользователей раскладка мест одной версии сессии."""
+    __slots__ = ("session", "version", "rows", "markup", "own_buttons")
+
+    def __init__(self, session, rows):
+        self.session = session          # Объект сессии, для которого построена раскладка
+        self.version = session.version  # Версия мест сессии на момент построения
+        self.rows = rows                # Ряды кнопок: свободные места и 🔒 для занятых
+        # Готовая клавиатура для пользователей без места — отдается без копирования
+        self.markup = InlineKeyboardMarkup.model_construct(inline_keyboard=rows)
+        self.own_buttons = {}           # Место -> кнопка "✅место" (создается при первом запросе)
+
+
+class SlotKeyboardCache:
+    """
+    Кэш клавиатур выбора места.
+    Для каждой сессии раскладка кнопок строится один раз на версию мест (session.version) и общая для всех:
+    свободные места и 🔒 для занятых. Клавиатура конкретного пользователя отличается от общей только
+    его собственным местом (✅), поэтому для него копируется лишь один ряд, а в нем подменяется одна кнопка.
+    Когда места в сессии меняются, версия растет и раскладка перестраивается при следующем запросе.
+    """
+
+    def __init__(self):
+        self._layouts = {}  # Ключ сессии -> _CachedLayout
+        self.hits = 0       # Клавиатура собрана из кэша
+        self.rebuilds = 0   # Раскладка построена заново
+
+    def _layout(self, session) -> _CachedLayout:
+        layout = self._layouts.get(session.key)
+        # Раскладка устарела, если места изменились или под тем же ключом открыта новая сессия
+        if layout is None or layout.session is not session or layout.version != session.version:
+            layout = _CachedLayout(session, self._build_rows(session))
+            self._layouts[session.key] = layout
+            self.rebuilds += 1
+        else:
+            self.hits += 1
+        return layout
+
+    @staticmethod
+    def _build_rows(session):
+        rows = []
+        for row_start in range(1, session.capacity + 1, ROW_WIDTH):
+            row = []
+            for i in range(row_start, min(row_start + ROW_WIDTH, session.capacity + 1)):
+                if session.owner(i) is None:
+                    row.append(InlineKeyboardButton(text=str(i), callback_data=slot_callback_data(session.key, i)))
+                else:
+                    row.append(InlineKeyboardButton(text=f"🔒{i}", callback_data=BUSY_DATA))
+            rows.append(row)
+        return rows
+
+    def get(self, session, user_id: int) -> InlineKeyboardMarkup:
+        """Клавиатура выбора места для пользователя user_id (его место отмечено ✅)."""
+        layout = self._layout(session)
+        seat = session.seat_of(user_id)
+        if seat is None:
+            return layout.markup
+        own_button = layout.own_buttons.get(seat)
+        if own_button is None:
+            own_button = InlineKeyboardButton(text=f"✅{seat}", callback_data=slot_callback_data(session.key, seat))
+            layout.own_buttons[seat] = own_button
+        row_index, column = divmod(seat - 1, ROW_WIDTH)
+        rows = layout.rows.copy()                 # Копируется только список рядов...
+        patched_row = rows[row_index].copy()      # ...и один ряд с местом пользователя
+        patched_row[column] = own_button
+        rows[row_index] = patched_row
+        # model_construct не повторяет проверку pydantic: все кнопки уже проверены при создании
+        return InlineKeyboardMarkup.model_construct(inline_keyboard=rows)
+
+    def invalidate(self, practice_session_key: str):
+        """Удаляет раскладку сессии из кэша (например, после закрытия записи)."""
+        self._layouts.pop(practice_session_key, None)
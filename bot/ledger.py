@@ -0,0 +1,115 @@
+import hashlib
+import logging
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETENTION_DAYS = 2  # Сегодня и вчера: событие 23:59, выполненное после полуночи, относится ко вчерашнему дню
+
+
+def schedule_entry_id(day_name: str, time_str: str, event_type: str, subject_name: str, group: str = "") -> str:
+    """
+    Короткий стабильный идентификатор записи расписания (12 шестнадцатеричных символов).
+    Строится из тех же полей, что и прежние ключи sent_notifications ("день_время_тип_предмет"),
+    поэтому старые ключи можно перевести в новый формат. Для группы (кроме группы по умолчанию)
+    ID группы входит в ключ: одинаковые занятия разных групп учитываются отдельно.
+    """
+    raw = f"{day_name}_{time_str}_{event_type}_{subject_name}"
+    if group:
+        raw = f"{group}/{raw}"
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=6).hexdigest()
+
+
+class NotificationLedger:
+    """
+    Учет отправленных уведомлений, разбитый по дням.
+    Уведомление идентифицируется парой (дата, ID записи расписания). Записи одного дня лежат
+    в отдельном множестве (разделе), поэтому устаревшие дни удаляются целиком, без перебора ключей,
+    и удаляются все старые дни, а не только вчерашний (важно после простоя бота).
+    Хранится не больше retention_days разделов, так что размер в памяти и на диске ограничен.
+    """
+    __slots__ = ("retention_days", "_partitions")
+
+    def __init__(self, retention_days: int = DEFAULT_RETENTION_DAYS):
+        self.retention_days = retention_days
+        self._partitions = {}  # Дата в ISO формате -> множество ID записей расписания
+
+    def add(self, day: date, entry_id: str) -> bool:
+        """Отмечает уведомление как отправленное. Возвращает False, если оно уже было отмечено."""
+        partition = self._partitions.setdefault(day.isoformat(), set())
+        if entry_id in partition:
+            return False
+        partition.add(entry_id)
+        return True
+
+    def contains(self, day: date, entry_id: str) -> bool:
+        partition = self._partitions.get(day.isoformat())
+        return partition is not None and entry_id in partition
+
+    def expire(self, today: date):
+        """
+        Удаляет разделы старше retention_days дней (считая сегодняшний).
+        Возвращает дату, раньше которой все удалено (ISO строка), или None, если удалять было нечего.
+        """
+        cutoff = (today - timedelta(days=self.retention_days - 1)).isoformat()
+        expired = [day for day in self._partitions if day < cutoff]
+        for day in expired:
+            del self._partitions[day]
+        return cutoff if expired else None
+
+    def expire_before(self, cutoff: str):
+        """Удаляет разделы за даты раньше cutoff (ISO строка). Используется при восстановлении из журнала."""
+        for day in [day for day in self._partitions if day < cutoff]:
+            del self._partitions[day]
+
+    def __len__(self):
+        return sum(len(partition) for partition in self._partitions.values())
+
+    @property
+    def partition_count(self) -> int:
+        return len(self._partitions)
+
+    def entries(self):
+        """Пары (дата ISO, ID записи расписания) всех отмеченных уведомлений."""
+        return [(day, entry_id) for day, partition in self._partitions.items() for entry_id in partition]
+
+    def copy(self):
+        clone = NotificationLedger(self.retention_days)
+        clone._partitions = {day: partition.copy() for day, partition in self._partitions.items()}
+        return clone
+
+    def to_dict(self) -> dict:
+        """Компактное представление для JSON: {"2025-01-06": ["3f2a9c...", ...], ...}."""
+        return {day: sorted(partition) for day, partition in self._partitions.items()}
+
+    @classmethod
+    def from_dict(cls, data, retention_days: int = DEFAULT_RETENTION_DAYS):
+        """
+        Восстанавливает учет из to_dict().
+        Понимает и старый формат sent_notifications.json — список строк "день_время_тип_предмет_дата".
+        Поврежденные записи пропускаются (с предупреждением в логе), а не мешают запуску бота.
+        """
+        ledger = cls(retention_days)
+        if isinstance(data, dict):
+            for day, entry_ids in data.items():
+                try:
+                    date.fromisoformat(day)
+                    if isinstance(entry_ids, str):
+                        raise TypeError(f"ожидался список ID, а не строка {entry_ids!r}")
+                    ledger._partitions[day] = {str(entry_id) for entry_id in entry_ids}
+                except (TypeError, ValueError) as e:
+                    logger.warning(f"Пропущен поврежденный учет уведомлений за {day!r}: {e}")
+        elif isinstance(data, list):
+            for legacy_key in data:
+                try:
+                    rest, _, day = legacy_key.rpartition("_")
+                    date.fromisoformat(day)
+                    day_name, time_str, event_type, subject_name = rest.split("_", 3)
+                except (AttributeError, TypeError, ValueError) as e:
+                    logger.warning(f"Пропущен поврежденный ключ sent_notifications {legacy_key!r}: {e}")
+                    continue
+                ledger._partitions.setdefault(day, set()).add(
+                    schedule_entry_id(day_name, time_str, event_type, subject_name))
+        else:
+            logger.warning(f"Учет уведомлений в неизвестном формате ({type(data).__name__}) пропущен")
+        return ledger
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import signal
+import time as time_module
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DRAIN_TIMEOUT = 8.0  # Сек. на завершение начатой работы; Docker ждет 10 сек. после SIGTERM, потом SIGKILL
+STOP_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+
+class InFlightUpdates:
+    """
+    Внешний middleware диспетчера (dp.update.outer_middleware): учитывает обновления, которые сейчас
+    обрабатываются, чтобы при остановке дождаться их. Обновление, полученное ботом, Telegram уже не пришлет
+    повторно (поллинг подтвердил его offset, вебхук ответил 200), поэтому прерванный обработчик — потерянное нажатие.
+    """
+
+    def __init__(self):
+        self._tasks = set()
+        self.abandoned = 0  # Обработчиков, прерванных по истечении срока остановки
+
+    async def __call__(self, handler, event, data):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            self._tasks.discard(task)
+
+    def __len__(self):
+        return len(self._tasks)
+
+    async def drain(self):
+        """Ждет обработки начатых обновлений; при отмене (срок вышел) прерывает оставшиеся обработчики."""
+        try:
+            while self._tasks:
+                await asyncio.wait(list(self._tasks))
+        except asyncio.CancelledError:
+            tasks = list(self._tasks)
+            self.abandoned += len(tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+
+class Lifecycle:
+    """
+    Жизненный цикл бота: фоновые задачи, сигналы остановки и порядок завершения.
+    По SIGTERM/SIGINT (request_stop) бот перестает принимать обновления, затем shutdown:
+      1. отменяет фоновые задачи (spawn), например планировщик — новые события больше не начинаются;
+      2. по порядку ждет шаги on_drain (начатые обработчики, рассылки) — все вместе не дольше drain_timeout;
+         шаг, не успевший к сроку, отменяется: недоставленное остается в очереди на диске до следующего запуска;
+      3. по порядку выполняет шаги on_checkpoint (итоги доставки, сохранение состояния, закрытие файлов) —
+         всегда и без срока; ошибка одного шага не мешает следующим.
+    Повторный сигнал во время остановки сразу прерывает ожидание шагов on_drain.
+    """
+
+    def __init__(self, drain_timeout: float = DEFAULT_DRAIN_TIMEOUT):
+        self.drain_timeout = drain_timeout
+        self.stopping = asyncio.Event()  # Остановка запрошена
+        self._forced = asyncio.Event()   # Повторный сигнал: не ждать шаги on_drain
+        self._tasks = {}                 # Фоновая задача -> имя
+        self._drain_steps = []           # (имя, async функция)
+        self._checkpoint_steps = []
+        self.stop_reason = None
+        self.report = {}                 # Имя шага -> длительность в мс или итог ("timeout", "error", ...)
+
+    # --- Запуск ---
+
+    def spawn(self, name: str, coro) -> asyncio.Task:
+        """Запускает фоновую задачу, которая работает до остановки бота (при остановке отменяется)."""
+        task = asyncio.create_task(coro, name=name)
+        self._tasks[task] = name
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: asyncio.Task):
+        name = self._tasks.pop(task, None)
+        if task.cancelled() or self.stopping.is_set():
+            return
+        error = task.exception()
+        if error is not None:
+            logger.error(f"Фоновая задача {name} завершилась с ошибкой: {error!r}", exc_info=error)
+
+    def install_signal_handlers(self):
+        """SIGTERM (остановка контейнера) и SIGINT (Ctrl+C) запускают плавную остановку вместо мгновенной."""
+        loop = asyncio.get_running_loop()
+        for sig in STOP_SIGNALS:
+            try:
+                loop.add_signal_handler(sig, self.request_stop, sig.name)
+            except (NotImplementedError, RuntimeError):
+                # Windows: обработчиков сигналов в цикле событий нет, остается KeyboardInterrupt
+                logger.debug(f"Обработчик сигнала {sig.name} не установлен")
+
+    def request_stop(self, reason: str = "stop"):
+        if self.stopping.is_set():
+            logger.warning(f"Повторный сигнал {reason}: остановка без ожидания начатой работы")
+            self._forced.set()
+            return
+        self.stop_reason = reason
+        logger.info(f"Получен сигнал {reason}: бот останавливается")
+        self.stopping.set()
+
+    async def wait(self, task: asyncio.Task = None):
+        """Ждет запроса остановки или завершения task (например, поллинга, упавшего с ошибкой)."""
+        stop_requested = asyncio.create_task(self.stopping.wait())
+        waiting = {stop_requested} if task is None else {stop_requested, task}
+        try:
+            await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stop_requested.cancel()
+
+    # --- Остановка ---
+
+    def on_drain(self, name: str, func):
+        """Шаг остановки: async func() ждет завершения начатой работы; отменяется, если общий срок вышел."""
+        self._drain_steps.append((name, func))
+
+    def on_checkpoint(self, name: str, func):
+        """Шаг остановки после on_drain: async или обычная func() сохраняет или закрывает что-либо; выполняется всегда."""
+        self._checkpoint_steps.append((name, func))
+
+    async def shutdown(self) -> dict:
+        """Останавливает бота (см. описание класса). Возвращает отчет о шагах."""
+        self.stopping.set()
+        started = time_module.perf_counter()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        deadline = started + self.drain_timeout
+        for name, func in self._drain_steps:
+            await self._drain(name, func, deadline)
+        for name, func in self._checkpoint_steps:
+            step_started = time_module.perf_counter()
+            try:
+                result = func()
+                if asyncio.iscoroutine(result):
+                    await result
+                self.report[name] = round((time_module.perf_counter() - step_started) * 1000, 1)
+            except Exception as e:
+                self.report[name] = "error"
+                logger.exception(f"Ошибка при остановке ({name}): {e}")
+        logger.info(f"Бот остановлен за {time_module.perf_counter() - started:.2f} сек. Шаги (мс): {self.report}")
+        return self.report
+
+    async def _drain(self, name: str, func, deadline: float):
+        step_started = time_module.perf_counter()
+        step = asyncio.create_task(func())
+        forced = asyncio.create_task(self._forced.wait())
+        # Даже если срок уже вышел, шаг получает шанс отменить свою работу аккуратно (а не быть брошенным)
+        await asyncio.wait({step, forced}, timeout=max(deadline - step_started, 0),
+                           return_when=asyncio.FIRST_COMPLETED)
+        forced.cancel()
+        if step.done():
+            outcome = round((time_module.perf_counter() - step_started) * 1000, 1)
+        else:
+            outcome = "forced" if self._forced.is_set() else "timeout"
+            step.cancel()
+            logger.warning(f"Остановка: шаг {name} не завершился за отведенное время и прерван")
+        try:
+            await step
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            outcome = "error"
+            logger.exception(f"Ошибка при остановке ({name}): {e}")
+        self.report[name] = outcome
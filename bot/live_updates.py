@@ -0,0 +1,157 @@
+import asyncio
+import logging
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEBOUNCE = 0.7        # Секунд ожидания после изменения мест: все изменения за это время уходят одним обновлением
+DEFAULT_EDIT_CONCURRENCY = 10 # Сколько правок сообщений выполняется одновременно
+
+
+class SeatMapViewers:
+    """
+    Живое обновление карты мест у всех, кто сейчас смотрит на клавиатуру выбора места.
+    Бот запоминает, в каких сообщениях показана клавиатура каждой открытой сессии.
+    Когда места в сессии меняются, через debounce секунд всем этим сообщениям отправляется
+    актуальная клавиатура. Сообщения, у которых клавиатура не изменилась, пропускаются,
+    а правки идут через те же ограничители частоты, что и рассылки (общий лимит и лимит на чат).
+    """
+
+    def __init__(self, bot, render, broadcaster, debounce: float = DEFAULT_DEBOUNCE,
+                 concurrency: int = DEFAULT_EDIT_CONCURRENCY):
+        self.bot = bot
+        self.render = render            # render(ключ_сессии, user_id) -> InlineKeyboardMarkup
+        self.broadcaster = broadcaster  # Источник ограничителей частоты (global_limiter, chat_limiter)
+        self.debounce = debounce
+        self.concurrency = concurrency
+        # Ключ сессии -> {(chat_id, message_id): [user_id, последняя отправленная клавиатура]}
+        self._viewers = {}
+        self._pending = {}              # Ключ сессии -> задача отложенного обновления
+        self._flushing = set()          # Сессии, сообщения которых сейчас редактируются
+        self._dirty = set()             # ... и места в которых изменились за это время (нужно повторить)
+        self._tasks = set()             # Задачи обновления: ждут debounce или уже редактируют сообщения
+        # Метрики
+        self.edits_sent = 0
+        self.edits_skipped = 0          # Клавиатура не изменилась — правка не нужна
+        self.edits_failed = 0
+
+    def track(self, practice_session_key: str, chat_id: int, message_id: int, user_id: int, markup=None):
+        """Запоминает сообщение с клавиатурой сессии. markup — клавиатура, которая сейчас в нем показана."""
+        self._viewers.setdefault(practice_session_key, {})[(chat_id, message_id)] = [user_id, markup]
+
+    def untrack(self, practice_session_key: str, chat_id: int, message_id: int):
+        """Забывает сообщение (например, пользователь отказался от записи или сообщение удалено)."""
+        viewers = self._viewers.get(practice_session_key)
+        if viewers is not None:
+            viewers.pop((chat_id, message_id), None)
+
+    def close_session(self, practice_session_key: str):
+        """Запись закрыта: отменяет отложенное обновление и забывает все сообщения сессии."""
+        self._viewers.pop(practice_session_key, None)
+        task = self._pending.pop(practice_session_key, None)
+        if task is not None:
+            task.cancel()
+
+    def viewer_count(self, practice_session_key: str = None) -> int:
+        if practice_session_key is not None:
+            return len(self._viewers.get(practice_session_key, {}))
+        return sum(len(viewers) for viewers in self._viewers.values())
+
+    def notify_changed(self, practice_session_key: str):
+        """Места в сессии изменились: планирует обновление всех сообщений (несколько вызовов подряд объединяются)."""
+        if practice_session_key in self._pending or not self._viewers.get(practice_session_key):
+            return
+        task = asyncio.create_task(self._flush_later(practice_session_key))
+        self._pending[practice_session_key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_later(self, practice_session_key: str):
+        try:
+            await asyncio.sleep(self.debounce)
+        finally:
+            self._pending.pop(practice_session_key, None)
+        await self.flush(practice_session_key)
+
+    async def drain(self):
+        """При остановке бота: отложенные обновления отправляются сразу, начатые — дожидаются."""
+        try:
+            for practice_session_key in list(self._pending):
+                self._pending.pop(practice_session_key).cancel()
+                await self.flush(practice_session_key)
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        except asyncio.CancelledError:
+            for task in list(self._tasks):
+                task.cancel()
+            raise
+
+    async def flush(self, practice_session_key: str):
+        """
+        Отправляет актуальную клавиатуру во все сообщения сессии, где она изменилась.
+        Обновления одной сессии идут по одному: если сессия уже обновляется, это обновление повторится
+        после текущего, чтобы последней в сообщениях оказалась самая новая клавиатура.
+        """
+        if practice_session_key in self._flushing:
+            self._dirty.add(practice_session_key)
+            return
+        self._flushing.add(practice_session_key)
+        try:
+            while True:
+                self._dirty.discard(practice_session_key)
+                await self._flush_once(practice_session_key)
+                if practice_session_key not in self._dirty:
+                    return
+        finally:
+            self._flushing.discard(practice_session_key)
+            self._dirty.discard(practice_session_key)
+
+    async def _flush_once(self, practice_session_key: str):
+        viewers = self._viewers.get(practice_session_key)
+        if not viewers:
+            return
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def edit(message_key, viewer):
+            # Кнопки клавиатур берутся из общего кэша, поэтому сравнение почти всегда сводится к сравнению ссылок
+            if self.render(practice_session_key, viewer[0]) == viewer[1]:
+                self.edits_skipped += 1
+                return
+            chat_id, message_id = message_key
+            async with semaphore:
+                await self._edit(practice_session_key, chat_id, message_id, viewer)
+
+        await asyncio.gather(*(edit(message_key, viewer) for message_key, viewer in list(viewers.items())))
+
+    async def _edit(self, practice_session_key: str, chat_id: int, message_id: int, viewer):
+        for _ in range(2):  # Вторая попытка — только после TelegramRetryAfter
+            await self.broadcaster.chat_limiter.acquire(chat_id)
+            await self.broadcaster.global_limiter.acquire()
+            # Клавиатура строится после ожидания лимитов: места могли измениться, пока правка ждала очереди
+            markup = self.render(practice_session_key, viewer[0])
+            if markup == viewer[1]:
+                self.edits_skipped += 1
+                return
+            try:
+                await self.bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=markup)
+                viewer[1] = markup
+                self.edits_sent += 1
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"Превышен лимит Telegram при обновлении карты мест, пауза {e.retry_after} сек.")
+                self.broadcaster.global_limiter.pause(e.retry_after)
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    viewer[1] = markup
+                    self.edits_skipped += 1
+                else:
+                    # Сообщение удалено или больше не редактируется — перестаем его обновлять
+                    logger.info(f"Сообщение {message_id} в чате {chat_id} больше не обновляется: {e}")
+                    self.untrack(practice_session_key, chat_id, message_id)
+                    self.edits_failed += 1
+                return
+            except Exception as e:
+                logger.warning(f"Не удалось обновить карту мест в чате {chat_id}: {e}")
+                self.edits_failed += 1
+                return
+        self.edits_failed += 1
@@ -0,0 +1,288 @@
+import logging
+import time as time_module
+from bisect import bisect_left
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_PATH = "/metrics"
+# Границы корзин гистограмм (сек.): от единиц миллисекунд (нажатия на места) до минут (рассылка всем)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BROADCAST_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Базовый класс метрики с метками: значения хранятся в словаре (значения меток) -> значение."""
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self):
+        """Строки метрики в текстовом формате Prometheus."""
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Counter(Metric):
+    """Счетчик, который только растет (например, число ошибок отправки)."""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Текущее значение. Если задана функция collect, значение вычисляется только при запросе метрик,
+    поэтому размер состояния (число пользователей, занятых мест) не пересчитывается на каждом нажатии.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels=(), collect=None):
+        super().__init__(name, help_text, labels)
+        self.collect = collect  # Функция без аргументов -> число
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def render(self):
+        if self.collect is not None:
+            try:
+                self._values[()] = self.collect()
+            except Exception as e:
+                logger.warning(f"Не удалось вычислить метрику {self.name}: {e}")
+        yield from super().render()
+
+
+class Histogram(Metric):
+    """
+    Гистограмма с фиксированными корзинами. observe — это поиск корзины делением пополам и два сложения,
+    поэтому ее можно вызывать на каждом обновлении даже во время массовой записи на места.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            # Счетчики по корзинам (последняя — +Inf), сумма и количество наблюдений
+            series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(float(bound))}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class MetricsRegistry:
+    """Набор метрик, который отдается одним текстом в формате Prometheus."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels=()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels=(), collect=None) -> Gauge:
+        return self._register(Gauge(name, help_text, labels, collect))
+
+    def histogram(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class BotMetrics:
+    """
+    Метрики бота: задержка обработчиков, рассылки, ошибки отправки, сохранение состояния и размер состояния.
+    Компоненты бота сообщают сюда о событиях (observe_*), а размер состояния считается при запросе метрик.
+    """
+
+    def __init__(self, registry: MetricsRegistry = None):
+        self.registry = registry if registry is not None else MetricsRegistry()
+        registry = self.registry
+        self.handler_latency = registry.histogram(
+            "bot_handler_latency_seconds", "Время работы обработчика обновления.", labels=("handler",))
+        self.handler_errors = registry.counter(
+            "bot_handler_errors_total", "Обработчики, завершившиеся ошибкой.", labels=("handler",))
+        self.broadcast_duration = registry.histogram(
+            "bot_broadcast_duration_seconds", "Длительность рассылки.", labels=("kind",), buckets=BROADCAST_BUCKETS)
+        self.broadcast_rate = registry.gauge(
+            "bot_broadcast_rate_messages_per_second", "Скорость последней рассылки.", labels=("kind",))
+        self.broadcast_messages = registry.counter(
+            "bot_broadcast_messages_total", "Сообщения рассылок по результату.", labels=("result",))
+        self.send_failures = registry.counter(
+            "bot_send_failures_total", "Ошибки отправки сообщений по типу ошибки.", labels=("error",))
+        self.persist_duration = registry.histogram(
+            "bot_persist_duration_seconds", "Длительность сохранения состояния.", labels=("storage",))
+        self.persist_bytes = registry.counter(
+            "bot_persist_bytes_total", "Байт записано на диск при сохранении состояния.", labels=("storage",))
+        self.started_at = time_module.time()
+        registry.gauge("bot_start_time_seconds", "Время запуска процесса бота (unix).", collect=lambda: self.started_at)
+
+    def watch_state(self, user_ids, practice_slots, sent_notifications):
+        """Регистрирует метрики размера состояния; значения вычисляются только при запросе метрик."""
+        self.registry.gauge("bot_users", "Зарегистрированные пользователи (user_ids).", collect=lambda: len(user_ids))
+        self.registry.gauge("bot_open_sessions", "Открытые сессии записи на практику.",
+                            collect=lambda: len(practice_slots))
+        self.registry.gauge("bot_booked_seats", "Занятые места во всех открытых сессиях.",
+                            collect=lambda: sum(session.booked_count for session in list(practice_slots.values())))
+        self.registry.gauge("bot_sent_notifications", "Записи учета отправленных уведомлений.",
+                            collect=lambda: len(sent_notifications))
+
+    def watch_subscriptions(self, subscriptions):
+        """Число подписок на группы (groups.SubscriptionIndex); вычисляется при запросе метрик."""
+        self.registry.gauge("bot_group_subscriptions", "Подписки пользователей на группы.",
+                            collect=lambda: len(subscriptions))
+
+    def watch_outbox(self, outbox):
+        """Очередь доставки (outbox.Outbox): недоставленные сообщения и исключенные получатели."""
+        self.registry.gauge("bot_outbox_pending", "Сообщения в очереди доставки (еще не доставлены).",
+                            collect=lambda: outbox.pending_count)
+        self.registry.gauge("bot_outbox_retry_queue", "Сообщения, ожидающие повторной отправки.",
+                            collect=lambda: outbox.retry_queue)
+        self.registry.gauge("bot_outbox_dead_recipients", "Получатели, исключенные из рассылок с запуска.",
+                            collect=lambda: outbox.dead_recipients)
+
+    def watch_history(self, history):
+        """Архив посещаемости (history.HistoryArchive): число сессий и студентов в индексах."""
+        self.registry.gauge("bot_history_sessions", "Закрытые сессии в архиве посещаемости.",
+                            collect=lambda: len(history))
+        self.registry.gauge("bot_history_students", "Студенты, хотя бы раз записанные на практику (в архиве).",
+                            collect=lambda: history.users_count)
+
+    def watch_click_throttle(self, throttle):
+        """Частые нажатия (throttling.ClickThrottle): работа, которую не пришлось делать."""
+        self.registry.gauge("bot_clicks_coalesced", "Нажатия на места, замененные следующими нажатиями (с запуска).",
+                            collect=lambda: throttle.coalesced)
+        self.registry.gauge("bot_clicks_unchanged", "Серии нажатий на места, не изменившие место (с запуска).",
+                            collect=lambda: throttle.unchanged)
+        self.registry.gauge("bot_clicks_throttled", "Нажатия сверх ограничения частоты (с запуска).",
+                            collect=lambda: throttle.throttled)
+
+    def observe_handler(self, handler: str, seconds: float, failed: bool = False):
+        self.handler_latency.observe(seconds, handler=handler)
+        if failed:
+            self.handler_errors.inc(handler=handler)
+
+    def observe_broadcast(self, kind: str, report):
+        """Учитывает итог рассылки (broadcast.BroadcastReport)."""
+        self.broadcast_duration.observe(report.duration, kind=kind)
+        self.broadcast_rate.set(report.rate, kind=kind)
+        self.broadcast_messages.inc(report.sent, result="sent")
+        self.broadcast_messages.inc(report.failed, result="failed")
+
+    def observe_send_failure(self, error_type: str):
+        self.send_failures.inc(error=error_type)
+
+    def observe_persist(self, storage: str, seconds: float, bytes_written: int = 0):
+        self.persist_duration.observe(seconds, storage=storage)
+        if bytes_written:
+            self.persist_bytes.inc(bytes_written, storage=storage)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware диспетчера: измеряет время работы обработчика, выбранного фильтрами,
+    и учитывает его в гистограмме с меткой — именем функции обработчика.
+    """
+
+    def __init__(self, metrics: BotMetrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time_module.perf_counter()
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.metrics.observe_handler(name, time_module.perf_counter() - started, failed)
+
+
+class MetricsServer:
+    """
+    Небольшой HTTP сервер (aiohttp), который отдает метрики по GET path в текстовом формате Prometheus.
+    Метрики рендерятся только по запросу, так что между запросами сервер ничего не стоит.
+    """
+
+    def __init__(self, registry: MetricsRegistry, path: str = DEFAULT_METRICS_PATH):
+        self.registry = registry
+        self.path = path
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_get(path, self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        logger.info(f"Метрики доступны на http://{host}:{port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
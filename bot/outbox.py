@@ -0,0 +1,400 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import time as time_module
+from datetime import datetime
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from broadcast import BroadcastReport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 8        # Попыток доставки одного сообщения при временных ошибках (сеть, 5xx)
+DEFAULT_BASE_DELAY = 2.0        # Пауза перед первым повтором (сек.); каждая следующая вдвое длиннее
+DEFAULT_MAX_DELAY = 600.0       # Самая длинная пауза между повторами (сек.)
+DEFAULT_FLUSH_INTERVAL = 0.5    # Как часто записывать на диск итоги доставки (сек.)
+DEFAULT_COMPACT_EVERY = 10000   # Через сколько записей файл очереди переписывается только с недоставленными
+DEFAULT_RETRY_CONCURRENCY = 10  # Одновременных повторных отправок
+
+# Итог попытки доставки
+DELIVERED = "delivered"  # Сообщение доставлено
+DEAD = "dead"            # Получатель недоступен навсегда (заблокировал бота, чат не найден): удаляется
+FAILED = "failed"        # Ошибка, которую повтор не исправит (например, неверная разметка)
+RETRY = "retry"          # Временная ошибка (сеть, ошибка сервера Telegram): повтор с паузой
+
+# Тексты ошибок Bad Request, после которых писать пользователю бесполезно
+DEAD_CHAT_ERRORS = ("chat not found", "user is deactivated", "peer_id_invalid", "bot was blocked", "bot was kicked")
+
+
+def classify_error(error: Exception) -> str:
+    """Итог неудачной попытки по ошибке отправки: DEAD, FAILED или RETRY."""
+    if isinstance(error, TelegramForbiddenError):
+        return DEAD
+    if isinstance(error, TelegramBadRequest):
+        message = str(error).lower()
+        return DEAD if any(text in message for text in DEAD_CHAT_ERRORS) else FAILED
+    return RETRY
+
+
+class OutboxBatch:
+    """Одна рассылка в очереди: текст, клавиатура, срок актуальности и получатели, которым она еще не доставлена."""
+    __slots__ = ("batch_id", "kind", "name", "text", "markup", "expires_at", "pending", "report", "_reply_markup")
+
+    def __init__(self, batch_id: int, kind: str, name: str, text: str, markup: dict = None,
+                 expires_at: datetime = None, pending=(), reply_markup=None):
+        self.batch_id = batch_id
+        self.kind = kind
+        self.name = name
+        self.text = text
+        self.markup = markup                    # Клавиатура в виде словаря (для записи на диск)
+        self.expires_at = expires_at            # После этого момента сообщение не отправляется
+        self.pending = set(pending)             # Получатели, которым сообщение еще не доставлено
+        self.report = BroadcastReport(name=name, total=len(self.pending))
+        self._reply_markup = reply_markup       # Готовый объект клавиатуры (восстанавливается из markup)
+
+    @property
+    def reply_markup(self):
+        if self._reply_markup is None and self.markup is not None:
+            self._reply_markup = InlineKeyboardMarkup.model_validate(self.markup)
+        return self._reply_markup
+
+    def to_record(self) -> dict:
+        return {"op": "batch", "batch": self.batch_id, "kind": self.kind, "name": self.name, "text": self.text,
+                "markup": self.markup, "expires": self.expires_at.isoformat() if self.expires_at else None,
+                "chats": sorted(self.pending)}
+
+    @classmethod
+    def from_record(cls, record: dict) -> "OutboxBatch":
+        expires = record.get("expires")
+        return cls(record["batch"], record.get("kind", "other"), record.get("name", ""), record["text"],
+                   record.get("markup"), datetime.fromisoformat(expires) if expires else None, record["chats"])
+
+
+class Outbox:
+    """
+    Очередь уведомлений на диске с доставкой и повторами.
+    Рассылка сначала записывается в файл очереди (одна строка JSON на рассылку: текст и список получателей),
+    затем отправляется с лимитами Broadcaster. Итоги доставки дописываются в файл пачками раз в flush_interval.
+    Временные ошибки повторяются с экспоненциальной паузой (RetryAfter — после паузы, которую просит Telegram),
+    получатели, заблокировавшие бота или удаленные, передаются в on_dead и больше не получают сообщений.
+    После перезапуска недоставленные сообщения загружаются из файла и доставляются (load, start); сообщение,
+    доставленное перед самым сбоем, может прийти повторно — доставка "хотя бы один раз".
+    now — часы для срока актуальности сообщений (в бенчмарках — виртуальные часы планировщика).
+    """
+
+    def __init__(self, broadcaster, path: str, on_dead=None, now=datetime.now,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 compact_every: int = DEFAULT_COMPACT_EVERY, retry_concurrency: int = DEFAULT_RETRY_CONCURRENCY):
+        self.broadcaster = broadcaster   # Отправка идет через бота и лимиты частоты рассыльщика
+        self.path = path
+        self.on_dead = on_dead           # async on_dead(chat_id): удалить недоступного получателя
+        self.now = now
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self.batches = {}                # ID рассылки -> OutboxBatch с недоставленными сообщениями
+        self.dead = set()                # Недоступные получатели: им ничего не отправляется
+        self._retries = []               # Куча (момент повтора по monotonic, порядок, ID рассылки, чат, попытка)
+        self._seq = itertools.count()
+        self._next_batch_id = 1
+        self._outcomes = {}              # (итог, ID рассылки) -> чаты; еще не записаны на диск
+        self._records = 0                # Записей в файле очереди
+        self._write_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._retry_semaphore = asyncio.Semaphore(retry_concurrency)
+        self._retry_tasks = set()
+        self._task = None
+        # Метрики
+        self.delivered = 0
+        self.retried = 0
+        self.dropped = 0                 # Не доставлено: ошибка без повтора, попытки исчерпаны или срок вышел
+        self.expired = 0
+        self.dead_recipients = 0
+        self.restored = 0                # Недоставленных сообщений загружено при запуске
+        self.bytes_written = 0
+
+    # --- Файл очереди ---
+
+    def load(self) -> int:
+        """
+        Восстанавливает недоставленные сообщения из файла очереди и ставит их на доставку.
+        Файл переписывается только с ними. Возвращает число недоставленных сообщений.
+        """
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line_number, line in enumerate(f, start=1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self._replay(json.loads(line))
+                    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                        logger.warning(f"Пропущена поврежденная строка {line_number} очереди {self.path}.")
+        self.batches = {batch_id: batch for batch_id, batch in self.batches.items() if batch.pending}
+        self._compact(self._snapshot())
+        due = time_module.monotonic()
+        for batch in self.batches.values():
+            for chat_id in batch.pending:
+                self._schedule(due, batch.batch_id, chat_id, 0)
+        self.restored = self.pending_count
+        if self.restored:
+            logger.info(f"Загружено недоставленных сообщений из {self.path}: {self.restored} "
+                        f"в {len(self.batches)} рассылках")
+        return self.restored
+
+    def _replay(self, record: dict):
+        op = record["op"]
+        if op == "batch":
+            batch = OutboxBatch.from_record(record)
+            self.batches[batch.batch_id] = batch
+            self._next_batch_id = max(self._next_batch_id, batch.batch_id + 1)
+            return
+        batch = self.batches.get(record["batch"])
+        if batch is not None:
+            batch.pending.difference_update(record["chats"])
+
+    def _snapshot(self):
+        """Записи о недоставленных сообщениях; строятся в цикле событий, пока доставка не меняет batches."""
+        return [batch.to_record() for batch in self.batches.values()]
+
+    def _compact(self, records):
+        """Переписывает файл очереди только с недоставленными сообщениями (временный файл и переименование)."""
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+            self.bytes_written += f.tell()
+        os.replace(temp_path, self.path)
+        self._records = len(records)
+
+    def _append(self, records):
+        data = "".join(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n" for record in records)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.bytes_written += len(data.encode('utf-8'))
+        self._records += len(records)
+
+    async def _write(self, records):
+        """Дописывает записи в файл очереди в отдельном потоке; записи идут в порядке вызовов."""
+        async with self._write_lock:
+            await asyncio.to_thread(self._append, records)
+
+    async def flush(self):
+        """Записывает накопившиеся итоги доставки; если файл разросся, переписывает его без доставленного."""
+        if not self._outcomes:
+            return
+        records = [{"op": outcome, "batch": batch_id, "chats": chats}
+                   for (outcome, batch_id), chats in self._outcomes.items()]
+        self._outcomes = {}
+        async with self._write_lock:
+            if not self.batches or self._records + len(records) >= self.compact_every:
+                # Итоги уже учтены в batches: достаточно переписать файл с тем, что осталось
+                await asyncio.to_thread(self._compact, self._snapshot())
+            else:
+                await asyncio.to_thread(self._append, records)
+
+    # --- Доставка ---
+
+    @property
+    def pending_count(self) -> int:
+        return sum(len(batch.pending) for batch in self.batches.values())
+
+    @property
+    def retry_queue(self) -> int:
+        """Сообщений, ожидающих повторной отправки."""
+        return len(self._retries)
+
+    async def broadcast(self, user_ids, text: str, name: str = "", kind: str = "other", expires_at: datetime = None,
+                        reply_markup=None) -> BroadcastReport:
+        """
+        Ставит рассылку в очередь (запись на диск до первой отправки) и делает первую попытку доставки всем
+        получателям параллельно, как Broadcaster.broadcast. Возвращает отчет первой попытки; сообщения
+        с временными ошибками доставляются дальше в фоне (start).
+        """
+        recipients = [chat_id for chat_id in user_ids if chat_id not in self.dead]  # Снимок списка
+        markup = reply_markup.model_dump(exclude_none=True) if reply_markup is not None else None
+        batch = OutboxBatch(self._next_batch_id, kind, name, text, markup, expires_at, recipients, reply_markup)
+        self._next_batch_id += 1
+        if not recipients:
+            return batch.report
+        if expires_at is not None and self.now() >= expires_at:
+            self.expired += len(recipients)
+            self.dropped += len(recipients)
+            return batch.report
+        self.batches[batch.batch_id] = batch
+        await self._write([batch.to_record()])
+        report = batch.report
+        started_at = time_module.monotonic()
+        semaphore = asyncio.Semaphore(self.broadcaster.concurrency)
+
+        async def attempt_limited(chat_id):
+            async with semaphore:
+                # Срок проверен при постановке в очередь: первая попытка идет сразу, даже если часы планировщика
+                # (виртуальные в бенчмарках) ушли вперед, пока рассылка записывалась на диск
+                await self._attempt(batch, chat_id, 0, check_expiry=False)
+
+        await asyncio.gather(*(attempt_limited(chat_id) for chat_id in recipients))
+        report.duration = time_module.monotonic() - started_at
+        logger.info(
+            f"Рассылка '{name}' (очередь): отправлено {report.sent}/{report.total}, ошибок {report.failed}, "
+            f"повторов {report.retries}, в очереди на повтор {len(batch.pending)}, время {report.duration:.2f} сек.")
+        if self.broadcaster.metrics is not None:
+            self.broadcaster.metrics.observe_broadcast(kind, report)
+        self._wakeup.set()  # Фоновая задача запишет итоги и запланирует повторы
+        return report
+
+    async def _attempt(self, batch: OutboxBatch, chat_id: int, attempt: int, check_expiry: bool = True):
+        """Одна попытка доставки сообщения рассылки batch в чат chat_id."""
+        report = batch.report
+        if chat_id in self.dead:
+            self._finish(batch, chat_id, "dropped")
+            return
+        if check_expiry and batch.expires_at is not None and self.now() >= batch.expires_at:
+            self.expired += 1
+            self._finish(batch, chat_id, "dropped")
+            return
+        broadcaster = self.broadcaster
+        await broadcaster.chat_limiter.acquire(chat_id)
+        await broadcaster.global_limiter.acquire()
+        try:
+            await broadcaster.bot.send_message(chat_id, batch.text, reply_markup=batch.reply_markup)
+        except TelegramRetryAfter as e:
+            # Telegram просит подождать: пауза для всех отправок, сообщение повторяется после нее
+            logger.warning(f"Превышен лимит Telegram, пауза {e.retry_after} сек. (чат {chat_id})")
+            broadcaster.global_limiter.pause(e.retry_after)
+            report.retries += 1
+            self._schedule(time_module.monotonic() + e.retry_after, batch.batch_id, chat_id, attempt)
+            return
+        except Exception as e:
+            outcome = classify_error(e)
+            if outcome == RETRY and attempt + 1 < self.max_attempts:
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                logger.info(f"Не удалось отправить сообщение пользователю {chat_id} ({e}), "
+                            f"повтор через {delay:.1f} сек. (попытка {attempt + 1})")
+                report.retries += 1
+                self._schedule(time_module.monotonic() + delay, batch.batch_id, chat_id, attempt + 1)
+                return
+            logger.warning(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+            broadcaster.count_failure(type(e).__name__, report)
+            self._finish(batch, chat_id, "dropped")
+            if outcome == DEAD:
+                await self._remove_recipient(chat_id)
+            return
+        report.sent += 1
+        self.delivered += 1
+        self._finish(batch, chat_id, DELIVERED)
+
+    async def _remove_recipient(self, chat_id: int):
+        if chat_id in self.dead:
+            return
+        self.dead.add(chat_id)
+        self.dead_recipients += 1
+        logger.info(f"Пользователь {chat_id} недоступен (заблокировал бота или удален) и исключен из рассылок")
+        if self.on_dead is not None:
+            try:
+                await self.on_dead(chat_id)
+            except Exception as e:
+                logger.error(f"Не удалось удалить недоступного пользователя {chat_id}: {e}")
+
+    def revive(self, chat_id: int):
+        """Пользователь снова написал боту (например, /start после разблокировки): сообщения ему снова отправляются."""
+        self.dead.discard(chat_id)
+
+    def _schedule(self, due: float, batch_id: int, chat_id: int, attempt: int):
+        heapq.heappush(self._retries, (due, next(self._seq), batch_id, chat_id, attempt))
+        self._wakeup.set()
+
+    def _finish(self, batch: OutboxBatch, chat_id: int, outcome: str):
+        if outcome != DELIVERED:
+            self.dropped += 1
+        batch.pending.discard(chat_id)
+        self._outcomes.setdefault((outcome, batch.batch_id), []).append(chat_id)
+        if not batch.pending:
+            self.batches.pop(batch.batch_id, None)
+
+    async def _retry(self, batch_id: int, chat_id: int, attempt: int):
+        batch = self.batches.get(batch_id)
+        if batch is None or chat_id not in batch.pending:
+            return
+        async with self._retry_semaphore:
+            self.retried += 1
+            await self._attempt(batch, chat_id, attempt)
+
+    def _start_due_retries(self):
+        now = time_module.monotonic()
+        while self._retries and self._retries[0][0] <= now:
+            _, _, batch_id, chat_id, attempt = heapq.heappop(self._retries)
+            task = asyncio.create_task(self._retry(batch_id, chat_id, attempt))
+            self._retry_tasks.add(task)
+            task.add_done_callback(self._retry_tasks.discard)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            self._start_due_retries()
+            try:
+                await self.flush()
+            except OSError as e:
+                logger.error(f"Не удалось записать итоги доставки в {self.path}: {e}")
+            timeout = self.flush_interval
+            if self._retries:
+                timeout = min(timeout, max(self._retries[0][0] - time_module.monotonic(), 0.0))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Запускает фоновую доставку: повторы, недоставленное до перезапуска, запись итогов на диск."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def drain(self):
+        """Ждет, пока очередь опустеет (все сообщения доставлены или отброшены). Нужна запущенная start."""
+        while self.batches or self._retry_tasks:
+            await asyncio.sleep(0.01)
+        await self.flush()
+
+    async def stop(self):
+        """Останавливает доставку и записывает итоги; недоставленное остается в файле до следующего запуска."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._retry_tasks):
+            task.cancel()
+        await asyncio.gather(*self._retry_tasks, return_exceptions=True)
+        await self.flush()
+        if self.batches:
+            logger.info(f"В очереди {self.path} осталось недоставленных сообщений: {self.pending_count} "
+                        f"в {len(self.batches)} рассылках; они будут доставлены после запуска")
+
+    def metrics(self) -> dict:
+        return {
+            "pending": self.pending_count,
+            "batches": len(self.batches),
+            "retry_queue": self.retry_queue,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "expired": self.expired,
+            "dead_recipients": self.dead_recipients,
+            "restored": self.restored,
+            "bytes_written": self.bytes_written,
+        }
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time as time_module
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 1.0  # Секунд между сохранениями: все изменения за это время пишутся одной записью на диск
+
+
+def snapshot_state(user_ids, practice_slots, sent_notifications):
+    """
+    Делает копию состояния, которую можно безопасно сериализовать в другом потоке,
+    пока обработчики в цикле событий продолжают менять оригинал.
+    """
+    return set(user_ids), {key: value.copy() for key, value in practice_slots.items()}, sent_notifications.copy()
+
+
+class PersistenceWriter:
+    """
+    Фоновое сохранение состояния вне цикла событий.
+    Обработчики только передают записи об изменениях (submit) и сразу продолжают работу.
+    Фоновая задача ждет interval секунд после первого изменения, собирает все накопившиеся записи
+    и сохраняет их одним вызовом хранилища в отдельном потоке. Так десятки нажатий во время записи
+    на практику превращаются в одну запись на диск, а диспетчер не простаивает на вводе-выводе.
+    """
+
+    def __init__(self, storage, get_state, interval: float = DEFAULT_FLUSH_INTERVAL, metrics=None):
+        self.storage = storage
+        self.get_state = get_state    # Функция, возвращающая (user_ids, practice_slots, sent_notifications)
+        self.interval = interval
+        self.bot_metrics = metrics    # metrics.BotMetrics или None
+        self._pending = []            # Записи, еще не сохраненные на диск
+        self._dirty = asyncio.Event() # Есть несохраненные изменения
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        # Метрики
+        self.flushes = 0              # Сколько раз состояние записывалось на диск
+        self.failed_flushes = 0
+        self.mutations_submitted = 0  # Сколько изменений передано обработчиками
+        self.mutations_flushed = 0    # Сколько изменений записано на диск
+        self.last_flush_latency = 0.0 # Длительность последней записи (сек.)
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+        self.last_flush_bytes = 0     # Байт записано последним сохранением
+
+    def submit(self, records):
+        """Принимает записи об изменениях и помечает состояние как несохраненное. Не блокирует."""
+        if not records:
+            return
+        self._pending.extend(records)
+        self.mutations_submitted += len(records)
+        self._dirty.set()
+
+    def start(self):
+        """Запускает фоновую задачу сохранения."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            # Ждем, пока накопятся изменения (debounce), и сохраняем их разом
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка фонового сохранения состояния: {e}")
+
+    async def flush(self):
+        """Немедленно сохраняет все накопившиеся изменения (в отдельном потоке)."""
+        async with self._flush_lock:
+            if not self._pending:
+                self._dirty.clear()
+                return
+            records, self._pending = self._pending, []
+            self._dirty.clear()
+            # Копия состояния делается здесь, в цикле событий, где его никто не меняет параллельно,
+            # и только если хранилищу нужно полное состояние (JSON файлы, компакция журнала)
+            state = snapshot_state(*self.get_state()) if self.storage.needs_state(records) else (None, None, None)
+            bytes_before = self.storage.bytes_written
+            started = time_module.perf_counter()
+            try:
+                await asyncio.to_thread(self.storage.apply, records, *state)
+            except Exception:
+                # Возвращаем записи в начало очереди, чтобы сохранить их при следующей попытке
+                self._pending[:0] = records
+                self._dirty.set()
+                self.failed_flushes += 1
+                raise
+            latency = time_module.perf_counter() - started
+            self.flushes += 1
+            self.mutations_flushed += len(records)
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.total_flush_latency += latency
+            self.last_flush_bytes = self.storage.bytes_written - bytes_before
+            if self.bot_metrics is not None:
+                self.bot_metrics.observe_persist(self.storage.name, latency, self.last_flush_bytes)
+            logger.debug(f"Сохранено {len(records)} изменений за {latency * 1000:.1f} мс")
+
+    async def stop(self):
+        """Останавливает фоновую задачу и сохраняет все, что еще не записано (вызывается при завершении бота)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        logger.info(f"Фоновое сохранение остановлено. Метрики: {self.metrics()}")
+
+    async def checkpoint(self):
+        """
+        Итоговое сохранение при остановке бота (после stop, когда обработчики уже не меняют состояние):
+        хранилище записывает полное согласованное состояние, например журнал сворачивается в снимок.
+        """
+        state = snapshot_state(*self.get_state())
+        await asyncio.to_thread(self.storage.checkpoint, *state)
+
+    def metrics(self) -> dict:
+        """Метрики сохранения: число записей на диск, объединенных изменений и задержки записи."""
+        return {
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "mutations_submitted": self.mutations_submitted,
+            "mutations_flushed": self.mutations_flushed,
+            # Изменения, которые не потребовали отдельной записи на диск благодаря объединению
+            "mutations_coalesced": self.mutations_flushed - self.flushes,
+            "pending": len(self._pending),
+            "bytes_written": self.storage.bytes_written,
+            "last_flush_bytes": self.last_flush_bytes,
+            "last_flush_latency_ms": round(self.last_flush_latency * 1000, 3),
+            "max_flush_latency_ms": round(self.max_flush_latency * 1000, 3),
+            "avg_flush_latency_ms": round(self.total_flush_latency / self.flushes * 1000, 3) if self.flushes else 0.0,
+        }
@@ -0,0 +1,343 @@
+import asyncio
+import logging
+import sys
+import threading
+import time as time_module
+import traceback
+import tracemalloc
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_UPDATE = 1.0        # Обновления дольше (сек.) пишутся в лог с разбивкой времени
+DEFAULT_STALL_THRESHOLD = 0.1    # Цикл событий, занятый дольше (сек.), считается зависшим
+DEFAULT_SAMPLE_INTERVAL = 0.005  # Интервал (сек.) между снимками стека при профилировании
+MAX_PROFILE_SECONDS = 120.0
+RECENT_TRACES = 200              # Сколько последних трасс обновлений хранится
+RECENT_STALLS = 20               # Сколько последних зависаний (со стеками) хранится
+TRACE_PARTS = ("total", "handler", "persist", "telegram_api")
+
+# Трасса обновления, которое сейчас обрабатывается в этой задаче (None вне обработки обновления)
+current_trace = ContextVar("current_trace", default=None)
+
+
+class UpdateTrace:
+    """
+    Время обработки одного обновления: всего, на сохранение состояния и на вызовы Telegram API.
+    Остальное (handler) — собственное время обработчиков, включая ожидание замков и цикла событий.
+    """
+    __slots__ = ("update_id", "event_type", "started", "total", "persist", "telegram_api", "api_calls", "finished")
+
+    def __init__(self, update_id, event_type: str):
+        self.update_id = update_id
+        self.event_type = event_type
+        self.started = time_module.perf_counter()
+        self.total = 0.0
+        self.persist = 0.0
+        self.telegram_api = 0.0
+        self.api_calls = 0
+        self.finished = False
+
+    @property
+    def handler(self) -> float:
+        return max(self.total - self.persist - self.telegram_api, 0.0)
+
+    def to_dict(self) -> dict:
+        return {
+            "update_id": self.update_id,
+            "event_type": self.event_type,
+            "total_ms": round(self.total * 1000, 3),
+            "handler_ms": round(self.handler * 1000, 3),
+            "persist_ms": round(self.persist * 1000, 3),
+            "telegram_api_ms": round(self.telegram_api * 1000, 3),
+            "api_calls": self.api_calls,
+        }
+
+
+class UpdateTracer:
+    """
+    Трассировка обновлений: внешний middleware диспетчера (tracing_middleware) засекает время от получения
+    обновления до конца обработки, а span("persist") и middleware сессии бота (api_middleware) добавляют
+    к трассе текущего обновления время сохранения и вызовов Telegram API.
+    Медленные обновления пишутся в лог, разбивка времени учитывается в метриках (если переданы).
+    """
+
+    def __init__(self, metrics=None, slow_threshold: float = DEFAULT_SLOW_UPDATE, keep: int = RECENT_TRACES):
+        self.slow_threshold = slow_threshold
+        self.recent = deque(maxlen=keep)
+        self.slowest = None
+        self._histogram = None
+        if metrics is not None:
+            self._histogram = metrics.registry.histogram(
+                "bot_update_seconds", "Время обработки обновления по частям.", labels=("part",))
+
+    @contextmanager
+    def span(self, part: str):
+        """Добавляет время блока к части part ("persist" или "telegram_api") трассы текущего обновления."""
+        trace = current_trace.get()
+        started = time_module.perf_counter()
+        try:
+            yield
+        finally:
+            # Задачи, созданные обработчиком (например, живое обновление карты мест), наследуют трассу,
+            # но к завершенной трассе их время не относится
+            if trace is not None and not trace.finished:
+                setattr(trace, part, getattr(trace, part) + time_module.perf_counter() - started)
+                if part == "telegram_api":
+                    trace.api_calls += 1
+
+    def finish(self, trace: UpdateTrace):
+        trace.total = time_module.perf_counter() - trace.started
+        trace.finished = True
+        self.recent.append(trace)
+        if self.slowest is None or trace.total > self.slowest.total:
+            self.slowest = trace
+        if self._histogram is not None:
+            for part in TRACE_PARTS:
+                self._histogram.observe(getattr(trace, part), part=part)
+        if trace.total >= self.slow_threshold:
+            logger.warning(f"Медленное обновление: {trace.to_dict()}")
+
+    @property
+    def tracing_middleware(self):
+        return _TracingMiddleware(self)
+
+    @property
+    def api_middleware(self):
+        return _ApiTimingMiddleware(self)
+
+    def report(self) -> dict:
+        return {
+            "recent": [trace.to_dict() for trace in self.recent],
+            "slowest": self.slowest.to_dict() if self.slowest is not None else None,
+        }
+
+
+class _TracingMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: открывает трассу обновления на время всей обработки."""
+
+    def __init__(self, tracer: UpdateTracer):
+        self.tracer = tracer
+
+    async def __call__(self, handler, event, data):
+        trace = UpdateTrace(getattr(event, "update_id", None), getattr(event, "event_type", "unknown"))
+        token = current_trace.set(trace)
+        try:
+            return await handler(event, data)
+        finally:
+            current_trace.reset(token)
+            self.tracer.finish(trace)
+
+
+class _ApiTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: учитывает время каждого запроса к Telegram API в трассе текущего обновления."""
+
+    def __init__(self, tracer: UpdateTracer):
+        self.tracer = tracer
+
+    async def __call__(self, make_request, bot, method):
+        with self.tracer.span("telegram_api"):
+            return await make_request(bot, method)
+
+
+class StallWatchdog:
+    """
+    Обнаруживает зависания цикла событий. Задача в цикле событий отмечается каждые threshold / 4 секунд,
+    а отдельный поток проверяет отметку: если цикл не отмечался дольше threshold, поток снимает стек
+    потока цикла событий — то есть код, который его блокирует (например, синхронный json.dump), — и пишет
+    его в лог. Одно зависание записывается один раз, сколько бы оно ни длилось.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_STALL_THRESHOLD, metrics=None, keep: int = RECENT_STALLS):
+        self.threshold = threshold
+        self.stalls = deque(maxlen=keep)  # Последние зависания: длительность на момент обнаружения и стек
+        self.stall_count = 0
+        self._beat = 0.0
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._counter = None
+        if metrics is not None:
+            self._counter = metrics.registry.counter("bot_loop_stalls_total", "Зависания цикла событий.")
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time_module.perf_counter()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="stall-watchdog", daemon=True)
+        self._thread.start()
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time_module.perf_counter()
+            await asyncio.sleep(self.threshold / 4)
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stop.wait(self.threshold / 4):
+            beat = self._beat
+            stalled_for = time_module.perf_counter() - beat
+            if stalled_for < self.threshold or beat == reported_beat:
+                continue
+            reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            self.stall_count += 1
+            self.stalls.append({"stalled_ms": round(stalled_for * 1000, 1), "at": time_module.time(), "stack": stack})
+            if self._counter is not None:
+                self._counter.inc()
+            logger.warning(f"Цикл событий заблокирован дольше {stalled_for * 1000:.0f} мс. Стек:\n{stack}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+class SamplingProfiler:
+    """
+    Профилировщик по выборкам: отдельный поток раз в interval секунд снимает стек потока цикла событий
+    и считает, сколько раз встретился каждый стек. Результат — в формате "свернутых стеков"
+    (функция;функция;функция количество), который понимают flamegraph.pl и speedscope.
+    Бот при этом не останавливается, а накладные расходы ограничены частотой выборок.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = asyncio.Lock()  # Одновременно идет только одно профилирование
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, seconds: float) -> str:
+        async with self._lock:
+            loop_thread_id = threading.get_ident()
+            samples = await asyncio.to_thread(self._sample, loop_thread_id, min(seconds, MAX_PROFILE_SECONDS))
+        return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+    def _sample(self, thread_id: int, seconds: float) -> Counter:
+        samples = Counter()
+        deadline = time_module.perf_counter() + seconds
+        while time_module.perf_counter() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]})")
+                    frame = frame.f_back
+                samples[";".join(reversed(stack))] += 1
+            time_module.sleep(self.interval)
+        return samples
+
+
+class MemorySnapshots:
+    """
+    Снимки памяти tracemalloc по запросу. Первый вызов включает tracemalloc (до этого он ничего не стоит),
+    следующие возвращают места, где выделено больше всего памяти, и прирост с прошлого снимка.
+    """
+
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self._previous = None
+
+    def snapshot(self, limit: int = 25) -> str:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._previous = None
+            return "tracemalloc включен. Повторите запрос, чтобы получить снимок.\n"
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>")))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Сейчас выделено {current / 1024:.1f} КиБ, пик {peak / 1024:.1f} КиБ", "", "Больше всего памяти:"]
+        lines.extend(str(stat) for stat in snapshot.statistics("lineno")[:limit])
+        if self._previous is not None:
+            lines.extend(["", "Прирост с прошлого снимка:"])
+            lines.extend(str(stat) for stat in snapshot.compare_to(self._previous, "lineno")[:limit])
+        self._previous = snapshot
+        return "\n".join(lines) + "\n"
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._previous = None
+
+
+class Profiler:
+    """
+    Инструменты профилирования бота: трассировка обновлений, обнаружение зависаний цикла событий,
+    профилирование по выборкам и снимки памяти. Все включается при запуске (install/start),
+    а профиль и снимок памяти запрашиваются во время работы по HTTP (add_routes), без перезапуска бота:
+        GET /debug/profile?seconds=10   — свернутые стеки за 10 секунд
+        GET /debug/tracemalloc          — снимок памяти (первый запрос включает tracemalloc)
+        GET /debug/tracemalloc?stop=1   — выключить tracemalloc
+        GET /debug/stalls               — последние зависания цикла событий со стеками
+        GET /debug/traces               — последние и самое медленное обновления с разбивкой времени
+    """
+
+    def __init__(self, metrics=None, slow_update: float = DEFAULT_SLOW_UPDATE,
+                 stall_threshold: float = DEFAULT_STALL_THRESHOLD):
+        self.tracer = UpdateTracer(metrics, slow_threshold=slow_update)
+        self.watchdog = StallWatchdog(stall_threshold, metrics=metrics)
+        self.sampler = SamplingProfiler()
+        self.memory = MemorySnapshots()
+
+    def install(self, dispatcher, bot):
+        """Регистрирует трассировку: внешний middleware на все обновления и middleware запросов бота."""
+        dispatcher.update.outer_middleware(self.tracer.tracing_middleware)
+        bot.session.middleware(self.tracer.api_middleware)
+
+    def start(self):
+        self.watchdog.start()
+
+    async def stop(self):
+        await self.watchdog.stop()
+        self.memory.stop()
+
+    def add_routes(self, app: web.Application, prefix: str = "/debug"):
+        app.router.add_get(f"{prefix}/profile", self._handle_profile)
+        app.router.add_get(f"{prefix}/tracemalloc", self._handle_tracemalloc)
+        app.router.add_get(f"{prefix}/stalls", self._handle_stalls)
+        app.router.add_get(f"{prefix}/traces", self._handle_traces)
+
+    async def _handle_profile(self, request: web.Request) -> web.Response:
+        if self.sampler.running:
+            return web.Response(status=409, text="Профилирование уже идет.\n")
+        try:
+            seconds = float(request.query.get("seconds", "10"))
+        except ValueError:
+            return web.Response(status=400, text="seconds должно быть числом.\n")
+        logger.info(f"Профилирование по выборкам на {seconds} сек.")
+        return web.Response(text=await self.sampler.profile(seconds))
+
+    async def _handle_tracemalloc(self, request: web.Request) -> web.Response:
+        if request.query.get("stop") == "1":
+            self.memory.stop()
+            return web.Response(text="tracemalloc выключен.\n")
+        # Снимок и сравнение могут занять заметное время, поэтому выполняются в отдельном потоке
+        return web.Response(text=await asyncio.to_thread(self.memory.snapshot))
+
+    async def _handle_stalls(self, request: web.Request) -> web.Response:
+        return web.json_response({"stall_count": self.watchdog.stall_count, "stalls": list(self.watchdog.stalls)})
+
+    async def _handle_traces(self, request: web.Request) -> web.Response:
+        return web.json_response(self.tracer.report())
@@ -0,0 +1,269 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta
+
+from groups import DEFAULT_GROUP, group_session_key
+from timetable import RUSSIAN_WEEKDAYS, Timetable
+
+logger = logging.getLogger(__name__)
+
+# Типы событий
+EVENT_LECTURE = "lecture"                # Начало лекции
+EVENT_PRACTICE_OPEN = "practice_open"    # Открытие записи на практику
+EVENT_PRACTICE_CLOSE = "practice_close"  # Закрытие записи на практику
+EVENT_DAILY_CLEANUP = "daily_cleanup"    # Ежедневная очистка устаревших данных (в полночь)
+
+DEFAULT_GRACE = timedelta(minutes=10)  # Насколько опоздавшее событие еще выполняется, а не пропускается
+DEFAULT_CATCH_UP = timedelta(hours=1)  # За сколько времени до запуска выполняются события, пропущенные за время простоя
+DEFAULT_HORIZON = timedelta(days=2)    # На сколько вперед разворачивается недельное расписание
+MAX_SLEEP = 3600.0                     # Не спим дольше часа: защита от перевода системных часов
+
+
+class Clock:
+    """Настоящие часы. В тестах и бенчмарках подменяются на SimulatedClock."""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+
+class SimulatedClock(Clock):
+    """
+    Виртуальные часы: sleep не ждет, а сразу переводит время вперед.
+    Позволяет прогнать неделю расписания за миллисекунды.
+    """
+
+    def __init__(self, start: datetime):
+        self.current = start
+
+    def now(self) -> datetime:
+        return self.current
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(0)  # Сначала даем поработать остальным задачам (они могут добавить более раннее событие)
+        self.current += timedelta(seconds=max(seconds, 0))
+
+
+@dataclass(order=True)
+class ScheduledEvent:
+    """Конкретное событие расписания с датой и временем."""
+    when: datetime
+    seq: int                                          # Порядок добавления (для событий в одно и то же время)
+    kind: str = field(compare=False)
+    day_name: str = field(compare=False, default="")  # День недели по-русски, например "Понедельник"
+    start_time: time = field(compare=False, default=None)
+    event_type: str = field(compare=False, default="")  # Тип занятия из расписания: "лекция" или "практика"
+    subject_name: str = field(compare=False, default="")
+    session_key: str = field(compare=False, default="")
+    group: str = field(compare=False, default=DEFAULT_GROUP)  # Группа, чье расписание породило событие
+
+    @property
+    def time_str(self) -> str:
+        return self.start_time.strftime('%H:%M') if self.start_time else ""
+
+
+class Timeline:
+    """
+    Отсортированная по времени очередь (куча) конкретных событий.
+    Расписание (Timetable или список (день недели, время, тип, предмет)) заранее скомпилировано
+    в индекс по дням недели и датам исключений и разворачивается в конкретные даты по мере необходимости,
+    на horizon вперед. Кроме занятий в очередь попадают закрытия записи на практики и ежедневная очистка.
+    Вместо одного расписания можно передать словарь ID группы -> расписание: события каждой группы
+    помечаются ее ID, а ключи сессий получают префикс группы (см. groups.group_session_key).
+    """
+
+    def __init__(self, schedule, start: datetime, session_key_for=None):
+        schedules = schedule if isinstance(schedule, dict) else {DEFAULT_GROUP: schedule}
+        self.timetables = {group: self._compile(group_schedule) for group, group_schedule in schedules.items()}
+        self._start = start
+        self._heap = []
+        self._seq = itertools.count()
+        self._generated_until = start.date() - timedelta(days=1)  # Последняя развернутая дата
+        # Функция, строящая ключ сессии практики по (день, время); по умолчанию "Понедельник_12:40"
+        self._session_key_for = session_key_for or (lambda day_name, start_time: f"{day_name}_{start_time.strftime('%H:%M')}")
+
+    @staticmethod
+    def _compile(schedule) -> Timetable:
+        return schedule if isinstance(schedule, Timetable) else Timetable.from_entries(schedule)
+
+    @property
+    def timetable(self) -> Timetable:
+        """Расписание группы по умолчанию (или единственной группы)."""
+        return self.timetables.get(DEFAULT_GROUP) or next(iter(self.timetables.values()))
+
+    def _expand_day(self, date):
+        midnight = datetime.combine(date, time(0, 0))
+        if midnight >= self._start:
+            self.push(EVENT_DAILY_CLEANUP, midnight)
+        self._expand_classes(date, self._start)
+
+    def _expand_classes(self, date, not_before: datetime, groups=None):
+        for group in (groups if groups is not None else self.timetables):
+            self._expand_group_classes(group, date, not_before)
+
+    def _expand_group_classes(self, group: str, date, not_before: datetime):
+        day_name = RUSSIAN_WEEKDAYS[date.weekday()]
+        for start_time, event_type, subject_name in self.timetables[group].entries_for(date):
+            when = datetime.combine(date, start_time)
+            if when < not_before:
+                continue  # События до начала работы планировщика (или до перезагрузки расписания) не выполняются
+            if event_type == "лекция":
+                kind = EVENT_LECTURE
+            elif event_type == "практика":
+                kind = EVENT_PRACTICE_OPEN
+            else:
+                logger.warning(f"Неизвестный тип занятия в расписании: {event_type}")
+                continue
+            session_key = group_session_key(group, self._session_key_for(day_name, start_time))
+            self.push(kind, when, day_name=day_name, start_time=start_time, event_type=event_type,
+                      subject_name=subject_name, session_key=session_key, group=group)
+
+    def ensure(self, until: datetime):
+        """Разворачивает расписание в конкретные события по дату until включительно."""
+        while self._generated_until < until.date():
+            self._generated_until += timedelta(days=1)
+            self._expand_day(self._generated_until)
+
+    def replace_timetable(self, timetable: Timetable, now: datetime, group: str = DEFAULT_GROUP):
+        """
+        Заменяет расписание группы на ходу: ее будущие лекции и открытия записи убираются из очереди,
+        и уже развернутые дни разворачиваются заново по новому расписанию (остальные группы не затрагиваются).
+        Закрытия записи и очистки остаются как есть.
+        """
+        self.timetables[group] = timetable
+        self._heap = [event for event in self._heap
+                      if event.kind not in (EVENT_LECTURE, EVENT_PRACTICE_OPEN) or event.when < now
+                      or event.group != group]
+        heapq.heapify(self._heap)
+        not_before = max(now, self._start)
+        date = not_before.date()
+        while date <= self._generated_until:
+            self._expand_classes(date, not_before, groups=(group,))
+            date += timedelta(days=1)
+
+    def push(self, kind: str, when: datetime, **details) -> ScheduledEvent:
+        event = ScheduledEvent(when, next(self._seq), kind, **details)
+        heapq.heappush(self._heap, event)
+        return event
+
+    def peek(self):
+        return self._heap[0] if self._heap else None
+
+    def pop(self) -> ScheduledEvent:
+        return heapq.heappop(self._heap)
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class EventScheduler:
+    """
+    Планировщик событий расписания: спит ровно до ближайшего события, а не опрашивает расписание.
+    Событие, обнаруженное с опозданием (например, цикл событий был занят долгой рассылкой),
+    выполняется, если опоздание не больше grace; иначе пропускается с записью в лог.
+    Закрытия записи выполняются при любом опоздании.
+    handler(event) вызывается для каждого события в отдельной задаче, поэтому долгая рассылка
+    не задерживает следующие события.
+    События за catch_up до запуска (бот был выключен) выполняются при запуске, независимо от grace:
+    строго по порядку и по одному, чтобы, например, закрытие записи, запланированное открытием, выполнилось
+    после него. Повторно уже выполненные до перезапуска события должен отсеять handler (учет уведомлений).
+    Когда пропущенные события выполнены, устанавливается recovered.
+    schedule — расписание или словарь ID группы -> расписание (см. Timeline).
+    """
+
+    def __init__(self, schedule, handler, clock: Clock = None, grace: timedelta = DEFAULT_GRACE,
+                 horizon: timedelta = DEFAULT_HORIZON, start: datetime = None, session_key_for=None,
+                 catch_up: timedelta = None):
+        self.handler = handler
+        self.clock = clock or Clock()
+        self.grace = grace
+        self.horizon = horizon
+        self.booted_at = self.clock.now()
+        self.catch_up = catch_up if catch_up is not None else grace
+        # События в пределах catch_up до запуска тоже выполняются: бот мог быть выключен во время события
+        start = start if start is not None else self.booted_at - max(self.catch_up, grace)
+        self.timeline = Timeline(schedule, start, session_key_for)
+        self._wakeup = asyncio.Event()
+        self._tasks = set()
+        self.recovered = asyncio.Event()  # Пропущенные за время простоя события выполнены
+        self.fired = 0      # Выполнено событий
+        self.skipped = 0    # Пропущено из-за слишком большого опоздания
+        self.caught_up = 0  # Из выполненных — пропущенных за время простоя и выполненных при запуске
+
+    def schedule_close(self, session_key: str, close_at: datetime):
+        """Добавляет закрытие записи на практику session_key в момент close_at."""
+        self.timeline.push(EVENT_PRACTICE_CLOSE, close_at, session_key=session_key)
+        self._wakeup.set()  # Новое событие может оказаться раньше того, до которого спит планировщик
+
+    def reload(self, timetable: Timetable, group: str = DEFAULT_GROUP):
+        """Переходит на новое расписание группы без перезапуска (см. Timeline.replace_timetable)."""
+        self.timeline.replace_timetable(timetable, self.clock.now(), group)
+        self._wakeup.set()  # Ближайшее событие могло измениться
+
+    async def _sleep(self, seconds: float):
+        """Спит seconds секунд или до появления нового события (schedule_close, reload)."""
+        self._wakeup.clear()
+        sleep_task = asyncio.create_task(self.clock.sleep(seconds))
+        wakeup_task = asyncio.create_task(self._wakeup.wait())
+        done, pending = await asyncio.wait({sleep_task, wakeup_task}, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+
+    def _dispatch(self, event: ScheduledEvent):
+        task = asyncio.create_task(self._run_handler(event))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_handler(self, event: ScheduledEvent):
+        try:
+            await self.handler(event)
+        except Exception as e:
+            logger.exception(f"Ошибка при обработке события {event.kind} ({event.session_key or event.subject_name}): {e}")
+
+    async def run_until(self, until: datetime = None):
+        """Выполняет события по порядку. Без until работает бесконечно."""
+        while True:
+            now = self.clock.now()
+            if until is not None and now >= until:
+                break
+            self.timeline.ensure(now + self.horizon)
+            event = self.timeline.peek()
+            if not self.recovered.is_set() and (event is None or event.when >= self.booted_at):
+                self.recovered.set()
+                logger.info(f"Пропущенные за время простоя события выполнены: {self.caught_up}")
+            if event is None or event.when > now:
+                target = event.when if event is not None else now + self.horizon
+                if until is not None:
+                    target = min(target, until)
+                await self._sleep(min((target - now).total_seconds(), MAX_SLEEP))
+                continue
+            self.timeline.pop()
+            lateness = now - event.when
+            if event.when < self.booted_at:
+                # Событие пропущено, пока бот был выключен: выполняется сразу и до следующего события
+                self.fired += 1
+                self.caught_up += 1
+                logger.info(f"Выполняется пропущенное событие {event.kind} {event.day_name} {event.time_str} "
+                            f"{event.subject_name or event.session_key} ({event.when})")
+                await self._run_handler(event)
+                continue
+            if event.kind != EVENT_PRACTICE_CLOSE and lateness > self.grace:
+                self.skipped += 1
+                logger.warning(f"Событие {event.kind} {event.day_name} {event.time_str} {event.subject_name} "
+                               f"пропущено: опоздание {lateness}")
+                continue
+            if lateness > timedelta(seconds=5):
+                logger.info(f"Событие {event.kind} {event.subject_name or event.session_key} выполняется "
+                            f"с опозданием {lateness}")
+            self.fired += 1
+            self._dispatch(event)
+
+    async def drain(self):
+        """Ждет завершения уже запущенных обработчиков событий."""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
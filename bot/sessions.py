@@ -0,0 +1,179 @@
+from datetime import datetime
+
+DEFAULT_CAPACITY = 33  # Количество мест на практике, если в сохраненных данных оно не указано
+SERIALIZATION_VERSION = 1
+
+
+class PracticeSession:
+    """
+    Сессия записи на практику.
+    Места хранятся в массиве фиксированного размера (индекс — номер места, значение — ID владельца),
+    а обратный словарь user_id -> место позволяет сразу найти место пользователя.
+    Занять, освободить и перенести место — O(1), список записавшихся — O(число занятых мест).
+    Свободные места отмечены битами целого числа (бит i — место i свободно), поэтому первое свободное место,
+    в том числе в предпочтительной зоне, находится несколькими операциями над числом, без перебора мест.
+    version увеличивается при каждом изменении мест (по ней можно понять, что клавиатуру пора перерисовать).
+    Время записи пользователя (для архива посещаемости) хранится, если оно известно: при переходе на другое
+    место остается время первой записи, при отмене записи удаляется.
+    """
+    __slots__ = ("key", "subject_name", "open_time", "capacity", "version", "_owners", "_seat_of", "_booked_at",
+                 "_free")
+
+    def __init__(self, key: str, subject_name: str, open_time: datetime, capacity: int = DEFAULT_CAPACITY):
+        self.key = key                    # Ключ сессии, например "Понедельник_12:40"
+        self.subject_name = subject_name
+        self.open_time = open_time        # Когда открылась запись
+        self.capacity = capacity
+        self.version = 0
+        self._owners = [None] * (capacity + 1)  # _owners[место] = user_id или None (индекс 0 не используется)
+        self._seat_of = {}                      # user_id -> номер места
+        self._booked_at = {}                    # user_id -> время записи (datetime)
+        self._free = (1 << (capacity + 1)) - 2  # Биты 1..capacity: свободные места
+
+    def is_valid_seat(self, seat: int) -> bool:
+        return 1 <= seat <= self.capacity
+
+    def owner(self, seat: int):
+        """ID пользователя, занявшего место seat, или None."""
+        return self._owners[seat] if self.is_valid_seat(seat) else None
+
+    def seat_of(self, user_id: int):
+        """Номер места пользователя user_id или None."""
+        return self._seat_of.get(user_id)
+
+    def first_free_seat(self, zone=None):
+        """
+        Свободное место с наименьшим номером или None, если свободных мест нет.
+        zone — предпочтительная зона (первое, последнее место): место ищется сначала в ней, затем во всей сессии.
+        """
+        free = self._free
+        if zone is not None:
+            first, last = zone
+            in_zone = free & ((1 << (last + 1)) - (1 << first))
+            if in_zone:
+                free = in_zone
+        # Младший установленный бит
+        return (free & -free).bit_length() - 1 if free else None
+
+    @property
+    def free_count(self) -> int:
+        return self.capacity - len(self._seat_of)
+
+    def book(self, seat: int, user_id: int):
+        """
+        Записывает пользователя на место seat. Если у пользователя уже было другое место, оно освобождается.
+        Возвращает номер прежнего места пользователя (или None).
+        ValueError, если места не существует или оно занято другим пользователем.
+        """
+        if not self.is_valid_seat(seat):
+            raise ValueError(f"Места #{seat} нет в сессии {self.key}")
+        current_owner = self._owners[seat]
+        if current_owner is not None and current_owner != user_id:
+            raise ValueError(f"Место #{seat} в сессии {self.key} уже занято")
+        previous_seat = self._seat_of.get(user_id)
+        if previous_seat == seat:
+            return previous_seat
+        if previous_seat is not None:
+            self._owners[previous_seat] = None
+            self._free |= 1 << previous_seat
+        self._owners[seat] = user_id
+        self._free &= ~(1 << seat)
+        self._seat_of[user_id] = seat
+        self.version += 1
+        return previous_seat
+
+    def release(self, user_id: int):
+        """Освобождает место пользователя. Возвращает номер освобожденного места (или None, если места не было)."""
+        seat = self._seat_of.pop(user_id, None)
+        if seat is not None:
+            self._owners[seat] = None
+            self._free |= 1 << seat
+            self._booked_at.pop(user_id, None)
+            self.version += 1
+        return seat
+
+    def set_bookings(self, bookings):
+        """
+        Заменяет все места парами (место, user_id), например свежими данными из общего хранилища.
+        version увеличивается, только если места действительно изменились.
+        """
+        seat_of = {user_id: seat for seat, user_id in bookings}
+        if seat_of == self._seat_of:
+            return
+        self._owners = [None] * (self.capacity + 1)
+        self._free = (1 << (self.capacity + 1)) - 2
+        for user_id, seat in seat_of.items():
+            self._owners[seat] = user_id
+            self._free &= ~(1 << seat)
+        self._seat_of = seat_of
+        self._booked_at = {user_id: at for user_id, at in self._booked_at.items() if user_id in seat_of}
+        self.version += 1
+
+    def mark_booked_at(self, user_id: int, at: datetime):
+        """Запоминает время записи пользователя (если у него есть место и время еще не известно)."""
+        if user_id in self._seat_of:
+            self._booked_at.setdefault(user_id, at)
+
+    def booked_at(self, user_id: int):
+        """Время записи пользователя или None, если оно неизвестно."""
+        return self._booked_at.get(user_id)
+
+    def booked_user_ids(self):
+        """ID всех записавшихся пользователей."""
+        return list(self._seat_of)
+
+    def bookings(self):
+        """Пары (место, user_id) для всех занятых мест."""
+        return [(seat, user_id) for user_id, seat in self._seat_of.items()]
+
+    @property
+    def booked_count(self) -> int:
+        return len(self._seat_of)
+
+    def copy(self):
+        """Независимая копия сессии (для сохранения в другом потоке)."""
+        clone = PracticeSession(self.key, self.subject_name, self.open_time, self.capacity)
+        clone.version = self.version
+        clone._owners = self._owners.copy()
+        clone._seat_of = self._seat_of.copy()
+        clone._booked_at = self._booked_at.copy()
+        clone._free = self._free
+        return clone
+
+    def to_dict(self) -> dict:
+        """Представление для сохранения в JSON. Номера мест — строки, так как ключи JSON всегда строки."""
+        return {
+            "v": SERIALIZATION_VERSION,
+            "subject_name": self.subject_name,
+            "open_time": self.open_time.isoformat(),
+            "capacity": self.capacity,
+            "seats": {str(seat): user_id for user_id, seat in self._seat_of.items()},
+            "booked_at": {str(user_id): at.isoformat() for user_id, at in self._booked_at.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, key: str, data: dict):
+        """
+        Восстанавливает сессию из to_dict().
+        Понимает и старый формат practice_slots.json, где номера мест лежали прямо в словаре сессии
+        рядом с "open_time" и "subject_name" (и не было версии "v").
+        Сессия в формате более новой версии не читается (ValueError): ее поля могли изменить смысл.
+        """
+        version = data.get("v")
+        if version is not None and version != SERIALIZATION_VERSION:
+            raise ValueError(f"неизвестная версия формата сессии {version!r} (поддерживается {SERIALIZATION_VERSION})")
+        open_time = data["open_time"]
+        if isinstance(open_time, str):
+            open_time = datetime.fromisoformat(open_time)
+        session = cls(key, data.get("subject_name", key.replace('_', ' ')), open_time,
+                      data.get("capacity", DEFAULT_CAPACITY))
+        if "seats" in data:
+            seats = data["seats"].items()
+        else:  # Старый формат: {"open_time": ..., "subject_name": ..., "1": user_id, ...}
+            seats = ((k, v) for k, v in data.items() if k not in ("open_time", "subject_name"))
+        for seat, user_id in seats:
+            session.book(int(seat), user_id)
+        for user_id, at in data.get("booked_at", {}).items():
+            session.mark_booked_at(int(user_id), datetime.fromisoformat(at))
+        session.version = 0
+        return session
@@ -0,0 +1,544 @@
+import asyncio
+import logging
+import time as time_module
+from datetime import datetime
+
+from groups import SubscriptionIndex
+from sessions import PracticeSession
+
+try:  # Redis нужен только для режима STATE_STORE=redis: pip install redis
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+# Результаты нажатия на место
+SEAT_CLAIMED = "claimed"    # Пользователь занял свободное место
+SEAT_MOVED = "moved"        # Пользователь перешел на другое место (прежнее освобождено)
+SEAT_RELEASED = "released"  # Пользователь нажал на свое место и отменил запись
+SEAT_TAKEN = "taken"        # Место уже занято другим пользователем
+SEAT_REJECTED = "rejected"  # Хранилище отвергло изменение (например, место занято в базе)
+SESSION_CLOSED = "closed"   # Запись на практику уже закрыта
+SEAT_INVALID = "invalid"    # Такого места в сессии нет
+SEAT_KEPT = "kept"          # "Любое свободное место": у пользователя уже есть место, оно остается за ним
+SESSION_FULL = "full"       # "Любое свободное место": свободных мест нет
+
+DEFAULT_LEASE_TTL = 15.0  # Секунд, на которые выдается аренда лидера (продлевается каждые ttl/3 секунд)
+REDIS_IMPORT_BATCH = 1000 # Сколько ID добавляется одной командой SADD при переносе пользователей в Redis
+
+
+def toggle_seat_in_session(session: PracticeSession, seat: int, user_id: int):
+    """
+    Нажатие на место в сессии: свободное место занимается (прежнее место пользователя освобождается),
+    свое место освобождается. Возвращает (результат, прежнее место пользователя).
+    """
+    if not session.is_valid_seat(seat):
+        return SEAT_INVALID, None
+    owner = session.owner(seat)
+    if owner == user_id:
+        session.release(user_id)
+        return SEAT_RELEASED, None
+    if owner is not None:
+        return SEAT_TAKEN, None
+    previous_seat = session.book(seat, user_id)
+    return (SEAT_CLAIMED, None) if previous_seat is None else (SEAT_MOVED, previous_seat)
+
+
+def claim_any_seat_in_session(session: PracticeSession, user_id: int, zone=None):
+    """
+    "Любое свободное место": пользователь без места получает свободное место с наименьшим номером
+    (сначала в зоне zone — (первое, последнее место), если она задана). Возвращает (результат, место).
+    """
+    seat = session.seat_of(user_id)
+    if seat is not None:
+        return SEAT_KEPT, seat
+    seat = session.first_free_seat(zone)
+    if seat is None:
+        return SESSION_FULL, None
+    session.book(seat, user_id)
+    return SEAT_CLAIMED, seat
+
+
+class StateStore:
+    """
+    Общее состояние записи на практики, которое могут разделять несколько процессов бота:
+    зарегистрированные пользователи, их подписки на группы, открытые сессии с местами и аренда лидера.
+    Все операции с местами атомарны внутри хранилища, поэтому два процесса не займут одно место.
+    shared=True означает, что состояние хранится вне процесса (его меняют и другие процессы),
+    и локальные копии сессий нужно обновлять из хранилища.
+    """
+    name = "base"
+    shared = False
+
+    async def add_user(self, user_id: int) -> bool:
+        """Регистрирует пользователя. Возвращает False, если он уже был зарегистрирован."""
+        raise NotImplementedError
+
+    async def user_ids(self):
+        """ID всех зарегистрированных пользователей."""
+        raise NotImplementedError
+
+    async def remove_user(self, user_id: int) -> bool:
+        """Удаляет пользователя и его подписки (сообщения ему не доставляются). False, если его не было."""
+        raise NotImplementedError
+
+    async def import_users(self, user_ids, subscriptions: SubscriptionIndex) -> int:
+        """
+        Переносит в хранилище пользователей и подписки, загруженные с диска (при запуске процесса):
+        иначе после перехода на общее хранилище прежние пользователи не получали бы уведомлений до /start.
+        Уже известные хранилищу пользователи и подписки не меняются, поэтому повторный перенос безопасен.
+        Возвращает число добавленных пользователей.
+        """
+        raise NotImplementedError
+
+    async def subscribe(self, user_id: int, group_id: str) -> bool:
+        """Подписывает пользователя на группу. Возвращает False, если он уже подписан."""
+        raise NotImplementedError
+
+    async def unsubscribe(self, user_id: int, group_id: str) -> bool:
+        """Отписывает пользователя от группы. Возвращает False, если он не был подписан."""
+        raise NotImplementedError
+
+    async def group_members(self, group_id: str):
+        """ID подписчиков группы (аудитория событий ее расписания)."""
+        raise NotImplementedError
+
+    async def user_groups(self, user_id: int):
+        """ID групп, на которые подписан пользователь."""
+        raise NotImplementedError
+
+    async def open_session(self, session: PracticeSession) -> bool:
+        """Открывает запись на практику. Возвращает False, если сессия с этим ключом уже открыта."""
+        raise NotImplementedError
+
+    async def load_session(self, practice_session_key: str):
+        """Открытая сессия с текущими местами или None."""
+        raise NotImplementedError
+
+    async def open_session_keys(self):
+        """Ключи всех открытых сессий."""
+        raise NotImplementedError
+
+    async def toggle_seat(self, practice_session_key: str, seat: int, user_id: int):
+        """Атомарное нажатие на место (см. toggle_seat_in_session). Для закрытой сессии — (SESSION_CLOSED, None)."""
+        raise NotImplementedError
+
+    async def claim_any_seat(self, practice_session_key: str, user_id: int, zone=None):
+        """Атомарно выдает свободное место (см. claim_any_seat_in_session). Для закрытой сессии — (SESSION_CLOSED, None)."""
+        raise NotImplementedError
+
+    async def claim_seat(self, practice_session_key: str, seat: int, user_id: int) -> bool:
+        """Занимает место, только если оно свободно, а у пользователя нет места (для отката изменений)."""
+        raise NotImplementedError
+
+    async def release_seat(self, practice_session_key: str, seat: int, user_id: int) -> bool:
+        """Освобождает место, только если его занимает user_id (для отката изменений)."""
+        raise NotImplementedError
+
+    async def close_session(self, practice_session_key: str):
+        """Атомарно закрывает запись и возвращает сессию с итоговыми местами (или None, если она уже закрыта)."""
+        raise NotImplementedError
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Берет или продлевает аренду name на ttl секунд. False, если аренду держит другой владелец."""
+        raise NotImplementedError
+
+    async def release_lease(self, name: str, owner: str):
+        """Отдает аренду, если ее держит owner."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InProcessStore(StateStore):
+    """
+    Хранилище в памяти процесса. Работает прямо с practice_slots, user_ids и индексом подписок бота,
+    поэтому в режиме одного процесса ничего не копируется. Атомарность обеспечивается тем,
+    что операции не содержат await: их нельзя прервать другой задачей цикла событий.
+    """
+    name = "memory"
+
+    def __init__(self, sessions: dict = None, user_ids: set = None, subscriptions: SubscriptionIndex = None):
+        self.sessions = sessions if sessions is not None else {}
+        self.users = user_ids if user_ids is not None else set()
+        self.subscriptions = subscriptions if subscriptions is not None else SubscriptionIndex()
+        self._leases = {}  # Имя аренды -> (владелец, время окончания по time.monotonic)
+
+    async def add_user(self, user_id: int) -> bool:
+        if user_id in self.users:
+            return False
+        self.users.add(user_id)
+        return True
+
+    async def user_ids(self):
+        return self.users
+
+    async def remove_user(self, user_id: int) -> bool:
+        if user_id not in self.users:
+            return False
+        self.users.discard(user_id)
+        self.subscriptions.remove_user(user_id)
+        return True
+
+    async def import_users(self, user_ids, subscriptions: SubscriptionIndex) -> int:
+        # Обычно это те же user_ids и индекс подписок, с которыми работает хранилище: переносить нечего
+        added = 0
+        if user_ids is not self.users:
+            added = len(self.users)
+            self.users.update(user_ids)
+            added = len(self.users) - added
+        if subscriptions is not self.subscriptions:
+            for group_id, members in subscriptions.to_dict().items():
+                for user_id in members:
+                    self.subscriptions.subscribe(user_id, group_id)
+        return added
+
+    async def subscribe(self, user_id: int, group_id: str) -> bool:
+        return self.subscriptions.subscribe(user_id, group_id)
+
+    async def unsubscribe(self, user_id: int, group_id: str) -> bool:
+        return self.subscriptions.unsubscribe(user_id, group_id)
+
+    async def group_members(self, group_id: str):
+        return self.subscriptions.audience(group_id)
+
+    async def user_groups(self, user_id: int):
+        return self.subscriptions.groups_of(user_id)
+
+    async def open_session(self, session: PracticeSession) -> bool:
+        if session.key in self.sessions:
+            return False
+        self.sessions[session.key] = session
+        return True
+
+    async def load_session(self, practice_session_key: str):
+        return self.sessions.get(practice_session_key)
+
+    async def open_session_keys(self):
+        return list(self.sessions)
+
+    async def toggle_seat(self, practice_session_key: str, seat: int, user_id: int):
+        session = self.sessions.get(practice_session_key)
+        if session is None:
+            return SESSION_CLOSED, None
+        return toggle_seat_in_session(session, seat, user_id)
+
+    async def claim_any_seat(self, practice_session_key: str, user_id: int, zone=None):
+        session = self.sessions.get(practice_session_key)
+        if session is None:
+            return SESSION_CLOSED, None
+        return claim_any_seat_in_session(session, user_id, zone)
+
+    async def claim_seat(self, practice_session_key: str, seat: int, user_id: int) -> bool:
+        session = self.sessions.get(practice_session_key)
+        if session is None or session.owner(seat) is not None or session.seat_of(user_id) is not None:
+            return False
+        session.book(seat, user_id)
+        return True
+
+    async def release_seat(self, practice_session_key: str, seat: int, user_id: int) -> bool:
+        session = self.sessions.get(practice_session_key)
+        if session is None or session.owner(seat) != user_id:
+            return False
+        session.release(user_id)
+        return True
+
+    async def close_session(self, practice_session_key: str):
+        return self.sessions.pop(practice_session_key, None)
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        now = time_module.monotonic()
+        holder = self._leases.get(name)
+        if holder is not None and holder[0] != owner and holder[1] > now:
+            return False
+        self._leases[name] = (owner, now + ttl)
+        return True
+
+    async def release_lease(self, name: str, owner: str):
+        holder = self._leases.get(name)
+        if holder is not None and holder[0] == owner:
+            del self._leases[name]
+
+
+# Lua скрипты выполняются в Redis атомарно: между проверкой и изменением места никто не вклинится.
+# KEYS: сессия (хэш с описанием), места (место -> user_id), обратный индекс (user_id -> место)
+REDIS_TOGGLE_SEAT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return {'closed'} end
+local seat = tonumber(ARGV[1])
+if seat < 1 or seat > tonumber(redis.call('HGET', KEYS[1], 'capacity')) then return {'invalid'} end
+local owner = redis.call('HGET', KEYS[2], ARGV[1])
+if owner == ARGV[2] then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    redis.call('HDEL', KEYS[3], ARGV[2])
+    return {'released'}
+end
+if owner then return {'taken'} end
+local previous = redis.call('HGET', KEYS[3], ARGV[2])
+if previous then redis.call('HDEL', KEYS[2], previous) end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[3], ARGV[2], ARGV[1])
+if previous then return {'moved', previous} end
+return {'claimed'}
+"""
+# Свободное место ищется перебором в Lua: мест в сессии не больше кнопок клавиатуры (100), а перебор идет
+# внутри Redis за один запрос. ARGV: user_id, первое и последнее место зоны (0 0 — без зоны)
+REDIS_CLAIM_ANY_SEAT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return {'closed'} end
+local current = redis.call('HGET', KEYS[3], ARGV[1])
+if current then return {'kept', current} end
+local capacity = tonumber(redis.call('HGET', KEYS[1], 'capacity'))
+local function first_free(first, last)
+    for seat = first, math.min(last, capacity) do
+        if redis.call('HEXISTS', KEYS[2], seat) == 0 then return seat end
+    end
+    return nil
+end
+local seat = nil
+if tonumber(ARGV[2]) > 0 then seat = first_free(tonumber(ARGV[2]), tonumber(ARGV[3])) end
+if not seat then seat = first_free(1, capacity) end
+if not seat then return {'full'} end
+redis.call('HSET', KEYS[2], seat, ARGV[1])
+redis.call('HSET', KEYS[3], ARGV[1], seat)
+return {'claimed', seat}
+"""
+REDIS_CLAIM_SEAT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+if redis.call('HEXISTS', KEYS[2], ARGV[1]) == 1 or redis.call('HEXISTS', KEYS[3], ARGV[2]) == 1 then return 0 end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[3], ARGV[2], ARGV[1])
+return 1
+"""
+REDIS_RELEASE_SEAT = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then return 0 end
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[2])
+return 1
+"""
+REDIS_OPEN_SESSION = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('DEL', KEYS[2], KEYS[3])
+redis.call('HSET', KEYS[1], 'subject_name', ARGV[1], 'open_time', ARGV[2], 'capacity', ARGV[3])
+redis.call('SADD', KEYS[4], ARGV[4])
+return 1
+"""
+REDIS_ACQUIRE_LEASE = """
+local holder = redis.call('GET', KEYS[1])
+if holder and holder ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+REDIS_RELEASE_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+
+class RedisStore(StateStore):
+    """
+    Общее хранилище в Redis для нескольких процессов бота.
+    Сессия — хэш с описанием, места — хэш место -> user_id и обратный хэш user_id -> место,
+    ключи открытых сессий — отдельное множество, подписчики группы и группы пользователя — множества;
+    нажатие на место, откат и открытие сессии выполняются Lua скриптами, закрытие — транзакцией MULTI/EXEC.
+    """
+    name = "redis"
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "practice_bot:"):
+        if redis_asyncio is None:
+            raise RuntimeError("Для STATE_STORE=redis нужен пакет redis (pip install redis)")
+        self.redis = redis_asyncio.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._open_sessions_key = f"{prefix}open_sessions"  # Множество ключей открытых сессий
+        self._toggle = self.redis.register_script(REDIS_TOGGLE_SEAT)
+        self._claim = self.redis.register_script(REDIS_CLAIM_SEAT)
+        self._claim_any = self.redis.register_script(REDIS_CLAIM_ANY_SEAT)
+        self._release = self.redis.register_script(REDIS_RELEASE_SEAT)
+        self._open = self.redis.register_script(REDIS_OPEN_SESSION)
+        self._acquire_lease = self.redis.register_script(REDIS_ACQUIRE_LEASE)
+        self._release_lease = self.redis.register_script(REDIS_RELEASE_LEASE)
+
+    def _session_keys(self, practice_session_key: str):
+        return [f"{self.prefix}session:{practice_session_key}",
+                f"{self.prefix}seats:{practice_session_key}",
+                f"{self.prefix}seat_of:{practice_session_key}"]
+
+    async def add_user(self, user_id: int) -> bool:
+        return await self.redis.sadd(f"{self.prefix}users", user_id) == 1
+
+    async def user_ids(self):
+        return {int(user_id) for user_id in await self.redis.smembers(f"{self.prefix}users")}
+
+    async def remove_user(self, user_id: int) -> bool:
+        groups = await self.redis.smembers(f"{self.prefix}user_groups:{user_id}")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.srem(f"{self.prefix}users", user_id)
+            for group_id in groups:
+                pipe.srem(f"{self.prefix}group:{group_id}", user_id)
+            pipe.delete(f"{self.prefix}user_groups:{user_id}")
+            removed = (await pipe.execute())[0]
+        return removed == 1
+
+    async def import_users(self, user_ids, subscriptions: SubscriptionIndex) -> int:
+        # Команды идут одним конвейером; SADD уже добавленного ID ничего не меняет
+        users = list(user_ids)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for start in range(0, len(users), REDIS_IMPORT_BATCH):
+                pipe.sadd(f"{self.prefix}users", *users[start:start + REDIS_IMPORT_BATCH])
+            for group_id, members in subscriptions.to_dict().items():
+                for start in range(0, len(members), REDIS_IMPORT_BATCH):
+                    pipe.sadd(f"{self.prefix}group:{group_id}", *members[start:start + REDIS_IMPORT_BATCH])
+                for user_id in members:
+                    pipe.sadd(f"{self.prefix}user_groups:{user_id}", group_id)
+            results = await pipe.execute()
+        return sum(results[:(len(users) + REDIS_IMPORT_BATCH - 1) // REDIS_IMPORT_BATCH])
+
+    async def subscribe(self, user_id: int, group_id: str) -> bool:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            added, _ = await (pipe.sadd(f"{self.prefix}group:{group_id}", user_id)
+                              .sadd(f"{self.prefix}user_groups:{user_id}", group_id).execute())
+        return added == 1
+
+    async def unsubscribe(self, user_id: int, group_id: str) -> bool:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            removed, _ = await (pipe.srem(f"{self.prefix}group:{group_id}", user_id)
+                                .srem(f"{self.prefix}user_groups:{user_id}", group_id).execute())
+        return removed == 1
+
+    async def group_members(self, group_id: str):
+        return {int(user_id) for user_id in await self.redis.smembers(f"{self.prefix}group:{group_id}")}
+
+    async def user_groups(self, user_id: int):
+        return set(await self.redis.smembers(f"{self.prefix}user_groups:{user_id}"))
+
+    async def open_session(self, session: PracticeSession) -> bool:
+        return await self._open(keys=[*self._session_keys(session.key), self._open_sessions_key],
+                                args=[session.subject_name, session.open_time.isoformat(), session.capacity,
+                                      session.key]) == 1
+
+    @staticmethod
+    def _build_session(practice_session_key: str, meta: dict, seats: dict):
+        if not meta:
+            return None
+        session = PracticeSession(practice_session_key, meta["subject_name"],
+                                  datetime.fromisoformat(meta["open_time"]), int(meta["capacity"]))
+        session.set_bookings((int(seat), int(user_id)) for seat, user_id in seats.items())
+        return session
+
+    async def load_session(self, practice_session_key: str):
+        session_key, seats_key, _ = self._session_keys(practice_session_key)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            meta, seats = await pipe.hgetall(session_key).hgetall(seats_key).execute()
+        return self._build_session(practice_session_key, meta, seats)
+
+    async def open_session_keys(self):
+        return list(await self.redis.smembers(self._open_sessions_key))
+
+    async def toggle_seat(self, practice_session_key: str, seat: int, user_id: int):
+        result = await self._toggle(keys=self._session_keys(practice_session_key), args=[seat, user_id])
+        previous_seat = int(result[1]) if len(result) > 1 else None
+        return result[0], previous_seat
+
+    async def claim_any_seat(self, practice_session_key: str, user_id: int, zone=None):
+        first, last = zone if zone is not None else (0, 0)
+        result = await self._claim_any(keys=self._session_keys(practice_session_key), args=[user_id, first, last])
+        seat = int(result[1]) if len(result) > 1 else None
+        return result[0], seat
+
+    async def claim_seat(self, practice_session_key: str, seat: int, user_id: int) -> bool:
+        return await self._claim(keys=self._session_keys(practice_session_key), args=[seat, user_id]) == 1
+
+    async def release_seat(self, practice_session_key: str, seat: int, user_id: int) -> bool:
+        return await self._release(keys=self._session_keys(practice_session_key), args=[seat, user_id]) == 1
+
+    async def close_session(self, practice_session_key: str):
+        keys = self._session_keys(practice_session_key)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            meta, seats, _, _ = await (pipe.hgetall(keys[0]).hgetall(keys[1]).delete(*keys)
+                                       .srem(self._open_sessions_key, practice_session_key).execute())
+        return self._build_session(practice_session_key, meta, seats)
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        return await self._acquire_lease(keys=[f"{self.prefix}lease:{name}"], args=[owner, int(ttl * 1000)]) == 1
+
+    async def release_lease(self, name: str, owner: str):
+        await self._release_lease(keys=[f"{self.prefix}lease:{name}"], args=[owner])
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+class LeaderLease:
+    """
+    Аренда лидера: из нескольких процессов бота только один (держатель аренды) выполняет события расписания
+    и рассылки. Аренда продлевается каждые ttl/3 секунд; если лидер упал, через ttl секунд ее берет другой процесс.
+    С хранилищем одного процесса (shared=False) процесс всегда лидер.
+    """
+
+    def __init__(self, store: StateStore, name: str, owner: str, ttl: float = DEFAULT_LEASE_TTL):
+        self.store = store
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+        self._expires_at = 0.0  # До какого момента (time.monotonic) аренда точно наша
+        self._task = None
+
+    @property
+    def is_leader(self) -> bool:
+        return not self.store.shared or time_module.monotonic() < self._expires_at
+
+    async def renew(self) -> bool:
+        """Одна попытка взять или продлить аренду."""
+        was_leader = self.is_leader
+        requested_at = time_module.monotonic()  # Срок отсчитывается от отправки запроса, а не от ответа
+        try:
+            acquired = await self.store.acquire_lease(self.name, self.owner, self.ttl)
+        except Exception as e:
+            logger.warning(f"Не удалось продлить аренду {self.name}: {e}")
+            acquired = False
+        if acquired:
+            self._expires_at = requested_at + self.ttl
+        if acquired and not was_leader:
+            logger.info(f"Процесс {self.owner} стал лидером ({self.name})")
+        elif was_leader and not self.is_leader:
+            logger.warning(f"Процесс {self.owner} больше не лидер ({self.name})")
+        return acquired
+
+    async def _run(self):
+        while True:
+            await self.renew()
+            await asyncio.sleep(self.ttl / 3)
+
+    def start(self):
+        if self.store.shared and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Прекращает продление и отдает аренду, чтобы другой процесс сразу стал лидером."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._expires_at = 0.0
+        try:
+            await self.store.release_lease(self.name, self.owner)
+        except Exception as e:
+            logger.warning(f"Не удалось отдать аренду {self.name}: {e}")
+
+
+def create_state_store(mode: str, sessions: dict = None, user_ids: set = None, redis_url: str = None,
+                       subscriptions: SubscriptionIndex = None) -> StateStore:
+    """
+    Создает общее хранилище по названию режима: "memory" (один процесс) или "redis" (несколько процессов).
+    sessions, user_ids и subscriptions — practice_slots, user_ids и подписки бота (для режима memory).
+    """
+    if mode == "memory":
+        return InProcessStore(sessions, user_ids, subscriptions)
+    if mode == "redis":
+        return RedisStore(redis_url or "redis://localhost:6379/0")
+    raise ValueError(f"Неизвестный режим общего хранилища: {mode}")
@@ -0,0 +1,447 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from journal import Journal
+from ledger import NotificationLedger
+from sessions import DEFAULT_CAPACITY, PracticeSession
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write_json(path: str, data):
+    """
+    Атомарно записывает data в JSON файл: сначала во временный файл рядом, затем fsync и переименование.
+    Читатель (или бот после сбоя) всегда видит либо старую, либо новую целую версию файла.
+    Возвращает размер записанного файла в байтах.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(temp_path, path)
+    return size
+
+
+class StorageBackend:
+    """
+    Базовый класс хранилища состояния бота (user_ids, practice_slots, sent_notifications).
+    load/save работают с полным состоянием, apply — с отдельными изменениями (записями journal.make_record).
+    """
+    name = "base"
+    # True, если apply сам выполняет каждую запись отдельной транзакцией вне цикла событий
+    # и может отвергнуть изменение; такие изменения не копятся в фоновом писателе (см. persistence.py)
+    transactional = False
+    # Сколько байт записано на диск с момента запуска (для метрик; SQLite его не считает)
+    bytes_written = 0
+
+    def load(self):
+        """Возвращает (user_ids, practice_slots, sent_notifications)."""
+        raise NotImplementedError
+
+    def save(self, user_ids_data, practice_slots_data, sent_notifications_data):
+        """Сохраняет полное состояние."""
+        raise NotImplementedError
+
+    def apply(self, records, user_ids_data, practice_slots_data, sent_notifications_data) -> bool:
+        """
+        Сохраняет изменения, описанные записями records (состояние в памяти к этому моменту уже изменено).
+        Возвращает False, если хранилище отвергло изменение (например, место уже занято в базе).
+        По умолчанию просто сохраняет полное состояние.
+        """
+        self.save(user_ids_data, practice_slots_data, sent_notifications_data)
+        return True
+
+    def needs_state(self, records) -> bool:
+        """
+        Нужно ли apply(records) полное состояние. Если нет, вместо него передается None и фоновый писатель
+        не копирует состояние. По умолчанию apply сохраняет полное состояние.
+        """
+        return True
+
+    async def apply_async(self, records, user_ids_data, practice_slots_data, sent_notifications_data) -> bool:
+        """Асинхронная версия apply. Хранилища с блокирующим вводом-выводом выполняют ее в пуле потоков."""
+        return self.apply(records, user_ids_data, practice_slots_data, sent_notifications_data)
+
+    def checkpoint(self, user_ids_data, practice_slots_data, sent_notifications_data):
+        """
+        Итоговое сохранение при остановке бота, когда все изменения уже применены (apply).
+        По умолчанию ничего не делает: JSON файлы и база SQLite уже содержат полное состояние.
+        """
+
+    def close(self):
+        pass
+
+
+class JsonStorage(StorageBackend):
+    """Три JSON файла, которые перезаписываются целиком при каждом сохранении."""
+    name = "json"
+
+    def __init__(self, user_ids_file: str, practice_slots_file: str, sent_notifications_file: str):
+        self.user_ids_file = user_ids_file                     # Файл для хранения ID пользователей
+        self.practice_slots_file = practice_slots_file         # Файл для хранения информации о записи на практики
+        self.sent_notifications_file = sent_notifications_file # Файл для хранения отправленных уведомлений
+
+    def load(self):
+        """
+        Загружает данные (user_ids, practice_slots, sent_notifications) из JSON файлов при запуске бота.
+        Если файлы не существуют или содержат некорректный JSON, инициализирует соответствующую
+        структуру данных пустым значением (set() или dict()).
+        """
+        loaded_user_ids = set()
+        loaded_practice_slots = {}
+        loaded_sent_notifications = NotificationLedger()
+
+        # Загрузка user_ids (множество ID пользователей)
+        try:
+            if os.path.exists(self.user_ids_file): # Проверка существования файла
+                with open(self.user_ids_file, 'r', encoding='utf-8') as f:
+                    # Загрузка из JSON и преобразование в множество
+                    loaded_user_ids = set(json.load(f))
+                logger.info(f"Загружено {len(loaded_user_ids)} user_ids из {self.user_ids_file}")
+        except (json.JSONDecodeError, FileNotFoundError) as e:
+            # Обработка ошибок: если файл не найден или ошибка парсинга JSON
+            logger.warning(f"Не удалось загрузить user_ids из {self.user_ids_file} ({e}). Используется пустое множество.")
+            loaded_user_ids = set() # Инициализация пустым множеством
+
+        # Загрузка practice_slots (словарь с информацией о практиках)
+        try:
+            if os.path.exists(self.practice_slots_file):
+                with open(self.practice_slots_file, 'r', encoding='utf-8') as f:
+                    temp_practice_slots = json.load(f) # Временный словарь для обработки
+                for key, value in temp_practice_slots.items():
+                    try:
+                        # Номера мест и время открытия восстанавливаются в PracticeSession.from_dict
+                        # (поддерживается и старый формат, где места лежали прямо в словаре сессии)
+                        loaded_practice_slots[key] = PracticeSession.from_dict(key, value)
+                    except (KeyError, ValueError, TypeError) as e:
+                        logger.error(f"Ошибка восстановления сессии {key} из practice_slots: {e}. Сессия пропущена.")
+                logger.info(f"Загружено {len(loaded_practice_slots)} записей practice_slots из {self.practice_slots_file}")
+        except (json.JSONDecodeError, FileNotFoundError) as e:
+            logger.warning(
+                f"Не удалось загрузить practice_slots из {self.practice_slots_file} ({e}). Используется пустой словарь.")
+            loaded_practice_slots = {} # Инициализация пустым словарем
+
+        # Загрузка sent_notifications (множество отправленных уведомлений)
+        try:
+            if os.path.exists(self.sent_notifications_file):
+                with open(self.sent_notifications_file, 'r', encoding='utf-8') as f:
+                    # Учет уведомлений по дням (старый формат — список строковых ключей — тоже читается)
+                    loaded_sent_notifications = NotificationLedger.from_dict(json.load(f))
+                logger.info(f"Загружено {len(loaded_sent_notifications)} sent_notifications из {self.sent_notifications_file}")
+        except (json.JSONDecodeError, FileNotFoundError) as e:
+            logger.warning(
+                f"Не удалось загрузить sent_notifications из {self.sent_notifications_file} ({e}). Используется пустой учет.")
+            loaded_sent_notifications = NotificationLedger() # Инициализация пустым учетом
+
+        return loaded_user_ids, loaded_practice_slots, loaded_sent_notifications
+
+    def save(self, user_ids_data, practice_slots_data, sent_notifications_data):
+        """
+        Сохраняет текущее состояние user_ids, practice_slots и sent_notifications в JSON файлы.
+        Множества преобразуются в списки, datetime объекты - в строки ISO формата.
+        """
+        # Каждый файл пишется атомарно: сбой во время записи оставит на диске предыдущую целую версию
+        # Сохранение user_ids
+        try:
+            # Преобразование множества в список для JSON-сериализации
+            self.bytes_written += atomic_write_json(self.user_ids_file, list(user_ids_data))
+            # logger.debug(f"user_ids сохранены в {self.user_ids_file}") # Отладочное сообщение (закомментировано)
+        except IOError as e: # Обработка ошибок ввода-вывода
+            logger.error(f"Ошибка сохранения user_ids в {self.user_ids_file}: {e}")
+
+        # Подготовка и сохранение practice_slots (datetime преобразуется в строку ISO формата в to_dict)
+        practice_slots_to_save = {key: session.to_dict() for key, session in practice_slots_data.items()}
+        try:
+            self.bytes_written += atomic_write_json(self.practice_slots_file, practice_slots_to_save)
+            # logger.debug(f"practice_slots сохранены в {self.practice_slots_file}")
+        except IOError as e:
+            logger.error(f"Ошибка сохранения practice_slots в {self.practice_slots_file}: {e}")
+
+        # Сохранение sent_notifications
+        try:
+            # Преобразование множества в список для JSON-сериализации
+            self.bytes_written += atomic_write_json(self.sent_notifications_file, sent_notifications_data.to_dict())
+            # logger.debug(f"sent_notifications сохранены в {self.sent_notifications_file}")
+        except IOError as e:
+            logger.error(f"Ошибка сохранения sent_notifications в {self.sent_notifications_file}: {e}")
+        # Логирование успешного сохранения всех данных
+        logger.info("Данные сохранены (user_ids, practice_slots, sent_notifications).")
+
+
+class JournalStorage(StorageBackend):
+    """Снимок состояния плюс журнал изменений только на добавление (см. journal.Journal)."""
+    name = "journal"
+
+    def __init__(self, journal: Journal):
+        self.journal = journal
+
+    @property
+    def bytes_written(self) -> int:
+        return self.journal.bytes_written
+
+    def load(self):
+        return self.journal.load()
+
+    def save(self, user_ids_data, practice_slots_data, sent_notifications_data):
+        self.journal.compact(user_ids_data, practice_slots_data, sent_notifications_data)
+
+    def needs_state(self, records) -> bool:
+        # Состояние нужно только для компакции, которую запустит это добавление
+        return self.journal.records_since_snapshot + len(records) >= self.journal.compact_every
+
+    def apply(self, records, user_ids_data, practice_slots_data, sent_notifications_data) -> bool:
+        self.journal.append(records)
+        if self.journal.needs_compaction():
+            self.journal.compact(user_ids_data, practice_slots_data, sent_notifications_data)
+        return True
+
+    def checkpoint(self, user_ids_data, practice_slots_data, sent_notifications_data):
+        # Журнал сворачивается в снимок: следующий запуск читает один файл, не проигрывая изменения
+        if self.journal.records_since_snapshot:
+            self.journal.compact(user_ids_data, practice_slots_data, sent_notifications_data)
+
+    def close(self):
+        self.journal.close()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id       INTEGER PRIMARY KEY,
+    registered_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_key  TEXT NOT NULL,
+    subject_name TEXT NOT NULL,
+    open_time    TEXT NOT NULL,
+    capacity     INTEGER NOT NULL DEFAULT 33,
+    closed_at    TEXT
+);
+-- Одновременно может быть открыта только одна сессия с данным ключом; закрытые остаются в истории
+CREATE UNIQUE INDEX IF NOT EXISTS sessions_open_key ON sessions(session_key) WHERE closed_at IS NULL;
+CREATE INDEX IF NOT EXISTS sessions_open_time ON sessions(open_time);
+CREATE TABLE IF NOT EXISTS bookings (
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    slot       INTEGER NOT NULL,
+    user_id    INTEGER NOT NULL,
+    booked_at  TEXT NOT NULL,
+    UNIQUE (session_id, slot),    -- Одно место — один пользователь
+    UNIQUE (session_id, user_id)  -- Один пользователь — одно место в сессии
+);
+CREATE INDEX IF NOT EXISTS bookings_user ON bookings(user_id);
+-- Отправленные уведомления: (дата, ID записи расписания); старые дни удаляются одним DELETE по дате
+CREATE TABLE IF NOT EXISTS notification_ledger (
+    notification_date TEXT NOT NULL,
+    entry_id          TEXT NOT NULL,
+    PRIMARY KEY (notification_date, entry_id)
+) WITHOUT ROWID;
+"""
+
+
+class SqliteStorage(StorageBackend):
+    """
+    Хранилище в базе SQLite: таблицы пользователей, сессий практик, бронирований мест и отправленных уведомлений.
+    Уникальные ограничения (сессия, место) и (сессия, пользователь) гарантируют на уровне базы,
+    что место занято не более чем одним пользователем, а у пользователя не более одного места в сессии.
+    Каждое изменение — отдельная короткая транзакция. Все обращения к базе идут через пул из одного потока:
+    цикл событий aiogram не блокируется, а порядок записей сохраняется.
+    Закрытые сессии и их бронирования не удаляются, а остаются в базе как история.
+    """
+    name = "sqlite"
+    transactional = True
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-storage")
+        # Соединение создается и используется только в потоке пула
+        self._conn = self._executor.submit(self._connect).result()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")   # Чтение не блокирует запись, запись — это добавление в WAL
+        conn.execute("PRAGMA synchronous=NORMAL") # В режиме WAL это безопасно и намного быстрее FULL
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript(SQLITE_SCHEMA)
+        self._migrate_sent_notifications(conn)
+        return conn
+
+    @staticmethod
+    def _migrate_sent_notifications(conn):
+        """Переносит уведомления из старой таблицы sent_notifications (строковые ключи) в notification_ledger."""
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sent_notifications'").fetchone() is None:
+            return
+        legacy_keys = [row[0] for row in conn.execute("SELECT notification_key FROM sent_notifications")]
+        ledger = NotificationLedger.from_dict(legacy_keys)
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT OR IGNORE INTO notification_ledger(notification_date, entry_id) VALUES (?, ?)",
+                             ledger.entries())
+            conn.execute("DROP TABLE sent_notifications")
+        logger.info(f"Перенесено {len(ledger)} отправленных уведомлений в таблицу notification_ledger")
+
+    def _run(self, func, *args):
+        """Выполняет func в потоке хранилища и ждет результат (для синхронных вызовов)."""
+        return self._executor.submit(func, *args).result()
+
+    def load(self):
+        return self._run(self._load)
+
+    def _load(self):
+        conn = self._conn
+        user_ids = {row[0] for row in conn.execute("SELECT user_id FROM users")}
+        practice_slots = {}
+        session_keys_by_id = {}
+        for session_id, session_key, subject_name, open_time, capacity in conn.execute(
+                "SELECT id, session_key, subject_name, open_time, capacity FROM sessions WHERE closed_at IS NULL"):
+            practice_slots[session_key] = PracticeSession(
+                session_key, subject_name, datetime.fromisoformat(open_time), capacity)
+            session_keys_by_id[session_id] = session_key
+        if session_keys_by_id:
+            for session_id, slot, user_id, booked_at in conn.execute(
+                    "SELECT b.session_id, b.slot, b.user_id, b.booked_at FROM bookings b "
+                    "JOIN sessions s ON s.id = b.session_id WHERE s.closed_at IS NULL"):
+                session = practice_slots[session_keys_by_id[session_id]]
+                session.book(slot, user_id)
+                session.mark_booked_at(user_id, datetime.fromisoformat(booked_at))
+        sent_notifications = NotificationLedger()
+        for notification_date, entry_id in conn.execute("SELECT notification_date, entry_id FROM notification_ledger"):
+            sent_notifications.add(date.fromisoformat(notification_date), entry_id)
+        logger.info(
+            f"Загружено из {self.db_path}: {len(user_ids)} user_ids, {len(practice_slots)} открытых сессий, "
+            f"{len(sent_notifications)} sent_notifications")
+        return user_ids, practice_slots, sent_notifications
+
+    def save(self, user_ids_data, practice_slots_data, sent_notifications_data):
+        """Полная синхронизация базы с состоянием в памяти (одна транзакция). Используется для импорта данных."""
+        # Снимок делается в вызывающем потоке, чтобы поток базы не читал изменяемые структуры
+        users = list(user_ids_data)
+        sessions = [(key, session.subject_name, session.open_time.isoformat(), session.capacity,
+                     [(seat, user_id, session.booked_at(user_id)) for seat, user_id in session.bookings()])
+                    for key, session in practice_slots_data.items()]
+        notifications = sent_notifications_data.entries()
+        self._run(self._save, users, sessions, notifications)
+
+    def _save(self, users, sessions, notifications):
+        conn = self._conn
+        now = datetime.now().isoformat()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT OR IGNORE INTO users(user_id, registered_at) VALUES (?, ?)",
+                             [(uid, now) for uid in users])
+            open_keys = {session[0] for session in sessions}
+            for (session_key,) in conn.execute("SELECT session_key FROM sessions WHERE closed_at IS NULL").fetchall():
+                if session_key not in open_keys:
+                    self._close_session(session_key, now)
+            for session_key, subject_name, open_time, capacity, seats in sessions:
+                session_id = self._open_session_id(session_key)
+                if session_id is None:
+                    session_id = self._insert_session(session_key, subject_name, open_time, capacity)
+                conn.execute("DELETE FROM bookings WHERE session_id = ?", (session_id,))
+                conn.executemany("INSERT INTO bookings(session_id, slot, user_id, booked_at) VALUES (?, ?, ?, ?)",
+                                 [(session_id, slot, uid, at.isoformat() if at is not None else now)
+                                  for slot, uid, at in seats])
+            conn.execute("DELETE FROM notification_ledger")
+            conn.executemany("INSERT INTO notification_ledger(notification_date, entry_id) VALUES (?, ?)",
+                             notifications)
+
+    def needs_state(self, records) -> bool:
+        return False
+
+    def apply(self, records, user_ids_data=None, practice_slots_data=None, sent_notifications_data=None) -> bool:
+        return self._run(self._apply, records)
+
+    async def apply_async(self, records, user_ids_data=None, practice_slots_data=None,
+                          sent_notifications_data=None) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._apply, records)
+
+    def _apply(self, records) -> bool:
+        """Применяет записи по одной, каждую в своей транзакции. Возвращает False, если база отвергла запись."""
+        accepted = True
+        for record in records:
+            try:
+                with self._conn:
+                    self._conn.execute("BEGIN IMMEDIATE")
+                    self._apply_record(record)
+            except sqlite3.IntegrityError as e:
+                logger.warning(f"База отклонила изменение {record}: {e}")
+                accepted = False
+        return accepted
+
+    def _apply_record(self, record: dict):
+        conn = self._conn
+        op = record["op"]
+        now = datetime.now().isoformat()
+        if op == "user_registered":
+            conn.execute("INSERT OR IGNORE INTO users(user_id, registered_at) VALUES (?, ?)", (record["user"], now))
+        elif op == "user_removed":
+            conn.execute("DELETE FROM users WHERE user_id = ?", (record["user"],))
+        elif op == "session_opened":
+            self._insert_session(record["session"], record["subject"], record["open_time"],
+                                 record.get("capacity", DEFAULT_CAPACITY))
+        elif op == "session_closed":
+            self._close_session(record["session"], now)
+        elif op == "seat_taken":
+            session_id = self._open_session_id(record["session"])
+            if session_id is None:
+                raise sqlite3.IntegrityError(f"сессия {record['session']} не открыта")
+            # Если у пользователя уже есть место в этой сессии, оно переносится (ограничение по пользователю),
+            # а если место занято другим пользователем, сработает ограничение (сессия, место)
+            conn.execute(
+                "INSERT INTO bookings(session_id, slot, user_id, booked_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(session_id, user_id) DO UPDATE SET slot = excluded.slot",
+                (session_id, record["slot"], record["user"], record.get("at", now)))
+        elif op == "seat_released":
+            conn.execute(
+                "DELETE FROM bookings WHERE slot = ? AND user_id = ? AND session_id = "
+                "(SELECT id FROM sessions WHERE session_key = ? AND closed_at IS NULL)",
+                (record["slot"], record["user"], record["session"]))
+        elif op == "notification_sent":
+            conn.execute("INSERT OR IGNORE INTO notification_ledger(notification_date, entry_id) VALUES (?, ?)",
+                         (record["date"], record["entry"]))
+        elif op == "notifications_expired":
+            conn.execute("DELETE FROM notification_ledger WHERE notification_date < ?", (record["before"],))
+        else:
+            logger.warning(f"Неизвестный тип изменения: {op}")
+
+    def _open_session_id(self, session_key: str):
+        row = self._conn.execute(
+            "SELECT id FROM sessions WHERE session_key = ? AND closed_at IS NULL", (session_key,)).fetchone()
+        return row[0] if row else None
+
+    def _insert_session(self, session_key: str, subject_name: str, open_time: str, capacity: int) -> int:
+        cursor = self._conn.execute(
+            "INSERT INTO sessions(session_key, subject_name, open_time, capacity) VALUES (?, ?, ?, ?)",
+            (session_key, subject_name, open_time, capacity))
+        return cursor.lastrowid
+
+    def _close_session(self, session_key: str, closed_at: str):
+        self._conn.execute("UPDATE sessions SET closed_at = ? WHERE session_key = ? AND closed_at IS NULL",
+                           (closed_at, session_key))
+
+    def close(self):
+        self._executor.submit(self._conn.close).result()
+        self._executor.shutdown(wait=True)
+
+
+def create_storage(mode: str, **paths) -> StorageBackend:
+    """
+    Создает хранилище по названию режима: "json", "journal" или "sqlite".
+    paths — пути к файлам: user_ids_file, practice_slots_file, sent_notifications_file (json),
+    snapshot_file, journal_file, compact_every, fsync (journal), db_file (sqlite).
+    """
+    if mode == "json":
+        return JsonStorage(paths["user_ids_file"], paths["practice_slots_file"], paths["sent_notifications_file"])
+    if mode == "journal":
+        return JournalStorage(Journal(paths["snapshot_file"], paths["journal_file"],
+                                      compact_every=paths.get("compact_every", 1000), fsync=paths.get("fsync", False)))
+    if mode == "sqlite":
+        return SqliteStorage(paths["db_file"])
+    raise ValueError(f"Неизвестный режим хранения: {mode}")
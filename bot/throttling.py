@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import time as time_module
+
+from callbacks import ACTION_SLOT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COALESCE_WINDOW = 0.4     # Сек.: нажатия на места одного пользователя чаще этого объединяются
+DEFAULT_COALESCE_MAX_DELAY = 1.5  # Сек.: дольше этого серия нажатий не откладывается, даже если нажатия идут непрерывно
+DEFAULT_CLICK_RATE = 5.0          # Остальных нажатий в секунду на пользователя (в среднем)
+DEFAULT_CLICK_BURST = 10          # ... и подряд без ожидания
+UNCHANGED_TEXT = "Место не изменилось."
+THROTTLED_TEXT = "Слишком много нажатий. Подождите секунду."
+MAX_IDLE_USERS = 10000            # Сколько счетчиков частоты хранить, прежде чем забывать неактивных пользователей
+
+
+def fold_seat_taps(current_seat, taps):
+    """
+    Место пользователя после серии нажатий taps, начиная с current_seat: нажатие на свое место освобождает его,
+    на другое — занимает (прежнее освобождается).
+    """
+    seat = current_seat
+    for tapped in taps:
+        seat = None if tapped == seat else tapped
+    return seat
+
+
+class _SeatBurst:
+    """Нажатия одного пользователя на места одной сессии, ожидающие объединения."""
+    __slots__ = ("lock", "taps", "latest", "first_at", "last_at", "done_at", "flushing")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # Нажатия пользователя в сессии обрабатываются по одному
+        self.taps = []              # Номера мест отложенных нажатий по порядку
+        self.latest = None          # (callback, data) последнего отложенного нажатия
+        self.first_at = 0.0
+        self.last_at = 0.0
+        self.done_at = float("-inf")  # Когда закончилась последняя обработка
+        self.flushing = False       # Одно из отложенных нажатий ждет конца серии
+
+    def idle(self, now: float, window: float) -> bool:
+        return not self.lock.locked() and not self.flushing and now - self.done_at >= window
+
+
+class ClickThrottle:
+    """
+    Внутренний middleware нажатий (dp.callback_query.middleware) против частых нажатий одного пользователя.
+
+    Нажатия на места: первое нажатие обрабатывается сразу. Нажатия того же пользователя в той же сессии,
+    пришедшие во время его обработки или в течение window секунд после нее, объединяются: каждое следующее
+    сразу получает пустой ответ на предыдущее (убирает "часики"), а когда нажатия стихают на window секунд
+    (но не позже max_delay после первого отложенного), вся серия сводится к итоговому месту (fold_seat_taps)
+    и выполняется одним нажатием: одно изменение мест, одно сохранение и одна правка клавиатуры.
+    Нажатия на места, которые к концу серии заняты другими пользователями, в серию не входят: если занятыми
+    оказались все, обработчик получает последнее нажатие как есть (и сообщает, что место занято).
+    Если итоговое место совпадает с текущим, ничего не меняется и не редактируется.
+    current_session(action) — async функция, которая возвращает сессию нажатия (PracticeSession) или None.
+
+    Остальные нажатия ограничиваются частотой rate в секунду на пользователя (подряд — не больше burst):
+    лишние получают короткий ответ и не обрабатываются. rate=0 отключает ограничение, window=0 — объединение.
+    Разобранное нажатие передается обработчику в data["callback_action"], для объединенной серии —
+    с итоговым номером места.
+    """
+
+    def __init__(self, codec, current_session, window: float = DEFAULT_COALESCE_WINDOW,
+                 max_delay: float = DEFAULT_COALESCE_MAX_DELAY, rate: float = DEFAULT_CLICK_RATE,
+                 burst: int = DEFAULT_CLICK_BURST, clock=time_module.monotonic):
+        self.codec = codec
+        self.current_session = current_session
+        self.window = window
+        self.max_delay = max_delay
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._bursts = {}   # (user_id, ID сессии) -> _SeatBurst
+        self._buckets = {}  # user_id -> [доступные нажатия, время последнего пополнения]
+        # Метрики
+        self.coalesced = 0  # Нажатия на места, замененные следующими (обработка, сохранение и правка не нужны)
+        self.unchanged = 0  # Серии нажатий, не изменившие место пользователя
+        self.batches = 0    # Серии нажатий, выполненные одним нажатием
+        self.throttled = 0  # Остальные нажатия сверх ограничения частоты
+
+    async def __call__(self, handler, event, data):
+        action = self.codec.decode(event.data or "")
+        if action is None:
+            return await handler(event, data)
+        data["callback_action"] = action
+        if action.kind != ACTION_SLOT:
+            if self.rate > 0 and not self._take_token(event.from_user.id):
+                self.throttled += 1
+                await self._answer(event, THROTTLED_TEXT)
+                return None
+            return await handler(event, data)
+        if self.window <= 0:
+            return await handler(event, data)
+
+        key = (event.from_user.id, action.session_id)
+        seat_burst = self._bursts.get(key)
+        if seat_burst is None:
+            seat_burst = self._bursts[key] = _SeatBurst()
+        now = self.clock()
+        if seat_burst.idle(now, self.window):
+            try:
+                async with seat_burst.lock:
+                    return await handler(event, data)
+            finally:
+                self._finished(key, seat_burst)
+
+        # Нажатие во время обработки или вскоре после нее: откладываем, предыдущее отложенное больше не нужно
+        if seat_burst.latest is not None:
+            self.coalesced += 1
+            await self._answer(seat_burst.latest[0])
+        else:
+            seat_burst.first_at = now
+        seat_burst.taps.append(action.seat)
+        seat_burst.latest = (event, data)
+        seat_burst.last_at = now
+        if seat_burst.flushing:
+            return None
+        seat_burst.flushing = True
+        try:
+            return await self._flush(key, seat_burst, handler)
+        finally:
+            self._finished(key, seat_burst)
+
+    async def _flush(self, key, seat_burst: _SeatBurst, handler):
+        """Ждет конца серии нажатий и выполняет ее одним нажатием."""
+        taken = False
+        try:
+            while True:
+                delay = min(seat_burst.last_at + self.window, seat_burst.first_at + self.max_delay) - self.clock()
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            async with seat_burst.lock:
+                # Нажатия, пришедшие дальше, начнут следующую серию
+                taps, (event, data) = seat_burst.taps, seat_burst.latest
+                seat_burst.taps, seat_burst.latest, seat_burst.flushing = [], None, False
+                taken = True
+                action = data["callback_action"]
+                user_id = event.from_user.id
+                session = await self.current_session(action)
+                if session is None:
+                    return await handler(event, data)
+                # Место, занятое другим, не достанется пользователю: такое нажатие не меняет его место
+                taps = [seat for seat in taps if session.owner(seat) in (None, user_id)]
+                if not taps:
+                    return await handler(event, data)
+                current = session.seat_of(user_id)
+                final = fold_seat_taps(current, taps)
+                if final == current:
+                    self.unchanged += 1
+                    await self._answer(event, UNCHANGED_TEXT)
+                    return None
+                self.batches += 1
+                # Освободить место — то же, что нажать на свое место
+                data["callback_action"] = action._replace(seat=final if final is not None else current)
+                return await handler(event, data)
+        except asyncio.CancelledError:
+            if not taken:
+                # Остановка бота до конца серии: отложенные нажатия не выполняются
+                seat_burst.taps, seat_burst.latest, seat_burst.flushing = [], None, False
+            raise
+
+    def _finished(self, key, seat_burst: _SeatBurst):
+        """Запоминает конец обработки; серия, в которой больше нечего ждать, забывается после window."""
+        seat_burst.done_at = self.clock()
+        asyncio.get_running_loop().call_later(self.window, self._forget, key, seat_burst)
+
+    def _forget(self, key, seat_burst: _SeatBurst):
+        if self._bursts.get(key) is seat_burst and seat_burst.idle(self.clock(), self.window):
+            del self._bursts[key]
+
+    def _take_token(self, user_id: int) -> bool:
+        now = self.clock()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_IDLE_USERS:
+                self._forget_full_buckets(now)
+            bucket = self._buckets[user_id] = [float(self.burst), now]
+        tokens = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def _forget_full_buckets(self, now: float):
+        """Забывает пользователей, чьи счетчики уже полностью восстановились (их состояние — как у новых)."""
+        for user_id, (tokens, updated) in list(self._buckets.items()):
+            if tokens + (now - updated) * self.rate >= self.burst:
+                del self._buckets[user_id]
+
+    @staticmethod
+    async def _answer(callback, text: str = None):
+        try:
+            await callback.answer(text)
+        except Exception as e:
+            logger.debug(f"Не удалось ответить на нажатие {callback.id}: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "coalesced": self.coalesced,
+            "unchanged": self.unchanged,
+            "batches": self.batches,
+            "throttled": self.throttled,
+            "pending_bursts": len(self._bursts),
+        }
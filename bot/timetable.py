@@ -0,0 +1,354 @@
+import csv
+import json
+import logging
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Русские названия дней недели по индексу datetime.weekday() (Понедельник=0); не зависят от локали
+RUSSIAN_WEEKDAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+# Исключения из недельного расписания на конкретную дату
+EXCEPTION_CANCEL = "cancel"  # Занятие (или весь день, если не указаны время и предмет) отменено
+EXCEPTION_MOVE = "move"      # Занятие перенесено на другую дату и/или время
+EXCEPTION_ADD = "add"        # Разовое занятие
+
+
+@dataclass(frozen=True)
+class WeeklyClass:
+    """Занятие недельного расписания."""
+    weekday: int           # datetime.weekday(): Понедельник=0
+    start_time: time
+    event_type: str        # "лекция" или "практика"
+    subject_name: str
+    anchor: date = None    # Понедельник недели, в которую занятие точно есть (для interval > 1)
+    interval: int = 1      # Раз в сколько недель (2 — по четным или нечетным неделям)
+    first_date: date = None  # Не раньше этой даты
+    last_date: date = None   # Не позже этой даты
+
+    def occurs_on(self, day: date) -> bool:
+        if self.first_date is not None and day < self.first_date:
+            return False
+        if self.last_date is not None and day > self.last_date:
+            return False
+        if self.interval > 1 and self.anchor is not None:
+            return ((day - self.anchor).days // 7) % self.interval == 0
+        return True
+
+
+@dataclass(frozen=True)
+class ScheduleException:
+    """Исключение из расписания на дату day. start_time и subject_name (если заданы) выбирают занятия."""
+    day: date
+    action: str
+    start_time: time = None
+    subject_name: str = None
+    event_type: str = None
+    new_day: date = None         # Для переноса: новая дата
+    new_start_time: time = None  # Для переноса: новое время
+
+    def matches(self, start_time: time, subject_name: str) -> bool:
+        return ((self.start_time is None or self.start_time == start_time)
+                and (self.subject_name is None or self.subject_name == subject_name))
+
+
+def parse_time(value) -> time:
+    if isinstance(value, time):
+        return value
+    return datetime.strptime(value.strip(), "%H:%M").time()
+
+
+def parse_weekday(value) -> int:
+    value = value.strip()
+    if value in RUSSIAN_WEEKDAYS:
+        return RUSSIAN_WEEKDAYS.index(value)
+    raise ValueError(f"Неизвестный день недели: {value}")
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+class Timetable:
+    """
+    Расписание, скомпилированное в индексы: недельные занятия по дням недели (отсортированы по времени)
+    и исключения по датам. Занятия конкретного дня (entries_for) собираются только из занятий
+    этого дня недели и исключений этой даты, без перебора всего расписания.
+    """
+
+    def __init__(self, classes, exceptions=(), semester_start: date = None):
+        self.semester_start = semester_start
+        self._by_weekday = {weekday: [] for weekday in range(7)}
+        for weekly_class in classes:
+            self._by_weekday[weekly_class.weekday].append(weekly_class)
+        for entries in self._by_weekday.values():
+            entries.sort(key=lambda entry: entry.start_time)
+        self._removals = {}   # Дата -> исключения, убирающие занятия этой даты (отмена и перенос)
+        self._additions = {}  # Дата -> (время, тип, предмет) разовых и перенесенных на эту дату занятий
+        for exception in exceptions:
+            self._add_exception(exception)
+        self.class_count = sum(len(entries) for entries in self._by_weekday.values())
+        self.exception_count = len(exceptions)
+
+    def _add_exception(self, exception: ScheduleException):
+        if exception.action in (EXCEPTION_CANCEL, EXCEPTION_MOVE):
+            self._removals.setdefault(exception.day, []).append(exception)
+        if exception.action == EXCEPTION_MOVE:
+            moved = self._find(exception)
+            if moved is None:
+                logger.warning(f"Перенос {exception.day} {exception.start_time} {exception.subject_name}: "
+                               f"занятие не найдено в расписании")
+                return
+            self._additions.setdefault(exception.new_day or exception.day, []).append(
+                (exception.new_start_time or moved.start_time, moved.event_type, moved.subject_name))
+        elif exception.action == EXCEPTION_ADD:
+            self._additions.setdefault(exception.day, []).append(
+                (exception.start_time, exception.event_type, exception.subject_name))
+
+    def _find(self, exception: ScheduleException):
+        for weekly_class in self._by_weekday[exception.day.weekday()]:
+            if weekly_class.occurs_on(exception.day) and exception.matches(weekly_class.start_time,
+                                                                            weekly_class.subject_name):
+                return weekly_class
+        return None
+
+    def entries_for(self, day: date):
+        """Занятия даты day: список (время, тип, предмет) по возрастанию времени."""
+        removals = self._removals.get(day, ())
+        entries = [(weekly_class.start_time, weekly_class.event_type, weekly_class.subject_name)
+                   for weekly_class in self._by_weekday[day.weekday()]
+                   if weekly_class.occurs_on(day)
+                   and not any(removal.matches(weekly_class.start_time, weekly_class.subject_name)
+                               for removal in removals)]
+        additions = self._additions.get(day)
+        if additions:
+            entries.extend(additions)
+            entries.sort(key=lambda entry: entry[0])
+        return entries
+
+    def weekly_entries(self):
+        """Недельное расписание в прежнем формате: (день недели, время, тип, предмет)."""
+        return [(RUSSIAN_WEEKDAYS[weekday], entry.start_time, entry.event_type, entry.subject_name)
+                for weekday, entries in self._by_weekday.items() for entry in entries]
+
+    @classmethod
+    def from_entries(cls, schedule):
+        """Расписание из списка кортежей (день недели, время, тип, предмет), как full_schedule в bot_2."""
+        classes = []
+        for day_name, start_time, event_type, subject_name in schedule:
+            if day_name not in RUSSIAN_WEEKDAYS:
+                logger.warning(f"Неизвестный день недели в расписании: {day_name}")
+                continue
+            classes.append(WeeklyClass(RUSSIAN_WEEKDAYS.index(day_name), start_time, event_type, subject_name))
+        return cls(classes)
+
+
+def _parse_date(value) -> date:
+    return date.fromisoformat(value.strip()) if value else None
+
+
+def _weekly_class(day, start_time, event_type, subject_name, weeks=None, first_date=None, last_date=None,
+                  semester_start: date = None) -> WeeklyClass:
+    """Занятие недельного расписания из полей файла. weeks: "all", "odd" (нечетные) или "even" (четные)."""
+    anchor, interval = None, 1
+    weeks = (weeks or "all").strip().lower()
+    if weeks in ("odd", "even", "нечетные", "четные"):
+        if semester_start is None:
+            raise ValueError("Для занятий по четным/нечетным неделям нужно указать semester_start")
+        anchor = week_start(semester_start)  # Первая неделя семестра — нечетная
+        if weeks in ("even", "четные"):
+            anchor += timedelta(days=7)
+        interval = 2
+    elif weeks not in ("all", "все", ""):
+        raise ValueError(f"Неизвестное значение weeks: {weeks}")
+    return WeeklyClass(parse_weekday(day), parse_time(start_time), event_type.strip(), subject_name.strip(),
+                       anchor, interval, _parse_date(first_date), _parse_date(last_date))
+
+
+def _exception(item: dict) -> ScheduleException:
+    action = (item.get("action") or EXCEPTION_ADD).strip()
+    if action not in (EXCEPTION_CANCEL, EXCEPTION_MOVE, EXCEPTION_ADD):
+        raise ValueError(f"Неизвестное исключение: {action}")
+    new_day, new_start_time = None, None
+    if action == EXCEPTION_MOVE:
+        target = datetime.fromisoformat(item["to"].strip()) if len(item["to"].strip()) > 5 else None
+        if target is not None:
+            new_day, new_start_time = target.date(), (target.time() if len(item["to"].strip()) > 10 else None)
+        else:  # Перенос только по времени, например "to": "14:20"
+            new_start_time = parse_time(item["to"])
+    start_time = parse_time(item["time"]) if item.get("time") else None
+    if action == EXCEPTION_ADD and (start_time is None or not item.get("type") or not item.get("subject")):
+        raise ValueError(f"Для разового занятия нужны time, type и subject: {item}")
+    return ScheduleException(_parse_date(item["date"]), action, start_time,
+                             (item.get("subject") or "").strip() or None, (item.get("type") or "").strip() or None,
+                             new_day, new_start_time)
+
+
+def load_json(path: str) -> Timetable:
+    """
+    JSON: {"semester_start": "2025-02-03",
+           "classes": [{"day": "Понедельник", "time": "09:00", "type": "лекция", "subject": "...", "weeks": "odd"}],
+           "exceptions": [{"date": "2025-02-24", "action": "cancel"},
+                          {"date": "2025-03-03", "time": "09:00", "action": "move", "to": "2025-03-04 10:40"},
+                          {"date": "2025-03-05", "time": "11:00", "type": "лекция", "subject": "...", "action": "add"}]}
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    semester_start = _parse_date(data.get("semester_start"))
+    classes = [_weekly_class(item["day"], item["time"], item["type"], item["subject"], item.get("weeks"),
+                             item.get("from"), item.get("until"), semester_start)
+               for item in data.get("classes", [])]
+    exceptions = [_exception(item) for item in data.get("exceptions", [])]
+    return Timetable(classes, exceptions, semester_start)
+
+
+def load_csv(path: str) -> Timetable:
+    """
+    CSV с заголовком: day,date,time,type,subject,weeks,action,to.
+    Строки с day — недельные занятия, строки с date — исключения (action: cancel, move или add).
+    Дата начала семестра для четных/нечетных недель — строка с action=semester_start и датой в date.
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    semester_start = next((_parse_date(row["date"]) for row in rows
+                           if (row.get("action") or "").strip() == "semester_start"), None)
+    classes, exceptions = [], []
+    for row in rows:
+        if (row.get("action") or "").strip() == "semester_start":
+            continue
+        if (row.get("day") or "").strip():
+            classes.append(_weekly_class(row["day"], row["time"], row["type"], row["subject"], row.get("weeks"),
+                                         semester_start=semester_start))
+        else:
+            exceptions.append(_exception(row))
+    return Timetable(classes, exceptions, semester_start)
+
+
+def _ical_lines(text: str):
+    """Строки iCalendar с учетом переноса длинных строк (продолжение начинается с пробела)."""
+    lines = []
+    for raw in text.splitlines():
+        if raw.startswith((" ", "\t")) and lines:
+            lines[-1] += raw[1:]
+        elif raw:
+            lines.append(raw)
+    return lines
+
+
+def _ical_datetime(value: str) -> datetime:
+    value = value.rstrip("Z")
+    return datetime.strptime(value, "%Y%m%dT%H%M%S") if "T" in value else datetime.strptime(value, "%Y%m%d")
+
+
+def load_ical(path: str) -> Timetable:
+    """
+    iCalendar (.ics): поддерживается подмножество, которое выгружают календари расписаний.
+    VEVENT с RRULE:FREQ=WEEKLY (INTERVAL=2 — через неделю, UNTIL — последняя дата) — недельное занятие,
+    EXDATE — отмена, VEVENT с RECURRENCE-ID — перенос, VEVENT без RRULE — разовое занятие.
+    SUMMARY — предмет, CATEGORIES — тип занятия ("лекция" или "практика"; по умолчанию "лекция").
+    Время берется как местное (часовой пояс в TZID не пересчитывается).
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = _ical_lines(f.read())
+    events, current = [], None
+    for line in lines:
+        if line == "BEGIN:VEVENT":
+            current = {}
+        elif line == "END:VEVENT":
+            events.append(current)
+            current = None
+        elif current is not None and ":" in line:
+            name, value = line.split(":", 1)
+            name = name.split(";", 1)[0].upper()
+            current.setdefault(name, []).append(value.strip())
+
+    classes, exceptions = [], []
+    by_uid = {}
+    for event in events:
+        start = _ical_datetime(event["DTSTART"][0])
+        subject_name = event.get("SUMMARY", [""])[0].replace("\\,", ",")
+        event_type = event.get("CATEGORIES", ["лекция"])[0].lower()
+        if "RRULE" in event and "RECURRENCE-ID" not in event:
+            rule = dict(part.split("=", 1) for part in event["RRULE"][0].split(";") if "=" in part)
+            if rule.get("FREQ") != "WEEKLY":
+                logger.warning(f"Пропущено событие {subject_name}: поддерживается только FREQ=WEEKLY")
+                continue
+            interval = int(rule.get("INTERVAL", "1"))
+            until = _ical_datetime(rule["UNTIL"]).date() if "UNTIL" in rule else None
+            weekly_class = WeeklyClass(start.weekday(), start.time(), event_type, subject_name,
+                                       week_start(start.date()), interval, start.date(), until)
+            classes.append(weekly_class)
+            by_uid[event.get("UID", [None])[0]] = weekly_class
+            for exdates in event.get("EXDATE", []):
+                for exdate in exdates.split(","):
+                    excluded = _ical_datetime(exdate)
+                    exceptions.append(ScheduleException(excluded.date(), EXCEPTION_CANCEL, start.time(), subject_name))
+        elif "RECURRENCE-ID" in event:
+            original = _ical_datetime(event["RECURRENCE-ID"][0])
+            weekly_class = by_uid.get(event.get("UID", [None])[0])
+            exceptions.append(ScheduleException(original.date(), EXCEPTION_MOVE, original.time(),
+                                                weekly_class.subject_name if weekly_class else subject_name,
+                                                new_day=start.date(), new_start_time=start.time()))
+        else:
+            exceptions.append(ScheduleException(start.date(), EXCEPTION_ADD, start.time(), subject_name, event_type))
+    # Переносы ссылаются на занятия, поэтому исключения применяются после того, как собраны все занятия
+    return Timetable(classes, exceptions)
+
+
+LOADERS = {".json": load_json, ".csv": load_csv, ".ics": load_ical}
+
+
+def load_timetable(path: str) -> Timetable:
+    """Загружает расписание из файла; формат определяется по расширению (.json, .csv, .ics)."""
+    loader = LOADERS.get(os.path.splitext(path)[1].lower())
+    if loader is None:
+        raise ValueError(f"Неизвестный формат файла расписания: {path}")
+    return loader(path)
+
+
+class ScheduleSource:
+    """
+    Файл расписания с горячей перезагрузкой: reload_if_changed сравнивает mtime файла с прочитанным ранее
+    и перечитывает файл только при изменении. Если файла нет, используется fallback; если новый файл
+    содержит ошибку, остается прежнее расписание.
+    """
+
+    def __init__(self, path: str, fallback=None):
+        self.path = path
+        self.fallback = fallback  # Timetable на случай, если файла нет
+        self._mtime = None
+        self.reloads = 0
+        self.timetable = self._load_initial()
+
+    def _load_initial(self) -> Timetable:
+        try:
+            self._mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            logger.info(f"Файл расписания {self.path} не найден, используется встроенное расписание")
+            return self.fallback or Timetable([])
+        timetable = load_timetable(self.path)
+        logger.info(f"Расписание загружено из {self.path}: {timetable.class_count} занятий, "
+                    f"{timetable.exception_count} исключений")
+        return timetable
+
+    def reload_if_changed(self):
+        """Возвращает новое расписание, если файл изменился и успешно прочитан, иначе None."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime == self._mtime:
+            return None
+        self._mtime = mtime
+        try:
+            timetable = load_timetable(self.path)
+        except Exception as e:
+            logger.error(f"Ошибка в файле расписания {self.path}, оставлено прежнее расписание: {e}")
+            return None
+        self.timetable = timetable
+        self.reloads += 1
+        logger.info(f"Расписание перезагружено из {self.path}: {timetable.class_count} занятий, "
+                    f"{timetable.exception_count} исключений")
+        return timetable
@@ -0,0 +1,133 @@
+import asyncio
+import hmac
+import logging
+import time as time_module
+from collections import deque
+
+from aiohttp import web
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+DEFAULT_WEBHOOK_PATH = "/webhook"
+DEFAULT_HANDLER_CONCURRENCY = 100  # Сколько обновлений обрабатывается одновременно
+LATENCY_SAMPLES = 10000            # Сколько последних задержек обработки хранится для метрик
+
+
+class WebhookServer:
+    """
+    Прием обновлений Telegram через вебхук (встроенный сервер aiohttp) вместо long polling.
+    На каждый запрос Telegram сразу получает 200, а обновление обрабатывается в фоне:
+    Telegram не ждет окончания обработчика и не присылает повторы, пока бот занят.
+    Запросы без правильного секретного токена (заголовок X-Telegram-Bot-Api-Secret-Token) отклоняются.
+    Одновременно обрабатывается не больше concurrency обновлений, остальные ждут своей очереди.
+    """
+
+    def __init__(self, dispatcher, bot, secret_token: str = None, path: str = DEFAULT_WEBHOOK_PATH,
+                 concurrency: int = DEFAULT_HANDLER_CONCURRENCY):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle)
+        # Метрики
+        self.received = 0       # Принято обновлений
+        self.unauthorized = 0   # Отклонено из-за неверного секретного токена
+        self.malformed = 0      # Не удалось разобрать тело запроса
+        self.processed = 0
+        self.failed = 0         # Обработчик завершился ошибкой
+        self.max_backlog = 0    # Максимум обновлений, ожидающих или проходящих обработку
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # От получения запроса до конца обработки (сек.)
+
+    def _check_secret(self, request: web.Request) -> bool:
+        if not self.secret_token:
+            return True
+        received = request.headers.get(SECRET_TOKEN_HEADER, "")
+        return hmac.compare_digest(received.encode(), self.secret_token.encode())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Обработчик POST запроса от Telegram: проверяет токен, ставит обновление в обработку и сразу отвечает."""
+        received_at = time_module.perf_counter()
+        if not self._check_secret(request):
+            self.unauthorized += 1
+            logger.warning(f"Отклонен запрос к вебхуку с неверным секретным токеном от {request.remote}")
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            # 200, а не ошибка: иначе Telegram будет бесконечно повторять запрос, который не разобрать
+            self.malformed += 1
+            logger.error(f"Не удалось разобрать обновление из вебхука: {e}")
+            return web.Response()
+        self.received += 1
+        task = asyncio.create_task(self._process(update, received_at))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.max_backlog = max(self.max_backlog, len(self._tasks))
+        return web.Response()
+
+    async def _process(self, update: Update, received_at: float):
+        async with self._semaphore:
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.exception(f"Ошибка обработки обновления {update.update_id}: {e}")
+        self.latencies.append(time_module.perf_counter() - received_at)
+
+    async def start(self, host: str, port: int):
+        """Запускает HTTP сервер."""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        logger.info(f"Вебхук принимает обновления на http://{host}:{port}{self.path}")
+
+    @property
+    def port(self):
+        """Порт, на котором фактически слушает сервер (полезно, если запускали на порту 0)."""
+        if self._runner is None or not self._runner.addresses:
+            return None
+        return self._runner.addresses[0][1]
+
+    async def drain(self):
+        """Ждет обработки уже принятых обновлений (отмена drain прерывает и их)."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def close(self):
+        """Останавливает прием новых обновлений; принятые продолжают обрабатываться (см. drain)."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def stop(self):
+        """Останавливает прием новых обновлений и дожидается обработки принятых."""
+        await self.close()
+        await self.drain()
+        logger.info(f"Вебхук остановлен. Метрики: {self.metrics()}")
+
+    def metrics(self) -> dict:
+        ordered = sorted(self.latencies)
+
+        def percentile(fraction):
+            return round(ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] * 1000, 3) if ordered else 0.0
+
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "failed": self.failed,
+            "unauthorized": self.unauthorized,
+            "malformed": self.malformed,
+            "in_flight": len(self._tasks),
+            "max_backlog": self.max_backlog,
+            "latency_p50_ms": percentile(0.50),
+            "latency_p99_ms": percentile(0.99),
+        }
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули бота импортируют друг друга по имени (from sessions import ...), как при запуске из каталога bot
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bot"))
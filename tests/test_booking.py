@@ -0,0 +1,200 @@
+import asyncio
+from datetime import datetime
+
+from booking import BookingDesk
+from sessions import PracticeSession
+from state_store import (SEAT_CLAIMED, SEAT_INVALID, SEAT_KEPT, SEAT_MOVED, SEAT_REJECTED, SEAT_RELEASED,
+                         SEAT_TAKEN, SESSION_CLOSED, SESSION_FULL)
+
+SESSION_KEY = "Понедельник_12:40"
+OPENED = datetime(2025, 1, 6, 12, 40)
+
+
+class Journal:
+    """persist для BookingDesk: запоминает записи, может отвергать бронь и задерживать сохранение."""
+
+    def __init__(self, reject=False, gate: asyncio.Event = None):
+        self.records = []
+        self.reject = reject
+        self.gate = gate  # Сохранение ждет, пока событие не установлено
+
+    async def __call__(self, records):
+        if self.gate is not None:
+            await self.gate.wait()
+        await asyncio.sleep(0)
+        if self.reject:
+            return False
+        self.records.extend(records)
+        return True
+
+    def ops(self):
+        return [(record["op"], record.get("slot"), record.get("user")) for record in self.records]
+
+
+def new_desk(capacity: int = 5, **journal_options):
+    journal = Journal(**journal_options)
+    sessions = {SESSION_KEY: PracticeSession(SESSION_KEY, "Физика", OPENED, capacity)}
+    return BookingDesk(sessions, journal, now=lambda: OPENED), sessions, journal
+
+
+def test_claim_move_release():
+    async def scenario():
+        desk, sessions, journal = new_desk()
+        assert (await desk.toggle(SESSION_KEY, 1, 100)).status == SEAT_CLAIMED
+        moved = await desk.toggle(SESSION_KEY, 2, 100)
+        assert (moved.status, moved.previous_seat) == (SEAT_MOVED, 1)
+        assert (await desk.toggle(SESSION_KEY, 2, 200)).status == SEAT_TAKEN
+        assert (await desk.toggle(SESSION_KEY, 9, 200)).status == SEAT_INVALID
+        assert (await desk.toggle(SESSION_KEY, 2, 100)).status == SEAT_RELEASED
+        assert sessions[SESSION_KEY].bookings() == []
+        assert journal.ops() == [("seat_taken", 1, 100), ("seat_released", 1, 100), ("seat_taken", 2, 100),
+                                 ("seat_released", 2, 100)]
+        assert desk.metrics()["conflicts"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_taps_on_one_seat():
+    async def scenario():
+        desk, sessions, journal = new_desk()
+        results = await asyncio.gather(*(desk.toggle(SESSION_KEY, 3, user_id) for user_id in range(1, 21)))
+        statuses = [result.status for result in results]
+        assert statuses.count(SEAT_CLAIMED) == 1 and statuses.count(SEAT_TAKEN) == 19
+        winner = statuses.index(SEAT_CLAIMED) + 1
+        assert sessions[SESSION_KEY].bookings() == [(3, winner)]
+        assert journal.ops() == [("seat_taken", 3, winner)]
+
+    asyncio.run(scenario())
+
+
+def test_redelivered_tap_is_processed_once():
+    async def scenario():
+        desk, sessions, journal = new_desk()
+        first, again = await asyncio.gather(desk.toggle(SESSION_KEY, 1, 100, update_id="cb-1"),
+                                            desk.toggle(SESSION_KEY, 1, 100, update_id="cb-1"))
+        # Без защиты повтор отменил бы только что сделанную запись
+        assert first == again and first.status == SEAT_CLAIMED
+        later = await desk.toggle(SESSION_KEY, 1, 100, update_id="cb-1")
+        assert later == first
+        assert sessions[SESSION_KEY].seat_of(100) == 1
+        assert journal.ops() == [("seat_taken", 1, 100)]
+        assert desk.metrics()["duplicates"] == 2
+        # Новое нажатие (другой callback ID) обрабатывается
+        assert (await desk.toggle(SESSION_KEY, 1, 100, update_id="cb-2")).status == SEAT_RELEASED
+
+    asyncio.run(scenario())
+
+
+def test_failed_tap_is_retried_on_redelivery():
+    async def scenario():
+        desk, sessions, _ = new_desk()
+        calls = []
+
+        async def failing_persist(records):
+            calls.append(records)
+            if len(calls) == 1:
+                raise OSError("диск недоступен")
+            return True
+
+        desk.persist = failing_persist
+        try:
+            await desk.toggle(SESSION_KEY, 1, 100, update_id="cb-1")
+        except OSError:
+            pass
+        else:
+            raise AssertionError("ошибка сохранения не дошла до вызывающего")
+        sessions[SESSION_KEY].release(100)  # Как после перезапуска: изменение не сохранилось
+        assert (await desk.toggle(SESSION_KEY, 1, 100, update_id="cb-1")).status == SEAT_CLAIMED
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_rejected_changes_are_rolled_back():
+    async def scenario():
+        desk, sessions, journal = new_desk()
+        session = sessions[SESSION_KEY]
+        assert (await desk.toggle(SESSION_KEY, 1, 100)).status == SEAT_CLAIMED
+        journal.reject = True
+        # Переход на другое место отвергнут: пользователь остается на прежнем
+        assert (await desk.toggle(SESSION_KEY, 2, 100)).status == SEAT_REJECTED
+        assert session.bookings() == [(1, 100)]
+        # Отмена отвергнута: место возвращается
+        assert (await desk.toggle(SESSION_KEY, 1, 100)).status == SEAT_REJECTED
+        assert session.bookings() == [(1, 100)]
+        # Новая запись и "любое свободное место" отвергнуты: место свободно
+        assert (await desk.toggle(SESSION_KEY, 3, 200)).status == SEAT_REJECTED
+        assert (await desk.claim_any(SESSION_KEY, 300)).status == SEAT_REJECTED
+        assert session.bookings() == [(1, 100)]
+        assert desk.metrics()["rejected"] == 4
+
+    asyncio.run(scenario())
+
+
+def test_claim_any():
+    async def scenario():
+        desk, sessions, _ = new_desk(capacity=3)
+        assert (await desk.claim_any(SESSION_KEY, 100, zone=(2, 3))).seat == 2
+        assert (await desk.claim_any(SESSION_KEY, 100)).status == SEAT_KEPT
+        assert (await desk.claim_any(SESSION_KEY, 200)).seat == 1
+        assert (await desk.claim_any(SESSION_KEY, 300)).seat == 3
+        assert (await desk.claim_any(SESSION_KEY, 400)).status == SESSION_FULL
+        assert desk.metrics()["assigned"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_close_waits_for_started_changes():
+    async def scenario():
+        gate = asyncio.Event()
+        desk, sessions, journal = new_desk(gate=gate)
+        tap = asyncio.create_task(desk.toggle(SESSION_KEY, 1, 100))
+        await asyncio.sleep(0)
+        close = asyncio.create_task(desk.close(SESSION_KEY))
+        late_tap = asyncio.create_task(desk.toggle(SESSION_KEY, 2, 200))
+        await asyncio.sleep(0)
+        assert not close.done()  # Закрытие ждет сохранения начатого нажатия
+        gate.set()
+        closed = await close
+        assert (await tap).status == SEAT_CLAIMED
+        assert (await late_tap).status == SESSION_CLOSED
+        assert closed.bookings() == [(1, 100)]
+        assert SESSION_KEY not in sessions
+        # В журнале после закрытия нет записей об этой сессии
+        assert journal.ops()[-1] == ("session_closed", None, None)
+        assert await desk.close(SESSION_KEY) is None
+        assert desk._locks == {}  # Замки забываются, когда их никто не ждет
+
+    asyncio.run(scenario())
+
+
+def test_late_tap_and_reopen_share_the_lock():
+    async def scenario():
+        gate = asyncio.Event()
+        desk, sessions, journal = new_desk(gate=gate)
+
+        async def late():
+            await asyncio.sleep(0)  # Нажатие приходит, когда закрытие уже держит замок
+            return await desk.toggle(SESSION_KEY, 1, 100)
+
+        late_tap = asyncio.create_task(late())
+        asyncio.get_running_loop().call_later(0.01, gate.set)
+        await desk.close(SESSION_KEY)
+        # Нажатие еще ждет замок: замок не должен забываться, иначе новая сессия откроется под другим замком
+        assert SESSION_KEY in desk._locks
+        assert await desk.open(PracticeSession(SESSION_KEY, "Физика", OPENED.replace(day=13), 5))
+        # Опоздавшее нажатие выполнилось до открытия и не попало в новую сессию
+        assert (await late_tap).status == SESSION_CLOSED
+        assert sessions[SESSION_KEY].bookings() == []
+        assert desk._locks == {}
+
+    asyncio.run(scenario())
+
+
+def test_close_skips_session_reopened_under_same_key():
+    async def scenario():
+        desk, sessions, _ = new_desk()
+        assert await desk.close(SESSION_KEY, is_due=lambda session: False) is None
+        assert SESSION_KEY in sessions
+
+    asyncio.run(scenario())
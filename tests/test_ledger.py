@@ -0,0 +1,85 @@
+import json
+from datetime import date
+
+from ledger import NotificationLedger, schedule_entry_id
+from storage import JsonStorage
+
+MONDAY = date(2025, 1, 6)
+
+
+def test_add_is_idempotent_per_day():
+    ledger = NotificationLedger()
+    entry_id = schedule_entry_id("Понедельник", "12:40", "практика", "Физика")
+    assert ledger.add(MONDAY, entry_id)
+    assert not ledger.add(MONDAY, entry_id)
+    assert ledger.contains(MONDAY, entry_id)
+    assert not ledger.contains(date(2025, 1, 13), entry_id)  # Та же запись расписания через неделю — новая
+    assert ledger.add(date(2025, 1, 13), entry_id)
+    assert len(ledger) == 2
+
+
+def test_entry_id_depends_on_group():
+    plain = schedule_entry_id("Понедельник", "12:40", "практика", "Физика")
+    assert plain == schedule_entry_id("Понедельник", "12:40", "практика", "Физика", "")
+    assert plain != schedule_entry_id("Понедельник", "12:40", "практика", "Физика", "ivt-21")
+    assert len(plain) == 12
+
+
+def test_expire_keeps_today_and_yesterday():
+    ledger = NotificationLedger(retention_days=2)
+    for day in (date(2025, 1, 3), date(2025, 1, 4), date(2025, 1, 5), MONDAY):
+        ledger.add(day, "entry")
+    # После простоя удаляются все старые дни, а не только позавчерашний
+    assert ledger.expire(MONDAY) == "2025-01-05"
+    assert sorted(ledger.to_dict()) == ["2025-01-05", "2025-01-06"]
+    assert ledger.partition_count == 2
+    assert ledger.expire(MONDAY) is None  # Удалять больше нечего
+
+
+def test_expire_before_matches_journal_replay():
+    ledger = NotificationLedger()
+    ledger.add(date(2025, 1, 4), "a")
+    ledger.add(MONDAY, "b")
+    ledger.expire_before("2025-01-05")
+    assert ledger.entries() == [("2025-01-06", "b")]
+
+
+def test_round_trip_and_copy():
+    ledger = NotificationLedger()
+    ledger.add(MONDAY, "b")
+    ledger.add(MONDAY, "a")
+    data = ledger.to_dict()
+    assert data == {"2025-01-06": ["a", "b"]}
+    restored = NotificationLedger.from_dict(json.loads(json.dumps(data)))
+    assert restored.contains(MONDAY, "a") and restored.contains(MONDAY, "b")
+    clone = restored.copy()
+    clone.add(MONDAY, "c")
+    assert not restored.contains(MONDAY, "c")
+
+
+def test_legacy_keys_are_converted():
+    legacy = ["Понедельник_12:40_практика_Основы программирования_2025-01-06",
+              "Вторник_09:00_лекция_Физика_2025-01-07"]
+    ledger = NotificationLedger.from_dict(legacy)
+    assert ledger.contains(MONDAY, schedule_entry_id("Понедельник", "12:40", "практика", "Основы программирования"))
+    assert ledger.contains(date(2025, 1, 7), schedule_entry_id("Вторник", "09:00", "лекция", "Физика"))
+    assert len(ledger) == 2
+
+
+def test_malformed_legacy_keys_are_skipped():
+    legacy = ["Понедельник_12:40_практика_Физика_2025-01-06", "испорчено", "a_b_2025-01-06", 42,
+              "Вторник_09:00_лекция_Физика_не-дата"]
+    ledger = NotificationLedger.from_dict(legacy)
+    assert ledger.entries() == [("2025-01-06", schedule_entry_id("Понедельник", "12:40", "практика", "Физика"))]
+    assert len(NotificationLedger.from_dict({"не-дата": ["a"], "2025-01-07": 5, "2025-01-06": ["b"]})) == 1
+    assert len(NotificationLedger.from_dict(7)) == 0
+
+
+def test_json_storage_starts_with_bad_legacy_file(tmp_path):
+    notifications_file = tmp_path / "sent_notifications.json"
+    notifications_file.write_text(json.dumps(["Понедельник_12:40_практика_Физика_2025-01-06", "испорчено"]),
+                                  encoding="utf-8")
+    storage = JsonStorage(str(tmp_path / "user_ids.json"), str(tmp_path / "practice_slots.json"),
+                          str(notifications_file))
+    _, _, ledger = storage.load()
+    assert len(ledger) == 1
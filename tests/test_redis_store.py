@@ -0,0 +1,249 @@
+"""
+RedisStore против настоящего Redis (REDIS_TEST_URL, например redis://localhost:6379/15) или, если он не задан,
+против fakeredis с Lua (pip install "fakeredis[lua]"). Без того и другого тесты пропускаются.
+Несколько RedisStore над одним Redis — как процессы бота в режиме STATE_STORE=redis.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+
+import state_store
+from booking import BookingDesk
+from groups import SubscriptionIndex
+from sessions import PracticeSession
+from state_store import (LeaderLease, RedisStore, SEAT_CLAIMED, SEAT_INVALID, SEAT_KEPT, SEAT_MOVED,
+                         SEAT_RELEASED, SEAT_TAKEN, SESSION_CLOSED, SESSION_FULL)
+
+REDIS_TEST_URL = os.getenv("REDIS_TEST_URL")
+SESSION_KEY = "Понедельник_12:40"
+
+
+@pytest.fixture
+def make_store(monkeypatch):
+    """Фабрика RedisStore над одним и тем же Redis. Хранилища создаются внутри asyncio.run теста."""
+    if state_store.redis_asyncio is None:
+        pytest.skip("не установлен пакет redis")
+    if REDIS_TEST_URL:
+        prefix = f"practice_bot_test:{uuid.uuid4().hex}:"
+
+        async def check():
+            client = state_store.redis_asyncio.from_url(REDIS_TEST_URL)
+            try:
+                await client.ping()
+            finally:
+                await client.aclose()
+
+        try:
+            asyncio.run(check())
+        except Exception as e:
+            pytest.skip(f"Redis {REDIS_TEST_URL} недоступен: {e}")
+        yield lambda: RedisStore(REDIS_TEST_URL, prefix=prefix)
+
+        async def cleanup():
+            client = state_store.redis_asyncio.from_url(REDIS_TEST_URL)
+            try:
+                keys = [key async for key in client.scan_iter(f"{prefix}*")]
+                if keys:
+                    await client.delete(*keys)
+            finally:
+                await client.aclose()
+
+        asyncio.run(cleanup())
+        return
+    fakeredis = pytest.importorskip("fakeredis", reason="нужен REDIS_TEST_URL или fakeredis[lua]")
+    pytest.importorskip("lupa", reason="fakeredis без Lua: pip install \"fakeredis[lua]\"")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(state_store.redis_asyncio, "from_url",
+                        lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=server, **kwargs))
+    yield lambda: RedisStore("redis://fake")
+
+
+def new_session(capacity: int = 10) -> PracticeSession:
+    return PracticeSession(SESSION_KEY, "Физика", datetime(2025, 1, 6, 12, 40), capacity)
+
+
+async def close_all(*stores):
+    for store in stores:
+        await store.close()
+
+
+async def assert_consistent(store: RedisStore, expected: dict = None):
+    """
+    Места в Redis согласованы: хэш мест и обратный индекс (пользователь -> место) — зеркала друг друга,
+    то есть у пользователя одно место и на месте один пользователь. expected — ожидаемые места {место: user_id}.
+    """
+    _, seats_key, seat_of_key = store._session_keys(SESSION_KEY)
+    seats = {int(seat): int(user_id) for seat, user_id in (await store.redis.hgetall(seats_key)).items()}
+    seat_of = {int(user_id): int(seat) for user_id, seat in (await store.redis.hgetall(seat_of_key)).items()}
+    assert seat_of == {user_id: seat for seat, user_id in seats.items()}
+    if expected is not None:
+        assert seats == expected
+        assert dict((await store.load_session(SESSION_KEY)).bookings()) == expected
+
+
+def test_concurrent_toggles_on_one_seat(make_store):
+    async def scenario():
+        workers = [make_store(), make_store()]
+        assert await workers[0].open_session(new_session())
+        assert not await workers[1].open_session(new_session())  # Второй процесс не открывает повторно
+        results = await asyncio.gather(*(workers[user_id % 2].toggle_seat(SESSION_KEY, 1, user_id)
+                                         for user_id in range(1, 51)))
+        statuses = [status for status, _ in results]
+        assert statuses.count(SEAT_CLAIMED) == 1 and statuses.count(SEAT_TAKEN) == 49
+        winner = statuses.index(SEAT_CLAIMED) + 1
+        await assert_consistent(workers[1], {1: winner})
+
+        assert await workers[0].toggle_seat(SESSION_KEY, 3, winner) == (SEAT_MOVED, 1)
+        assert await workers[1].toggle_seat(SESSION_KEY, 3, winner) == (SEAT_RELEASED, None)
+        assert await workers[0].toggle_seat(SESSION_KEY, 11, winner) == (SEAT_INVALID, None)
+        await assert_consistent(workers[0], {})
+        await close_all(*workers)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_moves_never_double_book(make_store):
+    async def scenario():
+        workers = [make_store(), make_store(), make_store()]
+        await workers[0].open_session(new_session(capacity=5))
+        # 20 пользователей одновременно нажимают на разные из пяти мест, каждый — по три раза
+        taps = [(user_id, 1 + (user_id * 7 + tap) % 5) for tap in range(3) for user_id in range(1, 21)]
+        await asyncio.gather(*(workers[index % 3].toggle_seat(SESSION_KEY, seat, user_id)
+                               for index, (user_id, seat) in enumerate(taps)))
+        await assert_consistent(workers[2])
+        await close_all(*workers)
+
+    asyncio.run(scenario())
+
+
+def test_claim_any_under_contention(make_store):
+    async def scenario():
+        workers = [make_store(), make_store()]
+        await workers[0].open_session(new_session(capacity=10))
+        # Сначала занимается зона, потом места с наименьшими номерами
+        assert await workers[0].claim_any_seat(SESSION_KEY, 1, zone=(4, 6)) == (SEAT_CLAIMED, 4)
+        assert await workers[1].claim_any_seat(SESSION_KEY, 2, zone=(4, 4)) == (SEAT_CLAIMED, 1)
+        results = await asyncio.gather(*(workers[user_id % 2].claim_any_seat(SESSION_KEY, user_id, zone=(4, 6))
+                                         for user_id in range(3, 31)))
+        claimed = {user_id: seat for user_id, (status, seat) in enumerate(results, 3) if status == SEAT_CLAIMED}
+        claimed.update({1: 4, 2: 1})
+        assert len(claimed) == 10
+        assert sorted(claimed.values()) == list(range(1, 11))
+        assert all(status == SESSION_FULL for status, _ in results if status != SEAT_CLAIMED)
+        user_id, seat = 1, 4
+        assert await workers[1].claim_any_seat(SESSION_KEY, user_id) == (SEAT_KEPT, seat)
+        await assert_consistent(workers[0], {seat: user_id for user_id, seat in claimed.items()})
+        await close_all(*workers)
+
+    asyncio.run(scenario())
+
+
+def test_rollback_claim_and_release(make_store):
+    async def scenario():
+        store = make_store()
+        await store.open_session(new_session())
+        assert await store.toggle_seat(SESSION_KEY, 2, 100) == (SEAT_CLAIMED, None)
+        # Откат записи: освобождается только место этого пользователя
+        assert not await store.release_seat(SESSION_KEY, 2, 200)
+        assert await store.release_seat(SESSION_KEY, 2, 100)
+        assert not await store.release_seat(SESSION_KEY, 2, 100)
+        # Откат отмены: место возвращается, только если оно свободно, а у пользователя нет другого места
+        assert await store.claim_seat(SESSION_KEY, 2, 100)
+        assert not await store.claim_seat(SESSION_KEY, 2, 200)
+        assert not await store.claim_seat(SESSION_KEY, 3, 100)
+        await assert_consistent(store, {2: 100})
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_close_and_reopen(make_store):
+    async def scenario():
+        workers = [make_store(), make_store()]
+        await workers[0].open_session(new_session())
+        await workers[0].toggle_seat(SESSION_KEY, 5, 100)
+        closed, again = await asyncio.gather(workers[0].close_session(SESSION_KEY),
+                                             workers[1].close_session(SESSION_KEY))
+        assert (closed is None) != (again is None)  # Закрывает только один процесс
+        closed = closed or again
+        assert dict(closed.bookings()) == {5: 100}
+        assert closed.subject_name == "Физика" and closed.capacity == 10
+        assert await workers[1].toggle_seat(SESSION_KEY, 1, 200) == (SESSION_CLOSED, None)
+        assert await workers[1].claim_any_seat(SESSION_KEY, 200) == (SESSION_CLOSED, None)
+        assert not await workers[1].claim_seat(SESSION_KEY, 1, 200)
+        assert await workers[0].load_session(SESSION_KEY) is None
+        assert await workers[0].open_session_keys() == []
+        # Повторно открытая сессия начинается без мест
+        assert await workers[1].open_session(new_session())
+        assert await workers[0].open_session_keys() == [SESSION_KEY]
+        assert (await workers[0].load_session(SESSION_KEY)).booked_count == 0
+        await close_all(*workers)
+
+    asyncio.run(scenario())
+
+
+def test_lease_handover(make_store):
+    async def scenario():
+        first, second = make_store(), make_store()
+        leader = LeaderLease(first, "scheduler", "worker-1", ttl=0.3)
+        follower = LeaderLease(second, "scheduler", "worker-2", ttl=0.3)
+        assert await leader.renew() and leader.is_leader
+        assert not await follower.renew() and not follower.is_leader
+        assert await leader.renew()  # Продление своей аренды
+        # Лидер остановился, не отдав аренду: через ttl ее берет другой процесс
+        await asyncio.sleep(0.4)
+        assert not leader.is_leader
+        assert await follower.renew() and follower.is_leader
+        assert not await leader.renew()
+        # Лидер отдает аренду при остановке: другой берет ее сразу
+        await second.release_lease("scheduler", "worker-1")  # Чужую аренду отдать нельзя
+        assert not await leader.renew()
+        await second.release_lease("scheduler", "worker-2")
+        assert await leader.renew()
+        await close_all(first, second)
+
+    asyncio.run(scenario())
+
+
+def test_import_users_is_idempotent(make_store):
+    async def scenario():
+        first, second = make_store(), make_store()
+        subscriptions = SubscriptionIndex()
+        subscriptions.subscribe(1, "ivt-21")
+        subscriptions.subscribe(2, "ivt-21")
+        subscriptions.subscribe(2, "pi-22")
+        assert await first.import_users({1, 2, 3}, subscriptions) == 3
+        assert await second.import_users({1, 2, 3}, subscriptions) == 0
+        assert await second.user_ids() == {1, 2, 3}
+        assert await second.group_members("ivt-21") == {1, 2}
+        assert await second.user_groups(2) == {"ivt-21", "pi-22"}
+        await close_all(first, second)
+
+    asyncio.run(scenario())
+
+
+def test_non_leader_forgets_closed_session(make_store):
+    async def scenario():
+        leader_store, follower_store = make_store(), make_store()
+
+        async def persist(records):
+            return True
+
+        leader = BookingDesk({}, persist, store=leader_store)
+        follower = BookingDesk({}, persist, store=follower_store)
+        await leader.open(new_session())
+        assert (await follower.toggle(SESSION_KEY, 1, 100)).status == SEAT_CLAIMED
+        assert SESSION_KEY in follower.sessions
+        # Лидер еще не закрыл запись, а ее время не вышло: копия остается
+        assert not await follower.forget(SESSION_KEY, is_due=lambda session: False)
+        assert SESSION_KEY in follower.sessions
+        closed = await leader.close(SESSION_KEY)
+        assert dict(closed.bookings()) == {1: 100}
+        assert await follower.forget(SESSION_KEY, is_due=lambda session: False)
+        assert follower.sessions == {}
+        await close_all(leader_store, follower_store)
+
+    asyncio.run(scenario())
@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime, time, timedelta
+
+from scheduler import (EVENT_LECTURE, EVENT_PRACTICE_CLOSE, EVENT_PRACTICE_OPEN, EventScheduler,
+                       SimulatedClock)
+
+MONDAY = datetime(2025, 1, 6)
+SCHEDULE = [
+    ("Понедельник", time(8, 0), "лекция", "Философия"),
+    ("Понедельник", time(8, 45), "лекция", "Физика"),
+    ("Понедельник", time(9, 0), "практика", "Иностранный язык"),
+    ("Понедельник", time(10, 0), "лекция", "Проектирование баз данных"),
+]
+
+
+class LaggingClock(SimulatedClock):
+    """Виртуальные часы, которые просыпаются на lag позже, как при занятом цикле событий."""
+
+    def __init__(self, start: datetime, lag: timedelta):
+        super().__init__(start)
+        self.lag = lag
+
+    async def sleep(self, seconds: float):
+        await super().sleep(seconds)
+        self.current += self.lag
+
+
+def recording_handler(clock, fired: list):
+    async def handler(event):
+        fired.append((event.kind, event.subject_name or event.session_key, clock.now()))
+
+    return handler
+
+
+def test_missed_events_are_caught_up_in_order():
+    async def scenario():
+        booted_at = MONDAY.replace(hour=9, minute=30)
+        clock = SimulatedClock(booted_at)
+        fired = []
+        record = recording_handler(clock, fired)
+
+        async def handler(event):
+            await record(event)
+            if event.kind == EVENT_PRACTICE_OPEN:  # Как bot_2: открытие планирует закрытие записи
+                event_scheduler.schedule_close(event.session_key, event.when + timedelta(minutes=20))
+
+        event_scheduler = EventScheduler(SCHEDULE, handler, clock=clock, catch_up=timedelta(hours=1))
+        await event_scheduler.run_until(MONDAY.replace(hour=9, minute=31))
+        await event_scheduler.drain()
+        # 08:00 — раньше окна catch_up; закрытие записи, запланированное открытием, выполняется после него
+        assert [(kind, name) for kind, name, _ in fired] == [(EVENT_LECTURE, "Физика"),
+                                                             (EVENT_PRACTICE_OPEN, "Иностранный язык"),
+                                                             (EVENT_PRACTICE_CLOSE, "Понедельник_09:00")]
+        assert all(now == booted_at for _, _, now in fired)  # Выполнены сразу при запуске
+        assert event_scheduler.recovered.is_set()
+        assert (event_scheduler.caught_up, event_scheduler.fired, event_scheduler.skipped) == (3, 3, 0)
+
+    asyncio.run(scenario())
+
+
+def test_recovered_without_missed_events():
+    async def scenario():
+        clock = SimulatedClock(MONDAY.replace(hour=11))
+        fired = []
+        event_scheduler = EventScheduler(SCHEDULE, recording_handler(clock, fired), clock=clock)
+        await event_scheduler.run_until(MONDAY.replace(hour=11, minute=1))
+        assert event_scheduler.recovered.is_set()
+        assert fired == [] and event_scheduler.caught_up == 0
+
+    asyncio.run(scenario())
+
+
+def test_late_event_within_grace_is_fired():
+    async def scenario():
+        clock = LaggingClock(MONDAY.replace(hour=9, minute=30), lag=timedelta(minutes=5))
+        fired = []
+        event_scheduler = EventScheduler(SCHEDULE, recording_handler(clock, fired), clock=clock)
+        await event_scheduler.run_until(MONDAY.replace(hour=10, minute=30))
+        await event_scheduler.drain()
+        assert fired == [(EVENT_LECTURE, "Проектирование баз данных", MONDAY.replace(hour=10, minute=5))]
+        assert (event_scheduler.fired, event_scheduler.skipped, event_scheduler.caught_up) == (1, 0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_event_later_than_grace_is_skipped_but_close_is_not():
+    async def scenario():
+        clock = LaggingClock(MONDAY.replace(hour=9, minute=30), lag=timedelta(minutes=15))
+        fired = []
+        event_scheduler = EventScheduler(SCHEDULE, recording_handler(clock, fired), clock=clock)
+        event_scheduler.schedule_close("Понедельник_09:00", MONDAY.replace(hour=10))
+        await event_scheduler.run_until(MONDAY.replace(hour=11))
+        await event_scheduler.drain()
+        # Закрытие записи опоздало на 15 минут, но выполнено; лекция с тем же опозданием пропущена
+        assert fired == [(EVENT_PRACTICE_CLOSE, "Понедельник_09:00", MONDAY.replace(hour=10, minute=15))]
+        assert (event_scheduler.fired, event_scheduler.skipped) == (1, 1)
+
+    asyncio.run(scenario())
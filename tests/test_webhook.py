@@ -0,0 +1,115 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import SECRET_TOKEN_HEADER, WebhookServer
+
+SECRET = "test-secret"
+
+
+class Dispatcher:
+    """feed_update для WebhookServer: запоминает обновления и ждет gate, как долгий обработчик."""
+
+    def __init__(self, gate: asyncio.Event = None, fail_on: int = None):
+        self.updates = []
+        self.gate = gate
+        self.fail_on = fail_on
+
+    async def feed_update(self, bot, update):
+        if self.gate is not None:
+            await self.gate.wait()
+        if update.update_id == self.fail_on:
+            raise RuntimeError("ошибка обработчика")
+        self.updates.append(update.update_id)
+
+
+def update(update_id: int) -> dict:
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "date": 1736156400, "chat": {"id": 100, "type": "private"},
+                        "from": {"id": 100, "is_bot": False, "first_name": "Студент"}, "text": "/start"}}
+
+
+async def post(client: TestClient, body, secret: str = SECRET):
+    headers = {SECRET_TOKEN_HEADER: secret} if secret is not None else {}
+    response = await client.post("/webhook", json=body, headers=headers)
+    return response.status
+
+
+def run_with_client(server: WebhookServer, scenario):
+    async def main():
+        client = TestClient(TestServer(server.app))
+        await client.start_server()
+        try:
+            await scenario(client)
+        finally:
+            await client.close()
+            await server.drain()
+
+    asyncio.run(main())
+
+
+def test_wrong_secret_is_rejected():
+    dispatcher = Dispatcher()
+    server = WebhookServer(dispatcher, bot=None, secret_token=SECRET)
+
+    async def scenario(client):
+        assert await post(client, update(1), secret="чужой") == 401
+        assert await post(client, update(2), secret=None) == 401
+        assert await post(client, update(3)) == 200
+        await server.drain()
+
+    run_with_client(server, scenario)
+    assert dispatcher.updates == [3]
+    metrics = server.metrics()
+    assert (metrics["unauthorized"], metrics["received"], metrics["processed"]) == (2, 1, 1)
+
+
+def test_without_secret_every_request_is_accepted():
+    dispatcher = Dispatcher()
+    server = WebhookServer(dispatcher, bot=None)
+
+    async def scenario(client):
+        assert await post(client, update(1), secret=None) == 200
+        await server.drain()
+
+    run_with_client(server, scenario)
+    assert dispatcher.updates == [1]
+
+
+def test_answers_before_processing():
+    gate = asyncio.Event()
+    dispatcher = Dispatcher(gate=gate)
+    server = WebhookServer(dispatcher, bot=None, secret_token=SECRET, concurrency=2)
+
+    async def scenario(client):
+        # Обработчики заняты, а Telegram уже получил 200 на каждый запрос
+        for update_id in range(1, 6):
+            assert await post(client, update(update_id)) == 200
+        assert dispatcher.updates == []
+        metrics = server.metrics()
+        assert (metrics["received"], metrics["processed"], metrics["in_flight"]) == (5, 0, 5)
+        assert metrics["max_backlog"] == 5
+        gate.set()
+        await server.drain()
+
+    run_with_client(server, scenario)
+    assert sorted(dispatcher.updates) == [1, 2, 3, 4, 5]
+    metrics = server.metrics()
+    assert (metrics["processed"], metrics["in_flight"]) == (5, 0)
+
+
+def test_malformed_and_failed_updates():
+    dispatcher = Dispatcher(fail_on=2)
+    server = WebhookServer(dispatcher, bot=None, secret_token=SECRET)
+
+    async def scenario(client):
+        # Неразбираемое тело тоже получает 200, иначе Telegram повторял бы его бесконечно
+        assert await post(client, {"не обновление": True}) == 200
+        assert await post(client, update(1)) == 200
+        assert await post(client, update(2)) == 200
+        await server.drain()
+
+    run_with_client(server, scenario)
+    assert dispatcher.updates == [1]
+    metrics = server.metrics()
+    assert (metrics["malformed"], metrics["received"], metrics["processed"], metrics["failed"]) == (1, 2, 1, 1)